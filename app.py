@@ -1,4 +1,5 @@
 # app.py
+import logging
 import os
 from datetime import timedelta
 from dotenv import load_dotenv
@@ -7,7 +8,7 @@ from flask_session import Session
 from flask_mail import Mail
 from flask_login import LoginManager
 from sqlalchemy import event, Engine
-from models import db, User, Role, ClientGroup
+from models import db, User, Role, Client, ClientGroup
 from routes.helpers import init_csrf_guard
 from extensions import Limiter
 from flask_limiter.util import get_remote_address
@@ -20,6 +21,8 @@ from flask_wtf.csrf import generate_csrf
 from utils.request_monitor import ConcurrentRequestLimiter, RequestMonitor
 from utils.api_response import register_error_handlers, register_request_handlers
 
+logger = logging.getLogger(__name__)
+
 # 创建并发限制器和监控器
 concurrent_limiter = ConcurrentRequestLimiter(max_concurrent=10)
 request_monitor = RequestMonitor(max_records=100)
@@ -77,12 +80,28 @@ from routes.status_bp import status_bp
 from routes.restart_openvpn import restart_openvpn_bp
 from routes.api import api_bp
 from routes.api.client_groups import client_groups_bp
+from routes.api.tc_state import tc_state_bp
+from routes.api.rate_schedules import rate_schedules_bp
+from routes.api.traffic import traffic_bp
+from routes.api.client_sessions import client_sessions_bp
 from routes.dashboard import dashboard_bp
+from routes.push import push_bp, init_push
 
 # 导入健康检查 API
 from routes.api.health import health_bp, init_health_monitor
 
-from utils.tc_config_exporter import export_tc_config
+from utils.tc_config_exporter import export_tc_config, track_tc_changes, get_exporter
+from openvpn_monitor.metrics_sampler import start_sampler
+from openvpn_monitor.timeseries import get_history
+from openvpn_monitor.tc_state import get_tc_state
+from openvpn_monitor.client_rates import get_rate_tracker, get_status_reader
+from utils.rate_scheduler import start_rate_scheduler
+from utils.traffic_accounting import init_traffic_accounting
+from utils.traffic_quota import init_traffic_quota
+from utils.session_history import init_session_history
+from utils.data_version import track_data_changes
+from utils.db_writer import init_db_writer
+from utils.client_search import ensure_search_index
 
 
 def optimize_sqlite_connection():
@@ -101,6 +120,26 @@ def optimize_sqlite_connection():
             cursor.close()
 
 
+def _attach_sampler_listener(sampler, name, factory):
+    """
+    🆕 初始化一个采样器子系统并注册其回调
+
+    Args:
+        sampler: 后台采样器
+        name: 子系统名称（用于日志）
+        factory: 完成初始化并返回采样器回调的函数
+
+    Returns:
+        bool: 是否启动成功（失败只记录日志，不影响其他子系统）
+    """
+    try:
+        sampler.add_listener(factory())
+        return True
+    except Exception as e:
+        logger.error(f"❌ {name}启动失败: {e}", exc_info=True)
+        return False
+
+
 def create_app():
     """
     应用程序工厂函数，用于创建和配置 Flask 应用实例。
@@ -165,11 +204,18 @@ def create_app():
     mail.init_app(app)
     csrf.init_app(app)
     db.init_app(app)
+    # 🆕 clients / client_groups 有实际写入时递增数据版本号（条件 GET 的 ETag 依据）
+    track_data_changes(db.session, Client, ClientGroup)
+    # 🆕 TC 配置导出器：提交后增量更新内存模型，去抖动线程需要应用上下文
+    track_tc_changes(db.session)
+    get_exporter().init_app(app)
     login_manager.init_app(app)
     limiter.init_app(app)
 
     # 启用 SQLite WAL 优化
     optimize_sqlite_connection()
+    # 🆕 单写入者线程：后台批量写入与同步写入排队执行（跨进程 flock 串行化）
+    init_db_writer(app)
 
     # 告诉 Flask-Login 如何加载用户
     @login_manager.user_loader
@@ -193,6 +239,9 @@ def create_app():
     # 在应用上下文中执行数据库操作
     with app.app_context():
         db.create_all()
+
+        # 🆕 客户端全文检索索引（FTS5 trigram，触发器维护）
+        ensure_search_index(db.engine)
         
         # 检查并创建超级管理员账户
         if not User.query.filter_by(username='super_admin').first():
@@ -242,7 +291,7 @@ def create_app():
         revoke_client_bp, uninstall_bp, download_client_bp,
         modify_client_expiry_bp, enable_client_bp, ip_bp,
         user_bp, add_users_bp, delete_user_bp, status_bp,
-        restart_openvpn_bp, client_groups_bp
+        restart_openvpn_bp, client_groups_bp, rate_schedules_bp
     ]
     
     for bp in json_blueprints:
@@ -268,12 +317,68 @@ def create_app():
     app.register_blueprint(restart_openvpn_bp)
     app.register_blueprint(api_bp)
     app.register_blueprint(client_groups_bp)
+    app.register_blueprint(tc_state_bp)
+    app.register_blueprint(rate_schedules_bp)
+    app.register_blueprint(traffic_bp)
+    app.register_blueprint(client_sessions_bp)
     app.register_blueprint(dashboard_bp)
+    app.register_blueprint(push_bp)
     
     # 注册健康检查 API（放在最后）
     init_health_monitor(redis, concurrent_limiter, request_monitor)
     app.register_blueprint(health_bp)
 
+    # 🆕 启动后台系统指标采样（仪表板接口直接读取最新采样）
+    try:
+        sampler = start_sampler()
+    except Exception as e:
+        sampler = None
+        logger.error(f"❌ 系统指标采样器启动失败，依赖采样器的子系统均未启动: {e}", exc_info=True)
+
+    if sampler is not None:
+        # 🆕 各子系统独立注册：一个失败（如历史存储文件无法创建）不影响其他子系统
+        # 采样结果同时写入多分辨率历史存储
+        _attach_sampler_listener(sampler, '系统指标历史存储', lambda: get_history().record_sample)
+        # 🆕 顺带读取 TC 引擎的状态快照，保证实时速率有连续的历史
+        _attach_sampler_listener(sampler, 'TC 状态快照', lambda: get_tc_state().record_sample)
+
+        # 🆕 status.log 只由一个读取者轮询解析，同一份快照推送给下面的订阅者
+        def status_reader():
+            reader = get_status_reader()
+            # 客户端累计字节 → 实时速率 / Top-N 排行
+            get_rate_tracker()
+            return reader.record_sample
+        _attach_sampler_listener(sampler, 'status.log 读取 / 实时速率', status_reader)
+
+        # 🆕 同一份累计字节 → 流量增量批量入库（小时 / 日 / 月汇总）；采样器回调只做到期入库
+        accountant = None
+
+        def traffic_accounting():
+            nonlocal accountant
+            accountant = init_traffic_accounting(app)
+            return accountant.record_sample
+        if _attach_sampler_listener(sampler, '流量统计', traffic_accounting):
+            # 🆕 用户组流量配额：入库后按增量检查，采样器回调只检查周期切换
+            _attach_sampler_listener(
+                sampler, '流量配额', lambda: init_traffic_quota(app, accountant).record_sample
+            )
+        else:
+            logger.error("❌ 流量统计未启动，流量配额随之停用")
+        # 🆕 相邻两次在线快照的差异 → 连接会话历史；采样器回调只做保留期清理
+        _attach_sampler_listener(sampler, '连接会话历史', lambda: init_session_history(app).record_sample)
+
+    # 🆕 分时段限速：在时段边界批量切换用户组速率
+    try:
+        start_rate_scheduler(app)
+    except Exception as e:
+        print(f"⚠️  分时段限速调度器启动失败: {e}")
+
+    # 🆕 服务端推送（SSE）：一个后台线程计算，所有已连接页面共享
+    try:
+        init_push(app)
+    except Exception as e:
+        print(f"⚠️  推送发布线程启动失败: {e}")
+
     return app
 
 
@@ -293,6 +398,7 @@ if __name__ == '__main__':
     print("✅ 性能指标 API: /api/metrics")
     print("✅ 系统状态 API: /api/status")
     print("✅ TC 配置导出已初始化")
+    print("✅ 后台系统指标采样已启动")
     print("✅ 用户组管理路由已加载")
     print("=" * 60)
     print("📍 访问地址: http://0.0.0.0:8080")
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+TC 限速布局基准测试（使用 FakeTcBackend，不需要 root / 真实网卡）
+对比:
+  1. 旧布局: 每客户端一条 flower filter、各占一个 prio（classid 池 250 个）
+  2. 新布局: u32 哈希表按 IP 末字节分 256 桶（classid 池 0x100 ~ 0xFFFE）
+指标: 调和耗时 / fork 次数 / tc 命令数 / 每包平均与最坏匹配步数 / classid 分配耗时
+🆕 分时段切换: 所有在线客户端的速率同时变化时，一次调和的耗时 / fork / tc 命令数
+运行方式: python3 benchmark_tc_layout.py [--clients 250 1000 4000]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from openvpn_monitor.tc_engine import (
+    ClassIdAllocator, FakeTcBackend, RateTable, TcEngine
+)
+
+# 旧守护脚本的 classid 池: 101 ~ 350 共 250 个
+LEGACY_POOL = (0x101, 0x101 + 249)
+# 旧脚本每个新客户端: 4 次存在性探测 + 4 次 add
+LEGACY_FORKS_PER_ADD = 8
+
+
+def client_ip(i):
+    return f"10.8.{i // 250}.{i % 250 + 2}"
+
+
+def write_table(table, count, version='bench', rates='10Mbit 20Mbit'):
+    with open(table, 'w') as f:
+        f.write(f"#version={version}\n# client upload download group\n")
+        for i in range(count):
+            f.write(f"user{i} {rates} bench\n")
+
+
+def write_inputs(directory, count):
+    status = os.path.join(directory, 'status.log')
+    table = os.path.join(directory, 'tc-rates.tbl')
+    with open(status, 'w') as f:
+        f.write("OpenVPN CLIENT LIST\nROUTING TABLE\nVirtual Address,Common Name,Real Address,Last Ref\n")
+        for i in range(count):
+            f.write(f"{client_ip(i)},user{i},203.0.113.1:{10000 + i},now\n")
+        f.write("GLOBAL STATS\nEND\n")
+    write_table(table, count)
+    return status, table
+
+
+def run_layout(layout, count, pool):
+    with tempfile.TemporaryDirectory() as directory:
+        status, table = write_inputs(directory, count)
+        backend = FakeTcBackend()
+        engine = TcEngine(
+            backend=backend, rate_table=RateTable(path=table), status_file=status,
+            layout=layout, classid_start=pool[0], classid_end=pool[1]
+        )
+        engine.setup()
+
+        forks_before = backend.forks
+        started = time.perf_counter()
+        result = engine.reconcile()
+        elapsed = time.perf_counter() - started
+        forks = backend.forks - forks_before
+
+        forks_before = backend.forks
+        engine.reconcile()
+        steady_forks = backend.forks - forks_before
+
+        steps = []
+        shaped = 0
+        for i in range(count):
+            minor, n = backend.classify('tun0', '1:', client_ip(i))
+            steps.append(n)
+            shaped += minor is not None
+
+    return {
+        'shaped': shaped,
+        'elapsed': elapsed,
+        'forks': forks,
+        'steady_forks': steady_forks,
+        'commands': result['commands'],
+        'avg_steps': sum(steps) / len(steps),
+        'max_steps': max(steps),
+    }
+
+
+def bench_transition(count):
+    """分时段切换: 速率表换成新版本，全部客户端速率变化，测一次调和"""
+    with tempfile.TemporaryDirectory() as directory:
+        status, table = write_inputs(directory, count)
+        backend = FakeTcBackend()
+        engine = TcEngine(backend=backend, rate_table=RateTable(path=table), status_file=status)
+        engine.setup()
+        engine.reconcile()
+
+        write_table(table, count, version='night', rates='50Mbit 100Mbit')
+        forks_before = backend.forks
+        started = time.perf_counter()
+        result = engine.reconcile()
+        elapsed = time.perf_counter() - started
+    return {'elapsed': elapsed, 'forks': backend.forks - forks_before, 'commands': result['commands']}
+
+
+def bench_allocator(count, rounds=3):
+    """分配 count 个、释放一半、再分配一半，比较线性扫描与位图分配器"""
+    start, end = 0x100, 0xFFFE
+
+    def linear():
+        used = {}
+        for _ in range(count):
+            for minor in range(start, end + 1):
+                if minor not in used:
+                    used[minor] = 1
+                    break
+        for minor in list(used)[::2]:
+            del used[minor]
+        for _ in range(count // 2):
+            for minor in range(start, end + 1):
+                if minor not in used:
+                    used[minor] = 1
+                    break
+
+    def bitmap():
+        allocator = ClassIdAllocator(start, end)
+        ids = [allocator.allocate() for _ in range(count)]
+        for minor in ids[::2]:
+            allocator.release(minor)
+        for _ in range(count // 2):
+            allocator.allocate()
+
+    results = {}
+    for name, func in (('linear', linear), ('bitmap', bitmap)):
+        best = None
+        for _ in range(rounds):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TC 限速布局基准测试')
+    parser.add_argument('--clients', type=int, nargs='+', default=[250, 1000, 4000])
+    args = parser.parse_args()
+    # 旧布局超过 250 个客户端时池耗尽的错误日志属于预期结果
+    logging.disable(logging.CRITICAL)
+
+    print("=" * 96)
+    print(f"{'在线数':>6} {'布局':<14} {'已限速':>6} {'调和耗时':>9} {'fork':>6} {'稳态fork':>8} "
+          f"{'tc命令':>7} {'平均匹配':>8} {'最坏匹配':>8} {'旧脚本fork(估算)':>16}")
+    print("-" * 96)
+    for count in args.clients:
+        rows = (
+            ('flower/250', 'flower', LEGACY_POOL),
+            ('u32 hash', 'u32', (0x100, 0xFFFE)),
+        )
+        for label, layout, pool in rows:
+            r = run_layout(layout, count, pool)
+            legacy = LEGACY_FORKS_PER_ADD * min(count, LEGACY_POOL[1] - LEGACY_POOL[0] + 1) \
+                if layout == 'flower' else '-'
+            print(f"{count:>6} {label:<14} {r['shaped']:>6} {r['elapsed'] * 1000:>7.1f}ms {r['forks']:>6} "
+                  f"{r['steady_forks']:>8} {r['commands']:>7} {r['avg_steps']:>8.1f} {r['max_steps']:>8} "
+                  f"{legacy:>16}")
+    print("=" * 96)
+
+    print("\n分时段切换（全部在线客户端速率同时变化，u32 布局，一次调和）")
+    for count in args.clients:
+        r = bench_transition(count)
+        print(f"  N={count:<6} 耗时 {r['elapsed'] * 1000:>8.1f}ms   fork {r['forks']:>3}   tc命令 {r['commands']:>6}")
+
+    print("\nclassid 分配（分配 N、释放一半、再分配 N/2，取最好成绩）")
+    for count in args.clients:
+        r = bench_allocator(count)
+        print(f"  N={count:<6} 线性扫描 {r['linear'] * 1000:>9.2f}ms   位图 {r['bitmap'] * 1000:>7.2f}ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,6 +14,7 @@ TC_DAEMON_SCRIPT="/usr/local/sbin/vpn-tc-daemon.sh"
 TC_SERVICE_FILE="/etc/systemd/system/vpn-tc-daemon.service"
 TC_USERS_CONF="/etc/openvpn/tc-users.conf"
 TC_ROLES_MAP="/etc/openvpn/tc-roles.map"
+TC_RATES_TABLE="/etc/openvpn/tc-rates.tbl"   # 由 Web 应用导出的客户端速率表
 
 echo "=== VPN Web Manager 部署脚本（含 TC 限速功能）==="
 
@@ -269,7 +270,10 @@ EOF
 fi
 
 echo "=== 6.5 配置 TC 守护进程 systemd 服务 ==="
-sudo tee "$TC_SERVICE_FILE" > /dev/null <<'EOF'
+# 默认使用 Python 调和引擎（每周期一次读取实际状态、一次 tc -batch 提交）
+# 旧版 bash 守护脚本仍安装在 $TC_DAEMON_SCRIPT，如需回退:
+#   ExecStart=$TC_DAEMON_SCRIPT  并将 WorkingDirectory 改回 /var/log/openvpn
+sudo tee "$TC_SERVICE_FILE" > /dev/null <<EOF
 [Unit]
 Description=OpenVPN TC Traffic Control Daemon
 Documentation=man:tc(8)
@@ -280,8 +284,9 @@ BindsTo=openvpn@server.service
 
 [Service]
 Type=simple
-ExecStart=/usr/local/sbin/vpn-tc-daemon.sh
-ExecReload=/bin/kill -HUP $MAINPID
+ExecStart=$APP_DIR/venv/bin/python3 -m openvpn_monitor.tc_engine
+# SIGHUP: 立即读取实际状态并完整调和
+ExecReload=/bin/kill -HUP \$MAINPID
 
 # 重启策略
 Restart=always
@@ -308,8 +313,8 @@ StandardOutput=journal
 StandardError=journal
 SyslogIdentifier=vpn-tc-daemon
 
-# 工作目录
-WorkingDirectory=/var/log/openvpn
+# 工作目录（python -m 需要从项目目录导入 openvpn_monitor）
+WorkingDirectory=$APP_DIR
 
 # 运行用户（必须是 root 才能操作 tc）
 User=root
@@ -335,6 +340,8 @@ echo "✓ TC 配置文件权限已设置"
 
 echo ""
 echo "=== 7. 配置 Flask 应用服务 ==="
+# 推送通道 (SSE) 每个打开的页面占用一个长连接，使用线程 worker 避免阻塞其它请求
+# 仍保持单进程：采样器 / 推送发布线程是进程内单例
 sudo tee /etc/systemd/system/vpnwm.service > /dev/null <<EOF
 [Unit]
 Description=VPN Web Manager
@@ -346,7 +353,7 @@ User=root
 WorkingDirectory=$APP_DIR
 Environment="FLASK_ENV=production"
 Environment="PYTHONUNBUFFERED=1"
-ExecStart=$APP_DIR/venv/bin/gunicorn --timeout 600 -w 1 -b 0.0.0.0:$APP_PORT --access-logfile /dev/null --error-logfile - "app:app"
+ExecStart=$APP_DIR/venv/bin/gunicorn --timeout 600 -w 1 --worker-class gthread --threads 16 -b 0.0.0.0:$APP_PORT --access-logfile /dev/null --error-logfile - "app:app"
 Restart=always
 RestartSec=10
 
@@ -356,15 +363,17 @@ EOF
 echo "✓ Flask 服务配置完成"
 
 echo "=== 8. 配置 OpenVPN 客户端同步服务 ==="
+# 常驻进程：inotify 监听 status.log / index.txt / CCD 目录，变化后增量同步，
+# 每 5 分钟完整对账一次（取代原来每 10 秒启动一次脚本的定时器）
 sudo tee /etc/systemd/system/sync_openvpn_clients.service > /dev/null <<EOF
 [Unit]
-# Description=Sync OpenVPN Clients to DB after OpenVPN is ready
+Description=Sync OpenVPN Clients to DB (inotify daemon)
 Requires=openvpn@server.service
 After=openvpn@server.service
 PartOf=openvpn@server.service
 
 [Service]
-Type=oneshot
+Type=simple
 User=root
 WorkingDirectory=$APP_DIR
 
@@ -374,7 +383,11 @@ Environment="OPENVPN_STATUS_FILE=/var/log/openvpn/status.log"
 Environment="OPENVPN_CCD_DIR=/etc/openvpn/ccd"
 Environment="OPENVPN_INDEX_TXT=/etc/openvpn/easy-rsa/pki/index.txt"
 
-ExecStart=$APP_DIR/venv/bin/python3 sync_clients.py
+ExecStart=$APP_DIR/venv/bin/python3 sync_clients.py --daemon
+# SIGHUP: 立即完整对账
+ExecReload=/bin/kill -HUP \$MAINPID
+Restart=always
+RestartSec=5
 
 LogLevelMax=notice          # 只记录 notice/warning/err/crit
 
@@ -383,25 +396,19 @@ StandardOutput=null
 StandardError=null
 
 [Install]
-WantedBy=multi-user.target
+# OpenVPN 启动时一并拉起（PartOf 保证随 OpenVPN 停止 / 重启）
+WantedBy=multi-user.target openvpn@server.service
 EOF
 echo "✓ OpenVPN 同步服务配置完成"
 
-echo "=== 9. 配置 OpenVPN 客户端同步定时器 ==="
-sudo tee /etc/systemd/system/sync_openvpn_clients.timer > /dev/null <<EOF
-[Unit]
-Description=Run sync_openvpn_clients.service every 10 seconds
-
-[Timer]
-OnBootSec=10
-OnUnitActiveSec=10
-AccuracySec=1s
-Unit=sync_openvpn_clients.service
-
-[Install]
-WantedBy=timers.target
-EOF
-echo "✓ OpenVPN 同步定时器配置完成"
+echo "=== 9. 移除旧的 OpenVPN 客户端同步定时器 ==="
+if [ -f /etc/systemd/system/sync_openvpn_clients.timer ]; then
+    sudo systemctl disable --now sync_openvpn_clients.timer 2>/dev/null || true
+    sudo rm -f /etc/systemd/system/sync_openvpn_clients.timer
+    echo "✓ 已移除 sync_openvpn_clients.timer（改为常驻服务）"
+else
+    echo "✓ 无旧定时器"
+fi
 
 echo ""
 echo "=== 10. 重新加载 systemd 并启用所有服务 ==="
@@ -410,7 +417,6 @@ sudo systemctl daemon-reload
 # 启用基础服务
 sudo systemctl enable vpnwm
 sudo systemctl enable sync_openvpn_clients.service
-sudo systemctl enable sync_openvpn_clients.timer
 
 # 启用 TC 限速服务（如果脚本存在）
 if [ -f "$TC_DAEMON_SCRIPT" ]; then
@@ -423,7 +429,8 @@ fi
 echo ""
 echo "=== 11. 启动所有服务 ==="
 sudo systemctl start vpnwm
-sudo systemctl start sync_openvpn_clients.timer
+# 升级时旧服务是 oneshot，restart 保证以常驻模式运行
+sudo systemctl restart sync_openvpn_clients.service
 
 # 启动 TC 限速服务（如果脚本存在且 OpenVPN 正在运行）
 if [ -f "$TC_DAEMON_SCRIPT" ]; then
@@ -457,12 +464,12 @@ fi
 
 echo ""
 echo "--- OpenVPN 同步服务 ---"
-if sudo systemctl is-active --quiet sync_openvpn_clients.timer; then
-    echo "✓ sync_openvpn_clients.timer 定时器运行正常"
-    sudo systemctl status sync_openvpn_clients.timer --no-pager -l | head -10
+if sudo systemctl is-active --quiet sync_openvpn_clients.service; then
+    echo "✓ sync_openvpn_clients.service 运行正常"
+    sudo systemctl status sync_openvpn_clients.service --no-pager -l | head -10
 else
-    echo "✗ sync_openvpn_clients.timer 定时器启动失败"
-    sudo journalctl -u sync_openvpn_clients.timer -n 10 --no-pager
+    echo "✗ sync_openvpn_clients.service 启动失败（OpenVPN 未运行时属正常）"
+    sudo journalctl -u sync_openvpn_clients.service -n 10 --no-pager
 fi
 
 echo ""
@@ -526,6 +533,7 @@ echo ""
 echo "📌 TC 限速配置文件:"
 echo "   用户配置: $TC_USERS_CONF"
 echo "   角色映射: $TC_ROLES_MAP"
+echo "   速率表:   $TC_RATES_TABLE"
 echo "   本地备份: $APP_DIR/data/tc-*.conf"
 echo ""
 echo "📌 常用管理命令:"
@@ -537,8 +545,8 @@ echo "   查看状态:    sudo systemctl status vpnwm"
 echo ""
 echo "   --- OpenVPN 同步 ---"
 echo "   查看日志:    sudo journalctl -u sync_openvpn_clients.service -f"
-echo "   查看定时器:  sudo systemctl status sync_openvpn_clients.timer"
-echo "   手动同步:    sudo systemctl start sync_openvpn_clients.service"
+echo "   查看状态:    sudo systemctl status sync_openvpn_clients.service"
+echo "   完整对账:    sudo systemctl reload sync_openvpn_clients.service"
 echo ""
 echo "   --- TC 限速服务 ---"
 echo "   查看日志:    sudo journalctl -u vpn-tc-daemon.service -f"
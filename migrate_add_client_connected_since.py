@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+数据库迁移脚本:为 clients 表添加 connected_since 字段(本次连接开始时间)及索引
+在线时长改为读取时由 connected_since 计算,旧的 duration 字符串字段不再读写
+运行方式: python3 migrate_add_client_connected_since.py
+"""
+import os
+import sys
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+
+# 数据库路径
+DATA_DIR = "/opt/vpnwm/data"
+DB_PATH = os.path.join(DATA_DIR, "vpn_users.db")
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
+
+def migrate():
+    """添加 connected_since 字段到 clients 表"""
+    try:
+        engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+
+        with engine.connect() as conn:
+            # 检查字段是否已存在
+            result = conn.execute(text("PRAGMA table_info(clients)"))
+            columns = [row[1] for row in result]
+
+            if 'connected_since' in columns:
+                print("✅ connected_since 字段已存在,无需迁移")
+                return
+
+            # 添加新字段
+            print("🔄 添加 connected_since 字段...")
+            conn.execute(text("ALTER TABLE clients ADD COLUMN connected_since DATETIME"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_clients_connected_since ON clients (connected_since)"
+            ))
+            # 旧的时长字符串不再更新,清空避免误读
+            if 'duration' in columns:
+                conn.execute(text("UPDATE clients SET duration = NULL"))
+            conn.commit()
+
+            print("✅ 迁移完成!")
+            print("   - 已添加字段: connected_since(带索引)")
+            print("   - 在线客户端的连接时间将在下一次同步时写入")
+
+    except SQLAlchemyError as e:
+        print(f"❌ 数据库迁移失败: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ 未知错误: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    if not os.path.exists(DB_PATH):
+        print(f"❌ 数据库文件不存在: {DB_PATH}")
+        sys.exit(1)
+
+    migrate()
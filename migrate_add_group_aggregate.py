@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+数据库迁移脚本:为 client_groups 表添加用户组聚合限速字段
+(aggregate_upload_rate / aggregate_upload_ceil / aggregate_download_rate /
+ aggregate_download_ceil / priority)
+运行方式: python3 migrate_add_group_aggregate.py
+"""
+import os
+import sys
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+
+# 数据库路径
+DATA_DIR = "/opt/vpnwm/data"
+DB_PATH = os.path.join(DATA_DIR, "vpn_users.db")
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
+
+# 字段名 -> 列定义
+NEW_COLUMNS = {
+    'aggregate_upload_rate': 'VARCHAR(50)',
+    'aggregate_upload_ceil': 'VARCHAR(50)',
+    'aggregate_download_rate': 'VARCHAR(50)',
+    'aggregate_download_ceil': 'VARCHAR(50)',
+    'priority': 'INTEGER NOT NULL DEFAULT 4',
+}
+
+def migrate():
+    """添加用户组聚合限速字段到 client_groups 表"""
+    try:
+        engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+        
+        with engine.connect() as conn:
+            # 检查字段是否已存在
+            result = conn.execute(text("PRAGMA table_info(client_groups)"))
+            columns = [row[1] for row in result]
+            
+            missing = [name for name in NEW_COLUMNS if name not in columns]
+            if not missing:
+                print("✅ 用户组聚合限速字段已存在,无需迁移")
+                return
+            
+            # 添加新字段
+            for name in missing:
+                print(f"🔄 添加 {name} 字段...")
+                conn.execute(text(f"ALTER TABLE client_groups ADD COLUMN {name} {NEW_COLUMNS[name]}"))
+            conn.commit()
+            
+            print("✅ 迁移完成!")
+            print(f"   - 已添加字段: {', '.join(missing)}")
+            print("   - 现有用户组未设置聚合速率,成员仍直接挂在根类下")
+            
+    except SQLAlchemyError as e:
+        print(f"❌ 数据库迁移失败: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ 未知错误: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    if not os.path.exists(DB_PATH):
+        print(f"❌ 数据库文件不存在: {DB_PATH}")
+        sys.exit(1)
+    
+    migrate()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+数据库迁移脚本:为 client_groups 表添加成员流量配额字段
+(quota_bytes / quota_period / quota_action / quota_throttle_rate)
+运行方式: python3 migrate_add_group_quota.py
+"""
+import os
+import sys
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+
+# 数据库路径
+DATA_DIR = "/opt/vpnwm/data"
+DB_PATH = os.path.join(DATA_DIR, "vpn_users.db")
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
+
+# 字段名 -> 列定义
+NEW_COLUMNS = {
+    'quota_bytes': 'BIGINT',
+    'quota_period': "VARCHAR(10) NOT NULL DEFAULT 'month'",
+    'quota_action': "VARCHAR(10) NOT NULL DEFAULT 'throttle'",
+    'quota_throttle_rate': 'VARCHAR(50)',
+}
+
+def migrate():
+    """添加成员流量配额字段到 client_groups 表"""
+    try:
+        engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+        
+        with engine.connect() as conn:
+            # 检查字段是否已存在
+            result = conn.execute(text("PRAGMA table_info(client_groups)"))
+            columns = [row[1] for row in result]
+            
+            missing = [name for name in NEW_COLUMNS if name not in columns]
+            if not missing:
+                print("✅ 成员流量配额字段已存在,无需迁移")
+                return
+            
+            # 添加新字段
+            for name in missing:
+                print(f"🔄 添加 {name} 字段...")
+                conn.execute(text(f"ALTER TABLE client_groups ADD COLUMN {name} {NEW_COLUMNS[name]}"))
+            conn.commit()
+            
+            print("✅ 迁移完成!")
+            print(f"   - 已添加字段: {', '.join(missing)}")
+            print("   - 现有用户组不限流量（quota_bytes 为空）")
+            
+    except SQLAlchemyError as e:
+        print(f"❌ 数据库迁移失败: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ 未知错误: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    if not os.path.exists(DB_PATH):
+        print(f"❌ 数据库文件不存在: {DB_PATH}")
+        sys.exit(1)
+    
+    migrate()
@@ -96,6 +96,71 @@ class ClientGroup(db.Model):
         nullable=False,
         comment="下行速率，格式如: 2Mbit, 50Mbit"
     )
+
+    # 🆕 用户组聚合限速（两级 HTB：根类 → 用户组类 → 客户端类）
+    # 为空表示不建立用户组类，成员直接挂在根类下（与旧行为一致）
+    aggregate_upload_rate = db.Column(
+        db.String(50),
+        nullable=True,
+        comment="整组上行保证速率，如 50Mbit"
+    )
+    aggregate_upload_ceil = db.Column(
+        db.String(50),
+        nullable=True,
+        comment="整组上行可借用的上限，为空时等于保证速率"
+    )
+    aggregate_download_rate = db.Column(
+        db.String(50),
+        nullable=True,
+        comment="整组下行保证速率"
+    )
+    aggregate_download_ceil = db.Column(
+        db.String(50),
+        nullable=True,
+        comment="整组下行可借用的上限，为空时等于保证速率"
+    )
+    priority = db.Column(
+        db.Integer,
+        default=4,
+        nullable=False,
+        comment="HTB 优先级 0~7，越小越优先分得空闲带宽"
+    )
+
+    # 🆕 成员 class 的队列参数，为空时使用全局默认（Config.TC_LEAF_QDISC / TC_BURST_MS）
+    leaf_qdisc = db.Column(
+        db.String(20),
+        nullable=True,
+        comment="成员 class 下的叶子队列: fq_codel / cake / pfifo"
+    )
+    burst_ms = db.Column(
+        db.Integer,
+        nullable=True,
+        comment="HTB burst / cburst 按速率折算的毫秒数"
+    )
+
+    # 🆕 成员流量配额（每个成员单独计量），为空表示不限
+    quota_bytes = db.Column(
+        db.BigInteger,
+        nullable=True,
+        comment="每个成员每个周期的流量上限（字节，上下行合计）"
+    )
+    quota_period = db.Column(
+        db.String(10),
+        default='month',
+        nullable=False,
+        comment="配额周期: day / month（服务器本地时间）"
+    )
+    quota_action = db.Column(
+        db.String(10),
+        default='throttle',
+        nullable=False,
+        comment="超额处理: throttle = 降速，disable = 禁用并踢下线"
+    )
+    quota_throttle_rate = db.Column(
+        db.String(50),
+        nullable=True,
+        comment="超额降速后的上下行速率，为空时使用 Config.TRAFFIC_QUOTA_THROTTLE_RATE"
+    )
     
     # 时间戳
     created_at = db.Column(
@@ -120,15 +185,16 @@ class ClientGroup(db.Model):
         passive_deletes=True  # 🆕 让数据库处理级联
     )
     
-    def to_dict(self, include_members=False):
+    def to_dict(self, include_members=False, client_count=None):
         """
         序列化为字典
         
         Args:
             include_members: 是否包含成员列表（默认否，避免性能问题）
+            client_count: 🆕 预先聚合好的成员数量；为 None 时单独 COUNT
         """
-        # 🆕 优化：使用 scalar 代替 count()，性能更好
-        client_count = self.clients.count()  # lazy='dynamic' 支持 .count()
+        if client_count is None:
+            client_count = self.clients.count()  # lazy='dynamic' 支持 .count()
         
         is_default = self.name.lower() == 'default'
 
@@ -138,6 +204,17 @@ class ClientGroup(db.Model):
             'description': self.description,
             'upload_rate': self.upload_rate,
             'download_rate': self.download_rate,
+            'aggregate_upload_rate': self.aggregate_upload_rate,
+            'aggregate_upload_ceil': self.aggregate_upload_ceil,
+            'aggregate_download_rate': self.aggregate_download_rate,
+            'aggregate_download_ceil': self.aggregate_download_ceil,
+            'priority': self.priority,
+            'leaf_qdisc': self.leaf_qdisc,
+            'burst_ms': self.burst_ms,
+            'quota_bytes': self.quota_bytes,
+            'quota_period': self.quota_period,
+            'quota_action': self.quota_action,
+            'quota_throttle_rate': self.quota_throttle_rate,
             'client_count': client_count,
             'is_default': is_default, 
             'created_at': self.created_at.isoformat() if self.created_at else None,
@@ -162,6 +239,83 @@ class ClientGroup(db.Model):
         return f'<ClientGroup {self.name}>'
 
 
+# ==================== 🆕 用户组分时段限速 ====================
+class GroupRateSchedule(db.Model):
+    """
+    用户组的分时段速率（如工作时间 / 夜间 / 周末）
+
+    - days: ISO 星期（1 = 周一 … 7 = 周日），逗号分隔
+    - start_time / end_time: 服务器本地时间 "HH:MM"；end < start 表示跨零点，
+      属于开始那一天；两者相等表示全天
+    - 不在任何时段内时使用用户组本身的 upload_rate / download_rate
+    """
+    __tablename__ = 'group_rate_schedules'
+
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(
+        db.Integer,
+        db.ForeignKey('client_groups.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True
+    )
+    name = db.Column(db.String(64), nullable=False, comment="时段名称，如: 工作时间")
+    days = db.Column(db.String(20), nullable=False, default='1,2,3,4,5,6,7', comment="ISO 星期，逗号分隔")
+    start_time = db.Column(db.String(5), nullable=False, comment="开始时间 HH:MM")
+    end_time = db.Column(db.String(5), nullable=False, comment="结束时间 HH:MM")
+    upload_rate = db.Column(db.String(50), nullable=False, comment="时段内上行速率")
+    download_rate = db.Column(db.String(50), nullable=False, comment="时段内下行速率")
+    enabled = db.Column(db.Boolean, default=True, nullable=False)
+
+    created_at = db.Column(
+        db.DateTime,
+        default=lambda: datetime.now(timezone.utc),
+        nullable=False
+    )
+    updated_at = db.Column(
+        db.DateTime,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+        nullable=False
+    )
+
+    # 删除用户组时一并删除时段（SQLite 未启用外键约束，由 ORM 级联）
+    group = db.relationship(
+        'ClientGroup',
+        backref=db.backref('rate_schedules', cascade='all, delete-orphan')
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'group_id': self.group_id,
+            'name': self.name,
+            'days': [int(day) for day in self.days.split(',') if day],
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'upload_rate': self.upload_rate,
+            'download_rate': self.download_rate,
+            'enabled': self.enabled,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+    def __repr__(self):
+        return f'<GroupRateSchedule {self.name} {self.start_time}-{self.end_time}>'
+
+
+def human_duration(seconds):
+    """>=1 h 输出 1h23m;<1 h 输出 5m12s;<1 min 输出 45s"""
+    if seconds < 0:
+        return "00:00"
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    if h:
+        return f"{h}h{m:02d}m"
+    if m:
+        return f"{m}m{s:02d}s"
+    return f"{s}s"
+
+
 # ==================== 🔥 Client 模型（重点改进）====================
 class Client(db.Model):
     __tablename__ = 'clients'
@@ -187,7 +341,8 @@ class Client(db.Model):
     # 🆕 网络信息字段（添加索引用于查询）
     vpn_ip = db.Column(db.String(15), nullable=True, index=True)  # 🆕 添加索引
     real_ip = db.Column(db.String(15), nullable=True)
-    duration = db.Column(db.String(50), nullable=True)
+    # 🆕 本次连接开始时间 (UTC)；在线时长在读取时计算，同步时只有重连才需要写入
+    connected_since = db.Column(db.DateTime, nullable=True, index=True, comment="本次连接开始时间 (UTC)")
 
     # 🆕 关联到用户组（添加 ondelete 规则）
     group_id = db.Column(
@@ -234,6 +389,8 @@ class Client(db.Model):
             'disabled': self.disabled,
             'vpn_ip': self.vpn_ip,
             'real_ip': self.real_ip,
+            'connected_since': self.connected_since.isoformat() if self.connected_since else None,
+            'duration_sec': self.online_seconds(),
             'duration': self.duration,
             'group_id': self.group_id,
             'created_at': self.created_at.isoformat() if self.created_at else None,
@@ -275,6 +432,25 @@ class Client(db.Model):
             'download_rate': self.group.download_rate
         }
     
+    # 🆕 在线时长（由 connected_since 计算）
+    def online_seconds(self, now=None):
+        """
+        本次连接已持续的秒数，离线或未知时返回 None
+
+        Args:
+            now: 当前时间（不带时区的 UTC），默认取当前时间
+        """
+        if not self.online or self.connected_since is None:
+            return None
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        return int((now - self.connected_since).total_seconds())
+
+    @property
+    def duration(self):
+        """人类可读的在线时长（如 1h23m），离线时为 None"""
+        seconds = self.online_seconds()
+        return human_duration(seconds) if seconds is not None else None
+
     # 🆕 添加便捷方法：更新在线状态
     def set_online(self, is_online: bool):
         """
@@ -288,4 +464,139 @@ class Client(db.Model):
             self.last_seen = datetime.now(timezone.utc)
     
     def __repr__(self):
-        return f'<Client {self.name}>'
\ No newline at end of file
+        return f'<Client {self.name}>'
+
+
+# ==================== 🆕 流量统计 ====================
+# 字节数为客户端视角：bytes_recv = 上行（客户端 → 服务器），bytes_sent = 下行
+class TrafficSample(db.Model):
+    """
+    原始流量增量：每个客户端每次批量写入一行（只写有流量的客户端）
+    已经同步累加进各级汇总表，超过保留期后直接删除（见 utils.traffic_accounting）
+    """
+    __tablename__ = 'traffic_samples'
+
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, nullable=False)
+    ts = db.Column(db.Integer, nullable=False, index=True, comment="采样时间 (Unix 秒)")
+    bytes_recv = db.Column(db.BigInteger, nullable=False, default=0)
+    bytes_sent = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class _TrafficRollup:
+    """
+    汇总表公共列：主键 (client_id, bucket)，按客户端查询一段时间直接走主键范围扫描；
+    bucket 单独索引，用于保留期清理与按周期排行
+    """
+    client_id = db.Column(db.Integer, nullable=False)
+    bucket = db.Column(db.Integer, nullable=False, index=True)
+    bytes_recv = db.Column(db.BigInteger, nullable=False, default=0)
+    bytes_sent = db.Column(db.BigInteger, nullable=False, default=0)
+
+    __table_args__ = (db.PrimaryKeyConstraint('client_id', 'bucket'),)
+
+
+class TrafficHourly(_TrafficRollup, db.Model):
+    """小时汇总，bucket = 整点的 Unix 秒"""
+    __tablename__ = 'traffic_hourly'
+
+
+class TrafficDaily(_TrafficRollup, db.Model):
+    """日汇总，bucket = 服务器本地日期 YYYYMMDD"""
+    __tablename__ = 'traffic_daily'
+
+
+class TrafficMonthly(_TrafficRollup, db.Model):
+    """月汇总，bucket = 服务器本地月份 YYYYMM"""
+    __tablename__ = 'traffic_monthly'
+
+
+class TrafficCounter(db.Model):
+    """
+    每个客户端最近一次入库时的累计计数器（status.log 的 Bytes Received / Sent）
+    Web 进程重启后据此继续计算增量；connected_since 变化表示客户端重连、计数器归零
+    """
+    __tablename__ = 'traffic_counters'
+
+    client_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    connected_since = db.Column(db.String(32), nullable=False)
+    bytes_recv = db.Column(db.BigInteger, nullable=False, default=0)
+    bytes_sent = db.Column(db.BigInteger, nullable=False, default=0)
+    ts = db.Column(db.Integer, nullable=False, comment="最后入库时间 (Unix 秒)")
+
+
+class TrafficQuotaState(db.Model):
+    """
+    当前周期内已超出配额的客户端（周期切换时删除并解除降速 / 禁用）
+    只记录由配额引擎处理的客户端，手动禁用的客户端不在此表中
+    """
+    __tablename__ = 'traffic_quota_states'
+
+    client_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    group_id = db.Column(db.Integer, nullable=False)
+    period = db.Column(db.String(10), nullable=False, comment="day / month")
+    bucket = db.Column(db.Integer, nullable=False, comment="超额所在周期: YYYYMMDD / YYYYMM")
+    action = db.Column(db.String(10), nullable=False, comment="throttle / disable")
+    used_bytes = db.Column(db.BigInteger, nullable=False, comment="超额时已用流量")
+    quota_bytes = db.Column(db.BigInteger, nullable=False, comment="超额时的配额")
+    exceeded_at = db.Column(
+        db.DateTime,
+        default=lambda: datetime.now(timezone.utc),
+        nullable=False
+    )
+
+    def to_dict(self):
+        return {
+            'client_id': self.client_id,
+            'group_id': self.group_id,
+            'period': self.period,
+            'bucket': self.bucket,
+            'action': self.action,
+            'used_bytes': self.used_bytes,
+            'quota_bytes': self.quota_bytes,
+            'exceeded_at': self.exceeded_at.isoformat() if self.exceeded_at else None,
+        }
+
+
+# ==================== 🆕 连接会话历史 ====================
+class ClientSession(db.Model):
+    """
+    客户端的一次连接（由相邻两次在线快照的差异得出，见 utils.session_history）
+
+    - 按客户端名记录：客户端被删除后历史仍可审计
+    - ended_at 为空表示仍在线；结束时写入时长与本次连接的累计字节
+    - 索引 (client_name, started_at) 用于单个客户端的历史，started_at 用于按时间段查询
+    """
+    __tablename__ = 'client_sessions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    client_name = db.Column(db.String(100, collation="NOCASE"), nullable=False)
+    real_ip = db.Column(db.String(45), nullable=True)
+    vpn_ip = db.Column(db.String(15), nullable=True)
+    started_at = db.Column(db.DateTime, nullable=False, index=True, comment="连接时间 (UTC)")
+    ended_at = db.Column(db.DateTime, nullable=True, comment="断开时间 (UTC)，为空表示在线")
+    duration_sec = db.Column(db.Integer, nullable=True)
+    bytes_recv = db.Column(db.BigInteger, nullable=True, comment="本次连接上行字节")
+    bytes_sent = db.Column(db.BigInteger, nullable=True, comment="本次连接下行字节")
+
+    __table_args__ = (
+        db.Index('ix_client_sessions_client_started', 'client_name', 'started_at'),
+    )
+
+    def to_dict(self):
+        ended = self.ended_at
+        duration = self.duration_sec
+        if ended is None:
+            duration = int((datetime.now(timezone.utc).replace(tzinfo=None) - self.started_at).total_seconds())
+        return {
+            'id': self.id,
+            'client_name': self.client_name,
+            'real_ip': self.real_ip,
+            'vpn_ip': self.vpn_ip,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'ended_at': ended.isoformat() if ended else None,
+            'online': ended is None,
+            'duration_sec': duration,
+            'bytes_recv': self.bytes_recv,
+            'bytes_sent': self.bytes_sent,
+        }
@@ -0,0 +1,278 @@
+"""
+客户端实时速率与 Top-N 排行
+
+数据来源:
+- OpenVPN status.log 的 CLIENT LIST（Bytes Received / Bytes Sent），覆盖所有在线客户端
+  - upload   = 客户端 → 服务器（Bytes Received）
+  - download = 服务器 → 客户端（Bytes Sent）
+- TC 引擎状态快照（openvpn_monitor.tc_state）的 class 丢包计数，用于按丢包排行
+
+status.log 只由 StatusLogReader 轮询：后台采样器每秒调用 refresh()，文件修改时间
+未变化时只做一次 stat，变化时解析一次，同一份快照分发给全部订阅者
+（实时速率、utils.traffic_accounting 流量统计、utils.session_history 连接会话）。
+每个客户端保留一小段 (时间, 累计字节) 序列，按请求的窗口计算速率；
+同一份采样、同一窗口的速率结果会缓存，排行时用 heapq.nlargest 只保留前 N 个，
+不对全部客户端排序，适合仪表板高频刷新。
+"""
+
+import heapq
+import logging
+import os
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from openvpn_monitor.config import Config
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('upload', 'download', 'total', 'drops')
+
+
+def parse_status_counters(path: str) -> Dict[str, Dict]:
+    """
+    解析 status.log（version 1）中每个客户端的累计字节数
+
+    Returns:
+        dict: {common_name: {'vpn_ip', 'real_ip', 'bytes_recv', 'bytes_sent', 'since'}}
+    """
+    clients: Dict[str, Dict] = {}
+    routes: Dict[str, str] = {}
+    section = None
+    with open(path, 'rb') as f:
+        data = f.read().decode('utf-8', errors='ignore')
+    for line in data.splitlines():
+        line = line.strip()
+        if line.startswith('OpenVPN CLIENT LIST'):
+            section = 'clients'
+            continue
+        if line.startswith('ROUTING TABLE'):
+            section = 'routes'
+            continue
+        if line.startswith('GLOBAL STATS'):
+            section = None
+            continue
+        if not section or line.startswith(('Common Name', 'Virtual Address', 'Updated')):
+            continue
+        parts = line.split(',')
+        if section == 'clients' and len(parts) >= 5 and parts[0] != 'UNDEF':
+            try:
+                recv, sent = int(parts[2]), int(parts[3])
+            except ValueError:
+                continue
+            clients[parts[0]] = {
+                'vpn_ip': None,
+                'real_ip': parts[1].rsplit(':', 1)[0],
+                'bytes_recv': recv,
+                'bytes_sent': sent,
+                'since': parts[4],
+            }
+        elif section == 'routes' and len(parts) >= 2:
+            routes.setdefault(parts[1], parts[0])
+    for name, client in clients.items():
+        client['vpn_ip'] = routes.get(name)
+    return clients
+
+
+StatusCallback = Callable[[Dict[str, Dict], float], None]
+
+
+class StatusLogReader:
+    """
+    status.log 快照读取（进程内唯一的 status.log 轮询者）
+
+    订阅者以 callback(counters, ts) 接收每一份新快照，counters 为
+    parse_status_counters() 的结果，ts 为文件修改时间（OpenVPN 写入时间即计数器的采样时间）。
+    """
+
+    def __init__(self, status_file: str = None):
+        self.status_file = status_file or Config.TC_STATUS_LOG
+        self.subscribers: List[StatusCallback] = []
+        self.reads = 0
+        self._mtime: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback: StatusCallback) -> None:
+        """添加订阅者（重复添加同一个回调只保留一个）"""
+        with self._lock:
+            if callback not in self.subscribers:
+                self.subscribers.append(callback)
+
+    def refresh(self) -> bool:
+        """status.log 有更新时解析一次并分发；返回是否读到新快照"""
+        with self._lock:
+            try:
+                stat = os.stat(self.status_file)
+            except OSError:
+                return False
+            if stat.st_mtime_ns == self._mtime:
+                return False
+            try:
+                counters = parse_status_counters(self.status_file)
+            except OSError as e:
+                logger.warning(f"⚠️ 读取 status.log 失败: {e}")
+                return False
+            self._mtime = stat.st_mtime_ns
+            self.reads += 1
+            # 持有锁分发：各订阅者按文件顺序收到每份快照，不会重复或乱序
+            for callback in self.subscribers:
+                try:
+                    callback(counters, stat.st_mtime)
+                except Exception as e:
+                    logger.error(f"❌ status.log 订阅者 {getattr(callback, '__qualname__', callback)} 处理失败: {e}")
+        return True
+
+    def record_sample(self, sample: Dict = None) -> None:
+        """采样器回调"""
+        self.refresh()
+
+
+class ClientRateTracker:
+    """
+    按客户端维护累计字节序列（数据由 StatusLogReader 推送，见 ingest()）
+
+    客户端重连（connected since 变化）或计数器回退时清空该客户端的序列；
+    下线的客户端在下一份快照时移除。
+    """
+
+    def __init__(self, capacity: int = None, max_window: int = None):
+        self.capacity = capacity or Config.CLIENT_RATE_SAMPLES
+        self.max_window = max_window or Config.CLIENT_RATE_MAX_WINDOW
+        # name -> {'since', 'vpn_ip', 'real_ip', 'samples': deque[(t, recv, sent)]}
+        self.clients: Dict[str, Dict] = {}
+        self.version = 0                    # 每追加一份采样递增，用于结果缓存
+        self._cache: Dict[float, Tuple[int, List[Dict]]] = {}
+        self._lock = threading.Lock()
+
+    def ingest(self, counters: Dict[str, Dict], now: float) -> None:
+        """追加一份累计字节快照（now 为快照时间）"""
+        with self._lock:
+            for name in list(self.clients):
+                if name not in counters:
+                    del self.clients[name]
+            for name, c in counters.items():
+                entry = self.clients.get(name)
+                if entry is None or entry['since'] != c['since']:
+                    entry = {'since': c['since'], 'samples': deque(maxlen=self.capacity)}
+                    self.clients[name] = entry
+                samples = entry['samples']
+                if samples and (c['bytes_recv'] < samples[-1][1] or c['bytes_sent'] < samples[-1][2]):
+                    samples.clear()
+                entry['vpn_ip'] = c['vpn_ip']
+                entry['real_ip'] = c['real_ip']
+                samples.append((now, c['bytes_recv'], c['bytes_sent']))
+                while samples and now - samples[0][0] > self.max_window:
+                    samples.popleft()
+            self.version += 1
+            self._cache.clear()
+
+    def rates(self, window: float) -> List[Dict]:
+        """
+        每个客户端在窗口内的平均速率（bit/s）
+
+        序列不足两点的客户端（刚上线）速率为 0。
+        """
+        with self._lock:
+            cached = self._cache.get(window)
+            if cached and cached[0] == self.version:
+                return cached[1]
+
+            result = []
+            for name, entry in self.clients.items():
+                samples = entry['samples']
+                newest = samples[-1]
+                base = next((s for s in samples if newest[0] - s[0] <= window), newest)
+                if base is newest and len(samples) > 1:
+                    base = samples[-2]
+                elapsed = newest[0] - base[0]
+                upload = (newest[1] - base[1]) * 8 / elapsed if elapsed > 0 else 0.0
+                download = (newest[2] - base[2]) * 8 / elapsed if elapsed > 0 else 0.0
+                result.append({
+                    'name': name,
+                    'vpn_ip': entry['vpn_ip'],
+                    'real_ip': entry['real_ip'],
+                    'upload_bps': round(upload, 1),
+                    'download_bps': round(download, 1),
+                    'total_bps': round(upload + download, 1),
+                    'bytes_recv': newest[1],
+                    'bytes_sent': newest[2],
+                    'window': round(elapsed, 1),
+                })
+            self._cache[window] = (self.version, result)
+            return result
+
+
+def top_consumers(metric: str, n: int, window: float,
+                  tracker: 'ClientRateTracker' = None) -> Dict:
+    """
+    按指标取前 N 个客户端（heapq.nlargest，O(M log N)）
+
+    Args:
+        metric: upload / download / total / drops
+        n: 返回数量
+        window: 计算窗口（秒）
+        tracker: 速率跟踪器，默认进程级单例
+
+    Returns:
+        dict: {'metric', 'window', 'online', 'top': [...]}
+    """
+    if metric == 'drops':
+        from openvpn_monitor.tc_state import get_tc_state
+
+        state = get_tc_state().client_rates(window)
+        clients = state['clients'] if state else []
+        candidates = (
+            {
+                'name': c['user'],
+                'vpn_ip': c['ip'],
+                'group': c['group'],
+                'drops_per_s': round((c['up']['drops_per_s'] or 0) + (c['down']['drops_per_s'] or 0), 2),
+                'drop_ratio': max(c['up']['drop_ratio'] or 0, c['down']['drop_ratio'] or 0),
+                'throttled': c['throttled'],
+            }
+            for c in clients
+        )
+        top = heapq.nlargest(n, candidates, key=lambda c: c['drops_per_s'])
+        return {
+            'metric': metric,
+            'window': state['window'] if state else 0,
+            'online': len(clients),
+            'top': [c for c in top if c['drops_per_s'] > 0],
+        }
+
+    tracker = tracker or get_rate_tracker()
+    get_status_reader().refresh()
+    rates = tracker.rates(window)
+    key = f'{metric}_bps'
+    top = heapq.nlargest(n, rates, key=lambda c: c[key])
+    return {
+        'metric': metric,
+        'window': max((c['window'] for c in top), default=0),
+        'online': len(rates),
+        'top': top,
+    }
+
+
+_reader: Optional[StatusLogReader] = None
+_tracker: Optional[ClientRateTracker] = None
+_tracker_lock = threading.Lock()
+
+
+def get_status_reader() -> StatusLogReader:
+    """获取进程级 status.log 读取者单例"""
+    global _reader
+    with _tracker_lock:
+        if _reader is None:
+            _reader = StatusLogReader()
+        return _reader
+
+
+def get_rate_tracker() -> ClientRateTracker:
+    """获取进程级速率跟踪器单例（创建时订阅 status.log 快照）"""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is not None:
+            return _tracker
+        _tracker = ClientRateTracker()
+    get_status_reader().subscribe(_tracker.ingest)
+    return _tracker
@@ -27,6 +27,68 @@ class Config:
     # 刷新间隔 (秒)
     REFRESH_INTERVAL = 5
 
+    # 🆕 后台系统指标采样
+    SAMPLE_INTERVAL = 1.0       # 采样周期 (秒)
+    SAMPLE_HISTORY = 600        # 环形缓冲区容量 (采样点数，默认 10 分钟)
+    DISK_PATH = '/'             # 监控的磁盘挂载点
+    RATE_WINDOW = 5             # 网络速率计算窗口 (秒)
+
+    # 🆕 指标历史（多分辨率时序存储，mmap 持久化）
+    DATA_DIR = '/opt/vpnwm/data'
+    METRICS_HISTORY_FILE = os.path.join(DATA_DIR, 'metrics_history.bin')
+    METRICS_HISTORY_FLUSH_INTERVAL = 60   # 刷盘周期 (秒)
+
+    # 🆕 TC 限速调和引擎（openvpn_monitor.tc_engine，取代 vpn-tc-daemon.sh）
+    TC_VPN_DEV = 'tun0'
+    TC_IFB_DEV = 'ifb0'
+    TC_STATUS_LOG = '/var/log/openvpn/status.log'
+    TC_LOG_FILE = '/var/log/openvpn/vpn-tc-daemon.log'
+    TC_RATE_TABLE = '/etc/openvpn/tc-rates.tbl'
+    TC_USERS_CONF = '/etc/openvpn/tc-users.conf'
+    TC_ROLES_MAP = '/etc/openvpn/tc-roles.map'
+    TC_RELOAD_SIGNAL = '/var/run/openvpn-tc/reload.signal'
+    TC_INTERVAL = 3             # 调和周期 (秒)
+    TC_REPAIR_INTERVAL = 5      # 每 N 个周期读取一次实际状态做修复
+    TC_DEFAULT_RATE = '2Mbit'   # 未分组客户端的默认速率
+    # 🆕 classid 池（tc 按十六进制解析；旧脚本的 1:101 ~ 1:350 落在池内，可直接接管）
+    # 0x2 ~ 0xFF 保留，0xFFFF 不可用
+    TC_CLASSID_START = 0x100
+    TC_CLASSID_END = 0xFFFE
+    # 🆕 用户组聚合类（两级 HTB: 根类 → 用户组类 → 客户端类）使用保留区间
+    TC_GROUP_CLASSID_START = 0x2
+    TC_GROUP_CLASSID_END = 0xFF
+    TC_LINK_RATE = '100Mbit'    # 根类 1:1 / 2:1 的速率（各用户组可借用的总带宽）
+    TC_FILTER_LAYOUT = 'u32'    # u32 = 按 IP 末字节哈希分桶；flower = 旧的每客户端一个 prio
+    # 🆕 客户端 class 的叶子队列与 burst（用户组可单独覆盖）
+    TC_LEAF_QDISC = 'fq_codel'  # fq_codel / cake / pfifo（内核默认，不挂叶子队列）
+    TC_BURST_MS = 10            # burst / cburst = 速率 × 该毫秒数，至少两个满 MTU 包
+    TC_FQ_CODEL_FLOWS = 128     # 每个叶子 fq_codel 的流表大小（默认 1024 在数千客户端时内存占用过大）
+    # 🆕 控制通道（Web 应用 → 引擎，带确认；不可用时退回 TC_RELOAD_SIGNAL）
+    TC_CONTROL_SOCKET = '/var/run/openvpn-tc/control.sock'
+    TC_APPLY_TIMEOUT = 3.0      # 同步生效的等待上限 (秒)
+    # 🆕 引擎状态快照（已应用的限速 + tc -s class 计数器），Web 端据此计算实时吞吐
+    TC_STATE_FILE = '/var/run/openvpn-tc/state.json'
+    TC_STATE_INTERVAL = 5       # 快照周期 (秒)，0 = 不写
+    TC_STATE_HISTORY = 120      # Web 端保留的快照数（默认 10 分钟）
+    TC_STATE_WINDOW = 15        # 默认速率计算窗口 (秒)
+
+    # 🆕 客户端实时速率（status.log 累计字节）与 Top-N 排行
+    CLIENT_RATE_SAMPLES = 120       # 每客户端保留的采样点数
+    CLIENT_RATE_MAX_WINDOW = 300    # 最大计算窗口 (秒)
+    CLIENT_RATE_WINDOW = 30         # 默认计算窗口 (秒)
+
+    # 🆕 流量统计（utils.traffic_accounting）：原始增量 + 小时 / 日 / 月汇总
+    TRAFFIC_FLUSH_INTERVAL = 60             # 批量入库周期 (秒)
+    TRAFFIC_RAW_RETENTION_HOURS = 48        # 原始增量保留时长（已计入汇总，过期直接删除）
+    TRAFFIC_HOURLY_RETENTION_DAYS = 93      # 小时汇总保留天数
+    TRAFFIC_DAILY_RETENTION_DAYS = 800      # 日汇总保留天数（月汇总永久保留）
+    TRAFFIC_RETENTION_INTERVAL = 3600       # 保留期清理周期 (秒)
+    TRAFFIC_QUOTA_THROTTLE_RATE = '256kbit'  # 超出配额后的默认降速速率（上下行相同）
+
+    # 🆕 连接会话历史（utils.session_history）
+    SESSION_RETENTION_DAYS = 365            # 已结束会话的保留天数
+    SESSION_RETENTION_INTERVAL = 3600       # 保留期清理周期 (秒)
+
     @classmethod
     def validate(cls):
         """验证配置"""
@@ -0,0 +1,307 @@
+"""
+后台系统指标采样模块
+以固定周期采集 CPU、内存、磁盘及各网卡流量计数器，写入定长环形缓冲区。
+仪表板接口直接读取最新采样，不再在请求线程中阻塞等待 psutil。
+"""
+
+import logging
+import threading
+import time
+from array import array
+from typing import Callable, Dict, List, Optional
+
+import psutil
+
+from openvpn_monitor.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    """
+    基于 array 的定长环形缓冲区
+
+    写入为 O(1)，容量固定，不会随运行时间增长内存。
+    """
+
+    def __init__(self, capacity: int, typecode: str = 'd'):
+        self.capacity = capacity
+        self._data = array(typecode, [0] * capacity)
+        self._head = 0      # 下一个写入位置
+        self._size = 0
+
+    def append(self, value) -> None:
+        self._data[self._head] = value
+        self._head = (self._head + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+
+    def __len__(self) -> int:
+        return self._size
+
+    def last(self, default=None):
+        """返回最近一次写入的值"""
+        if not self._size:
+            return default
+        return self._data[(self._head - 1) % self.capacity]
+
+    def at(self, age: int):
+        """按“距今”索引读取：age=0 为最新值，age=1 为上一个值"""
+        if age < 0 or age >= self._size:
+            raise IndexError(age)
+        return self._data[(self._head - 1 - age) % self.capacity]
+
+    def values(self, count: Optional[int] = None) -> List:
+        """按时间顺序（旧 → 新）返回最近 count 个值"""
+        n = self._size if count is None else max(0, min(count, self._size))
+        start = (self._head - n) % self.capacity
+        if start + n <= self.capacity:
+            return self._data[start:start + n].tolist()
+        return (self._data[start:] + self._data[:(start + n) % self.capacity]).tolist()
+
+
+class MetricsSampler:
+    """
+    后台指标采样器
+
+    - 独立守护线程按 interval 周期采样
+    - CPU 使用非阻塞的 psutil.cpu_percent(interval=None)，两次采样之间的平均值
+    - 每个指标 / 每个网卡计数器对应一个 RingBuffer
+    - 读取方通过 latest() 获得最新一次采样的快照副本
+    """
+
+    def __init__(self, interval: float = None, capacity: int = None, disk_path: str = None):
+        self.interval = interval or Config.SAMPLE_INTERVAL
+        self.capacity = capacity or Config.SAMPLE_HISTORY
+        self.disk_path = disk_path or Config.DISK_PATH
+
+        self.lock = threading.Lock()
+        self.timestamps = RingBuffer(self.capacity)      # time.monotonic()
+        self.cpu = RingBuffer(self.capacity)
+        self.memory = RingBuffer(self.capacity)
+        self.disk = RingBuffer(self.capacity)
+        # interface -> {'monotonic': RingBuffer, 'bytes_sent': RingBuffer, ...}
+        # 每个网卡自带时间戳序列（网卡可能在运行中出现/消失）
+        self.network: Dict[str, Dict[str, RingBuffer]] = {}
+
+        self._latest: Optional[Dict] = None
+        self._listeners: List[Callable[[Dict], None]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ------------------------------------------------------------------
+    # 生命周期
+    # ------------------------------------------------------------------
+    def start(self) -> None:
+        """启动采样线程（重复调用无副作用）"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        # 预热：第一次调用 cpu_percent(None) 只建立基准，返回 0.0
+        psutil.cpu_percent(interval=None)
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name='metrics-sampler', daemon=True)
+        self._thread.start()
+        logger.info(f"✅ 系统指标采样器已启动 (周期 {self.interval}s, 容量 {self.capacity})")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval * 2)
+
+    def add_listener(self, callback: Callable[[Dict], None]) -> None:
+        """注册采样回调：每次采样完成后在采样线程中以快照为参数调用"""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def _run(self) -> None:
+        next_tick = time.monotonic() + self.interval
+        while not self._stop.wait(max(0.0, next_tick - time.monotonic())):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"❌ 系统指标采样失败: {e}")
+            next_tick += self.interval
+            # 线程被长时间挂起后不补采，直接对齐到下一个周期
+            now = time.monotonic()
+            if next_tick < now:
+                next_tick = now + self.interval
+
+    # ------------------------------------------------------------------
+    # 采样
+    # ------------------------------------------------------------------
+    def sample(self) -> Dict:
+        """采集一次并写入环形缓冲区，返回本次采样快照"""
+        now = time.monotonic()
+        cpu = psutil.cpu_percent(interval=None)
+        mem = psutil.virtual_memory()
+        try:
+            disk = psutil.disk_usage(self.disk_path)
+        except OSError:
+            disk = None
+        try:
+            nics = psutil.net_io_counters(pernic=True)
+        except Exception:
+            nics = {}
+
+        snapshot = {
+            'timestamp': time.time(),
+            'monotonic': now,
+            'cpu': cpu,
+            'memory': {
+                'total': mem.total / (1024 ** 3),  # GB
+                'used': mem.used / (1024 ** 3),
+                'percent': mem.percent
+            },
+            'disk': {
+                'total': disk.total / (1024 ** 3) if disk else 0,  # GB
+                'used': disk.used / (1024 ** 3) if disk else 0,
+                'percent': disk.percent if disk else 0
+            },
+            'network': {
+                name: {
+                    'bytes_sent': net.bytes_sent,
+                    'bytes_recv': net.bytes_recv,
+                    'packets_sent': net.packets_sent,
+                    'packets_recv': net.packets_recv
+                }
+                for name, net in nics.items()
+            }
+        }
+
+        with self.lock:
+            self.timestamps.append(now)
+            self.cpu.append(cpu)
+            self.memory.append(snapshot['memory']['percent'])
+            self.disk.append(snapshot['disk']['percent'])
+
+            for name, counters in snapshot['network'].items():
+                buffers = self.network.get(name)
+                if buffers is None:
+                    buffers = {key: RingBuffer(self.capacity) for key in ('monotonic', *counters)}
+                    self.network[name] = buffers
+                buffers['monotonic'].append(now)
+                for key, value in counters.items():
+                    buffers[key].append(value)
+
+            self._latest = snapshot
+
+        for callback in self._listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.error(f"❌ 采样回调执行失败: {e}")
+
+        return snapshot
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+    def latest(self) -> Optional[Dict]:
+        """最新一次采样快照（未采样时返回 None）"""
+        with self.lock:
+            return self._latest
+
+    def get_network_stats(self, interface: str) -> Dict[str, int]:
+        """从最新采样中取某网卡计数器，与 SystemMonitor.get_network_stats 返回格式一致"""
+        latest = self.latest()
+        if latest and interface in latest['network']:
+            return dict(latest['network'][interface])
+        return {
+            'bytes_sent': 0,
+            'bytes_recv': 0,
+            'packets_sent': 0,
+            'packets_recv': 0
+        }
+
+    def get_network_rate(self, interface: str, window: float = None) -> Optional[Dict]:
+        """
+        计算某网卡在固定时间窗口内的平均速率 (bytes/s)
+
+        速率只由采样序列决定：取最新采样与“至少早 window 秒”的最近一次采样做差，
+        与多少个请求、以何种顺序读取无关。历史不足一个窗口时使用已有的最早采样。
+
+        Returns:
+            dict: {'bytes_sent', 'bytes_recv', 'upload_rate', 'download_rate', 'window'}
+                  该网卡无采样时返回 None
+        """
+        if window is None:
+            window = Config.RATE_WINDOW
+
+        with self.lock:
+            buffers = self.network.get(interface)
+            if not buffers or not len(buffers['monotonic']):
+                return None
+
+            stamps = buffers['monotonic']
+            sent = buffers['bytes_sent']
+            recv = buffers['bytes_recv']
+            newest_ts = stamps.at(0)
+            result = {
+                'bytes_sent': int(sent.at(0)),
+                'bytes_recv': int(recv.at(0)),
+                'upload_rate': 0.0,
+                'download_rate': 0.0,
+                'window': 0.0
+            }
+
+            # 找到满足窗口长度的最近一次采样
+            age = 1
+            while age < len(stamps) - 1 and newest_ts - stamps.at(age) < window:
+                age += 1
+            if age >= len(stamps):
+                return result
+
+            # 窗口内出现计数器回退（网卡重建 / 计数器清零）时，只用回退之后的采样
+            for step in range(1, age + 1):
+                if sent.at(step) > sent.at(step - 1) or recv.at(step) > recv.at(step - 1):
+                    age = step - 1
+                    break
+            if age == 0:
+                return result
+
+            elapsed = newest_ts - stamps.at(age)
+            if elapsed <= 0:
+                return result
+
+            result['upload_rate'] = (sent.at(0) - sent.at(age)) / elapsed
+            result['download_rate'] = (recv.at(0) - recv.at(age)) / elapsed
+            result['window'] = round(elapsed, 3)
+            return result
+
+    def get_all_stats(self, vpn_interface: str = 'tun0') -> Optional[Dict]:
+        """与 SystemMonitor.get_all_stats 返回格式一致，数据来自最新采样"""
+        latest = self.latest()
+        if latest is None:
+            return None
+        return {
+            'cpu': latest['cpu'],
+            'memory': dict(latest['memory']),
+            'disk': dict(latest['disk']),
+            'network': self.get_network_stats(vpn_interface),
+            'sampled_at': latest['timestamp']
+        }
+
+
+# 进程级单例
+_sampler: Optional[MetricsSampler] = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler() -> MetricsSampler:
+    """获取进程级采样器单例（不会自动启动）"""
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = MetricsSampler()
+        return _sampler
+
+
+def start_sampler() -> MetricsSampler:
+    """获取并启动进程级采样器"""
+    sampler = get_sampler()
+    sampler.start()
+    return sampler
@@ -11,9 +11,13 @@ class SystemMonitor:
     """系统资源监控器"""
     
     @staticmethod
-    def get_cpu_usage() -> float:
-        """获取CPU使用率"""
-        return psutil.cpu_percent(interval=1)
+    def get_cpu_usage(interval: float = 1) -> float:
+        """
+        获取CPU使用率
+
+        interval=None 时不阻塞，返回距上次调用以来的平均使用率
+        """
+        return psutil.cpu_percent(interval=interval)
     
     @staticmethod
     def get_memory_usage() -> Dict[str, float]:
@@ -59,10 +63,10 @@ class SystemMonitor:
         }
     
     @classmethod
-    def get_all_stats(cls, vpn_interface: str = 'tun0') -> Dict:
+    def get_all_stats(cls, vpn_interface: str = 'tun0', cpu_interval: float = 1) -> Dict:
         """获取所有系统统计信息"""
         return {
-            'cpu': cls.get_cpu_usage(),
+            'cpu': cls.get_cpu_usage(cpu_interval),
             'memory': cls.get_memory_usage(),
             'disk': cls.get_disk_usage(),
             'network': cls.get_network_stats(vpn_interface)
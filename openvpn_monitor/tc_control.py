@@ -0,0 +1,354 @@
+"""
+TC 控制通道（Web 应用 ↔ 限速引擎）
+
+Unix 流套接字 /var/run/openvpn-tc/control.sock，每行一个 JSON 消息:
+
+请求:  {"id": "...", "op": "update_users", "users": [["alice", "10.8.0.6"], ...]}
+       {"id": "...", "op": "update_role", "role": "vip"}
+       {"id": "...", "op": "reconcile"}
+       {"id": "...", "op": "ping"}
+       {"id": "...", "op": "batch", "ops": [{...}, {...}]}
+应答:  {"id": "...", "status": "accepted"}                      收到后立即返回
+       {"id": "...", "status": "applied" | "failed", ...}       调和完成后返回
+
+同一连接可连续发送多条请求；同一调和周期内到达的请求合并为一次调和。
+引擎不可用时，客户端退回旧的信号文件（兼容 vpn-tc-daemon.sh）。
+
+本模块只依赖标准库（引擎进程与 Web 进程共用）。
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from openvpn_monitor.config import Config
+
+logger = logging.getLogger(__name__)
+
+OPS = ('update_users', 'update_role', 'reconcile', 'ping', 'batch')
+
+# 单条消息上限，防止异常客户端耗尽内存
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+
+def encode_message(message: Dict) -> bytes:
+    return (json.dumps(message, ensure_ascii=False, separators=(',', ':')) + '\n').encode()
+
+
+# ==================== 服务端（引擎进程） ====================
+class PendingRequest:
+    """已确认、等待调和结果的请求"""
+
+    def __init__(self, connection: '_Connection', message: Dict):
+        self.connection = connection
+        self.message = message
+        self.id = message.get('id')
+        self.received = time.monotonic()
+
+    def ops(self) -> List[Dict]:
+        if self.message.get('op') == 'batch':
+            return [op for op in self.message.get('ops', []) if isinstance(op, dict)]
+        return [self.message]
+
+    def reply(self, payload: Dict) -> None:
+        payload = dict(payload, id=self.id)
+        payload['apply_ms'] = round((time.monotonic() - self.received) * 1000, 1)
+        self.connection.send(payload)
+
+
+class _Connection:
+    """一个客户端连接；读取结束且所有请求都已回复后关闭"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.closed = False
+        self.reading = True
+        self.inflight = 0
+
+    def send(self, payload: Dict) -> None:
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.sock.sendall(encode_message(payload))
+            except OSError:
+                self._close()
+
+    def begin(self) -> None:
+        with self.lock:
+            self.inflight += 1
+
+    def finish(self) -> None:
+        with self.lock:
+            self.inflight -= 1
+            if not self.reading and self.inflight <= 0:
+                self._close()
+
+    def stop_reading(self) -> None:
+        with self.lock:
+            self.reading = False
+            if self.inflight <= 0:
+                self._close()
+
+    def _close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+
+
+class ControlServer:
+    """
+    控制通道服务端
+
+    请求在连接线程中解析并立即确认，随后放入待处理列表并唤醒引擎主循环；
+    主循环调和完成后调用 complete() 逐个回复结果。
+    """
+
+    def __init__(self, path: str = None, wake: threading.Event = None):
+        self.path = path or Config.TC_CONTROL_SOCKET
+        self.wake = wake or threading.Event()
+        self._pending: List[PendingRequest] = []
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self.received = 0
+
+    def start(self) -> bool:
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(self.path)
+            os.chmod(self.path, 0o660)
+            sock.listen(16)
+        except OSError as e:
+            logger.error(f"❌ 控制通道启动失败: {e}")
+            return False
+        self._sock = sock
+        threading.Thread(target=self._accept_loop, name='tc-control', daemon=True).start()
+        logger.info(f"✅ 控制通道已启动: {self.path}")
+        return True
+
+    def stop(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self._sock = None
+
+    def _accept_loop(self) -> None:
+        while self._sock is not None:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client: socket.socket) -> None:
+        connection = _Connection(client)
+        buffer = b''
+        try:
+            while True:
+                chunk = client.recv(65536)
+                if not chunk:
+                    break
+                buffer += chunk
+                if len(buffer) > MAX_MESSAGE_SIZE:
+                    connection.send({'status': 'failed', 'error': '消息过大'})
+                    break
+                while b'\n' in buffer:
+                    line, buffer = buffer.split(b'\n', 1)
+                    if line.strip():
+                        self._handle(connection, line)
+        except OSError:
+            pass
+        finally:
+            # 仍有等待结果的请求时由 complete() 负责关闭
+            connection.stop_reading()
+
+    def _handle(self, connection: _Connection, line: bytes) -> None:
+        try:
+            message = json.loads(line)
+            if not isinstance(message, dict):
+                raise ValueError('消息必须是 JSON 对象')
+        except ValueError as e:
+            connection.send({'status': 'failed', 'error': f'无效的消息: {e}'})
+            return
+
+        op = message.get('op')
+        if op not in OPS:
+            connection.send({'id': message.get('id'), 'status': 'failed', 'error': f'未知操作: {op}'})
+            return
+        if op == 'ping':
+            connection.send({'id': message.get('id'), 'status': 'applied', 'pong': True})
+            return
+
+        self.received += 1
+        connection.begin()
+        connection.send({'id': message.get('id'), 'status': 'accepted'})
+        with self._lock:
+            self._pending.append(PendingRequest(connection, message))
+        self.wake.set()
+
+    def take_pending(self) -> List[PendingRequest]:
+        """取出当前所有待处理请求（本周期的调和会覆盖它们）"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return pending
+
+    def complete(self, pending: List[PendingRequest], describe: Callable[[Dict], Dict], ok: bool,
+                 error: str = None) -> None:
+        """
+        回复调和结果
+
+        Args:
+            pending: take_pending() 取出的请求
+            describe: 对单个 op 生成结果详情的函数（如离线用户、在线成员数）
+            ok: 本次调和是否成功
+            error: 失败原因
+        """
+        for request in pending:
+            results = [describe(op) for op in request.ops()]
+            payload = {'status': 'applied' if ok else 'failed', 'results': results}
+            if error:
+                payload['error'] = error
+            request.reply(payload)
+            request.connection.finish()
+
+
+# ==================== 客户端（Web 进程） ====================
+class ApplyStats:
+    """端到端生效延迟统计（发送请求 → 收到 applied）"""
+
+    def __init__(self, size: int = 200):
+        self.latencies = deque(maxlen=size)
+        self.counts = {'applied': 0, 'failed': 0, 'timeout': 0, 'unavailable': 0, 'accepted': 0}
+        self.last: Optional[Dict] = None
+        self.lock = threading.Lock()
+
+    def record(self, result: Dict) -> None:
+        with self.lock:
+            status = result.get('status')
+            if status in self.counts:
+                self.counts[status] += 1
+            if status == 'applied' and result.get('latency_ms') is not None:
+                self.latencies.append(result['latency_ms'])
+            self.last = {'status': status, 'latency_ms': result.get('latency_ms'), 'at': time.time()}
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            values = sorted(self.latencies)
+            counts = dict(self.counts)
+            last = self.last
+
+        def percentile(p):
+            if not values:
+                return None
+            return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+        return {
+            'counts': counts,
+            'samples': len(values),
+            'latency_ms': {
+                'p50': percentile(50),
+                'p95': percentile(95),
+                'max': values[-1] if values else None,
+            },
+            'last': last,
+        }
+
+
+apply_stats = ApplyStats()
+
+
+def request(op: str, wait: bool = True, timeout: float = None, path: str = None, **payload) -> Dict:
+    """
+    向引擎发送一条控制请求
+
+    Args:
+        op: 操作名（见 OPS）
+        wait: True 等待调和结果；False 收到确认即返回
+        timeout: 总超时（秒）
+        path: 套接字路径
+        payload: 操作参数，如 users=[(name, ip)]、role='vip'、ops=[...]
+
+    Returns:
+        dict: {'status': applied / failed / accepted / timeout / unavailable,
+               'latency_ms', 'results', 'error'}
+    """
+    timeout = timeout if timeout is not None else Config.TC_APPLY_TIMEOUT
+    path = path or Config.TC_CONTROL_SOCKET
+    request_id = uuid.uuid4().hex
+    message = dict(payload, id=request_id, op=op)
+    started = time.monotonic()
+
+    def _result(status, **extra):
+        result = dict(extra, status=status, latency_ms=round((time.monotonic() - started) * 1000, 1))
+        if op != 'ping':
+            apply_stats.record(result)
+        return result
+
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    except OSError as e:
+        return _result('unavailable', error=str(e))
+
+    with sock:
+        try:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.sendall(encode_message(message))
+        except OSError as e:
+            return _result('unavailable', error=str(e))
+
+        buffer = b''
+        deadline = started + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return _result('timeout', error=f'{timeout}s 内未收到结果')
+            try:
+                sock.settimeout(remaining)
+                chunk = sock.recv(65536)
+            except socket.timeout:
+                return _result('timeout', error=f'{timeout}s 内未收到结果')
+            except OSError as e:
+                return _result('unavailable', error=str(e))
+            if not chunk:
+                return _result('unavailable', error='引擎关闭了连接')
+            buffer += chunk
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                try:
+                    reply = json.loads(line)
+                except ValueError:
+                    continue
+                if reply.get('id') != request_id:
+                    continue
+                status = reply.get('status')
+                if status == 'accepted' and wait:
+                    continue
+                extra = {k: v for k, v in reply.items() if k not in ('id', 'status')}
+                return _result(status, **extra)
+
+
+def is_available(path: str = None) -> bool:
+    """引擎控制通道是否可用（ping）"""
+    return request('ping', timeout=0.5, path=path).get('status') == 'applied'
+
+
+def get_apply_stats() -> Dict:
+    """端到端生效延迟统计（用于 /api/metrics）"""
+    return apply_stats.snapshot()
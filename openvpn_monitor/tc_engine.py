@@ -0,0 +1,1559 @@
+"""
+TC 限速调和引擎（替代 vpn-tc-daemon.sh 的逐条 tc 调用）
+
+每个周期:
+1. 解析 status.log 得到在线客户端，按速率表计算“期望状态”
+2. 期望状态未变化且不是修复周期：直接跳过（0 次 fork）
+3. 否则一次性读取实际状态（tc -j class/qdisc/filter show，共 6 次 fork）
+4. 计算差异，全部变更通过一次 `tc -force -batch -` 提交
+
+🆕 控制通道（openvpn_monitor.tc_control）: Web 端的变更请求立即唤醒主循环，
+调和完成后回复 applied / failed，不再等待下一个轮询周期。
+
+🆕 状态快照: 以固定节奏把已应用的 ip / 用户 / classid / 速率与 tc -s class
+计数器原子写入 state.json，供 Web 端（openvpn_monitor.tc_state）计算实时吞吐与丢包率。
+
+🆕 每个客户端 class 下挂 fq_codel（或 cake）叶子队列，burst / cburst 按速率折算，
+可按用户组覆盖（速率表 @group 行的 leaf= / burst_ms=）。
+
+🆕 可扩展布局（详见 TC_SHAPING_DESIGN.md）:
+- classid 空间 0x100 ~ 0xFFFE，由两级位图分配，不再线性扫描
+- 默认 filter 布局为 u32 哈希表：按客户端 IP 末字节分到 256 个桶，
+  每个包只需匹配一次链接规则 + 桶内少量规则，与在线人数无关
+
+后端可替换：TcBackend 调用真实 tc 命令，FakeTcBackend 在内存中模拟内核状态，
+用于单元测试与基准测试。
+
+运行: python -m openvpn_monitor.tc_engine [--once] [--dry-run]
+"""
+
+import argparse
+import ipaddress
+import json
+import logging
+import os
+import re
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from openvpn_monitor.config import Config
+from openvpn_monitor.tc_control import ControlServer
+
+logger = logging.getLogger(__name__)
+
+
+# tc -s class 中导出到状态快照的计数器
+STAT_FIELDS = ('bytes', 'packets', 'drops', 'overlimits')
+
+# 状态快照格式版本
+STATE_FORMAT = 1
+
+# 一次调和中逐条记录的速率更新上限，超出部分只输出汇总
+LOG_DETAIL_LIMIT = 20
+
+
+# ==================== 速率解析 ====================
+_RATE_UNITS = {
+    'bit': 1, 'kbit': 1000, 'mbit': 1000 ** 2, 'gbit': 1000 ** 3, 'tbit': 1000 ** 4,
+    'kibit': 1024, 'mibit': 1024 ** 2, 'gibit': 1024 ** 3, 'tibit': 1024 ** 4,
+    'bps': 8, 'kbps': 8000, 'mbps': 8 * 1000 ** 2, 'gbps': 8 * 1000 ** 3, 'tbps': 8 * 1000 ** 4,
+    'kibps': 8 * 1024, 'mibps': 8 * 1024 ** 2, 'gibps': 8 * 1024 ** 3, 'tibps': 8 * 1024 ** 4,
+}
+_RATE_RE = re.compile(r'^\s*([0-9]*\.?[0-9]+)\s*([a-zA-Z]*)\s*$')
+
+
+def parse_rate(rate: str) -> int:
+    """
+    把 tc 速率字符串转换为字节/秒（与 `tc -j` 输出的单位一致）
+
+    Raises:
+        ValueError: 格式无效
+    """
+    match = _RATE_RE.match(rate or '')
+    if not match:
+        raise ValueError(f'无效的速率: {rate!r}')
+    value, unit = match.groups()
+    unit = unit.lower() or 'bit'
+    if unit not in _RATE_UNITS:
+        raise ValueError(f'无效的速率单位: {rate!r}')
+    return int(float(value) * _RATE_UNITS[unit] / 8)
+
+
+_SIZE_UNITS = {'': 1, 'b': 1, 'k': 1024, 'kb': 1024, 'm': 1024 ** 2, 'mb': 1024 ** 2, 'g': 1024 ** 3, 'gb': 1024 ** 3}
+
+
+def parse_size(size) -> int:
+    """
+    🆕 把 tc 大小（"1600b"、"15Kb"，或 tc -j 输出的整数）转换为字节数
+
+    Raises:
+        ValueError: 格式无效
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = _RATE_RE.match(size or '')
+    if not match or match.group(2).lower() not in _SIZE_UNITS:
+        raise ValueError(f'无效的大小: {size!r}')
+    value, unit = match.groups()
+    return int(float(value) * _SIZE_UNITS[unit.lower()])
+
+
+def rates_equal(a: int, b: int) -> bool:
+    """内核按字节存储速率，允许 1% 的舍入误差"""
+    return abs(a - b) <= max(a, b) * 0.01
+
+
+def sizes_equal(a: int, b: int) -> bool:
+    """🆕 内核把 burst 换算成发送时间存储，读回时有舍入误差"""
+    return abs(a - b) <= max(a, b) * 0.02 + 8
+
+
+def parse_handle(handle: str) -> Tuple[int, int]:
+    """解析 tc 句柄 "1:65"（十六进制）→ (1, 0x65)"""
+    major, _, minor = handle.partition(':')
+    return int(major or '0', 16), int(minor or '0', 16)
+
+
+# ==================== 🆕 叶子队列与 burst ====================
+# 客户端 class 下可挂的叶子队列；pfifo 为 htb 的内核默认（不单独创建）
+LEAF_QDISCS = ('fq_codel', 'cake', 'pfifo')
+
+# burst 下限：两个满 MTU 包（1500 + 链路层开销），否则低速率时 htb 无法发出整包
+MIN_BURST = 2 * 1600
+
+# 计算 fq_codel target 使用的包长
+MTU = 1514
+
+
+def burst_bytes(rate: str, burst_ms: int) -> int:
+    """
+    由速率折算 htb burst / cburst（字节）
+
+    tc 默认的 burst 约为 rate / HZ，高速率时不足以在一个定时器周期内发满速率，
+    低速率时又可能小于一个整包；这里取 rate × burst_ms，并保证不低于 MIN_BURST。
+    """
+    return max(parse_rate(rate) * burst_ms // 1000, MIN_BURST)
+
+
+def leaf_qdisc_spec(kind: str, rate: str) -> Optional[str]:
+    """
+    客户端 class 的叶子队列参数；pfifo 返回 None（删除叶子即恢复内核默认）
+
+    - fq_codel: target 至少 5ms，且不低于 1.5 个满包在该速率下的发送时间
+      （低速率时 5ms 连一个包都发不完，会持续误丢包）；interval 保持为 target 的 20 倍。
+      flows / memory_limit 按单个客户端缩小，数千个叶子时内存占用可控
+    - cake: 整形由 htb 完成，只使用它的流隔离与 AQM
+    """
+    if kind == 'fq_codel':
+        transmit_ms = MTU * 1000 / max(parse_rate(rate), 1)
+        target = max(5, int(transmit_ms * 1.5 + 0.999))
+        return (f'fq_codel limit 1000 flows {Config.TC_FQ_CODEL_FLOWS} memory_limit 4mb '
+                f'target {target}ms interval {max(100, target * 20)}ms')
+    if kind == 'cake':
+        return 'cake unlimited besteffort flows'
+    return None
+
+
+# ==================== 状态模型 ====================
+@dataclass(frozen=True)
+class TcClass:
+    """一个 htb class"""
+    minor: int
+    parent: str
+    rate: int           # 字节/秒
+    ceil: int = 0       # 字节/秒；0 = 未知（与 rate 相同）
+    prio: int = 0
+    burst: int = 0      # 🆕 字节；0 = 未知
+    cburst: int = 0
+
+
+@dataclass(frozen=True)
+class TcFilter:
+    """一条 filter（按 IP 分类的规则，或 u32 哈希表 / 链接规则）"""
+    pref: int
+    handle: str             # flower: "0x1"；u32: "100:5:1" / "100:" / "800::800"
+    ip: Optional[str]
+    minor: Optional[int]    # flowid 的 minor；非分类 filter 为 None
+    kind: str = 'flower'
+    link: Optional[str] = None      # u32 链接到的哈希表
+    divisor: Optional[int] = None   # u32 哈希表桶数
+
+
+_FILTER_HEAD_RE = re.compile(r'^filter .*?\bpref (\d+) (\w+)')
+_FILTER_FIELD_RES = {
+    'handle': re.compile(r'\b(?:handle|fh) (\S+)'),
+    'classid': re.compile(r'\b(?:classid|flowid) (\d+:\w*)'),
+    'link': re.compile(r'\blink (\S+)'),
+    'divisor': re.compile(r'\bdivisor (\d+)'),
+}
+_U32_MATCH_RE = re.compile(r'^\s*match ([0-9a-f]{8})/ffffffff at (?:12|16)\b')
+_FLOWER_IP_RE = re.compile(r'^\s*(?:dst_ip|src_ip) (\d+\.\d+\.\d+\.\d+)\b')
+
+
+def parse_filter_output(text: str) -> List[TcFilter]:
+    """
+    解析 `tc filter show` 的文本输出（u32 的 -j 输出不完整，统一按文本解析）
+
+    每条规则以 "filter ..." 行开头，后续缩进行包含 flower 的 dst_ip/src_ip
+    或 u32 的 "match 0a080005/ffffffff at 16"。只有 pref 头部、没有句柄的行被忽略。
+    """
+    filters = []
+    current = None
+
+    def _flush():
+        if current and current['handle']:
+            classid = current['classid']
+            filters.append(TcFilter(
+                pref=current['pref'], handle=current['handle'], ip=current['ip'],
+                minor=parse_handle(classid)[1] if classid else None,
+                kind=current['kind'], link=current['link'],
+                divisor=int(current['divisor']) if current['divisor'] else None,
+            ))
+
+    for line in text.splitlines():
+        head = _FILTER_HEAD_RE.match(line)
+        if head:
+            _flush()
+            current = {'pref': int(head.group(1)), 'kind': head.group(2), 'ip': None}
+            for key, regex in _FILTER_FIELD_RES.items():
+                found = regex.search(line)
+                current[key] = found.group(1) if found else None
+            continue
+        if current is None:
+            continue
+        found = _FLOWER_IP_RE.match(line)
+        if found:
+            current['ip'] = found.group(1)
+            continue
+        found = _U32_MATCH_RE.match(line)
+        if found:
+            current['ip'] = str(ipaddress.IPv4Address(int(found.group(1), 16)))
+    _flush()
+    return filters
+
+
+# ==================== filter 布局 ====================
+class FlowerLayout:
+    """旧布局：每个客户端一条 flower filter，各占一个 prio（内核逐个 prio 线性匹配）"""
+
+    name = 'flower'
+
+    def infra_commands(self, dev: str, root: str, direction: str, filters: List[TcFilter]) -> List[str]:
+        return []
+
+    def expected_handle(self, ip: str) -> Optional[str]:
+        return None     # 由内核分配
+
+    def add_command(self, dev: str, root: str, direction: str, ip: str, minor: int) -> str:
+        return (f'filter add dev {dev} protocol ip parent {root} prio {minor} '
+                f'flower {direction}_ip {ip} flowid {root}{minor:x}')
+
+
+class HashedU32Layout:
+    """
+    u32 哈希布局
+
+    - 哈希表 100: 有 256 个桶，链接规则按 IP 末字节（dst 偏移 16 / src 偏移 12）选桶
+    - 客户端规则句柄固定为 100:<末字节>:<第三字节+1>，同一 /16 网段内不会冲突，
+      重复下发是幂等的，也便于按句柄精确删除
+    """
+
+    name = 'u32'
+    PRIO = 10
+    HTID = 0x100
+    DIVISOR = 256
+    OFFSETS = {'dst': 16, 'src': 12}
+
+    def infra_commands(self, dev: str, root: str, direction: str, filters: List[TcFilter]) -> List[str]:
+        commands = []
+        table = f'{self.HTID:x}:'
+        if not any(f.kind == 'u32' and f.handle == table and f.divisor for f in filters):
+            commands.append(
+                f'filter add dev {dev} parent {root} prio {self.PRIO} handle {table} '
+                f'protocol ip u32 divisor {self.DIVISOR}'
+            )
+        if not any(f.kind == 'u32' and f.link == table for f in filters):
+            offset = self.OFFSETS[direction]
+            commands.append(
+                f'filter add dev {dev} parent {root} prio {self.PRIO} protocol ip u32 ht 800:: '
+                f'match u32 0 0 at {offset} hashkey mask 0x000000ff at {offset} link {table}'
+            )
+        return commands
+
+    def expected_handle(self, ip: str) -> str:
+        octets = ip.split('.')
+        return f'{self.HTID:x}:{int(octets[3]):x}:{int(octets[2]) + 1:x}'
+
+    def add_command(self, dev: str, root: str, direction: str, ip: str, minor: int) -> str:
+        handle = self.expected_handle(ip)
+        bucket = handle.split(':')[1]
+        return (f'filter add dev {dev} parent {root} prio {self.PRIO} handle {handle} '
+                f'protocol ip u32 ht {self.HTID:x}:{bucket}: match ip {direction} {ip}/32 '
+                f'flowid {root}{minor:x}')
+
+
+LAYOUTS = {'flower': FlowerLayout, 'u32': HashedU32Layout}
+
+
+def delete_filter_command(dev: str, root: str, item: TcFilter) -> str:
+    """按句柄精确删除一条客户端规则（两种布局通用，用于迁移时清理旧规则）"""
+    return f'filter del dev {dev} parent {root} pref {item.pref} handle {item.handle} {item.kind}'
+
+
+# ==================== classid 分配 ====================
+class ClassIdAllocator:
+    """
+    classid 两级位图分配器
+
+    - 第一级：每个 minor 占 1 位
+    - 第二级：每个第一级字节对应一个标志字节（1 = 该字节仍有空位），
+      用 bytearray.find（C 实现的 memchr）定位有空位的字节，分配 / 释放均为 O(1) 摊还
+    - next-fit：从上次分配位置继续向后找，刚释放的 classid 不会被立即复用，
+      避免新客户端继承旧 class 的统计
+    """
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.size = end - start + 1
+        nbytes = (self.size + 7) // 8
+        self._bits = bytearray(nbytes)
+        self._has_free = bytearray(b'\x01' * nbytes)
+        self._cursor = 0
+        self.used = 0
+
+        # 末字节中超出池范围的位预置为已占用
+        tail = self.size % 8
+        if tail:
+            self._bits[-1] = 0xFF & ~((1 << tail) - 1)
+
+    def __contains__(self, minor: int) -> bool:
+        if not self.start <= minor <= self.end:
+            return False
+        offset = minor - self.start
+        return bool(self._bits[offset >> 3] & (1 << (offset & 7)))
+
+    def _set(self, offset: int) -> None:
+        index = offset >> 3
+        self._bits[index] |= 1 << (offset & 7)
+        if self._bits[index] == 0xFF:
+            self._has_free[index] = 0
+        self.used += 1
+
+    def reserve(self, minor: int) -> bool:
+        """占用指定 classid（接管已有规则时使用），已占用或超出范围返回 False"""
+        if not self.start <= minor <= self.end or minor in self:
+            return False
+        self._set(minor - self.start)
+        return True
+
+    def allocate(self) -> Optional[int]:
+        """分配一个空闲 classid，池已满返回 None"""
+        index = self._has_free.find(1, self._cursor)
+        if index < 0:
+            index = self._has_free.find(1, 0, self._cursor)
+            if index < 0:
+                return None
+        byte = self._bits[index]
+        bit = (~byte & (byte + 1)).bit_length() - 1     # 最低的 0 位
+        offset = (index << 3) + bit
+        self._set(offset)
+        self._cursor = index
+        return self.start + offset
+
+    def release(self, minor: int) -> None:
+        if minor not in self:
+            return
+        offset = minor - self.start
+        index = offset >> 3
+        self._bits[index] &= ~(1 << (offset & 7)) & 0xFF
+        self._has_free[index] = 1
+        self.used -= 1
+
+
+@dataclass(frozen=True)
+class ClientShape:
+    """一个在线客户端的期望限速"""
+    user: str
+    ip: str
+    minor: int
+    up: str             # tun0 class 速率（与旧脚本 RATE_UP 一致）
+    down: str           # ifb0 class 速率（与旧脚本 RATE_DOWN 一致）
+    parent: int = 1     # 🆕 父 class minor：1 = 直接挂在根类下，0x2 ~ 0xFF = 用户组聚合类
+    prio: int = 0
+    leaf: str = ''      # 🆕 叶子队列（LEAF_QDISCS）；空 = 不管理
+    burst_ms: int = 0   # 🆕 burst 折算毫秒数；0 = 使用 tc 默认
+
+
+@dataclass(frozen=True)
+class GroupLimit:
+    """🆕 用户组聚合限速（速率表中的 @group 行）"""
+    up_rate: str
+    up_ceil: str
+    down_rate: str
+    down_ceil: str
+    prio: int = 0
+
+
+@dataclass(frozen=True)
+class GroupOptions:
+    """🆕 用户组成员 class 的队列参数（速率表 @group 行的 leaf= / burst_ms=），None = 全局默认"""
+    leaf: Optional[str] = None
+    burst_ms: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class GroupShape:
+    """🆕 一个用户组聚合类的期望状态"""
+    name: str
+    minor: int
+    limit: GroupLimit
+    burst_ms: int = 0
+
+
+# ==================== 后端 ====================
+class TcBackend:
+    """真实后端：调用 tc / ip 命令"""
+
+    def __init__(self, tc_bin: str = 'tc', ip_bin: str = 'ip'):
+        self.tc_bin = tc_bin
+        self.ip_bin = ip_bin
+        self.forks = 0
+
+    def _run(self, args: Sequence[str], stdin: Optional[str] = None) -> subprocess.CompletedProcess:
+        self.forks += 1
+        return subprocess.run(
+            list(args), input=stdin, capture_output=True, text=True, timeout=30
+        )
+
+    def _show(self, *args: str) -> List[Dict]:
+        result = self._run([self.tc_bin, '-j', *args])
+        if result.returncode != 0 or not result.stdout.strip():
+            return []
+        try:
+            return json.loads(result.stdout)
+        except json.JSONDecodeError:
+            logger.warning(f"⚠️ 无法解析 tc 输出: tc -j {' '.join(args)}")
+            return []
+
+    def link_exists(self, dev: str) -> bool:
+        return os.path.isdir(f'/sys/class/net/{dev}')
+
+    def ensure_ifb(self, dev: str) -> bool:
+        """创建并启动 ifb 设备"""
+        if not self.link_exists(dev):
+            if self._run([self.ip_bin, 'link', 'add', dev, 'type', 'ifb']).returncode != 0:
+                self._run(['modprobe', 'ifb'])
+                self._run([self.ip_bin, 'link', 'add', dev, 'type', 'ifb'])
+        self._run([self.ip_bin, 'link', 'set', dev, 'up'])
+        return self.link_exists(dev)
+
+    def list_qdiscs(self, dev: str) -> List[Tuple[str, str]]:
+        """[(kind, handle)]"""
+        return [(q.get('kind', ''), q.get('handle', '')) for q in self._show('qdisc', 'show', 'dev', dev)]
+
+    def list_classes(self, dev: str) -> Dict[int, TcClass]:
+        classes = {}
+        for item in self._show('class', 'show', 'dev', dev):
+            if item.get('class') != 'htb' or 'handle' not in item:
+                continue
+            _, minor = parse_handle(item['handle'])
+            classes[minor] = TcClass(
+                minor=minor, parent=item.get('parent', ''), rate=int(item.get('rate', 0)),
+                ceil=int(item.get('ceil', 0)), prio=int(item.get('prio', 0)),
+                burst=parse_size(item.get('burst', 0)), cburst=parse_size(item.get('cburst', 0))
+            )
+        return classes
+
+    def list_leaf_qdiscs(self, dev: str, root: str) -> Dict[int, str]:
+        """🆕 挂在根 htb 各 class 下的叶子队列: {class minor: kind}"""
+        major = parse_handle(root)[0]
+        leaves = {}
+        for item in self._show('qdisc', 'show', 'dev', dev):
+            parent = item.get('parent')
+            if not parent or item.get('root'):
+                continue
+            parent_major, minor = parse_handle(parent)
+            if parent_major == major:
+                leaves[minor] = item.get('kind', '')
+        return leaves
+
+    def class_stats(self, dev: str) -> Dict[int, Dict[str, int]]:
+        """tc -s class show 的计数器: {minor: {bytes, packets, drops, overlimits}}"""
+        stats = {}
+        for item in self._show('-s', 'class', 'show', 'dev', dev):
+            if item.get('class') != 'htb' or 'handle' not in item:
+                continue
+            _, minor = parse_handle(item['handle'])
+            counters = item.get('stats') or {}
+            stats[minor] = {key: int(counters.get(key, 0)) for key in STAT_FIELDS}
+        return stats
+
+    def list_filters(self, dev: str, parent: str) -> List[TcFilter]:
+        result = self._run([self.tc_bin, 'filter', 'show', 'dev', dev, 'parent', parent])
+        if result.returncode != 0:
+            return []
+        return parse_filter_output(result.stdout)
+
+    def batch(self, commands: List[str]) -> bool:
+        """一次 fork 提交全部命令；-force 使单条失败不影响其余命令"""
+        if not commands:
+            return True
+        result = self._run([self.tc_bin, '-force', '-batch', '-'], stdin='\n'.join(commands) + '\n')
+        if result.returncode != 0:
+            logger.warning(f"⚠️ tc -batch 部分命令失败: {result.stderr.strip()[:500]}")
+            return False
+        return True
+
+
+class FakeTcBackend:
+    """
+    内存后端：模拟内核中的 qdisc / class / filter
+
+    只解析引擎会生成的命令子集；forks 统计“如果是真实后端”会产生的进程数。
+    classify() 模拟内核的逐 prio 匹配过程，用于比较不同布局的每包匹配次数。
+    """
+
+    _CLASS_RE = re.compile(
+        r'^class (add|change|del) dev (\S+)(?: parent (\S+))? classid (\S+)'
+        r'(?: htb rate (\S+) ceil (\S+)(?: burst (\S+) cburst (\S+))?(?: prio (\d+))?)?'
+    )
+    _FLOWER_ADD_RE = re.compile(
+        r'^filter add dev (\S+) protocol ip parent (\S+) prio (\d+) flower (?:dst_ip|src_ip) (\S+) flowid (\S+)'
+    )
+    _U32_TABLE_RE = re.compile(
+        r'^filter add dev (\S+) parent (\S+) prio (\d+) handle (\S+) protocol ip u32 divisor (\d+)'
+    )
+    _U32_LINK_RE = re.compile(
+        r'^filter add dev (\S+) parent (\S+) prio (\d+) protocol ip u32 ht 800:: .* link (\S+)'
+    )
+    _U32_ENTRY_RE = re.compile(
+        r'^filter add dev (\S+) parent (\S+) prio (\d+) handle (\S+) protocol ip u32 ht \S+ '
+        r'match ip (?:dst|src) ([\d.]+)/32 flowid (\S+)'
+    )
+    _FILTER_DEL_RE = re.compile(r'^filter del dev (\S+) parent (\S+) pref (\d+) handle (\S+) (\w+)')
+    _QDISC_RE = re.compile(r'^qdisc add dev (\S+) (root|ingress)(?: handle (\S+))?')
+    _LEAF_RE = re.compile(r'^qdisc (replace|del) dev (\S+) parent (\S+)(?: (\w+))?')
+
+    def __init__(self, links: Sequence[str] = ('tun0',)):
+        self.links = set(links)
+        self.qdiscs: Dict[str, List[Tuple[str, str]]] = {}
+        self.classes: Dict[str, Dict[int, TcClass]] = {}
+        self.leaves: Dict[str, Dict[int, str]] = {}     # dev -> {class minor: 叶子队列}
+        # (dev, parent) -> {(pref, handle): TcFilter}
+        self.filters: Dict[Tuple[str, str], Dict[Tuple[int, str], TcFilter]] = {}
+        self.forks = 0
+        self.commands: List[str] = []
+        self._next_handle = 1
+        # dev -> {minor: {bytes, packets, drops, overlimits}}，由测试直接写入
+        self.counters: Dict[str, Dict[int, Dict[str, int]]] = {}
+
+    def link_exists(self, dev: str) -> bool:
+        return dev in self.links
+
+    def ensure_ifb(self, dev: str) -> bool:
+        self.forks += 2
+        self.links.add(dev)
+        return True
+
+    def list_qdiscs(self, dev: str) -> List[Tuple[str, str]]:
+        self.forks += 1
+        return list(self.qdiscs.get(dev, []))
+
+    def list_classes(self, dev: str) -> Dict[int, TcClass]:
+        self.forks += 1
+        return dict(self.classes.get(dev, {}))
+
+    def list_leaf_qdiscs(self, dev: str, root: str) -> Dict[int, str]:
+        self.forks += 1
+        return dict(self.leaves.get(dev, {}))
+
+    def class_stats(self, dev: str) -> Dict[int, Dict[str, int]]:
+        self.forks += 1
+        counters = self.counters.get(dev, {})
+        return {
+            minor: dict(counters.get(minor) or dict.fromkeys(STAT_FIELDS, 0))
+            for minor in self.classes.get(dev, {})
+        }
+
+    def list_filters(self, dev: str, parent: str) -> List[TcFilter]:
+        self.forks += 1
+        return list(self.filters.get((dev, parent), {}).values())
+
+    def batch(self, commands: List[str]) -> bool:
+        if not commands:
+            return True
+        self.forks += 1
+        ok = True
+        for command in commands:
+            self.commands.append(command)
+            if not self._apply(command):
+                ok = False
+        return ok
+
+    def _apply(self, command: str) -> bool:
+        match = self._QDISC_RE.match(command)
+        if match:
+            dev, where, handle = match.groups()
+            self.qdiscs.setdefault(dev, []).append(('ingress', 'ffff:') if where == 'ingress' else ('htb', handle))
+            return True
+
+        match = self._LEAF_RE.match(command)
+        if match:
+            action, dev, parent, kind = match.groups()
+            minor = parse_handle(parent)[1]
+            if minor not in self.classes.get(dev, {}):
+                return False
+            leaves = self.leaves.setdefault(dev, {})
+            if action == 'del':
+                return leaves.pop(minor, None) is not None
+            leaves[minor] = kind
+            return True
+
+        match = self._CLASS_RE.match(command)
+        if match:
+            action, dev, parent, classid, rate, ceil, burst, cburst, prio = match.groups()
+            minor = parse_handle(classid)[1]
+            classes = self.classes.setdefault(dev, {})
+            if action == 'del':
+                # 内核删除 class 时一并销毁其叶子队列
+                self.leaves.get(dev, {}).pop(minor, None)
+                return classes.pop(minor, None) is not None
+            if action == 'add' and minor in classes:
+                return False
+            if action == 'change' and minor not in classes:
+                return False
+            classes[minor] = TcClass(
+                minor=minor, parent=parent or '', rate=parse_rate(rate),
+                ceil=parse_rate(ceil), prio=int(prio or 0),
+                burst=parse_size(burst) if burst else 0, cburst=parse_size(cburst) if cburst else 0
+            )
+            return True
+
+        match = self._FLOWER_ADD_RE.match(command)
+        if match:
+            dev, parent, prio, ip, flowid = match.groups()
+            self._add_filter(dev, parent, TcFilter(
+                pref=int(prio), handle=f'0x{self._next_handle:x}', ip=ip, minor=parse_handle(flowid)[1]
+            ))
+            self._next_handle += 1
+            return True
+
+        match = self._U32_TABLE_RE.match(command)
+        if match:
+            dev, parent, prio, handle, divisor = match.groups()
+            return self._add_filter(dev, parent, TcFilter(
+                pref=int(prio), handle=handle, ip=None, minor=None, kind='u32', divisor=int(divisor)
+            ))
+
+        match = self._U32_LINK_RE.match(command)
+        if match:
+            dev, parent, prio, link = match.groups()
+            return self._add_filter(dev, parent, TcFilter(
+                pref=int(prio), handle='800::800', ip=None, minor=None, kind='u32', link=link
+            ))
+
+        match = self._U32_ENTRY_RE.match(command)
+        if match:
+            dev, parent, prio, handle, ip, flowid = match.groups()
+            return self._add_filter(dev, parent, TcFilter(
+                pref=int(prio), handle=handle, ip=ip, minor=parse_handle(flowid)[1], kind='u32'
+            ))
+
+        match = self._FILTER_DEL_RE.match(command)
+        if match:
+            dev, parent, pref, handle, kind = match.groups()
+            entries = self.filters.get((dev, parent), {})
+            item = entries.get((int(pref), handle))
+            if item is None or item.kind != kind:
+                return False
+            del entries[(int(pref), handle)]
+            return True
+
+        if command.startswith('filter add') and 'mirred' in command:
+            dev = command.split()[3]
+            return self._add_filter(dev, 'ffff:', TcFilter(
+                pref=1, handle='800::800', ip=None, minor=None, kind='u32'
+            ))
+
+        return False
+
+    def _add_filter(self, dev: str, parent: str, item: TcFilter) -> bool:
+        entries = self.filters.setdefault((dev, parent), {})
+        if (item.pref, item.handle) in entries:
+            return False    # 句柄已存在（内核返回 EEXIST）
+        entries[(item.pref, item.handle)] = item
+        return True
+
+    def classify(self, dev: str, parent: str, ip: str) -> Tuple[Optional[int], int]:
+        """
+        模拟一个包的分类过程
+
+        Returns:
+            tuple: (命中的 classid minor, 匹配步数)
+                   flower 每个 prio 计 1 步；u32 链接规则 1 步 + 桶内逐条比较
+        """
+        by_pref: Dict[int, List[TcFilter]] = {}
+        for item in self.filters.get((dev, parent), {}).values():
+            by_pref.setdefault(item.pref, []).append(item)
+
+        steps = 0
+        for pref in sorted(by_pref):
+            entries = by_pref[pref]
+            if entries[0].kind == 'flower':
+                steps += 1
+                for item in entries:
+                    if item.ip == ip:
+                        return item.minor, steps
+                continue
+            # u32：先走链接规则，再在末字节对应的桶内顺序比较
+            link = next((f for f in entries if f.link), None)
+            if link is None:
+                continue
+            steps += 1
+            bucket = f'{link.link}{int(ip.split(".")[3]):x}:'
+            for item in entries:
+                if item.ip and item.handle.startswith(bucket):
+                    steps += 1
+                    if item.ip == ip:
+                        return item.minor, steps
+        return None, steps
+
+
+# ==================== 速率表 ====================
+# 🆕 用户组行: "@group<TAB>组名<TAB>rate_up=.. ceil_up=.. rate_down=.. ceil_down=.. prio=.. leaf=.. burst_ms=.."
+# 聚合限速（rate_* / ceil_* / prio）与队列参数（leaf / burst_ms）都是可选的
+GROUP_LINE_PREFIX = '@group\t'
+
+
+def parse_group_line(line: str) -> Optional[Tuple[str, Optional[GroupLimit], GroupOptions]]:
+    parts = line.rstrip('\n').split('\t')
+    if len(parts) < 3 or not parts[1]:
+        return None
+    values = dict(item.partition('=')[::2] for item in parts[2].split())
+
+    limit = None
+    if 'rate_up' in values or 'rate_down' in values:
+        try:
+            rate_up, rate_down = values['rate_up'], values['rate_down']
+            limit = GroupLimit(
+                up_rate=rate_up, up_ceil=values.get('ceil_up') or rate_up,
+                down_rate=rate_down, down_ceil=values.get('ceil_down') or rate_down,
+                prio=int(values.get('prio', 0)),
+            )
+            for rate in (limit.up_rate, limit.up_ceil, limit.down_rate, limit.down_ceil):
+                parse_rate(rate)
+        except (KeyError, ValueError):
+            logger.warning(f"⚠️ 无效的用户组聚合限速: {line.strip()}")
+            limit = None
+
+    leaf = values.get('leaf') or None
+    if leaf is not None and leaf not in LEAF_QDISCS:
+        logger.warning(f"⚠️ 无效的叶子队列 {leaf}，使用默认值: {line.strip()}")
+        leaf = None
+    try:
+        burst_ms = int(values['burst_ms']) if values.get('burst_ms') else None
+    except ValueError:
+        logger.warning(f"⚠️ 无效的 burst_ms，使用默认值: {line.strip()}")
+        burst_ms = None
+    return parts[1], limit, GroupOptions(leaf=leaf, burst_ms=burst_ms)
+
+
+class RateTable:
+    """
+    客户端速率表（由 Web 端导出的 tc-rates.tbl）
+
+    只在首行版本号变化时重新读取；文件不存在时退回旧格式
+    tc-users.conf + tc-roles.map（以修改时间作为版本）。
+    """
+
+    def __init__(self, path: str = None, users_conf: str = None, roles_map: str = None):
+        self.path = path or Config.TC_RATE_TABLE
+        self.users_conf = users_conf or Config.TC_USERS_CONF
+        self.roles_map = roles_map or Config.TC_ROLES_MAP
+        self.version: Optional[str] = None
+        self.rates: Dict[str, Tuple[str, str]] = {}
+        self.groups: Dict[str, str] = {}            # client -> group
+        self.group_limits: Dict[str, GroupLimit] = {}   # 🆕 group -> 聚合限速（仅配置了聚合速率的组）
+        self.group_options: Dict[str, GroupOptions] = {}    # 🆕 group -> 队列参数（仅有覆盖的组）
+
+    def refresh(self) -> bool:
+        """版本变化时重新加载，返回是否有变化"""
+        try:
+            with open(self.path, 'r') as f:
+                header = f.readline().strip()
+                if header.startswith('#version='):
+                    version = header[len('#version='):]
+                    if version == self.version:
+                        return False
+                    self.rates, self.groups, self.group_limits, self.group_options = self._parse_table(f)
+                    self.version = version
+                    logger.info(f"📋 速率表已加载: 版本 {version}, {len(self.rates)} 个客户端")
+                    return True
+        except FileNotFoundError:
+            pass
+        return self._refresh_legacy()
+
+    @staticmethod
+    def _parse_table(lines) -> Tuple[Dict[str, Tuple[str, str]], Dict[str, str],
+                                     Dict[str, GroupLimit], Dict[str, GroupOptions]]:
+        rates, groups, limits, options = {}, {}, {}, {}
+        for line in lines:
+            if line.startswith(GROUP_LINE_PREFIX):
+                parsed = parse_group_line(line)
+                if parsed:
+                    name, limit, group_options = parsed
+                    if limit is not None:
+                        limits[name] = limit
+                    if group_options != GroupOptions():
+                        options[name] = group_options
+                continue
+            parts = line.split(None, 3)
+            if len(parts) < 3 or parts[0].startswith('#'):
+                continue
+            rates[parts[0]] = (parts[1], parts[2])
+            if len(parts) > 3:
+                groups[parts[0]] = parts[3].strip()
+        return rates, groups, limits, options
+
+    def _refresh_legacy(self) -> bool:
+        try:
+            version = 'legacy-%d-%d' % (
+                os.stat(self.users_conf).st_mtime_ns, os.stat(self.roles_map).st_mtime_ns
+            )
+        except FileNotFoundError:
+            version = 'empty'
+        if version == self.version:
+            return False
+
+        group_rates, roles = {}, {}
+        for path, target in ((self.users_conf, group_rates), (self.roles_map, roles)):
+            try:
+                with open(path, 'r') as f:
+                    for line in f:
+                        key, sep, value = line.strip().partition('=')
+                        if sep and not key.startswith('#') and key not in target:
+                            target[key] = value
+            except FileNotFoundError:
+                continue
+
+        rates = {}
+        for client, group in roles.items():
+            parts = group_rates.get(group, '').split()
+            if len(parts) == 2:
+                rates[client] = (parts[0], parts[1])
+        self.rates = rates
+        self.groups = {client: group for client, group in roles.items() if client in rates}
+        self.group_limits = {}
+        self.group_options = {}
+        self.version = version
+        return True
+
+    def get(self, user: str) -> Tuple[str, str]:
+        return self.rates.get(user, (Config.TC_DEFAULT_RATE, Config.TC_DEFAULT_RATE))
+
+
+def parse_status_clients(path: str) -> Dict[str, str]:
+    """
+    解析 OpenVPN status.log 的 ROUTING TABLE
+
+    Returns:
+        dict: {vpn_ip: user}
+    """
+    clients = {}
+    try:
+        with open(path, 'r', errors='replace') as f:
+            in_section = False
+            for line in f:
+                if line.startswith('ROUTING TABLE'):
+                    in_section = True
+                    continue
+                if line.startswith('GLOBAL STATS'):
+                    in_section = False
+                if not in_section:
+                    continue
+                fields = [field.strip() for field in line.split(',')]
+                if len(fields) >= 2 and fields[1] and _IPV4_RE.match(fields[0]):
+                    clients[fields[0]] = fields[1]
+    except FileNotFoundError:
+        pass
+    return clients
+
+
+_IPV4_RE = re.compile(r'^\d+\.\d+\.\d+\.\d+$')
+
+
+# ==================== 引擎 ====================
+class TcEngine:
+    """期望状态 → 实际状态的调和器"""
+
+    def __init__(self, backend=None, rate_table: RateTable = None, status_file: str = None,
+                 vpn_dev: str = None, ifb_dev: str = None, dry_run: bool = False,
+                 layout: str = None, classid_start: int = None, classid_end: int = None,
+                 state_file: str = None):
+        self.backend = backend or TcBackend()
+        self.rate_table = rate_table or RateTable()
+        self.status_file = status_file or Config.TC_STATUS_LOG
+        self.vpn_dev = vpn_dev or Config.TC_VPN_DEV
+        self.ifb_dev = ifb_dev or Config.TC_IFB_DEV
+        self.dry_run = dry_run
+
+        self.classid_start = classid_start or Config.TC_CLASSID_START
+        self.classid_end = classid_end or Config.TC_CLASSID_END
+        self.allocator = ClassIdAllocator(self.classid_start, self.classid_end)
+        self.layout = LAYOUTS[layout or Config.TC_FILTER_LAYOUT]()
+        self.state_file = state_file or Config.TC_STATE_FILE
+
+        # 🆕 用户组聚合类使用保留区间 0x2 ~ 0xFF
+        self.group_allocator = ClassIdAllocator(Config.TC_GROUP_CLASSID_START, Config.TC_GROUP_CLASSID_END)
+        self.group_assignments: Dict[str, int] = {}    # group -> classid minor
+
+        self.assignments: Dict[str, int] = {}      # ip -> classid minor
+        self.last_applied: Optional[Dict[str, ClientShape]] = None
+        self.last_groups: Optional[Dict[int, GroupShape]] = None
+        self.desired_groups: Dict[int, GroupShape] = {}
+        self.cycles = 0
+        self.force_full = True                      # 启动后第一次必须读实际状态
+        self.unshaped: List[Tuple[str, str]] = []   # classid 池耗尽而未限速的 (ip, user)
+
+    # ------------------------------------------------------------------
+    # classid 分配
+    # ------------------------------------------------------------------
+    def _assign_classids(self, online: Dict[str, str]) -> None:
+        """保留已有分配，释放下线客户端，为新客户端分配"""
+        for ip in list(self.assignments):
+            if ip not in online:
+                self.allocator.release(self.assignments.pop(ip))
+        unshaped = []
+        for ip in sorted(online):
+            if ip in self.assignments:
+                continue
+            minor = self.allocator.allocate()
+            if minor is None:
+                unshaped.append(ip)
+                continue
+            self.assignments[ip] = minor
+        self.unshaped = [(ip, online[ip]) for ip in unshaped]
+        if unshaped:
+            logger.error(f"❌ classid 池已耗尽，{len(unshaped)} 个客户端不限速（如 {online[unshaped[0]]} {unshaped[0]}）")
+
+    def adopt(self, filters: List[TcFilter]) -> None:
+        """从实际 filter 恢复 ip → classid（重启后沿用已有规则，避免全部重建）"""
+        for item in filters:
+            if item.ip and item.minor is not None and item.ip not in self.assignments \
+                    and self.allocator.reserve(item.minor):
+                self.assignments[item.ip] = item.minor
+
+    def restore_groups(self) -> None:
+        """从上次的状态快照恢复 用户组 → classid（快照缺失时重新分配，差异由调和修正）"""
+        try:
+            with open(self.state_file, 'r') as f:
+                groups = json.load(f).get('groups') or []
+        except (OSError, ValueError):
+            return
+        for group in groups:
+            try:
+                minor = int(group['classid'], 16)
+            except (KeyError, TypeError, ValueError):
+                continue
+            if group.get('name') and group['name'] not in self.group_assignments \
+                    and self.group_allocator.reserve(minor):
+                self.group_assignments[group['name']] = minor
+
+    def _in_pool(self, minor: int) -> bool:
+        return self.classid_start <= minor <= self.classid_end
+
+    # ------------------------------------------------------------------
+    # 期望状态 / 差异
+    # ------------------------------------------------------------------
+    def _assign_group_classids(self, groups: List[str]) -> None:
+        """为有在线成员、且配置了聚合限速的用户组分配 classid；其余释放"""
+        wanted = set(groups)
+        for name in list(self.group_assignments):
+            if name not in wanted:
+                self.group_allocator.release(self.group_assignments.pop(name))
+        for name in sorted(wanted - set(self.group_assignments)):
+            minor = self.group_allocator.allocate()
+            if minor is None:
+                logger.error(f"❌ 用户组 classid 已耗尽，{name} 的成员直接挂在根类下")
+                continue
+            self.group_assignments[name] = minor
+
+    def desired_state(self, online: Dict[str, str]) -> Dict[str, ClientShape]:
+        """
+        计算期望的客户端 class；同时更新 self.desired_groups
+
+        配置了聚合限速的用户组建立两级结构: 根类 → 用户组类 → 客户端类，
+        客户端速率上限不变，用户组类的 ceil 决定整组可借用的带宽。
+        """
+        self._assign_classids(online)
+        limits = self.rate_table.group_limits
+        member_groups = {ip: self.rate_table.groups.get(online[ip]) for ip in self.assignments}
+        self._assign_group_classids([g for g in member_groups.values() if g in limits])
+        self.desired_groups = {
+            minor: GroupShape(name=name, minor=minor, limit=limits[name], burst_ms=self._group_options(name)[1])
+            for name, minor in self.group_assignments.items()
+        }
+
+        desired = {}
+        for ip, minor in self.assignments.items():
+            user = online[ip]
+            up, down = self.rate_table.get(user)
+            group = member_groups[ip]
+            parent = self.group_assignments.get(group, 1)
+            prio = limits[group].prio if parent != 1 else 0
+            leaf, burst_ms = self._group_options(group)
+            desired[ip] = ClientShape(user=user, ip=ip, minor=minor, up=up, down=down, parent=parent, prio=prio,
+                                      leaf=leaf, burst_ms=burst_ms)
+        return desired
+
+    def _group_options(self, group: Optional[str]) -> Tuple[str, int]:
+        """🆕 用户组的 (叶子队列, burst 毫秒数)，未覆盖的取全局默认"""
+        options = self.rate_table.group_options.get(group) or GroupOptions()
+        return options.leaf or Config.TC_LEAF_QDISC, options.burst_ms or Config.TC_BURST_MS
+
+    def base_commands(self) -> List[str]:
+        """根 qdisc / 父类 / ingress 重定向缺失时的修复命令"""
+        commands = []
+        vpn, ifb = self.vpn_dev, self.ifb_dev
+        vpn_qdiscs = self.backend.list_qdiscs(vpn)
+        ifb_qdiscs = self.backend.list_qdiscs(ifb)
+
+        if ('htb', '1:') not in vpn_qdiscs:
+            commands.append(f'qdisc add dev {vpn} root handle 1: htb default 1')
+        if ('ingress', 'ffff:') not in vpn_qdiscs:
+            commands.append(f'qdisc add dev {vpn} ingress')
+        if not self.backend.list_filters(vpn, 'ffff:'):
+            commands.append(
+                f'filter add dev {vpn} parent ffff: protocol ip u32 match u32 0 0 '
+                f'action mirred egress redirect dev {ifb}'
+            )
+        if ('htb', '2:') not in ifb_qdiscs:
+            commands.append(f'qdisc add dev {ifb} root handle 2: htb default 1')
+        return commands
+
+    def diff(self, desired: Dict[str, ClientShape],
+             actual_classes: Dict[str, Dict[int, TcClass]],
+             actual_filters: Dict[str, List[TcFilter]],
+             groups: Dict[int, GroupShape] = None,
+             actual_leaves: Dict[str, Dict[int, str]] = None) -> List[str]:
+        """
+        计算把实际状态变为期望状态的命令
+
+        顺序: 删除 filter → 删除客户端 class → 删除用户组 class → 增改用户组 class
+        → 增改客户端 class → 叶子队列 → 哈希表等基础规则 → 增加 filter
+        """
+        groups = self.desired_groups if groups is None else groups
+        actual_leaves = actual_leaves or {}
+        deletes_f, deletes_c, deletes_g, upserts_g, upserts_c, infra, adds_f = [], [], [], [], [], [], []
+        leaves = []
+        link_rate = Config.TC_LINK_RATE
+
+        devices = (
+            # dev, 根句柄, 匹配方向, 速率字段
+            (self.vpn_dev, '1:', 'dst', 'up'),
+            (self.ifb_dev, '2:', 'src', 'down'),
+        )
+        for dev, root, direction, rate_attr in devices:
+            classes = actual_classes.get(dev, {})
+            filters = actual_filters.get(dev, [])
+            dev_leaves = actual_leaves.get(dev, {})
+            wanted_minors = {shape.minor: shape for shape in desired.values()}
+
+            if 1 not in classes:
+                upserts_g.append(
+                    f'class add dev {dev} parent {root} classid {root}1 htb rate {link_rate} ceil {link_rate}'
+                )
+            elif not rates_equal(classes[1].rate, parse_rate(link_rate)):
+                upserts_g.append(
+                    f'class change dev {dev} parent {root} classid {root}1 htb rate {link_rate} ceil {link_rate}'
+                )
+            infra.extend(self.layout.infra_commands(dev, root, direction, filters))
+
+            # 🆕 父类变化（加入 / 移出聚合用户组）的客户端: htb 不能原地改父类，
+            # 需要先删掉指向它的 filter 和 class 再重建
+            reparent = {
+                minor for minor, shape in wanted_minors.items()
+                if minor in classes and classes[minor].parent != f'{root}{shape.parent:x}'
+            }
+
+            # filter：每个期望 IP 只保留一条当前布局下指向正确 class 的规则，
+            # 其它布局（如升级前的 flower）的客户端规则一律删除
+            satisfied = set()
+            for item in filters:
+                if item.ip is None:
+                    continue    # 哈希表 / 链接规则
+                shape = desired.get(item.ip)
+                if shape is not None and item.minor == shape.minor and item.ip not in satisfied \
+                        and item.minor not in reparent \
+                        and item.kind == self.layout.name \
+                        and self.layout.expected_handle(item.ip) in (None, item.handle):
+                    satisfied.add(item.ip)
+                    continue
+                if item.minor is not None and (self._in_pool(item.minor) or shape is not None):
+                    deletes_f.append(delete_filter_command(dev, root, item))
+
+            # 用户组聚合类
+            for minor, cls in classes.items():
+                if self._is_group_minor(minor) and minor not in groups:
+                    deletes_g.append(f'class del dev {dev} classid {root}{minor:x}')
+            for minor, group in sorted(groups.items()):
+                limit = group.limit
+                rate, ceil = (limit.up_rate, limit.up_ceil) if rate_attr == 'up' else (limit.down_rate, limit.down_ceil)
+                spec = (f'parent {root}1 classid {root}{minor:x} '
+                        f'{self._htb_spec(rate, ceil, group.burst_ms, limit.prio)}')
+                cls = classes.get(minor)
+                if cls is None:
+                    upserts_g.append(f'class add dev {dev} {spec}')
+                elif not self._class_matches(cls, f'{root}1', rate, ceil, limit.prio, group.burst_ms):
+                    upserts_g.append(f'class change dev {dev} {spec}')
+
+            # 客户端类
+            for minor, cls in classes.items():
+                if self._in_pool(minor) and (minor not in wanted_minors or minor in reparent):
+                    deletes_c.append(f'class del dev {dev} classid {root}{minor:x}')
+            for minor, shape in sorted(wanted_minors.items()):
+                rate = getattr(shape, rate_attr)
+                parent = f'{root}{shape.parent:x}'
+                spec = f'parent {parent} classid {root}{minor:x} {self._htb_spec(rate, rate, shape.burst_ms, shape.prio)}'
+                cls = classes.get(minor)
+                if cls is None or minor in reparent:
+                    upserts_c.append(f'class add dev {dev} {spec}')
+                    previous_rate = None
+                elif not self._class_matches(cls, parent, rate, rate, shape.prio, shape.burst_ms):
+                    upserts_c.append(f'class change dev {dev} {spec}')
+                    previous_rate = f'{cls.rate * 8}bit'
+                else:
+                    previous_rate = rate
+                if shape.leaf:
+                    leaves.extend(self._leaf_commands(dev, f'{root}{minor:x}', shape.leaf, rate,
+                                                      dev_leaves.get(minor), previous_rate))
+
+            handles = {}
+            for ip, shape in sorted(desired.items()):
+                handle = self.layout.expected_handle(ip)
+                if handle is not None:
+                    if handles.setdefault(handle, ip) != ip:
+                        logger.error(f"❌ {ip} 与 {handles[handle]} 的 u32 句柄冲突（VPN 网段需不大于 /16），跳过")
+                        continue
+                if ip not in satisfied:
+                    adds_f.append(self.layout.add_command(dev, root, direction, ip, shape.minor))
+
+        return deletes_f + deletes_c + deletes_g + upserts_g + upserts_c + leaves + infra + adds_f
+
+    @staticmethod
+    def _htb_spec(rate: str, ceil: str, burst_ms: int, prio: int) -> str:
+        spec = f'htb rate {rate} ceil {ceil}'
+        if burst_ms:
+            spec += f' burst {burst_bytes(rate, burst_ms)}b cburst {burst_bytes(ceil, burst_ms)}b'
+        if prio:
+            spec += f' prio {prio}'
+        return spec
+
+    @staticmethod
+    def _leaf_commands(dev: str, classid: str, kind: str, rate: str, current: Optional[str],
+                       previous_rate: Optional[str]) -> List[str]:
+        """
+        🆕 叶子队列的修复命令
+
+        Args:
+            current: 实际挂着的叶子队列类型（None = 内核默认）
+            previous_rate: class 修改前的速率；None = 本批命令中新建 / 重建了 class
+        """
+        spec = leaf_qdisc_spec(kind, rate)
+        if spec is None:
+            # pfifo：删掉自定义叶子，内核自动恢复默认队列；新建的 class 本来就是默认队列
+            if current not in (None, 'pfifo') and previous_rate is not None:
+                return [f'qdisc del dev {dev} parent {classid}']
+            return []
+        # 速率变化只在 fq_codel 参数随之变化时才重新下发（高速率下 target 都是 5ms）
+        if previous_rate is None or current != kind or leaf_qdisc_spec(kind, previous_rate) != spec:
+            # replace 对同类型队列是原地修改，不会清空已排队的包
+            return [f'qdisc replace dev {dev} parent {classid} {spec}']
+        return []
+
+    @staticmethod
+    def _class_matches(cls: TcClass, parent: str, rate: str, ceil: str, prio: int, burst_ms: int = 0) -> bool:
+        if burst_ms and cls.burst and not (
+            sizes_equal(cls.burst, burst_bytes(rate, burst_ms))
+            and (not cls.cburst or sizes_equal(cls.cburst, burst_bytes(ceil, burst_ms)))
+        ):
+            return False
+        return (
+            cls.parent == parent
+            and rates_equal(cls.rate, parse_rate(rate))
+            and (not cls.ceil or rates_equal(cls.ceil, parse_rate(ceil)))
+            and cls.prio == prio
+        )
+
+    @staticmethod
+    def _is_group_minor(minor: int) -> bool:
+        return Config.TC_GROUP_CLASSID_START <= minor <= Config.TC_GROUP_CLASSID_END
+
+    # ------------------------------------------------------------------
+    # 周期
+    # ------------------------------------------------------------------
+    def read_actual(self) -> Tuple[Dict[str, Dict[int, TcClass]], Dict[str, List[TcFilter]],
+                                   Dict[str, Dict[int, str]]]:
+        classes = {
+            self.vpn_dev: self.backend.list_classes(self.vpn_dev),
+            self.ifb_dev: self.backend.list_classes(self.ifb_dev),
+        }
+        filters = {
+            self.vpn_dev: self.backend.list_filters(self.vpn_dev, '1:'),
+            self.ifb_dev: self.backend.list_filters(self.ifb_dev, '2:'),
+        }
+        # 🆕 叶子队列
+        leaves = {
+            self.vpn_dev: self.backend.list_leaf_qdiscs(self.vpn_dev, '1:'),
+            self.ifb_dev: self.backend.list_leaf_qdiscs(self.ifb_dev, '2:'),
+        }
+        return classes, filters, leaves
+
+    def setup(self) -> bool:
+        """确保 ifb 设备与基础 qdisc 存在，并接管已有规则"""
+        if not self.backend.link_exists(self.vpn_dev):
+            logger.error(f"❌ {self.vpn_dev} 不存在")
+            return False
+        if not self.backend.ensure_ifb(self.ifb_dev):
+            logger.error(f"❌ 无法创建 {self.ifb_dev}")
+            return False
+        commands = self.base_commands()
+        if commands and not self.dry_run:
+            self.backend.batch(commands)
+        _, filters, _ = self.read_actual()
+        self.adopt(filters[self.vpn_dev])
+        self.restore_groups()
+        logger.info(
+            f"✅ TC 引擎初始化完成（{self.layout.name} 布局，classid 池 0x{self.classid_start:x}-0x{self.classid_end:x}，"
+            f"接管 {len(self.assignments)} 个已有客户端）"
+        )
+        return True
+
+    def reconcile(self, force: bool = False) -> Dict:
+        """
+        执行一次调和
+
+        Args:
+            force: 忽略“期望状态未变化”的快速路径，读取实际状态并修复
+
+        Returns:
+            dict: {'online', 'commands', 'skipped', 'ok'}
+        """
+        self.cycles += 1
+        self.rate_table.refresh()
+        online = parse_status_clients(self.status_file)
+        desired = self.desired_state(online)
+
+        groups = self.desired_groups
+        force = force or self.force_full
+        if not force and desired == self.last_applied and groups == self.last_groups:
+            return {'online': len(desired), 'commands': 0, 'skipped': True, 'ok': True}
+
+        commands = []
+        if force:
+            commands.extend(self.base_commands())
+        actual_classes, actual_filters, actual_leaves = self.read_actual()
+        commands.extend(self.diff(desired, actual_classes, actual_filters, groups, actual_leaves))
+
+        ok = True
+        if commands:
+            if self.dry_run:
+                for command in commands:
+                    logger.info(f"[dry-run] tc {command}")
+            else:
+                ok = self.backend.batch(commands)
+            self._log_changes(desired)
+
+        # 提交失败：下个周期强制重新读取实际状态
+        self.last_applied = desired if ok else None
+        self.last_groups = groups if ok else None
+        self.force_full = not ok
+        return {'online': len(desired), 'commands': len(commands), 'skipped': False, 'ok': ok}
+
+    # ------------------------------------------------------------------
+    # 状态快照
+    # ------------------------------------------------------------------
+    def snapshot(self) -> Dict:
+        """
+        已应用的限速状态 + tc -s class 计数器（2 次 fork）
+
+        up / down 分别对应 vpn_dev / ifb_dev 上的 class，与用户组的上下行速率字段一致。
+        """
+        stats = {dev: self.backend.class_stats(dev) for dev in (self.vpn_dev, self.ifb_dev)}
+        clients = []
+        for ip, shape in sorted((self.last_applied or {}).items()):
+            entry = {
+                'ip': ip,
+                'user': shape.user,
+                'group': self.rate_table.groups.get(shape.user),
+                'classid': f'{shape.minor:x}',
+                'parent': f'{shape.parent:x}',
+                'leaf': shape.leaf or None,
+            }
+            for direction, dev, rate in (('up', self.vpn_dev, shape.up), ('down', self.ifb_dev, shape.down)):
+                counters = stats[dev].get(shape.minor) or dict.fromkeys(STAT_FIELDS, 0)
+                try:
+                    rate_bps = parse_rate(rate) * 8
+                except ValueError:
+                    rate_bps = None
+                entry[direction] = dict(counters, rate=rate, rate_bps=rate_bps)
+            clients.append(entry)
+
+        # 🆕 用户组聚合类（重启后据此恢复组名 → classid，避免重建整棵树）
+        groups = []
+        for minor, group in sorted((self.last_groups or {}).items()):
+            limit = group.limit
+            entry = {'name': group.name, 'classid': f'{minor:x}', 'prio': limit.prio}
+            for direction, dev, rate, ceil in (('up', self.vpn_dev, limit.up_rate, limit.up_ceil),
+                                               ('down', self.ifb_dev, limit.down_rate, limit.down_ceil)):
+                counters = stats[dev].get(minor) or dict.fromkeys(STAT_FIELDS, 0)
+                entry[direction] = dict(counters, rate=rate, ceil=ceil)
+            groups.append(entry)
+
+        return {
+            'format': STATE_FORMAT,
+            'timestamp': time.time(),
+            'layout': self.layout.name,
+            'devices': {'up': self.vpn_dev, 'down': self.ifb_dev},
+            'rate_version': self.rate_table.version,
+            'applied': self.last_applied is not None,
+            'unshaped': [{'ip': ip, 'user': user} for ip, user in self.unshaped],
+            'groups': groups,
+            'clients': clients,
+        }
+
+    def write_state(self, path: str = None) -> bool:
+        """原子写入状态快照（先写临时文件再 rename，读取方不会读到半个文件）"""
+        path = path or self.state_file
+        try:
+            state = self.snapshot()
+            directory = os.path.dirname(path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix='.state-', dir=directory)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+                os.chmod(tmp, 0o644)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ 写入状态快照失败: {e}")
+            return False
+
+    def describe_request(self, op: Dict) -> Dict:
+        """
+        控制通道请求在本次调和后的结果详情
+
+        - update_users: 已按当前速率限速的客户端与离线客户端
+        - update_role: 该组在线并已限速的成员数
+        """
+        applied = self.last_applied or {}
+        name = op.get('op')
+        if name == 'update_users':
+            shaped, offline = [], []
+            for item in op.get('users') or []:
+                user = item[0] if isinstance(item, (list, tuple)) else item
+                ip = item[1] if isinstance(item, (list, tuple)) and len(item) > 1 else None
+                shape = applied.get(ip) if ip else next(
+                    (s for s in applied.values() if s.user == user), None
+                )
+                if shape is not None and shape.user == user:
+                    shaped.append({'user': user, 'ip': shape.ip, 'up': shape.up, 'down': shape.down})
+                else:
+                    offline.append(user)
+            return {'op': name, 'shaped': shaped, 'offline': offline}
+        if name == 'update_role':
+            role = op.get('role')
+            members = sum(1 for s in applied.values() if self.rate_table.groups.get(s.user) == role)
+            return {'op': name, 'role': role, 'online_members': members}
+        return {'op': name, 'online': len(applied)}
+
+    def _log_changes(self, desired: Dict[str, ClientShape]) -> None:
+        previous = self.last_applied or {}
+        updated = 0
+        for ip, shape in desired.items():
+            old = previous.get(ip)
+            if old is None:
+                logger.info(f"🟢 客户端上线: {shape.user} ({ip}) ↑{shape.up} ↓{shape.down} → class 0x{shape.minor:x}")
+            elif (old.up, old.down) != (shape.up, shape.down):
+                updated += 1
+                if updated <= LOG_DETAIL_LIMIT:
+                    logger.info(f"🔄 速率更新: {shape.user} ({ip}) → ↑{shape.up} ↓{shape.down}")
+        if updated > LOG_DETAIL_LIMIT:
+            # 🆕 分时段切换等批量变更只汇总，避免每个周期写上千行日志
+            logger.info(f"🔄 速率更新: 共 {updated} 个客户端（仅列出前 {LOG_DETAIL_LIMIT} 个）")
+        for ip, shape in previous.items():
+            if ip not in desired:
+                logger.info(f"🔴 客户端下线: {shape.user} ({ip}) → 删除 class 0x{shape.minor:x}")
+
+
+# ==================== 守护进程 ====================
+def consume_reload_signals(path: str) -> int:
+    """
+    读取并清空热更新信号文件，返回信号条数
+
+    速率来自速率表，信号只用于触发一次立即的完整调和。
+    """
+    try:
+        with open(path, 'r+') as f:
+            lines = [line for line in f.read().splitlines() if line.strip()]
+            if lines:
+                f.seek(0)
+                f.truncate()
+            return len(lines)
+    except FileNotFoundError:
+        return 0
+
+
+def sd_notify(message: str) -> None:
+    """systemd 通知（READY / WATCHDOG / STATUS），未在 systemd 下运行时忽略"""
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(message.encode(), address)
+    except OSError:
+        pass
+
+
+def run_forever(engine: TcEngine, interval: float = None, repair_interval: int = None,
+                control: bool = True) -> None:
+    """
+    主循环
+
+    - 每 interval 秒调和一次，每 repair_interval 个周期强制读取实际状态
+    - SIGHUP / 信号文件 / 控制通道请求：立即强制调和
+    - 控制通道请求在调和完成后回复 applied / failed
+    - 🆕 每 TC_STATE_INTERVAL 秒写出一次状态快照（TC_STATE_FILE）
+    """
+    interval = interval or Config.TC_INTERVAL
+    repair_interval = repair_interval or Config.TC_REPAIR_INTERVAL
+    reload_signal = Config.TC_RELOAD_SIGNAL
+    state_file = engine.state_file
+    state_interval = Config.TC_STATE_INTERVAL
+    stop = {'flag': False, 'force': False}
+    wake = threading.Event()
+
+    def _terminate(signum, frame):
+        stop['flag'] = True
+        wake.set()
+
+    def _reload(signum, frame):
+        stop['force'] = True
+        wake.set()
+
+    signal.signal(signal.SIGTERM, _terminate)
+    signal.signal(signal.SIGINT, _terminate)
+    signal.signal(signal.SIGHUP, _reload)
+
+    os.makedirs(os.path.dirname(reload_signal), exist_ok=True)
+    server = None
+    if control and not engine.dry_run:
+        server = ControlServer(Config.TC_CONTROL_SOCKET, wake)
+        if not server.start():
+            server = None
+    sd_notify('READY=1')
+
+    def _cycle(force: bool) -> None:
+        signals = consume_reload_signals(reload_signal)
+        if signals:
+            logger.info(f"📢 收到 {signals} 条热更新信号")
+            force = True
+        pending = server.take_pending() if server else []
+        if pending:
+            force = True
+
+        error = None
+        try:
+            result = engine.reconcile(force=force)
+            if result['commands']:
+                logger.info(
+                    f"✅ 调和完成: {result['online']} 个在线客户端, "
+                    f"{result['commands']} 条 tc 命令{'（部分失败）' if not result['ok'] else ''}"
+                )
+        except Exception as e:
+            logger.exception(f"❌ 调和失败: {e}")
+            engine.force_full = True
+            result = {'online': len(engine.assignments), 'ok': False}
+            error = str(e)
+
+        if pending:
+            server.complete(pending, engine.describe_request, result['ok'],
+                            error or (None if result['ok'] else 'tc 批量命令部分失败'))
+            logger.info(f"📨 控制通道: {len(pending)} 个请求已回复 ({'applied' if result['ok'] else 'failed'})")
+
+        sd_notify(f"WATCHDOG=1\nSTATUS=监控中: {result['online']} 个客户端在线")
+
+    tick = 0
+    next_reconcile = next_state = time.monotonic()
+    while not stop['flag']:
+        if wake.is_set() or time.monotonic() >= next_reconcile:
+            wake.clear()
+            tick += 1
+            force = stop['force'] or tick % repair_interval == 0
+            stop['force'] = False
+            _cycle(force)
+            next_reconcile = time.monotonic() + interval
+
+        # 🆕 状态快照按固定节奏写出，与调和周期无关
+        if state_interval and time.monotonic() >= next_state:
+            engine.write_state(state_file)
+            next_state = time.monotonic() + state_interval
+
+        deadline = min(next_reconcile, next_state) if state_interval else next_reconcile
+        wake.wait(max(0.0, deadline - time.monotonic()))
+
+    if server:
+        server.stop()
+    logger.info("TC 引擎退出（保留现有 tc 规则）")
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='OpenVPN TC 限速调和引擎')
+    parser.add_argument('--once', action='store_true', help='只执行一次完整调和后退出')
+    parser.add_argument('--dry-run', action='store_true', help='只打印 tc 命令，不执行')
+    args = parser.parse_args(argv)
+
+    handlers = [logging.StreamHandler()]
+    try:
+        os.makedirs(os.path.dirname(Config.TC_LOG_FILE), exist_ok=True)
+        handlers.append(logging.FileHandler(Config.TC_LOG_FILE))
+    except OSError:
+        pass
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S', handlers=handlers)
+
+    engine = TcEngine(dry_run=args.dry_run)
+    for attempt in range(1, 6):
+        if engine.setup():
+            break
+        logger.warning(f"⚠️ TC 初始化失败，5 秒后重试 ({attempt}/5)...")
+        time.sleep(5)
+    else:
+        logger.error("❌ TC 初始化失败，退出")
+        return 1
+
+    if args.once:
+        result = engine.reconcile(force=True)
+        logger.info(f"调和结果: {result}")
+        return 0 if result['ok'] else 1
+
+    run_forever(engine)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
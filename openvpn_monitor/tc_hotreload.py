@@ -1,12 +1,17 @@
 """
 TC 热更新模块
 用于向守护进程发送速率变更信号，实现不断线的实时限速调整
+
+🆕 优先走控制通道（openvpn_monitor.tc_control，引擎收到后立即调和并回复结果）；
+控制通道不可用时（旧的 vpn-tc-daemon.sh）退回追加信号文件。
 """
 
 import os
 import logging
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
+
+from openvpn_monitor import tc_control
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +50,22 @@ def _write_signal(signal_line: str) -> bool:
         return False
 
 
+def _dispatch(op: str, signal_line: str, **payload) -> bool:
+    """
+    发送变更通知：控制通道确认收到即返回，否则写信号文件
+
+    Args:
+        op: 控制通道操作名
+        signal_line: 退回信号文件时写入的内容
+        payload: 控制通道参数
+    """
+    result = tc_control.request(op, wait=False, timeout=0.5, **payload)
+    if result['status'] == 'accepted':
+        logger.info(f"✅ 热更新已提交到控制通道: {signal_line}")
+        return True
+    return _write_signal(signal_line)
+
+
 def notify_user_update(username: str, vpn_ip: str) -> bool:
     """
     通知守护进程：某用户需要更新速率
@@ -69,7 +90,32 @@ def notify_user_update(username: str, vpn_ip: str) -> bool:
         return False
     
     signal = f"UPDATE_USER={username}|{vpn_ip}"
-    return _write_signal(signal)
+    return _dispatch('update_users', signal, users=[[username, vpn_ip]])
+
+
+def notify_users_update(users) -> bool:
+    """
+    🆕 通知守护进程：一批用户需要更新速率（合并为一条信号）
+
+    使用场景:
+    - 批量移动 / 分配 / 移出用户组
+
+    Args:
+        users: [(username, vpn_ip), ...]，只需包含在线用户
+
+    Returns:
+        bool: 是否发送成功（列表为空时返回 True）
+
+    Example:
+        >>> notify_users_update([("alice", "10.8.0.23"), ("bob", "10.8.0.24")])
+        True
+    """
+    users = [[name, ip] for name, ip in users if name and ip]
+    if not users:
+        return True
+
+    signal = "UPDATE_USERS=" + ",".join(f"{name}|{ip}" for name, ip in users)
+    return _dispatch('update_users', signal, users=users)
 
 
 def notify_role_update(role_name: str) -> bool:
@@ -97,7 +143,41 @@ def notify_role_update(role_name: str) -> bool:
         return False
     
     signal = f"UPDATE_ROLE={role_name}"
-    return _write_signal(signal)
+    return _dispatch('update_role', signal, role=role_name)
+
+
+def apply_rate_changes(users=(), roles=(), timeout: Optional[float] = None) -> Dict:
+    """
+    🆕 同步应用速率变更：一条批量请求，等待引擎调和完成
+
+    调用前配置文件必须已经写入（见 utils.tc_config_exporter.apply_tc_changes）。
+
+    Args:
+        users: [(username, vpn_ip), ...]
+        roles: [role_name, ...]
+        timeout: 等待上限（秒），默认 Config.TC_APPLY_TIMEOUT
+
+    Returns:
+        dict: tc_control.request() 的结果；status 取值:
+              applied / failed / timeout（引擎仍会在后台完成）/
+              signaled（控制通道不可用，已退回信号文件，结果未知）
+    """
+    ops = [{'op': 'update_users', 'users': [[name, ip] for name, ip in users if name and ip]}]
+    ops = [op for op in ops if op['users']]
+    ops.extend({'op': 'update_role', 'role': role} for role in roles if role)
+    if not ops:
+        ops = [{'op': 'reconcile'}]
+
+    result = tc_control.request('batch', timeout=timeout, ops=ops)
+    if result['status'] == 'unavailable':
+        logger.warning(f"⚠️ TC 控制通道不可用，退回信号文件: {result.get('error')}")
+        ok = notify_users_update(users) if users else True
+        for role in roles:
+            ok = notify_role_update(role) and ok
+        result = dict(result, status='signaled' if ok else 'failed')
+    elif result['status'] != 'applied':
+        logger.warning(f"⚠️ TC 变更未确认生效: {result['status']} {result.get('error', '')}")
+    return result
 
 
 def check_signal_file_writable() -> bool:
@@ -0,0 +1,180 @@
+"""
+TC 限速实时状态（Web 端）
+
+读取引擎写出的状态快照 state.json（见 TcEngine.write_state），保存最近若干份，
+用两份快照的计数器差值计算每个客户端当前的吞吐、包速率与丢包率。
+
+- 文件修改时间未变化时不重新解析
+- 由后台采样器每秒调用 refresh()，请求线程只做差值计算
+- classid 变化或计数器回退（class 被重建）的客户端不计算速率
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from openvpn_monitor.config import Config
+
+logger = logging.getLogger(__name__)
+
+DIRECTIONS = ('up', 'down')
+
+# 带宽利用率达到该比例，或窗口内有丢包时，视为“正在被限速”
+THROTTLE_UTILIZATION = 0.9
+
+
+class _Snapshot:
+    __slots__ = ('timestamp', 'meta', 'clients')
+
+    def __init__(self, state: Dict):
+        self.timestamp = float(state.get('timestamp', 0))
+        self.clients: Dict[str, Dict] = {c['ip']: c for c in state.get('clients', []) if c.get('ip')}
+        self.meta = {k: v for k, v in state.items() if k != 'clients'}
+
+
+def _direction_rates(new: Dict, old: Optional[Dict], elapsed: float) -> Dict:
+    """单个方向的速率；old 为空或计数器回退时只返回配置值"""
+    result = {'rate': new.get('rate'), 'rate_bps': new.get('rate_bps'), 'bytes': new.get('bytes', 0)}
+    if old is None or elapsed <= 0:
+        return dict(result, bps=None, pps=None, drops_per_s=None, drop_ratio=None,
+                    utilization=None, throttled=False)
+
+    deltas = {key: new.get(key, 0) - old.get(key, 0) for key in ('bytes', 'packets', 'drops', 'overlimits')}
+    if any(value < 0 for value in deltas.values()):
+        return dict(result, bps=None, pps=None, drops_per_s=None, drop_ratio=None,
+                    utilization=None, throttled=False)
+
+    bps = deltas['bytes'] * 8 / elapsed
+    offered = deltas['packets'] + deltas['drops']
+    drop_ratio = deltas['drops'] / offered if offered else 0.0
+    utilization = bps / new['rate_bps'] if new.get('rate_bps') else None
+    throttled = deltas['drops'] > 0 or (utilization is not None and utilization >= THROTTLE_UTILIZATION)
+    return dict(
+        result,
+        bps=round(bps, 1),
+        pps=round(deltas['packets'] / elapsed, 2),
+        drops_per_s=round(deltas['drops'] / elapsed, 2),
+        drop_ratio=round(drop_ratio, 4),
+        utilization=round(utilization, 4) if utilization is not None else None,
+        throttled=throttled,
+    )
+
+
+class TcStateHistory:
+    """最近若干份状态快照（环形），线程安全"""
+
+    def __init__(self, path: str = None, capacity: int = None):
+        self.path = path or Config.TC_STATE_FILE
+        self.snapshots: deque = deque(maxlen=capacity or Config.TC_STATE_HISTORY)
+        self._mtime: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def refresh(self) -> bool:
+        """文件有更新时读取并追加一份快照，返回是否追加"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ 读取 TC 状态快照失败: {e}")
+            return False
+
+        snapshot = _Snapshot(state)
+        with self._lock:
+            self._mtime = mtime
+            if self.snapshots and snapshot.timestamp <= self.snapshots[-1].timestamp:
+                return False
+            self.snapshots.append(snapshot)
+        return True
+
+    def record_sample(self, sample: Dict = None) -> None:
+        """采样器回调：顺带检查快照文件"""
+        self.refresh()
+
+    def _pair(self, window: float):
+        """最新快照，以及窗口内最早的一份（不足两份时为 None）"""
+        with self._lock:
+            if not self.snapshots:
+                return None, None
+            newest = self.snapshots[-1]
+            base = None
+            for snapshot in self.snapshots:
+                if snapshot is newest:
+                    break
+                if newest.timestamp - snapshot.timestamp <= window:
+                    base = snapshot
+                    break
+            if base is None and len(self.snapshots) > 1:
+                # 窗口比快照间隔还短：退回相邻的上一份
+                base = self.snapshots[-2]
+            return newest, base
+
+    def client_rates(self, window: float = None) -> Optional[Dict]:
+        """
+        计算每个客户端的实时速率
+
+        Args:
+            window: 计算窗口（秒），默认 Config.TC_STATE_WINDOW
+
+        Returns:
+            dict: {'timestamp', 'age', 'stale', 'window', 'meta', 'clients': [...]}；
+                  尚无快照时返回 None
+        """
+        self.refresh()
+        window = window or Config.TC_STATE_WINDOW
+        newest, base = self._pair(window)
+        if newest is None:
+            return None
+
+        elapsed = newest.timestamp - base.timestamp if base else 0.0
+        clients = []
+        for ip, client in newest.clients.items():
+            old = base.clients.get(ip) if base else None
+            # classid 变了说明是另一条 class，计数器不可比较
+            if old is not None and old.get('classid') != client.get('classid'):
+                old = None
+            entry = {
+                'ip': ip,
+                'user': client.get('user'),
+                'group': client.get('group'),
+                'classid': client.get('classid'),
+            }
+            for direction in DIRECTIONS:
+                entry[direction] = _direction_rates(
+                    client.get(direction) or {}, (old or {}).get(direction), elapsed
+                )
+            entry['throttled'] = any(entry[d]['throttled'] for d in DIRECTIONS)
+            clients.append(entry)
+
+        age = time.time() - newest.timestamp
+        interval = Config.TC_STATE_INTERVAL or 5
+        return {
+            'timestamp': newest.timestamp,
+            'age': round(age, 1),
+            'stale': age > interval * 3,
+            'window': round(elapsed, 1),
+            'meta': newest.meta,
+            'clients': clients,
+        }
+
+
+_history: Optional[TcStateHistory] = None
+_history_lock = threading.Lock()
+
+
+def get_tc_state() -> TcStateHistory:
+    """获取进程级快照历史单例"""
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = TcStateHistory()
+        return _history
@@ -0,0 +1,262 @@
+"""
+多分辨率指标时序存储
+- 1 秒精度保留 10 分钟，1 分钟精度保留 1 天，1 小时精度保留 30 天
+- 每个原始采样增量更新各精度桶的 min / max / sum / count（即 min/avg/max 聚合）
+- 数据区是固定布局的 double 数组，直接映射到文件 (mmap)，重启后历史不丢失
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from openvpn_monitor.config import Config
+
+logger = logging.getLogger(__name__)
+
+# 支持的指标（顺序即文件布局，修改后旧文件会被重建）
+METRICS: Tuple[str, ...] = ('cpu', 'memory', 'disk', 'net_up', 'net_down')
+
+# (桶宽秒数, 槽位数)
+TIERS: Tuple[Tuple[int, int], ...] = (
+    (1, 600),        # 1s  × 10 分钟
+    (60, 1440),      # 1m  × 1 天
+    (3600, 720),     # 1h  × 30 天
+)
+
+# 每个槽位: bucket_ts, min, max, sum, count
+SLOT_FIELDS = 5
+
+_MAGIC = b'VPNWMTS1'
+_HEADER = struct.Struct('<8sII')            # magic, 指标数, 布局校验和
+_HEADER_SIZE = 64                           # 预留，保证数据区按 8 字节对齐
+
+
+def _layout_checksum() -> int:
+    """布局签名：指标或分辨率定义变化时与文件中的值不一致，触发重建"""
+    spec = ','.join(METRICS) + '|' + ';'.join(f'{r}x{n}' for r, n in TIERS)
+    checksum = 0
+    for ch in spec.encode():
+        checksum = (checksum * 31 + ch) & 0xFFFFFFFF
+    return checksum
+
+
+def parse_range(value: str) -> int:
+    """
+    解析时间范围参数
+
+    支持: 纯秒数 "300"，或带单位 "10m" / "6h" / "7d"
+
+    Raises:
+        ValueError: 格式无效或非正数
+    """
+    value = (value or '').strip().lower()
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if value and value[-1] in units:
+        seconds = int(float(value[:-1]) * units[value[-1]])
+    else:
+        seconds = int(float(value))
+    if seconds <= 0:
+        raise ValueError(value)
+    return seconds
+
+
+class TimeSeriesStore:
+    """mmap 持久化的多分辨率环形时序存储"""
+
+    def __init__(self, path: str = None):
+        self.path = path or Config.METRICS_HISTORY_FILE
+        self.lock = threading.Lock()
+
+        self._tier_offsets: List[int] = []
+        offset = 0
+        for _, slots in TIERS:
+            self._tier_offsets.append(offset)
+            offset += slots
+        self._slots_per_metric = offset
+
+        self._size = _HEADER_SIZE + len(METRICS) * self._slots_per_metric * SLOT_FIELDS * 8
+        self._file = None
+        self._mmap = None
+        self.data = None          # memoryview('d')
+        self._last_flush = time.monotonic()
+
+        # 网络速率由相邻两次采样计算（只在采样线程中访问）
+        self._last_net: Optional[Tuple[str, float, int, int]] = None
+
+        self._open()
+
+    # ------------------------------------------------------------------
+    # 文件映射
+    # ------------------------------------------------------------------
+    def _open(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._file = os.fdopen(fd, 'r+b')
+
+        header = self._file.read(_HEADER.size)
+        valid = False
+        if len(header) == _HEADER.size and os.fstat(fd).st_size == self._size:
+            magic, n_metrics, checksum = _HEADER.unpack(header)
+            valid = magic == _MAGIC and n_metrics == len(METRICS) and checksum == _layout_checksum()
+
+        if not valid:
+            # 新文件或布局变化：清零重建
+            self._file.seek(0)
+            self._file.truncate(0)
+            self._file.truncate(self._size)
+            self._file.seek(0)
+            self._file.write(_HEADER.pack(_MAGIC, len(METRICS), _layout_checksum()))
+            self._file.flush()
+            logger.info(f"🆕 指标历史文件已初始化: {self.path}")
+
+        self._mmap = mmap.mmap(self._file.fileno(), self._size)
+        self.data = memoryview(self._mmap)[_HEADER_SIZE:].cast('d')
+
+    def close(self) -> None:
+        with self.lock:
+            if self._mmap is None:
+                return
+            self.data.release()
+            self._mmap.flush()
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+            self.data = None
+
+    def flush(self) -> None:
+        with self.lock:
+            if self._mmap is not None:
+                self._mmap.flush()
+                self._last_flush = time.monotonic()
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+    def _base(self, metric_idx: int, tier_idx: int, slot: int) -> int:
+        return ((metric_idx * self._slots_per_metric) + self._tier_offsets[tier_idx] + slot) * SLOT_FIELDS
+
+    def add(self, metric: str, value: float, ts: float = None) -> None:
+        """写入一个原始采样，同时增量更新所有精度的聚合桶"""
+        if ts is None:
+            ts = time.time()
+        metric_idx = METRICS.index(metric)
+        data = self.data
+        with self.lock:
+            for tier_idx, (resolution, slots) in enumerate(TIERS):
+                bucket = (int(ts) // resolution) * resolution
+                base = self._base(metric_idx, tier_idx, (bucket // resolution) % slots)
+                if data[base] != bucket or data[base + 4] == 0:
+                    # 槽位属于更早的周期：覆盖
+                    data[base] = bucket
+                    data[base + 1] = value
+                    data[base + 2] = value
+                    data[base + 3] = value
+                    data[base + 4] = 1
+                else:
+                    if value < data[base + 1]:
+                        data[base + 1] = value
+                    if value > data[base + 2]:
+                        data[base + 2] = value
+                    data[base + 3] += value
+                    data[base + 4] += 1
+
+    def record_sample(self, snapshot: Dict) -> None:
+        """
+        采样器回调：把一次系统采样写入各指标
+
+        网络速率 (KB/s) 由本存储自己维护的上一次计数器计算，只依赖采样序列。
+        """
+        ts = snapshot['timestamp']
+        self.add('cpu', snapshot['cpu'], ts)
+        self.add('memory', snapshot['memory']['percent'], ts)
+        self.add('disk', snapshot['disk']['percent'], ts)
+
+        interface = Config.VPN_INTERFACE
+        net = snapshot['network'].get(interface)
+        if net is not None:
+            current = (interface, snapshot['monotonic'], net['bytes_sent'], net['bytes_recv'])
+            last = self._last_net
+            self._last_net = current
+            # 切换监控网卡后重新建立基准
+            if last is not None and last[0] == interface and current[1] > last[1]:
+                elapsed = current[1] - last[1]
+                sent = current[2] - last[2]
+                recv = current[3] - last[3]
+                # 计数器回绕 / 网卡重建时跳过该点
+                if sent >= 0 and recv >= 0:
+                    self.add('net_up', sent / elapsed / 1024, ts)
+                    self.add('net_down', recv / elapsed / 1024, ts)
+        else:
+            self._last_net = None
+
+        if time.monotonic() - self._last_flush >= Config.METRICS_HISTORY_FLUSH_INTERVAL:
+            self.flush()
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+    @staticmethod
+    def pick_resolution(range_seconds: int) -> int:
+        """选择能覆盖该时间范围的最细精度，返回 TIERS 下标"""
+        for tier_idx, (resolution, slots) in enumerate(TIERS):
+            if range_seconds <= resolution * slots:
+                return tier_idx
+        return len(TIERS) - 1
+
+    def query(self, metric: str, range_seconds: int, now: float = None) -> Dict:
+        """
+        查询某指标最近 range_seconds 的历史
+
+        Returns:
+            dict: {'metric', 'resolution', 'points': [{'ts', 'min', 'avg', 'max'}, ...]}
+        """
+        if metric not in METRICS:
+            raise KeyError(metric)
+        if now is None:
+            now = time.time()
+
+        metric_idx = METRICS.index(metric)
+        tier_idx = self.pick_resolution(range_seconds)
+        resolution, slots = TIERS[tier_idx]
+        range_seconds = min(range_seconds, resolution * slots)
+
+        end = (int(now) // resolution) * resolution
+        start = end - range_seconds + resolution
+        data = self.data
+        points = []
+        with self.lock:
+            for bucket in range(start, end + 1, resolution):
+                base = self._base(metric_idx, tier_idx, (bucket // resolution) % slots)
+                if data[base] != bucket or data[base + 4] == 0:
+                    continue
+                points.append({
+                    'ts': bucket,
+                    'min': round(data[base + 1], 2),
+                    'avg': round(data[base + 3] / data[base + 4], 2),
+                    'max': round(data[base + 2], 2),
+                })
+
+        return {
+            'metric': metric,
+            'resolution': resolution,
+            'range': range_seconds,
+            'points': points
+        }
+
+
+# 进程级单例
+_store: Optional[TimeSeriesStore] = None
+_store_lock = threading.Lock()
+
+
+def get_history() -> TimeSeriesStore:
+    """获取进程级时序存储单例（首次调用时映射文件）"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = TimeSeriesStore()
+        return _store
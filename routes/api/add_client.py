@@ -177,16 +177,15 @@ def add_client():
             disabled=False,
             vpn_ip="",
             real_ip="",
-            duration="",
             group_id=group_id  # 🆕 设置用户组
         )
 
         db.session.add(new_client)
         db.session.commit()
 
-        # 🆕 导出 TC 配置（更新限速规则）
-        from utils.tc_config_exporter import export_tc_config
-        export_tc_config()
+        # 🆕 导出 TC 配置（更新限速规则，去抖动合并写入）
+        from utils.tc_config_exporter import request_tc_export
+        request_tc_export()
 
     except IntegrityError:
         db.session.rollback()
@@ -5,48 +5,75 @@
 from flask import Blueprint, request, jsonify
 from flask_login import login_required, current_user
 from models import db, ClientGroup, Client, Role
-from routes.helpers import role_required
+from routes.helpers import role_required, conditional_get
 from utils.api_response import api_success, api_error
-from utils.tc_config_exporter import export_tc_config
-from openvpn_monitor.tc_hotreload import notify_user_update, notify_role_update
+from utils.tc_config_exporter import apply_tc_changes, request_tc_export
+from utils.data_version import current_data_version
+from utils.rate_scheduler import get_rate_scheduler
+from utils.traffic_quota import ACTIONS, PERIODS, get_quota_enforcer, parse_quota
+from openvpn_monitor.tc_engine import LEAF_QDISCS, parse_rate
+from sqlalchemy import func, case
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
 client_groups_bp = Blueprint('client_groups', __name__)
 
+# ==================== 用户组汇总（聚合查询 + 缓存） ====================
+# 🆕 按数据版本号缓存：成员变化、在线状态变化都会递增版本号使缓存失效
+_summary_cache = {'version': None, 'groups': None}
+_summary_lock = threading.Lock()
+
+
+def get_group_summaries():
+    """
+    一次聚合查询获取所有用户组及其成员 / 在线 / 禁用数量
+
+    client_groups LEFT JOIN clients GROUP BY，无论多少个组都只有一次数据库往返。
+
+    Returns:
+        list[dict]: 与 ClientGroup.to_dict() 相同的字段，另含 online_count / disabled_count
+    """
+    version = current_data_version()
+    with _summary_lock:
+        if _summary_cache['version'] == version:
+            return _summary_cache['groups']
+
+    rows = (
+        db.session.query(
+            ClientGroup,
+            func.count(Client.id),
+            func.coalesce(func.sum(case((Client.online.is_(True), 1), else_=0)), 0),
+            func.coalesce(func.sum(case((Client.disabled.is_(True), 1), else_=0)), 0),
+        )
+        .outerjoin(Client, Client.group_id == ClientGroup.id)
+        .group_by(ClientGroup.id)
+        .order_by(ClientGroup.id)
+        .all()
+    )
+
+    groups = []
+    for group, client_count, online_count, disabled_count in rows:
+        item = group.to_dict(client_count=client_count)
+        item['online_count'] = int(online_count)
+        item['disabled_count'] = int(disabled_count)
+        groups.append(item)
+
+    with _summary_lock:
+        _summary_cache['version'] = version
+        _summary_cache['groups'] = groups
+    return groups
+
+
 # ==================== 获取所有用户组 ====================
 @client_groups_bp.route('/api/client_groups', methods=['GET'])
 @login_required
+@conditional_get()
 def get_client_groups():
     """获取所有用户组列表"""
     try:
-        # ⭐ 最彻底的方式：关闭当前会话，强制全新查询
-        db.session.close()
-        
-        # 重新查询所有组
-        groups = ClientGroup.query.all()
-        
-        # ⭐ 关键：强制重新加载每个组的 clients 关联
-        result = []
-        for group in groups:
-            # 强制刷新组对象
-            db.session.refresh(group)
-            
-            # ⭐ 关键：显式查询该组的客户端数量（完全绕过缓存）
-            count = db.session.query(Client).filter_by(group_id=group.id).count()
-            
-            result.append({
-                'id': group.id,
-                'name': group.name,
-                'description': group.description,
-                'upload_rate': group.upload_rate,
-                'download_rate': group.download_rate,
-                'is_default': group.name.lower() == 'default',
-                'client_count': count,  # 使用显式查询的计数
-                'created_at': group.created_at.isoformat() if group.created_at else None
-            })
-        
+        result = get_group_summaries()
         return api_success({
             'groups': result,
             'total': len(result)
@@ -68,7 +95,21 @@ def create_client_group():
         "name": "VIP用户组",
         "description": "VIP客户端用户组",
         "upload_rate": "20Mbit",
-        "download_rate": "50Mbit"
+        "download_rate": "50Mbit",
+        // 🆕 可选：整组聚合限速（两级 HTB，空闲带宽可借用到 ceil）
+        "aggregate_upload_rate": "50Mbit",
+        "aggregate_upload_ceil": "80Mbit",
+        "aggregate_download_rate": "100Mbit",
+        "aggregate_download_ceil": "200Mbit",
+        "priority": 4,
+        // 🆕 可选：成员 class 的叶子队列与 burst，不传使用全局默认
+        "leaf_qdisc": "fq_codel",
+        "burst_ms": 10,
+        // 🆕 可选：每个成员的流量配额（上下行合计），超额后降速或禁用
+        "quota": "50GB",
+        "quota_period": "month",          // day / month
+        "quota_action": "throttle",       // throttle / disable
+        "quota_throttle_rate": "512kbit"  // 降速后的速率，不传使用全局默认
     }
     """
     try:
@@ -93,20 +134,38 @@ def create_client_group():
         
         if not validate_rate_format(download_rate):
             return api_error('下行速率格式无效，应为数字+单位(如：50Mbit)')
+
+        aggregate, error = parse_group_aggregate(data)
+        if error:
+            return api_error(error)
+
+        queue, error = parse_group_queue(data)
+        if error:
+            return api_error(error)
+
+        quota, error = parse_group_quota(data)
+        if error:
+            return api_error(error)
         
         # 创建用户组
         group = ClientGroup(
             name=name,
             description=description,
             upload_rate=upload_rate,
-            download_rate=download_rate
+            download_rate=download_rate,
+            **aggregate,
+            **queue,
+            **quota
         )
         
         db.session.add(group)
         db.session.commit()
+
+        if group.quota_bytes:
+            get_quota_enforcer().reload()
         
-        # 🆕 导出 TC 配置
-        export_tc_config()
+        # 🆕 导出 TC 配置（去抖动合并写入）
+        request_tc_export()
         
         logger.info(f"用户组创建成功: {name} (上行:{upload_rate}, 下行:{download_rate})")
         return api_success(
@@ -131,8 +190,19 @@ def update_client_group(group_id):
         "name": "新名称",
         "description": "新描述",
         "upload_rate": "10Mbit",
-        "download_rate": "30Mbit"
+        "download_rate": "30Mbit",
+        "aggregate_upload_rate": "50Mbit",    // 🆕 整组聚合限速，传 null 取消
+        "aggregate_upload_ceil": "80Mbit",
+        "aggregate_download_rate": "100Mbit",
+        "aggregate_download_ceil": "200Mbit",
+        "priority": 4,
+        "leaf_qdisc": "cake",     // 🆕 成员叶子队列 fq_codel / cake / pfifo，传 null 恢复全局默认
+        "burst_ms": 20,           // 🆕 burst 折算毫秒数，传 null 恢复全局默认
+        "quota": "50GB",          // 🆕 成员流量配额，传 null 取消；quota_period / quota_action /
+                                  //    quota_throttle_rate 同创建
+        "wait": true              // 🆕 速率变化时等待守护进程确认生效（默认 true）
     }
+    响应中的 tc_apply 为生效结果: applied / failed / timeout / signaled
     """
     try:
         group = ClientGroup.query.get(group_id)
@@ -176,25 +246,63 @@ def update_client_group(group_id):
             if group.download_rate != download_rate:
                 rate_changed = True
             group.download_rate = download_rate
+
+        aggregate, error = parse_group_aggregate(data, group)
+        if error:
+            return api_error(error)
+        queue, error = parse_group_queue(data)
+        if error:
+            return api_error(error)
+        for field, value in {**aggregate, **queue}.items():
+            if getattr(group, field) != value:
+                rate_changed = True
+                setattr(group, field, value)
+
+        quota, error = parse_group_quota(data)
+        if error:
+            return api_error(error)
+        quota_changed = False
+        for field, value in quota.items():
+            if getattr(group, field) != value:
+                quota_changed = True
+                setattr(group, field, value)
         
         db.session.commit()
-        
-        # 🆕 导出配置文件
-        export_tc_config()
-        
-        # 🆕 如果速率有变化，通知守护进程热更新
-        if rate_changed:
-            success = notify_role_update(group.name)
+
+        # 🆕 配额变化：重新评估成员（降低配额立即处理已超额的成员，取消 / 提高配额立即解除）
+        if quota_changed:
+            get_quota_enforcer().reload()
+        
+        # 🆕 导出配置文件；速率有变化时同步等待守护进程确认生效
+        result = None
+        message = f'用户组 "{group.name}" 更新成功'
+        if rate_changed and data.get('wait', True):
+            result = apply_tc_changes(role_updates=[group.name])
             logger.info(
                 f"用户组 {group.name} 速率已更新: "
                 f"{old_upload}/{old_download} → {group.upload_rate}/{group.download_rate}，"
-                f"热更新{'成功' if success else '失败'}"
+                f"生效结果 {result['status']} ({result.get('latency_ms')} ms)"
             )
+            if result['status'] == 'applied':
+                message += f"，限速已生效（{result['latency_ms']} ms）"
+            elif result['status'] == 'signaled':
+                message += '，限速变更已通知守护进程'
+            else:
+                message += f"，但限速未确认生效（{result['status']}）"
+        elif rate_changed:
+            request_tc_export(role_updates=[group.name])
+            logger.info(
+                f"用户组 {group.name} 速率已更新: "
+                f"{old_upload}/{old_download} → {group.upload_rate}/{group.download_rate}，"
+                "热更新已排队"
+            )
+        else:
+            request_tc_export()
         
         logger.info(f"用户组更新成功: {group.name}")
         return api_success(
-            {'group': group.to_dict()},
-            message=f'用户组 "{group.name}" 更新成功'
+            {'group': group.to_dict(), 'tc_apply': result},
+            message=message
         )
     except Exception as e:
         db.session.rollback()
@@ -223,8 +331,13 @@ def delete_client_group(group_id):
         db.session.delete(group)
         db.session.commit()
         
+        # 🆕 该组的限速时段已级联删除
+        get_rate_scheduler().reload()
+        # 🆕 原成员的配额限制随之解除
+        get_quota_enforcer().reload()
+
         # 🆕 导出更新后的配置
-        export_tc_config()
+        request_tc_export()
         
         logger.info(f"用户组删除成功: {group_name}")
         return api_success(
@@ -275,18 +388,17 @@ def add_group_member(group_id):
 
         client.group_id = group_id
         db.session.commit()
+        _recheck_quota()
         
-        # 🆕 导出配置
-        export_tc_config()
-        
-        # 🆕 如果客户端在线，发送热更新信号
+        # 🆕 导出配置；客户端在线时在写入后发送热更新信号
         if client.online and client.vpn_ip:
-            success = notify_user_update(client.name, client.vpn_ip)
+            request_tc_export(user_updates=[(client.name, client.vpn_ip)])
             logger.info(
                 f"客户端 {client_name} 添加到用户组 {group.name}，"
-                f"热更新{'成功' if success else '失败'}"
+                "热更新已排队"
             )
         else:
+            request_tc_export()
             logger.info(f"客户端 {client_name} 添加到用户组 {group.name}（离线）")
         
         return api_success(
@@ -331,18 +443,17 @@ def remove_group_member(group_id):
         
         client.group_id = None
         db.session.commit()
+        _recheck_quota()
         
-        # 🆕 导出配置
-        export_tc_config()
-        
-        # 🆕 如果客户端在线，发送热更新信号（移除限速）
+        # 🆕 导出配置；客户端在线时在写入后发送热更新信号（移除限速）
         if client.online and client.vpn_ip:
-            success = notify_user_update(client.name, client.vpn_ip)
+            request_tc_export(user_updates=[(client.name, client.vpn_ip)])
             logger.info(
                 f"客户端 {client_name} 从用户组 {group.name} 移除，"
-                f"热更新{'成功' if success else '失败'}"
+                "热更新已排队"
             )
         else:
+            request_tc_export()
             logger.info(f"客户端 {client_name} 从用户组 {group.name} 移除（离线）")
         
         return api_success(
@@ -415,18 +526,17 @@ def modify_client_group():
             old_group_name = client.group.name if client.group else '无'
             client.group_id = None
             db.session.commit()
+            _recheck_quota()
             
-            # 🆕 导出配置文件
-            export_tc_config()
-            
-            # 🆕 如果客户端在线，发送热更新信号
+            # 🆕 导出配置；客户端在线时在写入后发送热更新信号
             if client.online and client.vpn_ip:
-                success = notify_user_update(client.name, client.vpn_ip)
+                request_tc_export(user_updates=[(client.name, client.vpn_ip)])
                 logger.info(
                     f"客户端 {client_name} 从用户组 {old_group_name} 移出，"
-                    f"热更新{'成功' if success else '失败'}"
+                    "热更新已排队"
                 )
             else:
+                request_tc_export()
                 logger.info(f"客户端 {client_name} 从用户组 {old_group_name} 移出（离线）")
             
             return api_success(
@@ -448,18 +558,17 @@ def modify_client_group():
         old_group_name = client.group.name if client.group else '无'
         client.group_id = group.id
         db.session.commit()
+        _recheck_quota()
         
-        # 🆕 导出配置文件
-        export_tc_config()
-        
-        # 🆕 如果客户端在线，发送热更新信号
+        # 🆕 导出配置；客户端在线时在写入后发送热更新信号
         if client.online and client.vpn_ip:
-            success = notify_user_update(client.name, client.vpn_ip)
+            request_tc_export(user_updates=[(client.name, client.vpn_ip)])
             logger.info(
                 f"客户端 {client_name} 从 {old_group_name} 移动到 {group_name}，"
-                f"热更新{'成功' if success else '失败'}"
+                "热更新已排队"
             )
         else:
+            request_tc_export()
             logger.info(f"客户端 {client_name} 从 {old_group_name} 移动到 {group_name}（离线）")
         
         return api_success(
@@ -473,9 +582,151 @@ def modify_client_group():
         return api_error(f'修改用户组失败: {str(e)}')
     
     
+# ==================== 🆕 批量调整用户组成员 ====================
+BULK_ACTIONS = ('move', 'assign', 'unassign')
+BULK_CHUNK = 500    # 单条 UPDATE 的 IN 列表上限
+
+
+def _recheck_quota():
+    """
+    🆕 成员变更后重新评估流量配额
+
+    配额引擎只在客户端产生流量增量时检查，被禁用的客户端不再产生增量：
+    移出 / 换组后需要立即解除原配额组的限制，移入已超额的配额组时立即处理
+    """
+    try:
+        get_quota_enforcer().reload()
+    except Exception as e:
+        # 成员变更已提交，配额评估失败不影响本次请求
+        logger.error(f"成员变更后重新评估流量配额失败: {str(e)}")
+
+
+def _pattern_to_like(pattern):
+    """把通配符模式 (* / ?) 转换为 LIKE 模式，其余字符按字面匹配"""
+    escaped = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped.replace('*', '%').replace('?', '_')
+
+
+@client_groups_bp.route('/api/client_groups/bulk_membership', methods=['POST'])
+@login_required
+@role_required([Role.ADMIN, Role.SUPER_ADMIN])
+def bulk_group_membership():
+    """
+    批量移动 / 分配 / 移出用户组成员
+
+    所有变更在一个事务内完成，只导出一次 TC 配置，
+    并用一条合并的热更新信号覆盖全部受影响的在线客户端。
+
+    请求体：
+    {
+        "action": "move" | "assign" | "unassign",
+        "target_group_id": 3,            // move / assign 必填
+        "clients": ["client_001", ...],  // 选择方式（可组合，取交集）：名称列表
+        "pattern": "office-*",           //   名称通配符（* 任意字符，? 单个字符）
+        "source_group_id": 2             //   当前所属用户组
+    }
+
+    - move: 无论当前属于哪个组，都移动到目标组
+    - assign: 只处理未分组的客户端，已属于其他组的跳过（与 add_member 规则一致）
+    - unassign: 移出用户组
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        action = (data.get('action') or '').strip().lower()
+        if action not in BULK_ACTIONS:
+            return api_error(f'无效的操作类型，可选: {", ".join(BULK_ACTIONS)}')
+
+        names = data.get('clients')
+        pattern = (data.get('pattern') or '').strip()
+        source_group_id = data.get('source_group_id')
+
+        if names is not None and not isinstance(names, list):
+            return api_error('clients 必须是客户端名称列表')
+        names = [str(n).strip() for n in (names or []) if str(n).strip()]
+        if not names and not pattern and source_group_id is None:
+            return api_error('请至少指定一种选择方式: clients / pattern / source_group_id')
+
+        target = None
+        if action in ('move', 'assign'):
+            target_id = data.get('target_group_id')
+            target = db.session.get(ClientGroup, target_id) if target_id is not None else None
+            if not target:
+                return api_error('目标用户组不存在', code=404)
+
+        if source_group_id is not None and not db.session.get(ClientGroup, source_group_id):
+            return api_error('源用户组不存在', code=404)
+
+        # ---------- 选出受影响的客户端（只取需要的列） ----------
+        query = db.session.query(
+            Client.id, Client.name, Client.group_id, Client.online, Client.vpn_ip
+        )
+        if names:
+            query = query.filter(Client.name.in_(names))
+        if pattern:
+            query = query.filter(Client.name.like(_pattern_to_like(pattern), escape='\\'))
+        if source_group_id is not None:
+            query = query.filter(Client.group_id == source_group_id)
+
+        selected = query.all()
+        missing = sorted(set(names) - {row.name for row in selected}) if names else []
+
+        skipped = []
+        if action == 'unassign':
+            affected = [row for row in selected if row.group_id is not None]
+        elif action == 'assign':
+            affected = [row for row in selected if row.group_id is None]
+            skipped = [row.name for row in selected if row.group_id not in (None, target.id)]
+        else:
+            affected = [row for row in selected if row.group_id != target.id]
+
+        new_group_id = target.id if target else None
+
+        # ---------- 一个事务内批量更新 ----------
+        ids = [row.id for row in affected]
+        for start in range(0, len(ids), BULK_CHUNK):
+            chunk = ids[start:start + BULK_CHUNK]
+            Client.query.filter(Client.id.in_(chunk)).update(
+                {Client.group_id: new_group_id}, synchronize_session=False
+            )
+        db.session.commit()
+        if affected:
+            _recheck_quota()
+
+        notified = 0
+        if affected:
+            # 🆕 只导出一次配置，写入后合并为一条热更新信号
+            online = [(row.name, row.vpn_ip) for row in affected if row.online and row.vpn_ip]
+            request_tc_export(user_updates=online)
+            notified = len(online)
+
+        target_name = target.name if target else '无'
+        logger.info(
+            f"批量{action}: 选中 {len(selected)} 个，更新 {len(affected)} 个 → {target_name}，"
+            f"热更新 {notified} 个在线客户端"
+        )
+
+        return api_success({
+            'action': action,
+            'target_group_id': new_group_id,
+            'matched': len(selected),
+            'updated': len(affected),
+            'notified': notified,
+            'skipped': skipped[:100],           # 已属于其他组（assign）
+            'skipped_count': len(skipped),
+            'missing': missing[:100],           # clients 列表中不存在的名称
+            'missing_count': len(missing),
+        }, message=f'已更新 {len(affected)} 个客户端的用户组')
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"批量调整用户组失败: {str(e)}")
+        return api_error(f'批量调整用户组失败: {str(e)}')
+
+
 # ==================== 未分组客户端 ====================
 @client_groups_bp.route('/api/clients/unassigned', methods=['GET'])
 @login_required
+@conditional_get()
 def get_unassigned_clients():
     """获取所有未分组的客户端"""
     clients = Client.query.filter(Client.group_id.is_(None)).all()
@@ -487,6 +738,127 @@ def get_unassigned_clients():
     })
 
 # ==================== 辅助函数 ====================
+AGGREGATE_FIELDS = (
+    'aggregate_upload_rate', 'aggregate_upload_ceil',
+    'aggregate_download_rate', 'aggregate_download_ceil',
+)
+
+
+def parse_group_aggregate(data, group=None):
+    """
+    🆕 解析并校验用户组聚合限速参数
+
+    - 上下行保证速率必须同时设置或同时为空（为空 = 不建立用户组类）
+    - ceil 可为空（等于保证速率），不能小于保证速率
+    - priority 为 0 ~ 7
+
+    Args:
+        data: 请求体
+        group: 更新时传入现有用户组，未提交的字段沿用现有值
+
+    Returns:
+        tuple: (需要写入的字段 dict, 错误信息或 None)
+    """
+    values = {}
+    for field in AGGREGATE_FIELDS:
+        if field in data:
+            value = (data[field] or '').strip() or None
+            if value is not None and not validate_rate_format(value):
+                return None, f'{field} 格式无效，应为数字+单位(如：50Mbit)'
+            values[field] = value
+    if 'priority' in data:
+        try:
+            priority = int(data['priority'])
+        except (TypeError, ValueError):
+            priority = -1
+        if not 0 <= priority <= 7:
+            return None, 'priority 必须是 0 ~ 7 的整数'
+        values['priority'] = priority
+
+    merged = {
+        field: values.get(field, getattr(group, field) if group is not None else None)
+        for field in AGGREGATE_FIELDS
+    }
+    if bool(merged['aggregate_upload_rate']) != bool(merged['aggregate_download_rate']):
+        return None, '整组上行与下行保证速率需同时设置或同时清空'
+    for direction in ('upload', 'download'):
+        rate = merged[f'aggregate_{direction}_rate']
+        ceil = merged[f'aggregate_{direction}_ceil']
+        if ceil and not rate:
+            return None, f'设置 aggregate_{direction}_ceil 前需先设置 aggregate_{direction}_rate'
+        if ceil and parse_rate(ceil) < parse_rate(rate):
+            return None, f'aggregate_{direction}_ceil 不能小于 aggregate_{direction}_rate'
+    return values, None
+
+
+def parse_group_queue(data):
+    """
+    🆕 解析并校验成员 class 的队列参数
+
+    - leaf_qdisc 为 fq_codel / cake / pfifo，为空表示使用 Config.TC_LEAF_QDISC
+    - burst_ms 为 1 ~ 1000 的整数，为空表示使用 Config.TC_BURST_MS
+
+    Returns:
+        tuple: (需要写入的字段 dict, 错误信息或 None)
+    """
+    values = {}
+    if 'leaf_qdisc' in data:
+        leaf = (data['leaf_qdisc'] or '').strip() or None
+        if leaf is not None and leaf not in LEAF_QDISCS:
+            return None, f"leaf_qdisc 必须是 {' / '.join(LEAF_QDISCS)} 之一"
+        values['leaf_qdisc'] = leaf
+    if 'burst_ms' in data:
+        burst_ms = data['burst_ms']
+        if burst_ms not in (None, ''):
+            try:
+                burst_ms = int(burst_ms)
+            except (TypeError, ValueError):
+                burst_ms = 0
+            if not 1 <= burst_ms <= 1000:
+                return None, 'burst_ms 必须是 1 ~ 1000 的整数'
+        values['burst_ms'] = burst_ms or None
+    return values, None
+
+
+def parse_group_quota(data):
+    """
+    🆕 解析并校验成员流量配额
+
+    - quota 为字节数或 "50GB" 格式（1024 进制），为空表示不限
+    - quota_period 为 day / month，quota_action 为 throttle / disable
+    - quota_throttle_rate 为速率格式，为空表示使用 Config.TRAFFIC_QUOTA_THROTTLE_RATE
+
+    Returns:
+        tuple: (需要写入的字段 dict, 错误信息或 None)
+    """
+    values = {}
+    if 'quota' in data:
+        quota = data['quota']
+        if quota in (None, ''):
+            values['quota_bytes'] = None
+        else:
+            try:
+                values['quota_bytes'] = parse_quota(quota)
+            except ValueError as e:
+                return None, str(e)
+    if 'quota_period' in data:
+        period = (data['quota_period'] or 'month').strip()
+        if period not in PERIODS:
+            return None, f"quota_period 必须是 {' / '.join(PERIODS)} 之一"
+        values['quota_period'] = period
+    if 'quota_action' in data:
+        action = (data['quota_action'] or 'throttle').strip()
+        if action not in ACTIONS:
+            return None, f"quota_action 必须是 {' / '.join(ACTIONS)} 之一"
+        values['quota_action'] = action
+    if 'quota_throttle_rate' in data:
+        rate = (data['quota_throttle_rate'] or '').strip() or None
+        if rate is not None and not validate_rate_format(rate):
+            return None, '降速速率格式无效，应为数字+单位(如：512kbit)'
+        values['quota_throttle_rate'] = rate
+    return values, None
+
+
 def validate_rate_format(rate_str):
     """
     验证速率格式是否正确
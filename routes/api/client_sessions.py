@@ -0,0 +1,126 @@
+"""
+🆕 客户端连接会话历史 API
+何时连接、连接多久、从哪个 IP 连接——按客户端或按时间段查询，
+数据来自 utils.session_history 维护的 client_sessions 表
+"""
+from datetime import datetime, timedelta
+from flask import Blueprint, request
+from flask_login import login_required
+from sqlalchemy import func
+from models import db, Client, ClientSession, Role
+from routes.helpers import role_required
+from utils.api_response import api_success, api_error
+from utils.session_history import get_session_recorder, utc_naive
+import logging
+
+logger = logging.getLogger(__name__)
+
+client_sessions_bp = Blueprint('client_sessions', __name__)
+
+MAX_LIMIT = 500
+
+
+def _parse_range():
+    """
+    解析 start / end（ISO 时间，按服务器本地时间解释）与 limit
+
+    Returns:
+        tuple: (start, end, limit, 错误信息或 None)；start / end 为 UTC 时间或 None
+    """
+    values = {}
+    for field in ('start', 'end'):
+        text = request.args.get(field)
+        if not text:
+            values[field] = None
+            continue
+        try:
+            moment = datetime.fromisoformat(text)
+        except ValueError:
+            return None, None, None, f'{field} 格式无效，应为 YYYY-MM-DD 或 YYYY-MM-DDTHH:MM'
+        values[field] = utc_naive(moment if moment.tzinfo else moment.astimezone())
+    limit = request.args.get('limit', 50, type=int)
+    if not 1 <= limit <= MAX_LIMIT:
+        return None, None, None, f'limit 必须在 1 ~ {MAX_LIMIT} 之间'
+    return values['start'], values['end'], limit, None
+
+
+@client_sessions_bp.route('/api/clients/<int:client_id>/sessions', methods=['GET'])
+@login_required
+@role_required([Role.ADMIN, Role.SUPER_ADMIN])
+def get_client_sessions(client_id):
+    """
+    单个客户端的连接历史（最新在前）
+    查询参数:
+    - start / end: 连接开始时间范围（YYYY-MM-DD 或 YYYY-MM-DDTHH:MM，服务器本地时间）
+    - limit: 返回条数（1 ~ 500），默认 50
+    summary 为范围内的连接次数与总时长（不受 limit 影响）
+    """
+    try:
+        client = Client.query.get(client_id)
+        if not client:
+            return api_error('客户端不存在', code=404)
+        start, end, limit, error = _parse_range()
+        if error:
+            return api_error(error)
+
+        # 走索引 (client_name, started_at)
+        filters = [ClientSession.client_name == client.name]
+        if start is not None:
+            filters.append(ClientSession.started_at >= start)
+        if end is not None:
+            filters.append(ClientSession.started_at < end)
+
+        sessions = ClientSession.query.filter(*filters) \
+            .order_by(ClientSession.started_at.desc()).limit(limit).all()
+        count, total_duration = db.session.query(
+            func.count(ClientSession.id), func.coalesce(func.sum(ClientSession.duration_sec), 0)
+        ).filter(*filters).one()
+        return api_success({
+            'client': {'id': client.id, 'name': client.name},
+            'summary': {'sessions': count, 'total_duration_sec': total_duration},
+            'sessions': [s.to_dict() for s in sessions],
+        })
+    except Exception as e:
+        logger.error(f"获取连接历史失败: {str(e)}")
+        return api_error(f'获取连接历史失败: {str(e)}')
+
+
+@client_sessions_bp.route('/api/sessions', methods=['GET'])
+@login_required
+@role_required([Role.ADMIN, Role.SUPER_ADMIN])
+def list_sessions():
+    """
+    按时间段查询全部客户端的连接（最新在前）
+    查询参数:
+    - start / end: 连接开始时间范围，默认最近 24 小时
+    - real_ip: 只看来自该 IP 的连接
+    - online: 1 = 只看仍在线的会话
+    - limit: 返回条数（1 ~ 500），默认 50
+    """
+    try:
+        start, end, limit, error = _parse_range()
+        if error:
+            return api_error(error)
+        if start is None and end is None:
+            start = utc_naive(datetime.now().astimezone() - timedelta(hours=24))
+
+        # 走索引 started_at
+        query = ClientSession.query
+        if start is not None:
+            query = query.filter(ClientSession.started_at >= start)
+        if end is not None:
+            query = query.filter(ClientSession.started_at < end)
+        real_ip = (request.args.get('real_ip') or '').strip()
+        if real_ip:
+            query = query.filter(ClientSession.real_ip == real_ip)
+        if request.args.get('online') in ('1', 'true'):
+            query = query.filter(ClientSession.ended_at.is_(None))
+
+        sessions = query.order_by(ClientSession.started_at.desc()).limit(limit).all()
+        return api_success({
+            'sessions': [s.to_dict() for s in sessions],
+            'recorder': get_session_recorder().get_stats(),
+        })
+    except Exception as e:
+        logger.error(f"查询连接历史失败: {str(e)}")
+        return api_error(f'查询连接历史失败: {str(e)}')
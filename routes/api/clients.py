@@ -1,20 +1,25 @@
 # routes/api/clients.py
-import os
 import subprocess
-import socket
-import time
 from flask import jsonify, request
 from flask_login import login_required
 from . import api_bp
 from utils.api_response import api_success, api_error
-from utils.openvpn_utils import log_message
+from routes.helpers import CLIENT_SOURCE_FILES, conditional_get
+from utils.client_search import search_filter, ranked_search
+from utils.pagination import (
+    CursorError, count_cache, encode_cursor, keyset_paginate, parse_per_page
+)
+from utils.openvpn_mgmt import kill_client, write_ccd_disable
 from models import Client, db
 from datetime import datetime
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import asc
+from sqlalchemy import asc, desc
 
 PER_PAGE = 10
 
+# 🆕 /api/clients 支持的排序字段
+SORT_FIELDS = ('name', 'online_time')
+
 def client_to_dict(c):
     return {
         "id": c.id,
@@ -25,117 +30,107 @@ def client_to_dict(c):
         "disabled": bool(c.disabled),
         "vpn_ip": c.vpn_ip,
         "real_ip": c.real_ip,
+        "connected_since": c.connected_since.isoformat() if c.connected_since else None,
+        "duration_sec": c.online_seconds(),
         "duration": c.duration
     }
 
 # ----------------- 查询分页 -----------------
 @api_bp.route('/clients', methods=['GET'])
 @login_required
+# 在线时长在读取时计算：ETag 同时取决于 status.log 等来源文件
+@conditional_get(*CLIENT_SOURCE_FILES)
 def api_clients():
+    """
+    客户端分页列表（按名称升序）
+
+    🆕 键集分页：?after=<next_cursor> 下一页，?before=<prev_cursor> 上一页，
+    ?last=1 最后一页，?per_page=N 每页数量；仍兼容 ?page=N（OFFSET）
+    🆕 ?sort=online_time 按在线时长排序（?order=desc 最久在前，默认；asc 最短在前），
+    离线客户端排在最后；该排序使用 ?page=N 分页
+    """
     page = request.args.get('page', 1, type=int)
     q = request.args.get('q', '', type=str).strip().lower()
-
-    query = Client.query.order_by(asc(Client.name))
+    per_page = parse_per_page(request.args.get('per_page'), PER_PAGE)
+    after = request.args.get('after') or None
+    before = request.args.get('before') or None
+    last = request.args.get('last') == '1'
+    sort = request.args.get('sort', 'name')
+    order = request.args.get('order', 'desc')
+    if sort not in SORT_FIELDS:
+        return api_error(f"不支持的排序字段: {sort}", code=400)
+    if order not in ('asc', 'desc'):
+        return api_error(f"不支持的排序方向: {order}", code=400)
+
+    query = Client.query
     if q:
-        query = query.filter(Client.name.ilike(f"%{q}%"))
-
-    total = query.count()
-    total_pages = (total + PER_PAGE - 1) // PER_PAGE
-    clients = query.offset((page-1)*PER_PAGE).limit(PER_PAGE).all()
+        query = query.filter(search_filter(Client, q, columns=('name',)))
+
+    total = count_cache.get_or_count('api_clients', q, query)
+    total_pages = (total + per_page - 1) // per_page
+
+    if sort == 'online_time':
+        # 在线时长越长 = connected_since 越早（走 connected_since 索引）
+        since_order = asc(Client.connected_since) if order == 'desc' else desc(Client.connected_since)
+        clients = (
+            query
+            .order_by(desc(Client.online), since_order, asc(Client.name))
+            .offset((max(page, 1) - 1) * per_page)
+            .limit(per_page)
+            .all()
+        )
+        next_cursor = prev_cursor = None
+    elif after or before or last or page <= 1:
+        try:
+            result = keyset_paginate(
+                query, Client.name,
+                after=after, before=before, last=last,
+                per_page=per_page, total=total
+            )
+        except CursorError as e:
+            return api_error(str(e), code=400)
+        clients = result['items']
+        next_cursor, prev_cursor = result['next_cursor'], result['prev_cursor']
+        if last:
+            page = max(total_pages, 1)
+    else:
+        clients = query.order_by(asc(Client.name)).offset((page-1)*per_page).limit(per_page + 1).all()
+        has_next = len(clients) > per_page
+        clients = clients[:per_page]
+        next_cursor = encode_cursor(clients[-1].name) if has_next else None
+        prev_cursor = encode_cursor(clients[0].name) if clients else None
 
     data = {
         "clients": [client_to_dict(c) for c in clients],
         "page": page,
+        "per_page": per_page,
         "total_pages": total_pages,
         "total": total,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "sort": sort,
         "q": q
     }
     return api_success(data)
 
 
-RECV_CHUNK = 4096
+# ----------------- 排序搜索 -----------------
+@api_bp.route('/clients/search', methods=['GET'])
+@login_required
+@conditional_get()
+def api_clients_search():
+    """
+    客户端排序搜索（名称 / 描述 / 用户组名）
+
+    完全匹配 > 名称前缀匹配 > 相关度；?limit=N 返回条数（默认 20，最多 100）
+    """
+    q = request.args.get('q', '', type=str).strip().lower()
+    limit = parse_per_page(request.args.get('limit'), 20)
+    if not q:
+        return api_success({"clients": [], "q": q, "total": 0})
 
-def recv_all_until_end(sock, timeout=3.0):
-    sock.settimeout(timeout)
-    data = b''
-    while True:
-        try:
-            chunk = sock.recv(RECV_CHUNK)
-            if not chunk:
-                break
-            data += chunk
-            if b'\nEND' in data or data.endswith(b'END') or b'\r\nEND' in data:
-                break
-        except socket.timeout:
-            break
-    return data.decode('utf-8', errors='ignore')
-
-def parse_status_for_cids(status_text, common_name):
-    lines = status_text.splitlines()
-    header_cols = None
-    client_lines = []
-    for ln in lines:
-        if ln.startswith('HEADER,CLIENT_LIST'):
-            parts = ln.split(',')
-            header_cols = parts[2:]
-            continue
-        if ln.startswith('CLIENT_LIST,'):
-            client_lines.append(ln)
-
-    if header_cols:
-        low_headers = [h.strip().lower() for h in header_cols]
-        try:
-            idx_cn = low_headers.index('common name')
-        except ValueError:
-            idx_cn = 0
-        cid_idx = low_headers.index('client id') if 'client id' in low_headers else None
-        cids = []
-        for cl in client_lines:
-            parts = cl.split(',')[1:]
-            name = parts[idx_cn] if idx_cn < len(parts) else ''
-            cid = parts[cid_idx] if cid_idx is not None and cid_idx < len(parts) else None
-            if name == common_name:
-                if cid:
-                    cids.append(cid)
-                else:
-                    return []
-        return cids if cids else None
-    return None
-
-def send_and_recv(sock, cmd, wait=0.05, recv_timeout=2.0):
-    sock.sendall((cmd + "\n").encode('utf-8'))
-    time.sleep(wait)
-    return recv_all_until_end(sock, timeout=recv_timeout)
-
-def openvpn_client_kill(host, port, client_name, mgmt_password=None):
-    try:
-        with socket.create_connection((host, port), timeout=5) as s:
-            banner = s.recv(RECV_CHUNK).decode('utf-8', errors='ignore')
-            if mgmt_password:
-                s.sendall(f"password {mgmt_password}\n".encode())
-                time.sleep(0.05)
-                _ = recv_all_until_end(s, timeout=1.0)
-
-            raw_status = send_and_recv(s, "status 2", wait=0.05, recv_timeout=2.0)
-            parse_res = parse_status_for_cids(raw_status, client_name)
-
-            if parse_res is None:
-                resp = send_and_recv(s, f"kill {client_name}", wait=0.05, recv_timeout=2.0)
-                return True, f"未在状态中找到客户端 '{client_name}'。尝试使用 kill {client_name}。响应: {resp.strip()}"
-            elif isinstance(parse_res, list) and len(parse_res) == 0:
-                resp = send_and_recv(s, f"kill {client_name}", wait=0.05, recv_timeout=2.0)
-                return True, f"找到了 '{client_name}' 但未找到客户端 ID。尝试使用 kill {client_name}。响应: {resp.strip()}"
-            else:
-                cids = parse_res
-                results = []
-                for cid in cids:
-                    resp = send_and_recv(s, f"client-kill {cid}", wait=0.05, recv_timeout=2.0)
-                    results.append(f"client-kill {cid} 响应: {resp.strip()}")
-                return True, "成功踢出客户端。\n" + "\n".join(results)
-    except socket.error as e:
-        return False, f"无法连接到 OpenVPN 管理接口: {e}"
-    except Exception as e:
-        return False, f"踢出客户端时发生错误: {e}"
+    results = ranked_search(db.session, q, limit=limit)
+    return api_success({"clients": results, "q": q, "total": len(results)})
 
 
 # ---------------- API 禁用客户端接口 ----------------
@@ -152,29 +147,14 @@ def api_disable_client():
 
     # ---------- 1. 创建禁用文件 ----------
     try:
-        ccd_dir = '/etc/openvpn/ccd'
-        disable_file_path = os.path.join(ccd_dir, client_name)
-        os.makedirs(ccd_dir, exist_ok=True)
-
-        cmd = ['sudo', 'sh', '-c', f'echo "disable" > {disable_file_path}']
-        log_message(f"执行命令以禁用客户端:{' '.join(cmd)}")
-        subprocess.run(cmd, capture_output=True, text=True, check=True)
-
-        os.system(f"sudo chown root:root {disable_file_path}")
-        os.system(f"sudo chmod 644 {disable_file_path}")
-        log_message(f"禁用文件创建成功:{disable_file_path}")
-
+        write_ccd_disable(client_name)
     except subprocess.CalledProcessError as e:
         return api_error(f"创建禁用文件失败:{e.stderr}")
     except Exception as e:
         return api_error(f"创建禁用文件异常:{e}")
 
     # ---------- 2. 调用管理接口踢出客户端 ----------
-    host = os.environ.get('OPENVPN_MGMT_HOST', '127.0.0.1')
-    port = int(os.environ.get('OPENVPN_MGMT_PORT', 7505))
-    password = os.environ.get('OPENVPN_MGMT_PASSWORD')
-
-    success, kill_msg = openvpn_client_kill(host, port, client_name, mgmt_password=password)
+    success, kill_msg = kill_client(client_name)
 
     # ---------- 3. 更新数据库 ----------
     try:
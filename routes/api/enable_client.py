@@ -4,8 +4,7 @@ from routes.helpers import login_required
 from models import Client, db
 from utils.openvpn_utils import log_message
 from utils.api_response import api_success, api_error
-import os
-import subprocess
+from utils.openvpn_mgmt import remove_ccd_disable
 
 enable_client_bp = Blueprint('enable_client', __name__)
 
@@ -15,21 +14,8 @@ def enable_client(client_name):
     - 删除 CCD 禁用文件
     - 更新数据库: client.disabled = False
     """
-    ccd_dir = '/etc/openvpn/ccd'
-    disable_file_path = os.path.join(ccd_dir, client_name)
-    
     # 删除 CCD 禁用文件
-    if os.path.exists(disable_file_path):
-        try:
-            subprocess.run(
-                ['sudo', 'rm', '-f', disable_file_path],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            log_message(f"已删除客户端 {client_name} 的禁用文件")
-        except subprocess.CalledProcessError as e:
-            raise Exception(f"删除禁用文件失败: {e.stderr}")
+    remove_ccd_disable(client_name)
     
     # 更新数据库: client.disabled = False
     client = Client.query.filter_by(name=client_name).first()
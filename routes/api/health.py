@@ -97,14 +97,21 @@ def metrics():
     - 并发请求统计
     - 慢请求列表
     - 监控统计信息
+    - 🆕 TC 限速变更的端到端生效延迟（控制通道）
+    - 🆕 单写入者队列：任务数、组提交批次、排队 + 执行延迟、跨进程写锁等待
     
     Returns:
         JSON: {
             "concurrent": {...},
             "slow_requests": [...],
-            "monitor_stats": {...}
+            "monitor_stats": {...},
+            "tc_apply": {"counts": {...}, "latency_ms": {"p50", "p95", "max"}, ...},
+            "db_writer": {"jobs", "batches", "latency_ms": {"p50", "p99", "max"}, ...}
         }
     """
+    from openvpn_monitor.tc_control import get_apply_stats
+    from utils.db_writer import get_db_writer
+
     metrics_data = {}
     
     # 获取并发统计
@@ -120,6 +127,9 @@ def metrics():
             limit=20        # 最多返回 20 条
         )
         metrics_data['monitor_stats'] = request_monitor.get_stats()
+
+    metrics_data['tc_apply'] = get_apply_stats()
+    metrics_data['db_writer'] = get_db_writer().get_stats()
     
     return jsonify(metrics_data), 200
 
@@ -0,0 +1,215 @@
+"""
+🆕 用户组分时段限速 API
+为用户组配置工作时间 / 夜间 / 周末等时段速率，由 utils.rate_scheduler 在时段边界批量切换
+"""
+from flask import Blueprint, request
+from flask_login import login_required
+from models import db, ClientGroup, GroupRateSchedule, Role
+from routes.helpers import role_required
+from routes.api.client_groups import validate_rate_format
+from utils.api_response import api_success, api_error
+from utils.rate_scheduler import get_rate_scheduler, parse_clock, parse_days
+import logging
+
+logger = logging.getLogger(__name__)
+
+rate_schedules_bp = Blueprint('rate_schedules', __name__)
+
+
+def _apply_message(result):
+    """时段变更后的生效说明"""
+    if result is None:
+        return '，当前生效速率未变化'
+    if result['status'] == 'applied':
+        return f"，限速已生效（{result['latency_ms']} ms）"
+    if result['status'] == 'signaled':
+        return '，限速变更已通知守护进程'
+    return f"，但限速未确认生效（{result['status']}）"
+
+
+def _reschedule():
+    """重新加载时段并立即切换（时段正在生效且速率变化时）"""
+    scheduler = get_rate_scheduler()
+    scheduler.reload()
+    return scheduler.tick()
+
+
+def parse_schedule(data, schedule=None):
+    """
+    解析并校验时段参数
+
+    Args:
+        data: 请求体
+        schedule: 更新时传入现有时段，未提交的字段沿用现有值
+
+    Returns:
+        tuple: (需要写入的字段 dict, 错误信息或 None)
+    """
+    values = {}
+    if 'name' in data or schedule is None:
+        name = (data.get('name') or '').strip()
+        if not name:
+            return None, '时段名称不能为空'
+        if len(name) > 64:
+            return None, '时段名称不能超过 64 个字符'
+        values['name'] = name
+    if 'days' in data or schedule is None:
+        try:
+            values['days'] = ','.join(str(day) for day in parse_days(data.get('days', '1-7')))
+        except (TypeError, ValueError) as e:
+            return None, str(e)
+    for field in ('start_time', 'end_time'):
+        if field in data or schedule is None:
+            value = (data.get(field) or '').strip()
+            try:
+                minutes = parse_clock(value)
+            except ValueError as e:
+                return None, f'{field}: {e}'
+            values[field] = f'{minutes // 60:02d}:{minutes % 60:02d}'
+    for field, label in (('upload_rate', '上行'), ('download_rate', '下行')):
+        if field in data or schedule is None:
+            rate = (data.get(field) or '').strip()
+            if not validate_rate_format(rate):
+                return None, f'{label}速率格式无效，应为数字+单位(如：50Mbit)'
+            values[field] = rate
+    if 'enabled' in data:
+        values['enabled'] = bool(data['enabled'])
+    return values, None
+
+
+# ==================== 查询时段 ====================
+@rate_schedules_bp.route('/api/client_groups/<int:group_id>/schedules', methods=['GET'])
+@login_required
+@role_required([Role.ADMIN, Role.SUPER_ADMIN])
+def list_rate_schedules(group_id):
+    """用户组的全部时段；active 表示当前正在生效"""
+    group = ClientGroup.query.get(group_id)
+    if not group:
+        return api_error('用户组不存在', code=404)
+
+    schedules = GroupRateSchedule.query.filter_by(group_id=group_id) \
+        .order_by(GroupRateSchedule.start_time, GroupRateSchedule.id).all()
+    active_id = get_rate_scheduler().active_schedule_ids().get(group_id)
+    return api_success({
+        'group': {
+            'id': group.id,
+            'name': group.name,
+            'upload_rate': group.upload_rate,
+            'download_rate': group.download_rate,
+        },
+        'active_schedule_id': active_id,
+        'schedules': [dict(s.to_dict(), active=s.id == active_id) for s in schedules],
+    })
+
+
+# ==================== 创建时段 ====================
+@rate_schedules_bp.route('/api/client_groups/<int:group_id>/schedules', methods=['POST'])
+@login_required
+@role_required([Role.ADMIN, Role.SUPER_ADMIN])
+def create_rate_schedule(group_id):
+    """
+    为用户组添加时段
+    请求体：
+    {
+        "name": "工作时间",
+        "days": [1, 2, 3, 4, 5],      // 或 "1-5"；1 = 周一，7 = 周日，默认每天
+        "start_time": "09:00",        // 服务器本地时间
+        "end_time": "18:00",          // 早于 start_time 表示跨零点，相同表示全天
+        "upload_rate": "5Mbit",
+        "download_rate": "10Mbit",
+        "enabled": true
+    }
+    同一用户组多个时段同时生效时，开始时间最晚的优先
+    """
+    try:
+        group = ClientGroup.query.get(group_id)
+        if not group:
+            return api_error('用户组不存在', code=404)
+
+        values, error = parse_schedule(request.get_json(silent=True) or {})
+        if error:
+            return api_error(error)
+
+        schedule = GroupRateSchedule(group_id=group_id, **values)
+        db.session.add(schedule)
+        db.session.commit()
+
+        result = _reschedule()
+        logger.info(
+            f"限速时段创建成功: {group.name}/{schedule.name} "
+            f"{schedule.days} {schedule.start_time}-{schedule.end_time}"
+        )
+        return api_success(
+            {'schedule': schedule.to_dict(), 'tc_apply': result},
+            message=f'时段 "{schedule.name}" 创建成功' + _apply_message(result)
+        )
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"创建限速时段失败: {str(e)}")
+        return api_error(f'创建限速时段失败: {str(e)}')
+
+
+# ==================== 更新时段 ====================
+@rate_schedules_bp.route('/api/client_groups/<int:group_id>/schedules/<int:schedule_id>', methods=['PUT'])
+@login_required
+@role_required([Role.ADMIN, Role.SUPER_ADMIN])
+def update_rate_schedule(group_id, schedule_id):
+    """更新时段（字段同创建，只需提交要修改的字段）"""
+    try:
+        schedule = GroupRateSchedule.query.filter_by(id=schedule_id, group_id=group_id).first()
+        if not schedule:
+            return api_error('时段不存在', code=404)
+
+        values, error = parse_schedule(request.get_json(silent=True) or {}, schedule)
+        if error:
+            return api_error(error)
+        for field, value in values.items():
+            setattr(schedule, field, value)
+        db.session.commit()
+
+        result = _reschedule()
+        logger.info(f"限速时段更新成功: {schedule.name}")
+        return api_success(
+            {'schedule': schedule.to_dict(), 'tc_apply': result},
+            message=f'时段 "{schedule.name}" 更新成功' + _apply_message(result)
+        )
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"更新限速时段失败: {str(e)}")
+        return api_error(f'更新限速时段失败: {str(e)}')
+
+
+# ==================== 删除时段 ====================
+@rate_schedules_bp.route('/api/client_groups/<int:group_id>/schedules/<int:schedule_id>', methods=['DELETE'])
+@login_required
+@role_required([Role.ADMIN, Role.SUPER_ADMIN])
+def delete_rate_schedule(group_id, schedule_id):
+    """删除时段；正在生效时立即恢复为其他时段或用户组基础速率"""
+    try:
+        schedule = GroupRateSchedule.query.filter_by(id=schedule_id, group_id=group_id).first()
+        if not schedule:
+            return api_error('时段不存在', code=404)
+
+        name = schedule.name
+        db.session.delete(schedule)
+        db.session.commit()
+
+        result = _reschedule()
+        logger.info(f"限速时段删除成功: {name}")
+        return api_success(
+            {'tc_apply': result},
+            message=f'时段 "{name}" 已删除' + _apply_message(result)
+        )
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"删除限速时段失败: {str(e)}")
+        return api_error(f'删除限速时段失败: {str(e)}')
+
+
+# ==================== 调度器状态 ====================
+@rate_schedules_bp.route('/api/rate_schedules/status', methods=['GET'])
+@login_required
+@role_required([Role.ADMIN, Role.SUPER_ADMIN])
+def get_rate_schedule_status():
+    """下一次切换时间、最近一次切换的用户组与生效结果"""
+    return api_success(get_rate_scheduler().get_stats())
@@ -0,0 +1,116 @@
+"""
+🆕 TC 限速实时状态 API
+展示引擎已应用的限速（classid / 速率）与每个客户端的实时吞吐、丢包率，
+以及按上行 / 下行 / 丢包排行的 Top-N 客户端
+"""
+from flask import Blueprint, request
+from flask_login import login_required
+from models import Role
+from routes.helpers import role_required
+from utils.api_response import api_success, api_error
+from openvpn_monitor.tc_state import get_tc_state
+from openvpn_monitor.client_rates import METRICS, top_consumers
+from openvpn_monitor.config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+tc_state_bp = Blueprint('tc_state', __name__)
+
+# 允许的排序字段 → 排序键
+_SORT_KEYS = {
+    'ip': lambda c: tuple(int(part) for part in c['ip'].split('.')),
+    'user': lambda c: c['user'] or '',
+    'up': lambda c: -(c['up']['bps'] or 0),
+    'down': lambda c: -(c['down']['bps'] or 0),
+    'drops': lambda c: -((c['up']['drops_per_s'] or 0) + (c['down']['drops_per_s'] or 0)),
+}
+
+
+@tc_state_bp.route('/api/tc/state', methods=['GET'])
+@login_required
+@role_required([Role.ADMIN, Role.SUPER_ADMIN])
+def get_tc_shaping_state():
+    """
+    当前限速状态与每客户端实时速率
+    查询参数:
+    - window: 速率计算窗口（秒），默认 Config.TC_STATE_WINDOW
+    - throttled: 1 = 只返回正在被限速（接近上限或有丢包）的客户端
+    - q: 按用户名 / IP / 用户组过滤（子串）
+    - sort: ip / user / up / down / drops，默认 ip
+    """
+    try:
+        window = request.args.get('window', type=float)
+        if window is not None and not 0 < window <= 3600:
+            return api_error('window 必须在 0 ~ 3600 秒之间')
+        sort = request.args.get('sort', 'ip')
+        if sort not in _SORT_KEYS:
+            return api_error(f'不支持的排序字段: {sort}')
+
+        state = get_tc_state().client_rates(window)
+        if state is None:
+            return api_error('TC 引擎尚未写出状态快照（引擎未运行或仍在使用旧守护脚本）', code=503)
+
+        clients = state['clients']
+        throttled_count = sum(1 for c in clients if c['throttled'])
+        if request.args.get('throttled') in ('1', 'true'):
+            clients = [c for c in clients if c['throttled']]
+        q = (request.args.get('q') or '').strip().lower()
+        if q:
+            clients = [
+                c for c in clients
+                if q in c['ip'] or q in (c['user'] or '').lower() or q in (c['group'] or '').lower()
+            ]
+        clients.sort(key=_SORT_KEYS[sort])
+
+        meta = state['meta']
+        return api_success({
+            'timestamp': state['timestamp'],
+            'age': state['age'],
+            'stale': state['stale'],
+            'window': state['window'],
+            'layout': meta.get('layout'),
+            'devices': meta.get('devices'),
+            'rate_version': meta.get('rate_version'),
+            'summary': {
+                'shaped': len(state['clients']),
+                'throttled': throttled_count,
+                'unshaped': len(meta.get('unshaped') or []),
+            },
+            'unshaped': meta.get('unshaped') or [],
+            'clients': clients,
+        })
+    except Exception as e:
+        logger.error(f"获取 TC 限速状态失败: {str(e)}")
+        return api_error(f'获取 TC 限速状态失败: {str(e)}')
+
+
+@tc_state_bp.route('/api/tc/top', methods=['GET'])
+@login_required
+@role_required([Role.ADMIN, Role.SUPER_ADMIN])
+def get_top_consumers():
+    """
+    带宽占用 Top-N 客户端
+    查询参数:
+    - by: upload / download / total / drops，默认 total
+    - n: 返回数量（1 ~ 100），默认 10
+    - window: 计算窗口（秒），默认 Config.CLIENT_RATE_WINDOW，
+              上限 Config.CLIENT_RATE_MAX_WINDOW
+    upload / download / total 来自 status.log 的累计字节（覆盖所有在线客户端），
+    drops 来自 TC 引擎状态快照（只含已限速的客户端）
+    """
+    try:
+        metric = request.args.get('by', 'total')
+        if metric not in METRICS:
+            return api_error(f'不支持的排行指标: {metric}')
+        n = request.args.get('n', 10, type=int)
+        if not 1 <= n <= 100:
+            return api_error('n 必须在 1 ~ 100 之间')
+        window = request.args.get('window', Config.CLIENT_RATE_WINDOW, type=int)
+        if not 1 <= window <= Config.CLIENT_RATE_MAX_WINDOW:
+            return api_error(f'window 必须在 1 ~ {Config.CLIENT_RATE_MAX_WINDOW} 秒之间')
+
+        return api_success(top_consumers(metric, n, window))
+    except Exception as e:
+        logger.error(f"获取带宽排行失败: {str(e)}")
+        return api_error(f'获取带宽排行失败: {str(e)}')
@@ -0,0 +1,163 @@
+"""
+🆕 客户端流量统计 API
+按小时 / 日 / 月查询单个客户端的流量，以及某个周期的流量排行、流量配额状态；
+数据来自 utils.traffic_accounting 维护的汇总表（最多滞后 Config.TRAFFIC_FLUSH_INTERVAL 秒）
+"""
+from datetime import datetime, timedelta
+from flask import Blueprint, request
+from flask_login import login_required
+from models import Client, ClientGroup, Role, TrafficQuotaState
+from routes.helpers import role_required
+from utils.api_response import api_success, api_error
+from utils.traffic_accounting import (
+    GRANULARITIES, client_usage, current_bucket, format_bucket, get_traffic_accountant,
+    parse_bucket, top_usage,
+)
+from utils.traffic_quota import get_quota_enforcer
+import logging
+
+logger = logging.getLogger(__name__)
+
+traffic_bp = Blueprint('traffic', __name__)
+
+
+def _default_range(granularity):
+    """默认范围：小时 = 最近 24 小时，日 = 本月，月 = 最近 12 个月"""
+    now = datetime.now()
+    if granularity == 'hour':
+        return current_bucket('hour', (now - timedelta(hours=23)).timestamp()), current_bucket('hour')
+    if granularity == 'day':
+        return int(now.strftime('%Y%m01')), current_bucket('day')
+    start_year, start_month = divmod(now.year * 12 + now.month - 1 - 11, 12)
+    return start_year * 100 + start_month + 1, current_bucket('month')
+
+
+@traffic_bp.route('/api/traffic/clients/<int:client_id>', methods=['GET'])
+@login_required
+@role_required([Role.ADMIN, Role.SUPER_ADMIN])
+def get_client_traffic(client_id):
+    """
+    单个客户端的流量明细
+    查询参数:
+    - granularity: hour / day / month，默认 day
+    - start / end: hour = YYYY-MM-DDTHH:MM，day = YYYY-MM-DD，month = YYYY-MM（含两端）
+      默认 hour = 最近 24 小时，day = 本月，month = 最近 12 个月
+    bytes_recv = 上行（客户端 → 服务器），bytes_sent = 下行
+    """
+    try:
+        granularity = request.args.get('granularity', 'day')
+        if granularity not in GRANULARITIES:
+            return api_error(f'不支持的粒度: {granularity}')
+        client = Client.query.get(client_id)
+        if not client:
+            return api_error('客户端不存在', code=404)
+
+        start, end = _default_range(granularity)
+        try:
+            if request.args.get('start'):
+                start = parse_bucket(granularity, request.args['start'])
+            if request.args.get('end'):
+                end = parse_bucket(granularity, request.args['end'])
+        except ValueError as e:
+            return api_error(str(e))
+        if start > end:
+            return api_error('start 不能晚于 end')
+
+        series = client_usage(client_id, granularity, start, end)
+        bytes_recv = sum(item['bytes_recv'] for item in series)
+        bytes_sent = sum(item['bytes_sent'] for item in series)
+        return api_success({
+            'client': {'id': client.id, 'name': client.name},
+            'granularity': granularity,
+            'start': format_bucket(granularity, start),
+            'end': format_bucket(granularity, end),
+            'totals': {
+                'bytes_recv': bytes_recv,
+                'bytes_sent': bytes_sent,
+                'total': bytes_recv + bytes_sent,
+            },
+            'series': series,
+        })
+    except Exception as e:
+        logger.error(f"获取客户端流量失败: {str(e)}")
+        return api_error(f'获取客户端流量失败: {str(e)}')
+
+
+@traffic_bp.route('/api/traffic/top', methods=['GET'])
+@login_required
+@role_required([Role.ADMIN, Role.SUPER_ADMIN])
+def get_traffic_top():
+    """
+    某个周期流量最多的客户端
+    查询参数:
+    - granularity: hour / day / month，默认 month
+    - period: 周期（格式同 start / end），默认当前周期
+    - n: 返回数量（1 ~ 100），默认 10
+    """
+    try:
+        granularity = request.args.get('granularity', 'month')
+        if granularity not in GRANULARITIES:
+            return api_error(f'不支持的粒度: {granularity}')
+        n = request.args.get('n', 10, type=int)
+        if not 1 <= n <= 100:
+            return api_error('n 必须在 1 ~ 100 之间')
+        try:
+            period = request.args.get('period')
+            bucket = parse_bucket(granularity, period) if period else current_bucket(granularity)
+        except ValueError as e:
+            return api_error(str(e))
+
+        return api_success({
+            'granularity': granularity,
+            'period': format_bucket(granularity, bucket),
+            'top': top_usage(granularity, bucket, n),
+        })
+    except Exception as e:
+        logger.error(f"获取流量排行失败: {str(e)}")
+        return api_error(f'获取流量排行失败: {str(e)}')
+
+
+@traffic_bp.route('/api/traffic/status', methods=['GET'])
+@login_required
+@role_required([Role.ADMIN, Role.SUPER_ADMIN])
+def get_traffic_status():
+    """采集与入库状态：跟踪的客户端数、待入库增量、最近一次入库 / 清理"""
+    return api_success(get_traffic_accountant().get_stats())
+
+
+@traffic_bp.route('/api/traffic/quotas', methods=['GET'])
+@login_required
+@role_required([Role.ADMIN, Role.SUPER_ADMIN])
+def get_traffic_quotas():
+    """
+    流量配额状态：配额引擎统计 + 当前周期已超额的客户端
+    查询参数:
+    - group_id: 只看某个用户组
+    """
+    try:
+        query = TrafficQuotaState.query
+        group_id = request.args.get('group_id', type=int)
+        if group_id is not None:
+            query = query.filter_by(group_id=group_id)
+        states = query.order_by(TrafficQuotaState.exceeded_at.desc()).all()
+
+        client_ids = [state.client_id for state in states]
+        names = dict(Client.query.with_entities(Client.id, Client.name)
+                     .filter(Client.id.in_(client_ids)).all()) if client_ids else {}
+        groups = dict(ClientGroup.query.with_entities(ClientGroup.id, ClientGroup.name).all())
+        enforcer = get_quota_enforcer()
+        return api_success({
+            'stats': enforcer.get_stats(),
+            'exceeded': [
+                dict(
+                    state.to_dict(),
+                    client_name=names.get(state.client_id),
+                    group_name=groups.get(state.group_id),
+                    current_used_bytes=enforcer.usage_of(state.client_id, state.period),
+                )
+                for state in states
+            ],
+        })
+    except Exception as e:
+        logger.error(f"获取流量配额状态失败: {str(e)}")
+        return api_error(f'获取流量配额状态失败: {str(e)}')
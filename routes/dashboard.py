@@ -123,74 +123,83 @@ Dashboard 仪表板路由
 from flask import Blueprint, jsonify, request
 from routes.helpers import login_required
 from openvpn_monitor.system_monitor import SystemMonitor
+from openvpn_monitor.metrics_sampler import get_sampler
+from openvpn_monitor.timeseries import METRICS, get_history, parse_range
+from utils.api_response import api_success, api_error
 from openvpn_monitor.config import Config
-import time
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
-# 全局变量存储上次网络数据用于计算速率
-_last_net_stats = None
-_last_net_time = None
-
 def get_network_with_speed(vpn_interface: str = None) -> dict:
     """
     获取网络统计并计算上传/下载速率
+
+    速率由后台采样器的单调采样序列在固定窗口 (Config.RATE_WINDOW) 内计算，
+    不依赖请求间隔，多个页面同时轮询也互不干扰；支持任意网卡。
     """
-    global _last_net_stats, _last_net_time
-    
     # 如果未指定接口，使用配置文件中的接口
     if vpn_interface is None:
         vpn_interface = Config.VPN_INTERFACE
-    
-    # 获取当前原始数据
-    try:
-        current_stats = SystemMonitor.get_network_stats(vpn_interface)
-    except Exception as e:
-        # 如果获取失败，返回空数据
-        return {
-            'upload_total': 0,
-            'download_total': 0,
-            'upload_speed': 0,
-            'download_speed': 0,
-            'upload_speed_str': '0 KB/s',
-            'download_speed_str': '0 KB/s',
-            'interface': vpn_interface,
-            'error': str(e)
-        }
-    
-    current_time = time.time()
-    
+
     # 构建结果
     result = {
-        'upload_total': round(current_stats['bytes_sent'] / 1024 / 1024, 2),    # MB
-        'download_total': round(current_stats['bytes_recv'] / 1024 / 1024, 2),  # MB
+        'upload_total': 0,      # MB
+        'download_total': 0,    # MB
         'upload_speed': 0,      # KB/s
         'download_speed': 0,    # KB/s
         'upload_speed_str': '0 KB/s',
         'download_speed_str': '0 KB/s',
-        'interface': vpn_interface  # 添加接口名称
+        'interface': vpn_interface,  # 添加接口名称
+        'window': 0             # 实际计算窗口 (秒)
     }
-    
-    # 计算速率
-    if _last_net_stats is not None and _last_net_time is not None:
-        time_delta = current_time - _last_net_time
-        
-        if time_delta > 0:
-            # 计算速度 (bytes -> KB/s)
-            upload_speed = (current_stats['bytes_sent'] - _last_net_stats['bytes_sent']) / time_delta / 1024
-            download_speed = (current_stats['bytes_recv'] - _last_net_stats['bytes_recv']) / time_delta / 1024
-            
-            result['upload_speed'] = round(upload_speed, 2)
-            result['download_speed'] = round(download_speed, 2)
-            result['upload_speed_str'] = format_speed(upload_speed)
-            result['download_speed_str'] = format_speed(download_speed)
-    
-    # 更新全局变量
-    _last_net_stats = current_stats.copy()
-    _last_net_time = current_time
-    
+
+    try:
+        rate = get_sampler().get_network_rate(vpn_interface)
+        if rate is None:
+            # 采样器尚无该网卡数据：只返回累计值
+            current_stats = SystemMonitor.get_network_stats(vpn_interface)
+            rate = {
+                'bytes_sent': current_stats['bytes_sent'],
+                'bytes_recv': current_stats['bytes_recv'],
+                'upload_rate': 0,
+                'download_rate': 0,
+                'window': 0
+            }
+    except Exception as e:
+        # 如果获取失败，返回空数据
+        result['error'] = str(e)
+        return result
+
+    # 计算速度 (bytes/s -> KB/s)
+    upload_speed = rate['upload_rate'] / 1024
+    download_speed = rate['download_rate'] / 1024
+
+    result.update({
+        'upload_total': round(rate['bytes_sent'] / 1024 / 1024, 2),
+        'download_total': round(rate['bytes_recv'] / 1024 / 1024, 2),
+        'upload_speed': round(upload_speed, 2),
+        'download_speed': round(download_speed, 2),
+        'upload_speed_str': format_speed(upload_speed),
+        'download_speed_str': format_speed(download_speed),
+        'window': rate['window']
+    })
     return result
 
+def get_system_stats(vpn_interface: str = None) -> dict:
+    """
+    获取系统资源统计（CPU、内存、磁盘、网络基础数据）
+
+    优先读取后台采样器的最新采样，不阻塞请求线程；
+    采样器尚未就绪时退化为非阻塞的即时查询。
+    """
+    if vpn_interface is None:
+        vpn_interface = Config.VPN_INTERFACE
+
+    stats = get_sampler().get_all_stats(vpn_interface)
+    if stats is None:
+        stats = SystemMonitor.get_all_stats(vpn_interface, cpu_interval=None)
+    return stats
+
 def format_speed(speed_kbps: float) -> str:
     """格式化速度显示"""
     if speed_kbps < 0:
@@ -208,11 +217,14 @@ def get_dashboard_data():
     获取仪表板系统监控数据（含网络速率）
     """
     try:
-        # 系统资源（CPU、内存、磁盘、网络基础数据）
-        system_stats = SystemMonitor.get_all_stats(Config.VPN_INTERFACE)
+        # 🆕 支持通过 ?interface= 查看任意网卡，默认使用配置的接口
+        interface = (request.args.get('interface') or Config.VPN_INTERFACE).strip()
+
+        # 系统资源（CPU、内存、磁盘、网络基础数据），来自后台采样器
+        system_stats = get_system_stats(interface)
         
         # 替换网络数据为带速率的版本
-        system_stats['network'] = get_network_with_speed(Config.VPN_INTERFACE)
+        system_stats['network'] = get_network_with_speed(interface)
         
         return jsonify({
             "success": True,
@@ -234,7 +246,7 @@ def get_dashboard_data():
 def monitor_status():
     """健康检查端点"""
     try:
-        system_stats = SystemMonitor.get_all_stats(Config.VPN_INTERFACE)
+        system_stats = get_system_stats(Config.VPN_INTERFACE)
         system_stats['network'] = get_network_with_speed(Config.VPN_INTERFACE)
         
         return jsonify({
@@ -248,6 +260,31 @@ def monitor_status():
             "msg": str(e)
         }), 500
 
+# 🆕 指标历史查询
+@dashboard_bp.route("/api/dashboard/history", methods=["GET"])
+@login_required
+def get_metric_history():
+    """
+    查询系统指标历史
+
+    参数:
+        metric: cpu | memory | disk | net_up | net_down
+        range:  时间范围，如 10m / 6h / 7d（默认 10m），自动选择 1s / 1m / 1h 精度
+    """
+    metric = request.args.get('metric', 'cpu').strip()
+    if metric not in METRICS:
+        return api_error(f"不支持的指标: {metric}，可选: {', '.join(METRICS)}")
+
+    try:
+        range_seconds = parse_range(request.args.get('range', '10m'))
+    except ValueError:
+        return api_error("range 参数格式无效，示例: 600 / 10m / 6h / 7d")
+
+    try:
+        return api_success(get_history().query(metric, range_seconds))
+    except Exception as e:
+        return api_error(f"查询指标历史失败: {str(e)}", status=500)
+
 # 🆕 获取当前网络接口配置
 @dashboard_bp.route("/api/dashboard/network-interface", methods=["GET"])
 @login_required
@@ -321,11 +358,6 @@ def set_network_interface():
             # 🆕 更新运行时配置
             Config.VPN_INTERFACE = interface_name
             
-            # 🆕 重置网络统计缓存
-            global _last_net_stats, _last_net_time
-            _last_net_stats = None
-            _last_net_time = None
-            
             return jsonify({
                 "code": 0,
                 "msg": f"网络监控接口已更新为: {interface_name}，配置已保存",
@@ -1,7 +1,10 @@
+import hashlib
+import os
 from functools import wraps
-from flask import request, jsonify, redirect, url_for, flash
+from flask import request, jsonify, redirect, url_for, flash, make_response
 from flask_wtf.csrf import validate_csrf, generate_csrf
 from flask_login import current_user
+from utils.data_version import current_data_version
 
 
 # ---------------------
@@ -26,6 +29,67 @@ def require_login():
         return redirect(url_for('auth_bp.login'))
 
 
+# ---------------------
+# 🆕 条件 GET（ETag / Last-Modified）
+# ---------------------
+# 🆕 客户端列表依赖的外部文件：任一文件变化都会使 ETag 失效
+# （status.log 每次刷新都会改变在线时长 duration，它在读取时计算，不递增数据版本号）
+CLIENT_SOURCE_FILES = (
+    '/var/log/openvpn/status.log',
+    '/etc/openvpn/easy-rsa/pki/index.txt',
+    '/etc/openvpn/ccd',
+)
+
+def conditional_get(*source_files, is_fresh=None):
+    """
+    基于数据版本号的条件 GET
+
+    ETag 由数据版本号、source_files 的修改时间和完整请求路径（含查询参数）生成，
+    客户端缓存仍有效时直接返回 304，不执行视图函数，也不访问数据库。
+
+    Args:
+        source_files: 视图依赖的外部文件（如 status.log、index.txt）
+        is_fresh: 可选，返回 False 时强制执行视图（如有客户端即将逻辑到期）
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            version, updated_at = current_data_version()
+            mtimes = []
+            for path in source_files:
+                try:
+                    mtimes.append(os.stat(path).st_mtime)
+                except OSError:
+                    mtimes.append(0.0)
+            last_modified = max([updated_at, *mtimes])
+
+            signature = f"{version}|{updated_at}|{mtimes}|{request.full_path}"
+            etag = f"{version}-{hashlib.sha1(signature.encode()).hexdigest()[:16]}"
+
+            if is_fresh is None or is_fresh():
+                not_modified = False
+                if request.if_none_match:
+                    not_modified = request.if_none_match.contains_weak(etag)
+                elif request.if_modified_since:
+                    not_modified = int(last_modified) <= request.if_modified_since.timestamp()
+                if not_modified:
+                    response = make_response('', 304)
+                    response.set_etag(etag, weak=True)
+                    response.last_modified = last_modified
+                    return response
+
+            # ETag 取执行视图之前的版本：视图执行期间发生的写入会在下次请求时体现
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag, weak=True)
+                response.last_modified = last_modified
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+            return response
+        return decorated
+    return decorator
+
+
 # ---------------------
 # 角色验证
 # ---------------------
@@ -1,6 +1,13 @@
+from datetime import datetime
 from flask import Blueprint, request, render_template, jsonify
 from flask_login import login_required
-from models import Client  # ORM 模型
+from sqlalchemy import func
+from models import db, Client  # ORM 模型
+from routes.helpers import CLIENT_SOURCE_FILES, conditional_get
+from utils.client_search import search_filter
+from utils.pagination import (
+    CursorError, count_cache, encode_cursor, keyset_paginate, parse_per_page
+)
 from utils.openvpn_utils import (
     get_openvpn_clients,
     check_openvpn_status,
@@ -11,6 +18,9 @@ from utils.openvpn_utils import (
 main_bp = Blueprint('main_bp', __name__)
 PER_PAGE = 10
 
+# 最近一次同步后，下一个将要逻辑到期的时间（到期需要执行同步来自动禁用）
+_next_logical_expiry = {'checked': False, 'at': None}
+
 # ---------- 工具函数 ----------
 def serialize_client(c: Client):
     """将 Client ORM 对象序列化为前端需要的字典"""
@@ -22,12 +32,30 @@ def serialize_client(c: Client):
         "vpn_ip": c.vpn_ip,
         "real_ip": c.real_ip,
         "duration": c.duration,
+        "duration_sec": c.online_seconds(),
         # 前端显示 expiry = logical_expiry
         "expiry": c.logical_expiry.strftime('%Y-%m-%d %H:%M:%S') if c.logical_expiry else None,
         "group": c.group.name if c.group else None,
         "group_id": c.group_id,
     }
 
+def _update_next_logical_expiry():
+    """记录未禁用客户端中最近的逻辑到期时间"""
+    _next_logical_expiry['at'] = (
+        db.session.query(func.min(Client.logical_expiry))
+        .filter(Client.disabled.is_(False), Client.logical_expiry > datetime.now())
+        .scalar()
+    )
+    _next_logical_expiry['checked'] = True
+
+
+def _no_pending_expiry():
+    """上次同步之后没有客户端到达逻辑到期时间，缓存的列表仍然有效"""
+    if not _next_logical_expiry['checked']:
+        return False
+    at = _next_logical_expiry['at']
+    return at is None or datetime.now() < at
+
 # ---------- 首页路由 ----------
 @main_bp.route('/')
 @login_required
@@ -77,6 +105,7 @@ def clients():
 # ---------- AJAX 接口 ----------
 @main_bp.route('/clients/data')
 @login_required
+@conditional_get(*CLIENT_SOURCE_FILES, is_fresh=_no_pending_expiry)
 def clients_data():
     """
     AJAX GET 接口，返回 JSON 格式客户端数据
@@ -84,34 +113,62 @@ def clients_data():
     """
     page = request.args.get('page', 1, type=int)
     q = request.args.get('q', '', type=str).strip()
+    per_page = parse_per_page(request.args.get('per_page'), PER_PAGE)
+    after = request.args.get('after') or None
+    before = request.args.get('before') or None
+    last = request.args.get('last') == '1'
 
     # 同步 OpenVPN 客户端状态
     sync_openvpn_clients_to_db()
     sync_online_state_to_db()
+    _update_next_logical_expiry()
 
     query = Client.query
     if q:
-        query = query.filter(
-            (Client.name.ilike(f"%{q}%")) |
-            (Client.description.ilike(f"%{q}%"))
+        # 🆕 名称 / 描述 / 用户组名子串搜索，3 个字符以上走 FTS5 trigram 索引
+        query = query.filter(search_filter(Client, q))
+
+    # 🆕 总数按 (搜索词, 数据版本号) 缓存
+    total = count_cache.get_or_count('clients_data', q, query)
+    total_pages = max((total + per_page - 1) // per_page, 1)
+
+    if after or before or last or page <= 1:
+        # 🆕 键集分页：按 id 降序，任意页代价相同
+        try:
+            result = keyset_paginate(
+                query, Client.id, descending=True,
+                after=after, before=before, last=last,
+                per_page=per_page, total=total
+            )
+        except CursorError as e:
+            return jsonify({"error": str(e)}), 400
+        clients_page = result['items']
+        next_cursor, prev_cursor = result['next_cursor'], result['prev_cursor']
+        if last:
+            page = total_pages
+    else:
+        # 兼容旧的 ?page=N 直接跳页（OFFSET）
+        clients_page = (
+            query
+            .order_by(Client.id.desc())
+            .offset((page - 1) * per_page)
+            .limit(per_page + 1)
+            .all()
         )
-
-    total = query.count()
-    total_pages = max((total + PER_PAGE - 1) // PER_PAGE, 1)
-
-    clients_page = (
-        query
-        .order_by(Client.id.desc())
-        .offset((page - 1) * PER_PAGE)
-        .limit(PER_PAGE)
-        .all()
-    )
+        has_next = len(clients_page) > per_page
+        clients_page = clients_page[:per_page]
+        next_cursor = encode_cursor(clients_page[-1].id) if has_next else None
+        prev_cursor = encode_cursor(clients_page[0].id) if clients_page else None
 
     clients_serialized = [serialize_client(c) for c in clients_page]
 
     return jsonify({
         "clients": clients_serialized,
         "page": page,
+        "per_page": per_page,
+        "total": total,
         "total_pages": total_pages,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
         "q": q
     })
@@ -0,0 +1,183 @@
+# routes/push.py
+"""
+服务端推送通道 (Server-Sent Events)
+一个长连接替代前端的多个轮询定时器:
+- clients: 客户端列表增量（新增/变化的行 + 删除的名称）
+- service: OpenVPN 服务状态（仅在变化时推送）
+- metrics: 系统监控采样
+"""
+from flask import Blueprint, Response
+from routes.helpers import login_required
+from datetime import datetime, timezone
+from models import db, Client, human_duration
+from utils.push_hub import PushHub, PushPublisher, format_sse
+from utils.openvpn_utils import check_openvpn_status
+from utils.data_version import current_data_version
+import logging
+
+logger = logging.getLogger(__name__)
+
+push_bp = Blueprint('push', __name__)
+
+# 🆕 推送连接上限：每个 SSE 连接长期占用一个 gunicorn 线程（deploy.sh: --threads 16），
+# 必须明显小于线程数，给普通请求留出线程；超出的页面退回轮询
+MAX_SUBSCRIBERS = 8
+
+# 进程级推送中心
+push_hub = PushHub(max_subscribers=MAX_SUBSCRIBERS)
+
+TOPICS = ('clients', 'service', 'metrics')
+
+# 新连接需要补发最新状态的主题（clients 是增量，页面加载时已自行拉取）
+STATE_TOPICS = ('service', 'metrics')
+
+# 发布周期（秒）
+CLIENTS_INTERVAL = 3
+SERVICE_INTERVAL = 5
+METRICS_INTERVAL = 5
+
+# SSE 心跳间隔（秒），防止代理断开空闲连接
+HEARTBEAT_INTERVAL = 15
+
+
+# ==================== 数据源 ====================
+class ClientListSource:
+    """对比前后两次客户端快照，只发布变化的行"""
+
+    COLUMNS = (
+        Client.name, Client.description, Client.online, Client.disabled,
+        Client.vpn_ip, Client.real_ip, Client.connected_since,
+        Client.logical_expiry, Client.group_id
+    )
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.snapshot = None    # name -> row tuple
+        self.version = None     # 快照对应的数据版本号
+
+    def reset(self):
+        self.snapshot = None
+        self.version = None
+
+    @staticmethod
+    def serialize(row):
+        # 在线时长按发布时刻计算（快照只比较 connected_since，时长增长本身不产生推送）
+        seconds = None
+        if row.online and row.connected_since is not None:
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            seconds = int((now - row.connected_since).total_seconds())
+        return {
+            "name": row.name,
+            "description": row.description,
+            "online": bool(row.online),
+            "disabled": bool(row.disabled),
+            "vpn_ip": row.vpn_ip,
+            "real_ip": row.real_ip,
+            "duration": human_duration(seconds) if seconds is not None else None,
+            "duration_sec": seconds,
+            "expiry": row.logical_expiry.strftime('%Y-%m-%d %H:%M:%S') if row.logical_expiry else None,
+            "group_id": row.group_id,
+        }
+
+    def __call__(self):
+        # 数据版本号未变化：无需查询
+        version = current_data_version()
+        if version == self.version:
+            return
+        self.version = version
+
+        rows = db.session.query(*self.COLUMNS).all()
+        current = {row.name: tuple(row) for row in rows}
+
+        if self.snapshot is None:
+            # 首次运行只建立基线；新订阅者自己加载当前页
+            self.snapshot = current
+            return
+
+        upserted = [
+            self.serialize(row) for row in rows
+            if self.snapshot.get(row.name) != current[row.name]
+        ]
+        removed = [name for name in self.snapshot if name not in current]
+        self.snapshot = current
+
+        if upserted or removed:
+            self.hub.publish('clients', {
+                'upserted': upserted,
+                'removed': removed,
+                'total': len(current)
+            }, only_if_changed=False)
+
+
+def publish_service_state():
+    """OpenVPN 服务状态：每个周期只检查一次，与订阅者数量无关"""
+    push_hub.publish('service', {'status': check_openvpn_status()})
+
+
+def publish_metrics():
+    """系统监控数据，与 /api/dashboard 的 system 字段格式一致"""
+    from routes.dashboard import get_system_stats, get_network_with_speed
+    stats = get_system_stats()
+    stats['network'] = get_network_with_speed()
+    # 采样时间戳每次都不同，去掉后才能识别“内容未变化”
+    stats.pop('sampled_at', None)
+    push_hub.publish('metrics', {'system': stats})
+
+
+def init_push(app):
+    """注册数据源并启动发布线程"""
+    publisher = PushPublisher(push_hub, app=app)
+    clients_source = ClientListSource(push_hub)
+    publisher.add_source('clients', CLIENTS_INTERVAL, clients_source, reset=clients_source.reset)
+    publisher.add_source('service', SERVICE_INTERVAL, publish_service_state)
+    publisher.add_source('metrics', METRICS_INTERVAL, publish_metrics)
+    publisher.start()
+    return publisher
+
+
+# ==================== SSE 接口 ====================
+@push_bp.route('/api/push/stream', methods=['GET'])
+@login_required
+def push_stream():
+    """
+    SSE 推送流
+
+    连接建立后先发送各主题的最新状态，之后只推送变化。
+    🆕 连接数已满时返回 204：EventSource 收到 204 后关闭且不会自动重连，
+    页面退回各模块的轮询定时器。
+    """
+    sub = push_hub.subscribe()
+    if sub is None:
+        logger.warning(f"⚠️ 推送连接已达上限 ({MAX_SUBSCRIBERS})，本页面改为轮询")
+        return Response(status=204, headers={'Cache-Control': 'no-cache'})
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            for message in push_hub.last_messages(STATE_TOPICS):
+                yield format_sse(message)
+            while not sub.closed:
+                message = sub.get(timeout=HEARTBEAT_INTERVAL)
+                if message is None:
+                    yield ": ping\n\n"
+                    continue
+                yield format_sse(message)
+        finally:
+            sub.close()
+
+    return Response(
+        stream(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',      # 关闭 nginx 缓冲
+        }
+    )
+
+
+@push_bp.route('/api/push/stats', methods=['GET'])
+@login_required
+def push_stats():
+    """推送通道统计"""
+    from utils.api_response import api_success
+    return api_success(push_hub.get_stats())
@@ -30,6 +30,10 @@ const elementsExist = tbody && paging && pageInfo && noData;
 export let currentPage = 1;
 let showOnlyOnline = false;
 
+// 🆕 当前页对应的分页参数（游标），刷新当前页时复用
+let currentNav = '';
+let currentQuery = '';
+
 /* 统一渲染表格 */
 function render(data) {
     if (!elementsExist) { return;}
@@ -133,35 +137,47 @@ function render(data) {
     }).join('');
 
     // ---------- 分页 ----------
+    // 🆕 键集分页：相邻页使用服务器返回的游标，首页 / 末页直接定位，不再按页码 OFFSET
     paging.innerHTML = '';
     if (data.total_pages <= 1) return;
 
-    const makePageItem = (page, text, disabled = false, active = false) =>
+    const makePageItem = (page, text, nav, disabled = false, active = false) =>
         `<li class="page-item ${disabled ? 'disabled' : ''} ${active ? 'active' : ''}">
-            <a class="page-link" href="#" data-page="${page}">${text}</a>
+            <a class="page-link" href="#" data-page="${page}" data-nav="${nav}">${text}</a>
         </li>`;
+    const ellipsis = `<li class="page-item disabled"><span class="page-link">...</span></li>`;
+    const prevNav = data.prev_cursor ? `before=${encodeURIComponent(data.prev_cursor)}` : '';
+    const nextNav = data.next_cursor ? `after=${encodeURIComponent(data.next_cursor)}` : '';
+    const lastNav = 'last=1';
 
+    const items = [];
     // 上一页
-    paging.innerHTML += makePageItem(data.page - 1, '«', data.page <= 1);
-
-    const start = Math.max(1, data.page - 2);
-    const end = Math.min(data.total_pages, data.page + 2);
+    items.push(makePageItem(data.page - 1, '«', data.page - 1 === 1 ? '' : prevNav, !data.prev_cursor));
 
-    if (start > 1) paging.innerHTML += makePageItem(1, 1);
-    if (start > 2) paging.innerHTML += `<li class="page-item disabled"><span class="page-link">...</span></li>`;
+    if (data.page > 1) items.push(makePageItem(1, 1, ''));
+    if (data.page > 3) items.push(ellipsis);
+    if (data.page > 2) items.push(makePageItem(data.page - 1, data.page - 1, prevNav));
 
-    for (let p = start; p <= end; p++) paging.innerHTML += makePageItem(p, p, false, p === data.page);
+    items.push(makePageItem(data.page, data.page, '', false, true));
 
-    if (end < data.total_pages - 1) paging.innerHTML += `<li class="page-item disabled"><span class="page-link">...</span></li>`;
-    if (end < data.total_pages) paging.innerHTML += makePageItem(data.total_pages, data.total_pages);
+    if (data.page < data.total_pages - 1) items.push(makePageItem(data.page + 1, data.page + 1, nextNav));
+    if (data.page < data.total_pages - 2) items.push(ellipsis);
+    if (data.page < data.total_pages) items.push(makePageItem(data.total_pages, data.total_pages, lastNav));
 
     // 下一页
-    paging.innerHTML += makePageItem(data.page + 1, '»', data.page >= data.total_pages);
+    items.push(makePageItem(data.page + 1, '»', data.page + 1 === data.total_pages ? lastNav : nextNav, !data.next_cursor));
+
+    paging.innerHTML = items.join('');
 }
 
 
-/* AJAX 拉数据 */
-export function loadClients(page = currentPage, q = '') {
+/* AJAX 拉数据
+ * @param {number} page 页码（用于显示）
+ * @param {string} q 搜索关键字
+ * @param {string|null} nav 分页游标参数，如 "after=..." / "before=..." / "last=1"；
+ *                          为 null 时：同一页同一搜索复用当前游标（刷新），否则从页码定位
+ */
+export function loadClients(page = currentPage, q = '', nav = null) {
     // 在这里再次进行检查,确保函数在合适的页面被调用
     if (!elementsExist) {
         return;
@@ -180,9 +196,16 @@ export function loadClients(page = currentPage, q = '') {
         q = String(q).trim();
     }
 
-    currentPage = Number(page) || 1;
+    const newPage = Number(page) || 1;
+    if (nav === null) {
+        nav = (newPage === currentPage && q === currentQuery) ? currentNav : '';
+    }
+    currentPage = newPage;
+    currentQuery = q;
+    currentNav = nav;
 
-    authFetch(`/clients/data?page=${currentPage}&q=${encodeURIComponent(q)}`)
+    const navParam = nav ? `&${nav}` : '';
+    authFetch(`/clients/data?page=${currentPage}&per_page=${PER_PAGE}&q=${encodeURIComponent(q)}${navParam}`)
         .then(render)
         .catch(console.error);
 }
@@ -583,7 +606,7 @@ export function bindClientEvents() {
             if (e.target.classList.contains('page-link')) {
                 e.preventDefault();
                 const page = parseInt(e.target.dataset.page);
-                if (page) loadClients(page, input.value.trim());
+                if (page) loadClients(page, input.value.trim(), e.target.dataset.nav || '');
             }
         });
     }
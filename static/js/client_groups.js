@@ -81,9 +81,9 @@ async function loadClientGroups(force = false) {
             }
         }
 
-        // ⭐ 添加时间戳，防止浏览器缓存
-        const timestamp = new Date().getTime();
-        const url = `/api/client_groups?_=${timestamp}`;
+        // ⭐ 服务器返回 ETag + Cache-Control: no-cache，浏览器每次都会重新验证，
+        //    数据未变化时得到 304 并复用缓存，无需时间戳参数
+        const url = '/api/client_groups';
         
         // console.log('📡 请求用户组数据:', url);
         
@@ -173,6 +173,8 @@ function renderGroupsCards() {
                         <div class="mt-2">
                             <small class="text-muted">
                                 <i class="fa fa-users"></i> 成员: <strong class="client-count-badge text-primary">${group.client_count || 0}</strong>
+                                <span class="ms-2"><i class="fa fa-circle text-success"></i> 在线: <strong>${group.online_count || 0}</strong></span>
+                                ${group.disabled_count ? `<span class="ms-2"><i class="fa fa-ban text-secondary"></i> 禁用: <strong>${group.disabled_count}</strong></span>` : ''}
                             </small>
                         </div>
                     </div>
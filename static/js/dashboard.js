@@ -2,6 +2,7 @@
  * dashboard.js
  * 只负责系统监控数据（CPU / Memory / Disk）
  * 不接管 OpenVPN 状态
+ * 🆕 优先订阅推送通道的 metrics 主题，推送不可用时退回 5 秒轮询
  */
 
 let dashboardTimer = null;
@@ -51,95 +52,131 @@ function formatGB(value) {
     return Number(value).toFixed(1) + ' GB';
 }
 
-/* ---------------- 核心刷新逻辑 ---------------- */
+/* ---------------- 核心渲染逻辑 ---------------- */
 
-async function refreshSystemMetrics() {
-    try {
-        const resp = await dashboardFetch('/api/dashboard');
-        if (!resp.ok) {
-            console.error('[dashboard] API 返回失败:', resp.status);
-            return;
+function renderSystemMetrics(data) {
+    if (!data || !data.system) {
+        console.warn('[dashboard] dashboard 数据结构异常', data);
+        return;
+    }
+
+    /* -------- CPU -------- */
+    if (typeof data.system.cpu === 'number') {
+        setText('cpu-value', data.system.cpu.toFixed(1) + '%');
+        setProgress('cpu-bar', data.system.cpu);
+    }
+
+    /* -------- Memory -------- */
+    if (data.system.memory) {
+        const mem = data.system.memory;
+
+        if (typeof mem.percent === 'number') {
+            setText('memory-value', mem.percent.toFixed(1) + '%');
+            setProgress('memory-progress', mem.percent);
         }
 
-        const data = await resp.json();
-        if (!data || !data.system) {
-            console.warn('[dashboard] dashboard 数据结构异常', data);
-            return;
+        if (mem.used !== undefined && mem.total !== undefined) {
+            setText(
+                'memory-detail',
+                `${formatGB(mem.used)} / ${formatGB(mem.total)}`
+            );
         }
+    }
 
-        /* -------- CPU -------- */
-        if (typeof data.system.cpu === 'number') {
-            setText('cpu-value', data.system.cpu.toFixed(1) + '%');
-            setProgress('cpu-bar', data.system.cpu);
+    /* -------- Disk -------- */
+    if (data.system.disk) {
+        const disk = data.system.disk;
+
+        if (typeof disk.percent === 'number') {
+            setText('disk-usage', disk.percent.toFixed(1) + '%');
+            setProgress('disk-progress', disk.percent);
         }
 
-        /* -------- Memory -------- */
-        if (data.system.memory) {
-            const mem = data.system.memory;
-
-            if (typeof mem.percent === 'number') {
-                setText('memory-value', mem.percent.toFixed(1) + '%');
-                setProgress('memory-progress', mem.percent);
-            }
-
-            if (mem.used !== undefined && mem.total !== undefined) {
-                setText(
-                    'memory-detail',
-                    `${formatGB(mem.used)} / ${formatGB(mem.total)}`
-                );
-            }
+        if (disk.used !== undefined && disk.total !== undefined) {
+            setText(
+                'disk-detail',
+                `${formatGB(disk.used)} / ${formatGB(disk.total)}`
+            );
         }
+    }
 
-        /* -------- Disk -------- */
-        if (data.system.disk) {
-            const disk = data.system.disk;
-
-            if (typeof disk.percent === 'number') {
-                setText('disk-usage', disk.percent.toFixed(1) + '%');
-                setProgress('disk-progress', disk.percent);
-            }
-
-            if (disk.used !== undefined && disk.total !== undefined) {
-                setText(
-                    'disk-detail',
-                    `${formatGB(disk.used)} / ${formatGB(disk.total)}`
-                );
-            }
+    /* -------- Network -------- */
+    if (data.system.network) {
+        const net = data.system.network;
+        
+        // 下载速度
+        if (net.download_speed_str !== undefined) {
+            setText('net-download', net.download_speed_str);
         }
+        
+        // 上传速度
+        if (net.upload_speed_str !== undefined) {
+            setText('net-upload', net.upload_speed_str);
+        }
+        
+        // 总下载
+        if (net.download_total !== undefined) {
+            setText('net-total-down', net.download_total.toFixed(1) + ' MB');
+        }
+        
+        // 总上传
+        if (net.upload_total !== undefined) {
+            setText('net-total-up', net.upload_total.toFixed(1) + ' MB');
+        }
+    }
+}
 
-        /* -------- Network -------- */
-        if (data.system.network) {
-            const net = data.system.network;
-            
-            // 下载速度
-            if (net.download_speed_str !== undefined) {
-                setText('net-download', net.download_speed_str);
-            }
-            
-            // 上传速度
-            if (net.upload_speed_str !== undefined) {
-                setText('net-upload', net.upload_speed_str);
-            }
-            
-            // 总下载
-            if (net.download_total !== undefined) {
-                setText('net-total-down', net.download_total.toFixed(1) + ' MB');
-            }
-            
-            // 总上传
-            if (net.upload_total !== undefined) {
-                setText('net-total-up', net.upload_total.toFixed(1) + ' MB');
-            }
+async function refreshSystemMetrics() {
+    try {
+        const resp = await dashboardFetch('/api/dashboard');
+        if (!resp.ok) {
+            console.error('[dashboard] API 返回失败:', resp.status);
+            return;
         }
 
+        renderSystemMetrics(await resp.json());
     } catch (err) {
         console.error('[dashboard] 刷新系统监控失败:', err);
     }
 }
 
+/* ---------------- 轮询兜底 ---------------- */
+
+function startPolling() {
+    if (dashboardTimer) return;
+    dashboardTimer = setInterval(refreshSystemMetrics, 5000);
+}
+
+function stopPolling() {
+    if (dashboardTimer) {
+        clearInterval(dashboardTimer);
+        dashboardTimer = null;
+    }
+}
+
 /* ---------------- 初始化 ---------------- */
 
 document.addEventListener('DOMContentLoaded', () => {
-    refreshSystemMetrics();
-    dashboardTimer = setInterval(refreshSystemMetrics, 5000);
+    const channel = window.pushChannel;
+    if (!channel) {
+        // 推送模块未加载：保持原有轮询方式
+        refreshSystemMetrics();
+        startPolling();
+        return;
+    }
+
+    // 连接建立后服务器会立即发送最近一次的 metrics
+    channel.subscribe('metrics', renderSystemMetrics);
+    channel.onConnectionChange(connected => {
+        if (connected) {
+            stopPolling();
+        } else {
+            startPolling();
+        }
+    });
+
+    if (!channel.isConnected()) {
+        refreshSystemMetrics();
+        startPolling();
+    }
 });
@@ -5,6 +5,8 @@
 import { qs, qsa } from './utils.js';
 // 从 refresh.js 模块中导入自动刷新相关函数
 import { refreshPage, startAutoRefresh } from './refresh.js';
+// 🆕 服务端推送通道（同时暴露 window.pushChannel 给 dashboard.js）
+import './pushChannel.js';
 // 从 clientManagement.js 模块中导入统一的初始化函数
 import { init as initClientManagement } from './clientManagement.js';
 // 从 userManagement.js 模块中导入统一的初始化函数
@@ -1,4 +1,32 @@
 import {authFetch} from "./utils.js";
+import { subscribe, onConnectionChange, isConnected } from './pushChannel.js';
+
+let statusTimer = null;
+
+function renderStatus(status) {
+    const badge = document.getElementById('ovpn-status-badge');
+    const text = document.getElementById('ovpn-status-text');
+    if (!badge || !text) return;
+
+    switch (status) {
+        case 'running':
+            text.textContent = '运行中';
+            badge.className = 'badge bg-success';
+            break;
+
+        case 'installed':
+            text.textContent = '已安装';
+            badge.className = 'badge bg-warning text-dark';
+            break;
+
+        case 'not_installed':
+        default:
+            text.textContent = '未安装';
+            badge.className = 'badge bg-danger';
+            break;
+    }
+}
+
 async function loadOpenVPNStatus() {
     const badge = document.getElementById('ovpn-status-badge');
     const text = document.getElementById('ovpn-status-text');
@@ -11,25 +39,7 @@ async function loadOpenVPNStatus() {
     try {
         const res = await authFetch('/api/status');
         const data = await res.json();
-
-        switch (data.status) {
-            case 'running':
-                text.textContent = '运行中';
-                badge.className = 'badge bg-success';
-                break;
-
-            case 'installed':
-                text.textContent = '已安装';
-                badge.className = 'badge bg-warning text-dark';
-                break;
-
-            case 'not_installed':
-            default:
-                text.textContent = '未安装';
-                badge.className = 'badge bg-danger';
-                break;
-        }
-
+        renderStatus(data.status);
     } catch (e) {
         console.error('获取 OpenVPN 状态失败', e);
         text.textContent = '异常';
@@ -37,7 +47,27 @@ async function loadOpenVPNStatus() {
     }
 }
 
+function startPolling() {
+    if (statusTimer) return;
+    statusTimer = setInterval(loadOpenVPNStatus, 5000);
+}
+
+function stopPolling() {
+    if (statusTimer) {
+        clearInterval(statusTimer);
+        statusTimer = null;
+    }
+}
+
 document.addEventListener('DOMContentLoaded', () => {
-    loadOpenVPNStatus();
-    setInterval(loadOpenVPNStatus, 5000);
+    if (!document.getElementById('ovpn-status-badge')) return;
+
+    // 🆕 服务状态只在变化时推送；推送断开期间退回轮询
+    subscribe('service', payload => renderStatus(payload.status));
+    onConnectionChange(connected => connected ? stopPolling() : startPolling());
+
+    if (!isConnected()) {
+        loadOpenVPNStatus();
+        startPolling();
+    }
 });
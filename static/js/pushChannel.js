@@ -0,0 +1,108 @@
+/**
+ * pushChannel.js
+ * 服务端推送通道（SSE）
+ * 整个页面共用一个 EventSource 连接，按主题分发消息：
+ *   - clients: 客户端列表增量 { upserted: [...], removed: [...], total }
+ *   - service: OpenVPN 服务状态 { status }
+ *   - metrics: 系统监控数据 { system }
+ * 连接断开期间由各模块自行退回轮询，浏览器会自动重连。
+ */
+
+const STREAM_URL = '/api/push/stream';
+// 服务器拒绝连接（连接数已满返回 204 / 登录失效）后，隔一段时间再尝试
+const RETRY_DELAY = 60000;
+
+const topicHandlers = {};                 // topic -> Set<handler>
+const connectionHandlers = new Set();
+let source = null;
+let connected = false;
+
+function setConnected(value) {
+    if (connected === value) return;
+    connected = value;
+    connectionHandlers.forEach(handler => {
+        try {
+            handler(connected);
+        } catch (err) {
+            console.error('[push] 连接状态回调执行失败:', err);
+        }
+    });
+}
+
+function dispatch(topic, event) {
+    const handlers = topicHandlers[topic];
+    if (!handlers || handlers.size === 0) return;
+
+    let payload;
+    try {
+        payload = JSON.parse(event.data);
+    } catch (err) {
+        console.error(`[push] ${topic} 消息解析失败:`, err);
+        return;
+    }
+    handlers.forEach(handler => {
+        try {
+            handler(payload);
+        } catch (err) {
+            console.error(`[push] ${topic} 消息处理失败:`, err);
+        }
+    });
+}
+
+function connect() {
+    if (source || typeof window.EventSource !== 'function') return;
+
+    source = new EventSource(STREAM_URL, { withCredentials: true });
+    source.onopen = () => setConnected(true);
+    source.onerror = () => {
+        setConnected(false);
+        // CLOSED 表示服务器拒绝（连接数已满 / 登录失效），浏览器不会再自动重连：
+        // 期间由各模块轮询，稍后再试
+        if (source && source.readyState === EventSource.CLOSED) {
+            source = null;
+            setTimeout(connect, RETRY_DELAY);
+        }
+    };
+    Object.keys(topicHandlers).forEach(topic => {
+        source.addEventListener(topic, event => dispatch(topic, event));
+    });
+}
+
+/**
+ * 订阅主题
+ * @param {string} topic 主题名
+ * @param {Function} handler 收到消息时以解析后的 payload 调用
+ * @returns {Function} 取消订阅函数
+ */
+export function subscribe(topic, handler) {
+    if (!topicHandlers[topic]) {
+        topicHandlers[topic] = new Set();
+        if (source) {
+            source.addEventListener(topic, event => dispatch(topic, event));
+        }
+    }
+    topicHandlers[topic].add(handler);
+    connect();
+    return () => topicHandlers[topic].delete(handler);
+}
+
+/**
+ * 监听连接状态变化（true = 已连接）
+ * @param {Function} handler
+ * @returns {Function} 取消监听函数
+ */
+export function onConnectionChange(handler) {
+    connectionHandlers.add(handler);
+    return () => connectionHandlers.delete(handler);
+}
+
+/**
+ * 推送通道当前是否可用
+ * @returns {boolean}
+ */
+export function isConnected() {
+    return connected;
+}
+
+// 暴露给非模块脚本（dashboard.js）
+window.pushChannel = { subscribe, onConnectionChange, isConnected };
@@ -1,43 +1,69 @@
 /**
  * refresh.js
  * 统一管理客户端管理页面的自动刷新、用户活跃检测、搜索恢复逻辑
+ * 🆕 优先使用服务端推送（SSE），推送断开时才退回定时轮询
  */
 import { authFetch, qs } from './utils.js';
 import { currentPage, loadClients } from './clientManagement.js';
 import { bindInstall, bindUninstall } from './installUninstall.js';
 import { bindRestart } from './restart.js';
+import { subscribe, onConnectionChange, isConnected } from './pushChannel.js';
+
+// 全局保存当前搜索关键字
+let currentSearchQuery = '';
 
 // ---------------- 用户活跃/搜索恢复 ----------------
 let lastUserActionTime = Date.now();
 const INACTIVE_TIMEOUT = 30000; // 30 秒无操作
+let inactivityTimer = null;
 
 /**
- * 标记用户活跃（输入、点击、翻页等操作时调用）
+ * 当前是否为默认视图（第一页、无搜索条件）
  */
-export function markUserActive() {
-    lastUserActionTime = Date.now();
+function isDefaultView() {
+    return !currentSearchQuery && Number(currentPage) === 1;
 }
 
-// 每秒检查用户是否超过 30 秒未操作
-setInterval(() => {
-    const now = Date.now();
-    if (now - lastUserActionTime > INACTIVE_TIMEOUT) {
-        // 恢复默认搜索条件
-        setCurrentSearchQuery('');
-        const searchInput = document.querySelector('#client-search');
-        if (searchInput) searchInput.value = '';
+function scheduleInactivityCheck(delay) {
+    inactivityTimer = setTimeout(checkInactivity, delay);
+}
 
-        // 刷新第一页默认列表
-        loadClients(1, '');
-        markUserActive(); // 防止连续重复刷新
+/**
+ * 超过 30 秒未操作时恢复默认搜索条件
+ * 定时器只在用户操作后挂起一次，已是默认视图时不再重复检查
+ */
+function checkInactivity() {
+    inactivityTimer = null;
+    const idle = Date.now() - lastUserActionTime;
+    if (idle < INACTIVE_TIMEOUT) {
+        scheduleInactivityCheck(INACTIVE_TIMEOUT - idle);
+        return;
     }
-}, 1000);
+    if (isDefaultView()) return;
+
+    // 恢复默认搜索条件
+    setCurrentSearchQuery('');
+    const searchInput = document.querySelector('#client-search');
+    if (searchInput) searchInput.value = '';
+
+    // 刷新第一页默认列表
+    loadClients(1, '');
+}
+
+/**
+ * 标记用户活跃（输入、点击、翻页等操作时调用）
+ */
+export function markUserActive() {
+    lastUserActionTime = Date.now();
+    if (!inactivityTimer) scheduleInactivityCheck(INACTIVE_TIMEOUT);
+}
 
 // ---------------- 自动刷新控制 ----------------
 let autoRefreshInterval = null;
-
-// 全局保存当前搜索关键字
-let currentSearchQuery = '';
+let autoRefreshMs = 10000;
+let autoRefreshRole = null;
+let autoRefreshActive = false;
+let pushUnsubscribers = [];
 
 // ---------------- 页面局部刷新 ----------------
 export function refreshPage(currentUserRole) {
@@ -64,53 +90,105 @@ export function setCurrentSearchQuery(q) {
     currentSearchQuery = (typeof q === 'string') ? q : '';
 }
 
+function startPolling() {
+    if (autoRefreshInterval || !autoRefreshActive) return;
+    autoRefreshInterval = setInterval(() => {
+        if (!document.hidden) {
+            refreshPage(autoRefreshRole);
+        }
+    }, autoRefreshMs);
+}
+
+function stopPolling() {
+    if (autoRefreshInterval) {
+        clearInterval(autoRefreshInterval);
+        autoRefreshInterval = null;
+    }
+}
+
+/**
+ * 客户端列表增量：只有当前页可能受影响时才重新加载
+ * 推送只携带变化的行，这里按当前页重新拉取以保持排序和分页一致
+ */
+function handleClientsPush(delta) {
+    if (document.hidden) return;
+    const changed = (delta.upserted || []).length + (delta.removed || []).length;
+    if (changed > 0) {
+        loadClients(currentPage, currentSearchQuery || '');
+    }
+}
+
+function handleServicePush(payload) {
+    renderOpenVPNStatus(payload.status, autoRefreshRole);
+    bindInstall();
+    bindUninstall();
+    bindRestart();
+}
+
 /**
  * 启动自动刷新（不会重复启动）
- * @param {number} ms 刷新间隔，毫秒
+ * 推送通道可用时不轮询；推送断开期间按 ms 间隔轮询
+ * @param {number} ms 轮询间隔（推送不可用时），毫秒
  * @param {string} currentUserRole 当前用户角色
  */
 export function startAutoRefresh(ms = 10000, currentUserRole) {
-    if (autoRefreshInterval) return; // 已经启动则不重复
-    autoRefreshInterval = setInterval(() => {
-        if (!document.hidden) {
-            refreshPage(currentUserRole);
-        }
-    }, ms);
+    if (autoRefreshActive) return; // 已经启动则不重复
+    autoRefreshActive = true;
+    autoRefreshMs = ms;
+    autoRefreshRole = currentUserRole;
+
+    pushUnsubscribers = [
+        subscribe('service', handleServicePush),
+        subscribe('clients', handleClientsPush),
+        onConnectionChange(connected => {
+            if (connected) {
+                stopPolling();
+                // 断线期间可能错过了变化，重连后补刷一次
+                refreshPage(autoRefreshRole);
+            } else {
+                startPolling();
+            }
+        })
+    ];
+
+    if (!isConnected()) startPolling();
 }
 
 /**
- * 停止自动刷新
+ * 停止自动刷新（同时暂停推送处理）
  */
 export function stopAutoRefresh() {
-    if (autoRefreshInterval) {
-        clearInterval(autoRefreshInterval);
-        autoRefreshInterval = null;
-    }
+    autoRefreshActive = false;
+    stopPolling();
+    pushUnsubscribers.forEach(unsubscribe => unsubscribe());
+    pushUnsubscribers = [];
 }
 
 // ---------------- OpenVPN 状态刷新 ----------------
+function renderOpenVPNStatus(status, currentUserRole) {
+    const statusBody = qs('#openvpn-status-body');
+    const actionsContainer = qs('#openvpn-status-actions');
+    if (actionsContainer) actionsContainer.innerHTML = '';
+
+    let statusText = '';
+    if (status === 'running') statusText = '<span class="status-indicator status-running"></span> 正在运行';
+    else if (status === 'installed') statusText = '<span class="status-indicator status-installed"></span> 已安装但未运行';
+    else statusText = '<span class="status-indicator status-not-installed"></span> OpenVPN未安装';
+
+    if (statusBody) statusBody.innerHTML = `<p>${statusText}</p>`;
+
+    // 根据角色显示按钮
+    if (currentUserRole === 'SUPER_ADMIN' && actionsContainer) {
+        if (status === 'not_installed') actionsContainer.innerHTML += `<button id="install-btn" class="btn btn-primary">安装OpenVPN</button>`;
+        if (status === 'running') actionsContainer.innerHTML += `<button id="restart-btn" class="btn btn-warning me-2">重启</button>`;
+        if (status === 'running' || status === 'installed') actionsContainer.innerHTML += `<button id="uninstall-btn" class="btn btn-danger">卸载</button>`;
+    }
+}
+
 async function refreshOpenVPNStatus(currentUserRole) {
     try {
         const statusData = await authFetch('/api/status', { returnRawResponse: false });
-
-        const statusBody = qs('#openvpn-status-body');
-        const actionsContainer = qs('#openvpn-status-actions');
-        if (actionsContainer) actionsContainer.innerHTML = '';
-
-        const status = statusData.status;
-        let statusText = '';
-        if (status === 'running') statusText = '<span class="status-indicator status-running"></span> 正在运行';
-        else if (status === 'installed') statusText = '<span class="status-indicator status-installed"></span> 已安装但未运行';
-        else statusText = '<span class="status-indicator status-not-installed"></span> OpenVPN未安装';
-
-        if (statusBody) statusBody.innerHTML = `<p>${statusText}</p>`;
-
-        // 根据角色显示按钮
-        if (currentUserRole === 'SUPER_ADMIN' && actionsContainer) {
-            if (status === 'not_installed') actionsContainer.innerHTML += `<button id="install-btn" class="btn btn-primary">安装OpenVPN</button>`;
-            if (status === 'running') actionsContainer.innerHTML += `<button id="restart-btn" class="btn btn-warning me-2">重启</button>`;
-            if (status === 'running' || status === 'installed') actionsContainer.innerHTML += `<button id="uninstall-btn" class="btn btn-danger">卸载</button>`;
-        }
+        renderOpenVPNStatus(statusData.status, currentUserRole);
     } catch (err) {
         console.error("无法获取OpenVPN状态:", err);
     }
@@ -1,10 +1,24 @@
 #!/usr/bin/env python3
+"""
+同步 OpenVPN 客户端状态（index.txt / CCD / status.log）到数据库
+
+- 默认同步一次后退出
+- --daemon 常驻：inotify 监听三个来源，去抖动后只重新读取变化的来源并增量写入，
+  定期完整对账兜底；SIGHUP 立即完整对账
+"""
+import argparse
 import os
 import re
+import signal
+import time
 from datetime import datetime, timezone
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, bindparam, insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import declarative_base
 from sqlalchemy.exc import SQLAlchemyError
+from utils.data_version import bump_data_version
+from utils.db_writer import DBWriter
+from utils.file_watch import FileWatcher
 
 # ------------------- 配置 -------------------
 DATA_DIR = "/opt/vpnwm/data"
@@ -13,9 +27,10 @@ if not os.path.isdir(DATA_DIR):
     raise RuntimeError(f"DATA_DIR 未找到:{DATA_DIR},请检查部署脚本是否创建了该目录")
 DB_PATH = os.path.join(DATA_DIR, "vpn_users.db")
 
-OPENVPN_STATUS_FILE = "/var/log/openvpn/status.log"
-CCD_DIR = "/etc/openvpn/ccd"
-INDEX_TXT = "/etc/openvpn/easy-rsa/pki/index.txt"
+# 🆕 可由 systemd 服务的 Environment 覆盖
+OPENVPN_STATUS_FILE = os.environ.get("OPENVPN_STATUS_FILE", "/var/log/openvpn/status.log")
+CCD_DIR = os.environ.get("OPENVPN_CCD_DIR", "/etc/openvpn/ccd")
+INDEX_TXT = os.environ.get("OPENVPN_INDEX_TXT", "/etc/openvpn/easy-rsa/pki/index.txt")
 
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
 
@@ -33,11 +48,18 @@ class Client(Base):
     disabled = Column(Boolean, default=False)
     vpn_ip = Column(String(15), nullable=True)
     real_ip = Column(String(15), nullable=True)
-    duration = Column(String(50), nullable=True)
+    # 🆕 本次连接开始时间 (UTC)，在线时长由 Web 端读取时计算
+    connected_since = Column(DateTime, nullable=True)
+    # 与 models.py 一致（NOT NULL），新增客户端时需要写入
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc),
+                        onupdate=lambda: datetime.now(timezone.utc), nullable=False)
 
 # ------------------- 数据库初始化 -------------------
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(bind=engine)
+
+# 🆕 与 Web 进程共用单写入者机制：写入经 flock 与 Web 端排队，不再靠 busy_timeout 抢锁
+writer = DBWriter(engine, name='sync-db-writer')
 
 # 不要创建表,因为表已经由 Flask 应用创建
 # Base.metadata.create_all(engine)
@@ -65,15 +87,6 @@ def parse_expiry_date(expiry_raw):
             return None
     return None
 
-def human_duration(seconds):
-    if seconds < 0:
-        return "00:00"
-    h, rem = divmod(seconds, 3600)
-    m, s = divmod(rem, 60)
-    if h: return f"{h}h{m:02d}m"
-    if m: return f"{m}m{s:02d}s"
-    return f"{s}s"
-
 # ------------------- OpenVPN 数据解析 -------------------
 def get_online_clients(status_file=OPENVPN_STATUS_FILE):
     clients = {}
@@ -107,11 +120,10 @@ def get_online_clients(status_file=OPENVPN_STATUS_FILE):
         dt = parse_connected_since(conn_since)
         if not dt:
             continue
-        duration_sec = int((datetime.now(timezone.utc) - dt).total_seconds())
         clients[cn] = {
             "real_ip": real_addr.split(":")[0],
-            "duration": human_duration(duration_sec),
-            "connected_since": conn_since,
+            # 与 Web 端一致：不带时区的 UTC
+            "connected_since": dt.replace(tzinfo=None),
             "vpn_ip": ""
         }
 
@@ -133,16 +145,22 @@ def get_online_clients(status_file=OPENVPN_STATUS_FILE):
 
     return clients
 
-def get_openvpn_clients():
-    clients_list = []
-    online_clients = get_online_clients()
-    disabled_clients = set()
+def read_disabled():
+    """CCD 目录中的文件名 = 被禁用的客户端"""
     if os.path.isdir(CCD_DIR):
         try:
-            disabled_clients = set(os.listdir(CCD_DIR))
+            return set(os.listdir(CCD_DIR))
         except:
             pass
+    return set()
+
+def read_index():
+    """
+    解析 index.txt
 
+    Returns:
+        dict: {name: (证书到期时间, 是否已吊销)}；同名多行时以最后一行（最新证书）为准
+    """
     try:
         with open(INDEX_TXT, "r") as f:
             lines = f.readlines()
@@ -150,6 +168,7 @@ def get_openvpn_clients():
         log_message(f"无法读取 index.txt: {e}")
         lines = []
 
+    entries = {}
     for line in lines:
         line = line.strip()
         if not (line.startswith("V") or line.startswith("R")):
@@ -167,9 +186,13 @@ def get_openvpn_clients():
             continue
 
         # 解析过期日期为 datetime 对象
-        expiry_date = parse_expiry_date(expiry_raw)
+        entries[name] = (parse_expiry_date(expiry_raw), line.startswith("R"))
+    return entries
 
-        is_revoked = line.startswith("R")
+def build_clients(index_entries, disabled_clients, online_clients):
+    """合并 index.txt / CCD / status.log 三个来源，得到每个客户端应写入的状态"""
+    clients_list = []
+    for name, (expiry_date, is_revoked) in index_entries.items():
         is_disabled = name in disabled_clients or is_revoked
         is_online = not is_disabled and name in online_clients
 
@@ -179,50 +202,271 @@ def get_openvpn_clients():
             "expiry": expiry_date,  # 证书真实到期时间
             "online": is_online,
             "disabled": is_disabled,
-            "vpn_ip": oc["vpn_ip"] if oc else "",
-            "real_ip": oc["real_ip"] if oc else "",
-            "duration": oc["duration"] if oc else ""
+            # 离线时与 Web 端同步逻辑一致写 NULL，避免两边来回改写
+            "vpn_ip": oc["vpn_ip"] if oc else None,
+            "real_ip": oc["real_ip"] if oc else None,
+            "connected_since": oc["connected_since"] if oc else None
         })
     return clients_list
 
+def get_openvpn_clients():
+    return build_clients(read_index(), read_disabled(), get_online_clients())
+
 # ------------------- 同步逻辑 -------------------
+# 同步写入的字段
+SYNC_FIELDS = ('expiry', 'disabled', 'online', 'vpn_ip', 'real_ip', 'connected_since')
+
+
+def apply_sync(conn, clients):
+    """
+    写入任务（在写入线程中执行，读取与写入在同一事务内）：
+    与数据库逐行对比，只插入新客户端、只更新真正变化的行
+
+    Returns:
+        int: 插入 + 更新的行数
+    """
+    table = Client.__table__
+    columns = [table.c.name] + [table.c[field] for field in SYNC_FIELDS]
+    existing = {row.name: row for row in conn.execute(select(*columns))}
+
+    inserts, updates = [], []
+    for c in clients:
+        desired = dict(c)
+        # disabled / revoked 永远不能 online
+        desired['online'] = c['online'] and not c['disabled']
+        row = existing.pop(c['name'], None)
+        if row is None:
+            inserts.append({'name': c['name'], **{field: desired[field] for field in SYNC_FIELDS}})
+        elif any(getattr(row, field) != desired[field] for field in SYNC_FIELDS):
+            updates.append({'b_name': c['name'], **{field: desired[field] for field in SYNC_FIELDS}})
+
+    if inserts:
+        conn.execute(insert(table), inserts)
+    if updates:
+        conn.execute(
+            update(table).where(table.c.name == bindparam('b_name'))
+            .values({field: bindparam(field) for field in SYNC_FIELDS}),
+            updates
+        )
+
+    # index.txt 中已不存在的客户端置为离线
+    gone = [name for name, row in existing.items() if row.online]
+    if gone:
+        conn.execute(update(table).where(table.c.name.in_(gone)).values(online=False))
+    return len(inserts) + len(updates) + len(gone)
+
+
 def sync_clients_to_db():
-    session = SessionLocal()
     try:
         clients = get_openvpn_clients()
         if not clients:
             log_message("没有客户端数据可同步")
             return
 
-        # 先全部置为离线
-        session.query(Client).update({Client.online: False})
-
-        for c in clients:
-            db_c = session.query(Client).filter_by(name=c['name']).first()
-            if not db_c:
-                db_c = Client(name=c['name'])
-                session.add(db_c)
-
-            db_c.expiry = c['expiry']
-            db_c.disabled = c['disabled']
-            # disabled / revoked 永远不能 online
-            db_c.online = c['online'] if not c['disabled'] else False
-            db_c.vpn_ip = c['vpn_ip']
-            db_c.real_ip = c['real_ip']
-            db_c.duration = c['duration']
-
-        session.commit()
-        # log_message(f"同步完成 ✅ 客户端总数: {len(clients)}")
+        # 🆕 数据未变化时不产生任何写入，也不递增数据版本号
+        changed = writer.run(apply_sync, clients)
+        if changed:
+            bump_data_version()
+        # log_message(f"同步完成 ✅ 客户端总数: {len(clients)}, 变更: {changed}")
 
     except SQLAlchemyError as e:
-        session.rollback()
         log_message(f"数据库错误: {e}")
     except Exception as e:
-        session.rollback()
         log_message(f"未知错误: {e}")
+
+
+def apply_changes(conn, rows, gone):
+    """
+    写入任务（常驻模式的增量写入）：只写入状态发生变化的客户端
+
+    Args:
+        rows: 需要插入或更新的客户端（INSERT ... ON CONFLICT(name) DO UPDATE）
+        gone: 已从 index.txt 消失、需要置为离线的客户端名称
+    """
+    table = Client.__table__
+    count = 0
+    if rows:
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.name],
+            set_={field: stmt.excluded[field] for field in SYNC_FIELDS},
+        )
+        conn.execute(stmt, [{'name': c['name'], **{field: c[field] for field in SYNC_FIELDS}} for c in rows])
+        count += len(rows)
+    if gone:
+        count += conn.execute(
+            update(table).where(table.c.name.in_(gone), table.c.online.is_(True)).values(online=False)
+        ).rowcount
+    return count
+
+
+# ------------------- 常驻模式 -------------------
+# 文件事件合并：最后一个事件后安静这么久才同步，最长推迟 DEBOUNCE_MAX
+DEBOUNCE = 0.2
+DEBOUNCE_MAX = 1.0
+# 兜底的完整对账间隔（秒）：与数据库逐行比较，修正其它写入方造成的偏差
+RECONCILE_INTERVAL = 300
+
+
+class SyncDaemon:
+    """
+    监听 status.log / index.txt / CCD 目录（inotify），只重新读取变化的来源，
+    与上一次写入的状态比较后增量写入；每 reconcile_interval 秒做一次完整对账
+    """
+
+    def __init__(self, debounce=DEBOUNCE, reconcile_interval=RECONCILE_INTERVAL, use_inotify=True):
+        self.debounce = debounce
+        self.reconcile_interval = reconcile_interval
+        self.watcher = FileWatcher(
+            {'status': OPENVPN_STATUS_FILE, 'index': INDEX_TXT, 'ccd': CCD_DIR},
+            use_inotify=use_inotify
+        )
+        self.stop_requested = False
+        self.reconcile_requested = False
+
+        # 各来源最近一次读取的结果
+        self.index_entries = {}
+        self.disabled = set()
+        self.online = {}
+        # name -> 最近一次写入的字段值
+        self.applied = {}
+
+        # 统计
+        self.syncs = 0
+        self.rows_written = 0
+
+    @staticmethod
+    def _state(c):
+        return tuple(c[field] for field in SYNC_FIELDS)
+
+    def _read(self, sources):
+        if 'index' in sources:
+            self.index_entries = read_index()
+        if 'ccd' in sources:
+            self.disabled = read_disabled()
+        if 'status' in sources:
+            self.online = get_online_clients()
+        return build_clients(self.index_entries, self.disabled, self.online)
+
+    def reconcile(self):
+        """重新读取全部来源，与数据库逐行对比"""
+        self.watcher.ensure_watches()
+        clients = self._read({'index', 'ccd', 'status'})
+        if not clients:
+            log_message("没有客户端数据可同步")
+            return 0
+        changed = writer.run(apply_sync, clients)
+        self.applied = {c['name']: self._state(c) for c in clients}
+        if changed:
+            bump_data_version()
+            log_message(f"完整对账: 修正 {changed} 行")
+        return changed
+
+    def sync(self, sources):
+        """只重新读取变化的来源，写入与上一次不同的客户端"""
+        clients = self._read(sources)
+        if not clients and 'index' in sources:
+            # index.txt 读取失败或正在改写：保持现状，等待下一次事件 / 对账
+            return 0
+        current = {c['name']: c for c in clients}
+        rows = [c for name, c in current.items() if self.applied.get(name) != self._state(c)]
+        gone = [name for name in self.applied if name not in current]
+        if not rows and not gone:
+            return 0
+
+        changed = writer.run(apply_changes, rows, gone)
+        for c in rows:
+            self.applied[c['name']] = self._state(c)
+        for name in gone:
+            self.applied.pop(name, None)
+        self.syncs += 1
+        self.rows_written += changed
+        if changed:
+            bump_data_version()
+        return changed
+
+    def run(self):
+        wake_r, wake_w = os.pipe()
+        os.set_blocking(wake_r, False)
+        os.set_blocking(wake_w, False)
+        signal.set_wakeup_fd(wake_w)
+
+        def _terminate(signum, frame):
+            self.stop_requested = True
+
+        def _reconcile(signum, frame):
+            self.reconcile_requested = True
+
+        signal.signal(signal.SIGTERM, _terminate)
+        signal.signal(signal.SIGINT, _terminate)
+        signal.signal(signal.SIGHUP, _reconcile)
+
+        log_message(f"常驻同步已启动（{self.watcher.mode}，完整对账间隔 {self.reconcile_interval} 秒）")
+        next_reconcile = 0.0
+        while not self.stop_requested:
+            try:
+                if self.reconcile_requested or time.monotonic() >= next_reconcile:
+                    self.reconcile_requested = False
+                    self.reconcile()
+                    next_reconcile = time.monotonic() + self.reconcile_interval
+
+                changed = self.watcher.wait(next_reconcile - time.monotonic(), wakeup_fd=wake_r)
+                _drain(wake_r)
+                if not changed:
+                    continue
+                # 去抖动：OpenVPN 改写 status.log、easy-rsa 改名替换 index.txt 都会连续产生多个事件
+                deadline = time.monotonic() + DEBOUNCE_MAX
+                while not self.stop_requested and time.monotonic() < deadline:
+                    more = self.watcher.wait(min(self.debounce, deadline - time.monotonic()), wakeup_fd=wake_r)
+                    _drain(wake_r)
+                    if not more:
+                        break
+                    changed |= more
+                self.sync(changed)
+
+            except SQLAlchemyError as e:
+                log_message(f"数据库错误: {e}")
+                # 写入失败：内存中的已写入状态不可信，尽快完整对账
+                next_reconcile = min(next_reconcile, time.monotonic() + 5)
+                time.sleep(1)
+            except Exception as e:
+                log_message(f"未知错误: {e}")
+                next_reconcile = min(next_reconcile, time.monotonic() + 5)
+                time.sleep(1)
+
+        self.watcher.close()
+        log_message(f"常驻同步退出（增量同步 {self.syncs} 次，写入 {self.rows_written} 行）")
+
+
+def _drain(fd):
+    try:
+        while os.read(fd, 512):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='同步 OpenVPN 客户端状态到数据库')
+    parser.add_argument('--daemon', action='store_true',
+                        help='常驻模式：监听文件变化增量同步（默认只同步一次后退出）')
+    parser.add_argument('--reconcile-interval', type=int, default=RECONCILE_INTERVAL,
+                        help=f'常驻模式下完整对账的间隔秒数（默认 {RECONCILE_INTERVAL}）')
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE,
+                        help=f'文件事件合并的安静时间（默认 {DEBOUNCE} 秒）')
+    parser.add_argument('--poll', action='store_true', help='不使用 inotify，定时检查文件状态')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.daemon:
+            SyncDaemon(debounce=args.debounce, reconcile_interval=args.reconcile_interval,
+                       use_inotify=not args.poll).run()
+        else:
+            sync_clients_to_db()
     finally:
-        session.close()
+        writer.stop()
+    return 0
 
 
 if __name__ == "__main__":
-    sync_clients_to_db()
\ No newline at end of file
+    raise SystemExit(main())
\ No newline at end of file
@@ -6,6 +6,9 @@ set -e
 
 TC_USERS_CONF="/etc/openvpn/tc-users.conf"
 TC_ROLES_MAP="/etc/openvpn/tc-roles.map"
+TC_RATES_TABLE="/etc/openvpn/tc-rates.tbl"
+TC_CONTROL_SOCKET="/var/run/openvpn-tc/control.sock"
+TC_STATE_FILE="/var/run/openvpn-tc/state.json"
 STATUS_LOG="/var/log/openvpn/status.log"
 
 GREEN='\033[0;32m'
@@ -139,6 +142,35 @@ else
     echo -e "  ${RED}✗${NC} $TC_ROLES_MAP 不存在"
 fi
 
+if [ -f "$TC_RATES_TABLE" ]; then
+    echo -e "  ${GREEN}✓${NC} $TC_RATES_TABLE 存在"
+    echo "    版本: $(head -n1 "$TC_RATES_TABLE" | sed 's/^#version=//')"
+    echo "    客户端数: $(grep -v "^#" "$TC_RATES_TABLE" | grep -v "^$" | wc -l)"
+else
+    echo -e "  ${YELLOW}⚠${NC}  $TC_RATES_TABLE 不存在（守护进程退回逐行 grep 查询）"
+fi
+
+if [ -S "$TC_CONTROL_SOCKET" ]; then
+    echo -e "  ${GREEN}✓${NC} 控制通道 $TC_CONTROL_SOCKET 已就绪（变更即时生效并回复结果）"
+else
+    echo -e "  ${YELLOW}⚠${NC}  控制通道不存在（旧守护脚本：通过信号文件轮询，最长延迟一个周期）"
+fi
+
+if [ -f "$TC_STATE_FILE" ]; then
+    echo -e "  ${GREEN}✓${NC} 状态快照 $TC_STATE_FILE 存在"
+    python3 - "$TC_STATE_FILE" <<'PYEOF' 2>/dev/null | sed 's/^/    /'
+import json, sys, time
+state = json.load(open(sys.argv[1]))
+print(f"更新于 {time.time() - state['timestamp']:.0f} 秒前, 已限速 {len(state['clients'])} 个客户端, "
+      f"未限速 {len(state.get('unshaped') or [])} 个")
+for c in state['clients'][:10]:
+    print(f"{c['ip']:<15} {c['user']:<20} classid {c['classid']:<5} "
+          f"上行 {c['up']['rate']:<8} 下行 {c['down']['rate']:<8} 丢包 {c['up']['drops'] + c['down']['drops']}")
+PYEOF
+else
+    echo -e "  ${YELLOW}⚠${NC}  状态快照不存在（TC 引擎未运行，Web 端无法显示实时限速状态）"
+fi
+
 # 6. 检查 OpenVPN 状态文件
 echo ""
 echo -e "${BLUE}[6/10]${NC} 检查 OpenVPN 状态文件..."
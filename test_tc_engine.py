@@ -0,0 +1,255 @@
+"""
+测试脚本 - TC 调和引擎（openvpn_monitor.tc_engine）
+
+使用内存后端 FakeTcBackend，不需要 root 权限，也不会修改本机的 tc 规则:
+- 一次调和后收敛，再次调和（含强制读取实际状态）不下发任何命令
+- 用户组聚合类的创建 / 删除与客户端改挂父类
+- 下线客户端的 class 与 filter 被删除
+
+运行: python -m pytest -q test_tc_engine.py 或 python test_tc_engine.py
+"""
+
+import os
+import sys
+import tempfile
+
+from openvpn_monitor.tc_engine import FakeTcBackend, RateTable, TcEngine
+
+VPN_DEV = 'tun0'
+IFB_DEV = 'ifb0'
+
+CLIENTS = {
+    '10.8.0.2': 'alice',
+    '10.8.0.3': 'bob',
+    '10.8.0.4': 'carol',
+}
+
+GROUP_LINE = '@group\toffice\trate_up=20Mbit ceil_up=30Mbit rate_down=40Mbit ceil_down=60Mbit prio=1\n'
+
+
+class Workspace:
+    """临时目录中的 status.log / 速率表 + 内存后端上的引擎"""
+
+    def __init__(self, directory, layout='u32'):
+        self.status = os.path.join(directory, 'status.log')
+        self.table = os.path.join(directory, 'tc-rates.tbl')
+        self.version = 0
+        self.backend = FakeTcBackend(links=(VPN_DEV,))
+        self.engine = TcEngine(
+            backend=self.backend, rate_table=RateTable(path=self.table), status_file=self.status,
+            vpn_dev=VPN_DEV, ifb_dev=IFB_DEV, layout=layout,
+            state_file=os.path.join(directory, 'state.json'),
+        )
+
+    def write_status(self, clients):
+        with open(self.status, 'w') as f:
+            f.write("OpenVPN CLIENT LIST\nROUTING TABLE\nVirtual Address,Common Name,Real Address,Last Ref\n")
+            for ip, user in clients.items():
+                f.write(f"{ip},{user},203.0.113.1:1194,now\n")
+            f.write("GLOBAL STATS\nEND\n")
+
+    def write_table(self, users, group=None, group_line=None):
+        """users: {client: (上行, 下行)}；group 非空时全部客户端属于该组"""
+        self.version += 1
+        with open(self.table, 'w') as f:
+            f.write(f"#version=test-{self.version}\n")
+            if group_line:
+                f.write(group_line)
+            for user, (up, down) in users.items():
+                f.write(f"{user} {up} {down}{' ' + group if group else ''}\n")
+
+    def minor_of(self, ip):
+        return self.engine.assignments.get(ip)
+
+    def client_parent(self, dev, ip):
+        cls = self.backend.classes.get(dev, {}).get(self.minor_of(ip))
+        return cls.parent if cls else None
+
+    def group_minors(self, dev):
+        return {minor for minor in self.backend.classes.get(dev, {}) if 0x2 <= minor <= 0xFF}
+
+    def assert_converged(self):
+        """强制读取实际状态的调和不应再有任何命令"""
+        result = self.engine.reconcile(force=True)
+        assert result['ok'], result
+        assert result['commands'] == 0, self.backend.commands[-10:]
+
+
+def _rates(users, up='10Mbit', down='20Mbit'):
+    return {user: (up, down) for user in users}
+
+
+def test_reconcile_converges():
+    """首次调和建立全部规则；之后快速路径与强制调和都是 0 条命令"""
+    with tempfile.TemporaryDirectory() as directory:
+        ws = Workspace(directory)
+        ws.write_status(CLIENTS)
+        ws.write_table(_rates(CLIENTS.values()))
+        assert ws.engine.setup()
+
+        first = ws.engine.reconcile()
+        assert first['ok'] and first['online'] == len(CLIENTS)
+        assert first['commands'] > 0
+
+        second = ws.engine.reconcile()
+        assert second['commands'] == 0 and second['skipped']
+        ws.assert_converged()
+
+        # 每个客户端两个方向都有 class，且包能被分类到自己的 class
+        for ip in CLIENTS:
+            minor = ws.minor_of(ip)
+            assert minor in ws.backend.classes[VPN_DEV]
+            assert minor in ws.backend.classes[IFB_DEV]
+            assert ws.backend.classify(VPN_DEV, '1:', ip)[0] == minor
+            assert ws.backend.classify(IFB_DEV, '2:', ip)[0] == minor
+
+
+def test_reconcile_converges_flower_layout():
+    with tempfile.TemporaryDirectory() as directory:
+        ws = Workspace(directory, layout='flower')
+        ws.write_status(CLIENTS)
+        ws.write_table(_rates(CLIENTS.values()))
+        assert ws.engine.setup()
+        assert ws.engine.reconcile()['commands'] > 0
+        assert ws.engine.reconcile()['commands'] == 0
+        ws.assert_converged()
+
+
+def test_rate_change_is_applied_in_place():
+    """速率变化只下发 class change，不重建 filter"""
+    with tempfile.TemporaryDirectory() as directory:
+        ws = Workspace(directory)
+        ws.write_status(CLIENTS)
+        ws.write_table(_rates(CLIENTS.values()))
+        ws.engine.setup()
+        ws.engine.reconcile()
+
+        ws.backend.commands.clear()
+        ws.write_table(_rates(CLIENTS.values(), up='50Mbit', down='100Mbit'))
+        result = ws.engine.reconcile()
+        assert result['ok'] and result['commands'] > 0
+        assert not [c for c in ws.backend.commands if c.startswith('filter')]
+        assert all(cls.rate == 50 * 1000 * 1000 // 8
+                   for minor, cls in ws.backend.classes[VPN_DEV].items() if minor >= 0x100)
+        ws.assert_converged()
+
+
+def test_aggregate_group_parent_added_and_removed():
+    """配置聚合限速的用户组：成员挂到组类下；取消后组类删除、成员改挂根类"""
+    with tempfile.TemporaryDirectory() as directory:
+        ws = Workspace(directory)
+        ws.write_status(CLIENTS)
+        ws.write_table(_rates(CLIENTS.values()))
+        ws.engine.setup()
+        ws.engine.reconcile()
+        assert not ws.group_minors(VPN_DEV)
+
+        # 加入聚合用户组
+        ws.write_table(_rates(CLIENTS.values()), group='office', group_line=GROUP_LINE)
+        assert ws.engine.reconcile()['ok']
+        groups = ws.group_minors(VPN_DEV)
+        assert len(groups) == 1 and ws.group_minors(IFB_DEV) == groups
+        group_minor = groups.pop()
+        assert ws.engine.group_assignments == {'office': group_minor}
+        assert ws.backend.classes[VPN_DEV][group_minor].ceil == 30 * 1000 * 1000 // 8
+        assert ws.backend.classes[IFB_DEV][group_minor].ceil == 60 * 1000 * 1000 // 8
+        for ip in CLIENTS:
+            assert ws.client_parent(VPN_DEV, ip) == f'1:{group_minor:x}'
+            assert ws.client_parent(IFB_DEV, ip) == f'2:{group_minor:x}'
+            # 改挂父类需要重建 class，filter 仍指向客户端 class
+            assert ws.backend.classify(VPN_DEV, '1:', ip)[0] == ws.minor_of(ip)
+        ws.assert_converged()
+
+        # 取消聚合限速
+        ws.write_table(_rates(CLIENTS.values()), group='office')
+        assert ws.engine.reconcile()['ok']
+        assert not ws.group_minors(VPN_DEV) and not ws.group_minors(IFB_DEV)
+        assert ws.engine.group_assignments == {}
+        for ip in CLIENTS:
+            assert ws.client_parent(VPN_DEV, ip) == '1:1'
+            assert ws.client_parent(IFB_DEV, ip) == '2:1'
+            assert ws.backend.classify(IFB_DEV, '2:', ip)[0] == ws.minor_of(ip)
+        ws.assert_converged()
+
+
+def test_group_class_removed_when_last_member_goes_offline():
+    with tempfile.TemporaryDirectory() as directory:
+        ws = Workspace(directory)
+        ws.write_status({'10.8.0.2': 'alice'})
+        ws.write_table(_rates(['alice']), group='office', group_line=GROUP_LINE)
+        ws.engine.setup()
+        ws.engine.reconcile()
+        assert len(ws.group_minors(VPN_DEV)) == 1
+
+        ws.write_status({})
+        assert ws.engine.reconcile()['ok']
+        assert not ws.group_minors(VPN_DEV) and not ws.group_minors(IFB_DEV)
+        ws.assert_converged()
+
+
+def test_offline_client_is_removed():
+    """下线客户端的 class / filter 在两个方向上都被删除，classid 回收"""
+    with tempfile.TemporaryDirectory() as directory:
+        ws = Workspace(directory)
+        ws.write_status(CLIENTS)
+        ws.write_table(_rates(CLIENTS.values()))
+        ws.engine.setup()
+        ws.engine.reconcile()
+
+        gone_ip = '10.8.0.3'
+        gone_minor = ws.minor_of(gone_ip)
+        remaining = {ip: user for ip, user in CLIENTS.items() if ip != gone_ip}
+        ws.write_status(remaining)
+        result = ws.engine.reconcile()
+        assert result['ok'] and result['online'] == len(remaining)
+
+        assert gone_ip not in ws.engine.assignments
+        assert gone_minor not in ws.engine.allocator
+        for dev, root in ((VPN_DEV, '1:'), (IFB_DEV, '2:')):
+            assert gone_minor not in ws.backend.classes[dev]
+            assert not [f for f in ws.backend.filters[(dev, root)].values() if f.ip == gone_ip]
+            assert ws.backend.classify(dev, root, gone_ip)[0] is None
+            for ip in remaining:
+                assert ws.backend.classify(dev, root, ip)[0] == ws.minor_of(ip)
+        ws.assert_converged()
+
+
+def test_restart_adopts_existing_rules():
+    """引擎重启后接管已有规则：不重建，直接收敛"""
+    with tempfile.TemporaryDirectory() as directory:
+        ws = Workspace(directory)
+        ws.write_status(CLIENTS)
+        ws.write_table(_rates(CLIENTS.values()))
+        ws.engine.setup()
+        ws.engine.reconcile()
+        before = {ip: ws.minor_of(ip) for ip in CLIENTS}
+
+        restarted = TcEngine(
+            backend=ws.backend, rate_table=RateTable(path=ws.table), status_file=ws.status,
+            vpn_dev=VPN_DEV, ifb_dev=IFB_DEV, layout='u32',
+            state_file=os.path.join(directory, 'state.json'),
+        )
+        assert restarted.setup()
+        assert restarted.reconcile()['commands'] == 0
+        assert restarted.assignments == before
+
+
+def main():
+    """运行所有测试"""
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_') and callable(value)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    if failed:
+        print(f"\n❌ {failed} / {len(tests)} 个测试失败")
+        sys.exit(1)
+    print(f"\n✅ 全部 {len(tests)} 个测试通过")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+# utils/client_search.py
+"""
+客户端全文检索（SQLite FTS5 trigram）
+- 影子索引 clients_fts(name, description, group_name)，rowid = clients.id
+- 由触发器与 clients / client_groups 同步，任何写入路径（ORM、原生 SQL、
+  sync_clients.py 独立进程）都不需要额外处理
+- 子串搜索走倒排索引，不再全表 LIKE '%q%' 扫描
+- trigram 至少需要 3 个字符；更短的关键字退回 LIKE
+"""
+import logging
+
+from sqlalchemy import column, or_, text
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'clients_fts'
+MIN_FTS_LENGTH = 3
+
+# 索引是否可用（SQLite 未编译 FTS5 / 版本低于 3.34 时为 False）
+_fts_available = False
+
+_CREATE_STATEMENTS = (
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE}
+    USING fts5(name, description, group_name, tokenize='trigram')
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS clients_fts_ai AFTER INSERT ON clients BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description, group_name)
+        VALUES (
+            new.id, new.name, new.description,
+            (SELECT name FROM client_groups WHERE id = new.group_id)
+        );
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS clients_fts_au
+    AFTER UPDATE OF name, description, group_id ON clients BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        INSERT INTO {FTS_TABLE}(rowid, name, description, group_name)
+        VALUES (
+            new.id, new.name, new.description,
+            (SELECT name FROM client_groups WHERE id = new.group_id)
+        );
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS clients_fts_ad AFTER DELETE ON clients BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS client_groups_fts_au
+    AFTER UPDATE OF name ON client_groups BEGIN
+        UPDATE {FTS_TABLE} SET group_name = new.name
+        WHERE rowid IN (SELECT id FROM clients WHERE group_id = new.id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS client_groups_fts_ad
+    AFTER DELETE ON client_groups BEGIN
+        UPDATE {FTS_TABLE} SET group_name = NULL
+        WHERE rowid IN (SELECT id FROM clients WHERE group_id = old.id);
+    END
+    """,
+)
+
+_REBUILD_STATEMENTS = (
+    f"DELETE FROM {FTS_TABLE}",
+    f"""
+    INSERT INTO {FTS_TABLE}(rowid, name, description, group_name)
+    SELECT c.id, c.name, c.description, g.name
+    FROM clients c LEFT JOIN client_groups g ON g.id = c.group_id
+    """,
+)
+
+
+def ensure_search_index(engine):
+    """
+    创建索引表与触发器（幂等），行数与 clients 不一致时全量重建
+
+    在应用启动时调用；失败时仅记录警告，搜索自动退回 LIKE。
+    """
+    global _fts_available
+    try:
+        with engine.begin() as conn:
+            for statement in _CREATE_STATEMENTS:
+                conn.execute(text(statement))
+            indexed = conn.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+            total = conn.execute(text("SELECT count(*) FROM clients")).scalar()
+            if indexed != total:
+                for statement in _REBUILD_STATEMENTS:
+                    conn.execute(text(statement))
+                logger.info(f"🆕 客户端搜索索引已重建 ({total} 条)")
+        _fts_available = True
+    except OperationalError as e:
+        _fts_available = False
+        logger.warning(f"⚠️ SQLite 不支持 FTS5 trigram，客户端搜索退回 LIKE: {e}")
+    return _fts_available
+
+
+def fts_available():
+    return _fts_available
+
+
+def use_fts(q):
+    """该关键字是否走全文索引"""
+    return _fts_available and len(q) >= MIN_FTS_LENGTH
+
+
+def fts_phrase(q, columns=None):
+    """
+    把用户输入转换为 FTS5 查询串（整体作为一个短语，特殊字符不生效）
+
+    Args:
+        q: 用户输入
+        columns: 限定检索的列，如 ('name',)
+    """
+    phrase = '"' + q.replace('"', '""') + '"'
+    if columns:
+        return '{' + ' '.join(columns) + '} : ' + phrase
+    return phrase
+
+
+def _escape_like(q):
+    return q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_filter(model, q, columns=('name', 'description', 'group_name')):
+    """
+    生成客户端搜索的 WHERE 条件
+
+    - 3 个字符及以上：clients.id IN (索引命中的 rowid)
+    - 更短：退回 ILIKE（不含 group_name）
+
+    Args:
+        model: Client 模型
+        q: 搜索关键字（已去除首尾空白）
+        columns: 检索的列
+    """
+    if use_fts(q):
+        matched = (
+            text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :fts_q")
+            .bindparams(fts_q=fts_phrase(q, columns))
+            .columns(column('rowid'))
+        )
+        return model.id.in_(matched)
+
+    pattern = f"%{_escape_like(q)}%"
+    conditions = [
+        getattr(model, name).ilike(pattern, escape='\\')
+        for name in columns if hasattr(model, name)
+    ]
+    return or_(*conditions)
+
+
+def ranked_search(session, q, limit=20):
+    """
+    排序搜索（用于搜索建议 / 快速定位）
+
+    排序：名称完全匹配 > 名称前缀匹配（按名称）> bm25 相关度（name 权重最高）。
+    短关键字只做名称前缀匹配（走 name 唯一索引的范围扫描）。
+
+    Returns:
+        list[dict]: [{'id', 'name', 'description', 'group', 'online', 'disabled',
+                         'match': exact / prefix / substring}]
+    """
+    params = {'q': q, 'limit': limit}
+
+    if use_fts(q):
+        params['fts_q'] = fts_phrase(q)
+        params['prefix'] = _escape_like(q) + '%'
+        sql = f"""
+            SELECT c.id, c.name, c.description, g.name AS group_name,
+                   c.online, c.disabled,
+                   CASE
+                       WHEN c.name = :q THEN 'exact'
+                       WHEN c.name LIKE :prefix ESCAPE '\\' THEN 'prefix'
+                       ELSE 'substring'
+                   END AS match_type
+            FROM {FTS_TABLE}
+            JOIN clients c ON c.id = {FTS_TABLE}.rowid
+            LEFT JOIN client_groups g ON g.id = c.group_id
+            WHERE {FTS_TABLE} MATCH :fts_q
+            ORDER BY c.name = :q DESC,
+                     c.name LIKE :prefix ESCAPE '\\' DESC,
+                     CASE WHEN c.name LIKE :prefix ESCAPE '\\' THEN c.name END,
+                     bm25({FTS_TABLE}, 10.0, 2.0, 1.0),
+                     c.name
+            LIMIT :limit
+        """
+    else:
+        # 名称范围扫描：name >= q AND name < q + U+FFFF
+        params['upper'] = q + '\uffff'
+        sql = """
+            SELECT c.id, c.name, c.description, g.name AS group_name,
+                   c.online, c.disabled,
+                   CASE WHEN c.name = :q THEN 'exact' ELSE 'prefix' END AS match_type
+            FROM clients c
+            LEFT JOIN client_groups g ON g.id = c.group_id
+            WHERE c.name >= :q AND c.name < :upper
+            ORDER BY c.name
+            LIMIT :limit
+        """
+
+    rows = session.execute(text(sql), params).mappings().all()
+    return [
+        {
+            'id': row['id'],
+            'name': row['name'],
+            'description': row['description'],
+            'group': row['group_name'],
+            'online': bool(row['online']),
+            'disabled': bool(row['disabled']),
+            'match': row['match_type'],
+        }
+        for row in rows
+    ]
@@ -0,0 +1,158 @@
+# utils/data_version.py
+"""
+数据版本号（跨进程共享）
+- clients / client_groups 每次实际写入都会递增版本号
+- Web 进程与 sync_clients.py 通过同一个 mmap 文件共享，写入用 flock 串行化
+- 列表接口据此生成 ETag / Last-Modified，数据未变化时直接返回 304
+
+本模块只依赖标准库（sync_clients.py 也会导入）。
+"""
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from itertools import chain
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = "/opt/vpnwm/data"
+VERSION_FILE = os.path.join(DATA_DIR, "data_version.bin")
+
+# 版本号 (uint64), 最后修改时间 (epoch 秒, double)
+_LAYOUT = struct.Struct('<Qd')
+
+# Session.info 中的“本事务有变更”标记
+_DIRTY_FLAG = 'data_version_dirty'
+
+
+class DataVersion:
+    """mmap 映射的版本计数器"""
+
+    def __init__(self, path=None):
+        self.path = path or VERSION_FILE
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._file = os.fdopen(fd, 'r+b')
+
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < _LAYOUT.size:
+                # 新文件：版本从 0 开始，修改时间取当前时间
+                self._file.truncate(_LAYOUT.size)
+                self._file.seek(0)
+                self._file.write(_LAYOUT.pack(0, time.time()))
+                self._file.flush()
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+        self._mmap = mmap.mmap(fd, _LAYOUT.size)
+
+    def current(self):
+        """
+        读取当前版本（无锁）
+
+        Returns:
+            tuple: (version, updated_at)
+        """
+        # 与写入方并发时可能读到半写入的值：连续两次一致才返回
+        while True:
+            first = _LAYOUT.unpack_from(self._mmap, 0)
+            second = _LAYOUT.unpack_from(self._mmap, 0)
+            if first == second:
+                return first
+
+    def bump(self):
+        """递增版本号，返回新版本"""
+        with self._lock:
+            fd = self._file.fileno()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                version, _ = _LAYOUT.unpack_from(self._mmap, 0)
+                version += 1
+                _LAYOUT.pack_into(self._mmap, 0, version, time.time())
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        return version
+
+
+# 进程级单例
+_instance = None
+_instance_lock = threading.Lock()
+
+
+def get_data_version():
+    global _instance
+    with _instance_lock:
+        if _instance is None:
+            _instance = DataVersion()
+        return _instance
+
+
+def current_data_version():
+    """当前 (version, updated_at)"""
+    return get_data_version().current()
+
+
+def bump_data_version():
+    """数据已变化：递增版本号"""
+    try:
+        return get_data_version().bump()
+    except OSError as e:
+        logger.error(f"❌ 更新数据版本号失败: {e}")
+        return None
+
+
+def track_data_changes(session_target, *models):
+    """
+    监听会话事件，提交时若涉及 models 的实际变更则递增版本号
+
+    - after_flush: 检查新增 / 删除 / 有字段实际变化的对象
+    - do_orm_execute: 覆盖 query.update() / query.delete() 批量语句
+    - after_commit: 有标记才递增；回滚时清除标记
+
+    原生 text() SQL 不经过 ORM，调用方需自行 bump_data_version()。
+
+    Args:
+        session_target: Session / sessionmaker / scoped_session
+        models: 需要跟踪的模型类
+    """
+    from sqlalchemy import event
+
+    tracked = tuple(models)
+
+    def _after_flush(session, flush_context):
+        if session.info.get(_DIRTY_FLAG):
+            return
+        for obj in chain(session.new, session.deleted):
+            if isinstance(obj, tracked):
+                session.info[_DIRTY_FLAG] = True
+                return
+        for obj in session.dirty:
+            # 赋相同的值不算变更
+            if isinstance(obj, tracked) and session.is_modified(obj, include_collections=False):
+                session.info[_DIRTY_FLAG] = True
+                return
+
+    def _do_orm_execute(state):
+        if not (state.is_update or state.is_delete):
+            return
+        mapper = state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, tracked):
+            state.session.info[_DIRTY_FLAG] = True
+
+    def _after_commit(session):
+        if session.info.pop(_DIRTY_FLAG, False):
+            bump_data_version()
+
+    def _after_rollback(session):
+        session.info.pop(_DIRTY_FLAG, None)
+
+    event.listen(session_target, 'after_flush', _after_flush)
+    event.listen(session_target, 'do_orm_execute', _do_orm_execute)
+    event.listen(session_target, 'after_commit', _after_commit)
+    event.listen(session_target, 'after_rollback', _after_rollback)
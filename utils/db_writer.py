@@ -0,0 +1,272 @@
+# utils/db_writer.py
+"""
+数据库单写入者（写入串行化）
+- 每个进程一个写入线程，独占一条数据库连接；调用方提交写入任务，拿到 Future
+- 队列中积压的任务合并为一个事务（组提交），一次 fsync 完成多个调用方的写入
+- 跨进程（Web 进程与 sync_clients.py）用同一个 flock 文件串行化：
+  写入方按顺序排队，不再依赖 SQLite busy_timeout 的退避重试（最长 10 秒的尾延迟）
+- 读取不经过本模块，WAL 模式下与写入并发
+
+写入任务是一个函数 fn(conn, *args, **kwargs)，在写入线程中以同一事务执行，
+只能做数据库操作（合并事务失败时会逐个重新执行）。
+
+本模块只依赖标准库与 SQLAlchemy（sync_clients.py 也会导入）。
+"""
+import fcntl
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = "/opt/vpnwm/data"
+LOCK_FILE = os.path.join(DATA_DIR, "db_write.lock")
+
+# 一个事务最多合并的任务数
+MAX_BATCH = 64
+# 默认等待结果的超时（秒）
+DEFAULT_TIMEOUT = 30
+
+_STOP = object()
+
+
+class DBWriter:
+    """写入线程 + 任务队列（进程级单例见 get_db_writer()，脚本也可以直接创建）"""
+
+    def __init__(self, engine=None, lock_path=None, name='db-writer'):
+        self.engine = engine
+        self.lock_path = lock_path or LOCK_FILE
+        self.name = name
+        self.queue = queue.Queue()
+        self.thread = None
+        self._start_lock = threading.Lock()
+        self._lock_fd = None
+        self._conn = None
+
+        # 统计
+        self.jobs = 0
+        self.failed = 0
+        self.batches = 0
+        self.retried_batches = 0
+        self.max_batch = 0
+        self._waits = deque(maxlen=500)      # 排队 + 执行（毫秒）
+        self._lock_waits = deque(maxlen=500)  # 等待跨进程写锁（毫秒）
+        self._stats_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # 提交任务
+    # ------------------------------------------------------------------
+    def start(self):
+        with self._start_lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            if self.engine is None:
+                raise RuntimeError("DBWriter 尚未绑定数据库引擎")
+            self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        提交写入任务
+
+        Returns:
+            Future: 结果为 fn 的返回值；事务失败时为异常
+        """
+        future = Future()
+        if threading.current_thread() is self.thread:
+            # 写入线程内再次提交（任务嵌套）：直接在当前事务中执行，避免自己等自己
+            try:
+                future.set_result(fn(self._conn, *args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        self.start()
+        self.queue.put((fn, args, kwargs, future, time.monotonic()))
+        return future
+
+    def run(self, fn, *args, timeout=DEFAULT_TIMEOUT, **kwargs):
+        """提交并等待结果（同步调用），失败时抛出任务的异常"""
+        return self.submit(fn, *args, **kwargs).result(timeout)
+
+    def execute(self, statement, params=None, timeout=DEFAULT_TIMEOUT):
+        """执行单条语句（params 为列表时 executemany），返回影响的行数"""
+        return self.run(_execute, statement, params, timeout=timeout)
+
+    def stop(self, timeout=5):
+        """处理完队列中已有的任务后退出"""
+        if self.thread is None:
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    # ------------------------------------------------------------------
+    # 写入线程
+    # ------------------------------------------------------------------
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            stop = False
+            while len(batch) < MAX_BATCH:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            batch = [job for job in batch if job[3].set_running_or_notify_cancel()]
+            if batch:
+                self._process(batch)
+            if stop:
+                break
+        self._close()
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed or self._conn.invalidated:
+            self._conn = self.engine.connect()
+        return self._conn
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _process(self, batch):
+        try:
+            results = self._transaction(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                self._finish(batch, [], error=e)
+                return
+            # 合并事务失败：逐个重新执行，只让出错的任务失败
+            self.retried_batches += 1
+            logger.warning(f"⚠️ 合并写入失败，逐个重试 {len(batch)} 个任务: {e}")
+            for job in batch:
+                try:
+                    self._finish([job], self._transaction([job]))
+                except Exception as job_error:
+                    self._finish([job], [], error=job_error)
+            return
+        self._finish(batch, results)
+
+    def _transaction(self, batch):
+        """持有跨进程写锁，在一个事务中执行 batch"""
+        waited = time.monotonic()
+        self._acquire()
+        try:
+            with self._stats_lock:
+                self._lock_waits.append((time.monotonic() - waited) * 1000)
+            conn = self._connection()
+            try:
+                with conn.begin():
+                    return [fn(conn, *args, **kwargs) for fn, args, kwargs, _, _ in batch]
+            except Exception:
+                if conn.invalidated:
+                    self._close()
+                raise
+        finally:
+            self._release()
+
+    def _finish(self, batch, results, error=None):
+        now = time.monotonic()
+        with self._stats_lock:
+            self.jobs += len(batch)
+            if error is None:
+                self.batches += 1
+                self.max_batch = max(self.max_batch, len(batch))
+            else:
+                self.failed += len(batch)
+            for job in batch:
+                self._waits.append((now - job[4]) * 1000)
+        for index, (fn, _, _, future, _) in enumerate(batch):
+            if error is not None:
+                logger.error(f"❌ 写入任务 {getattr(fn, '__name__', fn)} 失败: {error}")
+                future.set_exception(error)
+            else:
+                future.set_result(results[index])
+
+    # ------------------------------------------------------------------
+    # 跨进程写锁
+    # ------------------------------------------------------------------
+    def _acquire(self):
+        if self._lock_fd is None:
+            try:
+                self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            except OSError as e:
+                # 锁文件不可用时退化为进程内串行（仍有 busy_timeout 兜底）
+                logger.warning(f"⚠️ 无法打开写锁文件 {self.lock_path}: {e}")
+                self._lock_fd = -1
+        if self._lock_fd >= 0:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+
+    def _release(self):
+        if self._lock_fd is not None and self._lock_fd >= 0:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def get_stats(self):
+        with self._stats_lock:
+            waits = sorted(self._waits)
+            lock_waits = sorted(self._lock_waits)
+            stats = {
+                'jobs': self.jobs,
+                'failed': self.failed,
+                'batches': self.batches,
+                'retried_batches': self.retried_batches,
+                'max_batch': self.max_batch,
+            }
+
+        def percentile(values, p):
+            if not values:
+                return None
+            return round(values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))], 1)
+
+        stats.update({
+            'queued': self.queue.qsize(),
+            'running': self.thread is not None and self.thread.is_alive(),
+            'latency_ms': {'p50': percentile(waits, 50), 'p99': percentile(waits, 99),
+                           'max': percentile(waits, 100)},
+            'lock_wait_ms': {'p50': percentile(lock_waits, 50), 'p99': percentile(lock_waits, 99),
+                             'max': percentile(lock_waits, 100)},
+        })
+        return stats
+
+
+def _execute(conn, statement, params):
+    if params is None:
+        return conn.execute(statement).rowcount
+    return conn.execute(statement, params).rowcount
+
+
+# 进程级单例
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_db_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = DBWriter()
+        return _writer
+
+
+def init_db_writer(app):
+    """绑定 Flask-SQLAlchemy 的引擎（写入线程使用连接池中的一条连接）"""
+    from models import db
+
+    writer = get_db_writer()
+    with app.app_context():
+        writer.engine = db.engine
+    writer.start()
+    return writer
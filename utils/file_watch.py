@@ -0,0 +1,224 @@
+# utils/file_watch.py
+"""
+文件变化监听（inotify，ctypes 调用 libc）
+- 监听文件所在目录而不是文件本身：改名替换（index.txt.new → index.txt）、
+  删除重建、日志轮转后仍然有效
+- 事件按名称过滤后映射为调用方定义的键，例如 {'status', 'index', 'ccd'}
+- inotify 不可用（非 Linux / 达到 max_user_watches 上限）时退化为定时 stat 比较
+
+本模块只依赖标准库（sync_clients.py 也会导入）。
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+
+logger = logging.getLogger(__name__)
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# 目录中文件的增删改、改名进出
+DIR_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+            | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT = struct.Struct('iIII')
+
+# 退化为轮询时的检查间隔（秒）
+POLL_INTERVAL = 2.0
+
+
+class Inotify:
+    """inotify 文件描述符的最小封装"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._init = libc.inotify_init1
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm = libc.inotify_rm_watch
+        self._rm.argtypes = (ctypes.c_int, ctypes.c_int)
+
+        self.fd = self._init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, f"inotify_init1: {os.strerror(code)}")
+
+    def add_watch(self, path, mask):
+        """添加监听，返回 watch descriptor"""
+        wd = self._add(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, f"inotify_add_watch {path}: {os.strerror(code)}", path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm(self.fd, wd)
+
+    def read_events(self):
+        """
+        读出当前所有事件（非阻塞）
+
+        Returns:
+            list: [(wd, mask, name)]
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + _EVENT.size <= len(data):
+                wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+                offset += length
+                events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class FileWatcher:
+    """
+    监听一组文件 / 目录，返回发生变化的键
+
+    Args:
+        targets: {key: path}；path 为文件时只关心该文件，为目录时关心目录中的任意文件
+        use_inotify: False 时直接使用 stat 轮询
+    """
+
+    def __init__(self, targets, use_inotify=True):
+        self.targets = dict(targets)
+        self.inotify = None
+        self.watches = {}       # wd -> (目录, [(文件名或 None, key)])
+        self._signatures = {}
+
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                logger.warning(f"⚠️ inotify 不可用，改为每 {POLL_INTERVAL:g} 秒检查文件状态: {e}")
+        if self.inotify is None:
+            self._signatures = self._snapshot()
+        self.ensure_watches()
+
+    @property
+    def mode(self):
+        return 'inotify' if self.inotify is not None else 'poll'
+
+    def _specs(self):
+        """目录 -> [(文件名或 None, key)]"""
+        specs = {}
+        for key, path in self.targets.items():
+            if os.path.isdir(path):
+                specs.setdefault(os.path.normpath(path), []).append((None, key))
+            else:
+                directory, name = os.path.split(os.path.normpath(path))
+                specs.setdefault(directory, []).append((name, key))
+        return specs
+
+    def ensure_watches(self):
+        """为尚未监听的目录添加监听（目录之后才创建的情况），返回缺失的目录"""
+        if self.inotify is None:
+            return []
+        watched = {directory for directory, _ in self.watches.values()}
+        missing = []
+        for directory, entries in self._specs().items():
+            if directory in watched:
+                continue
+            try:
+                wd = self.inotify.add_watch(directory, DIR_MASK)
+            except OSError as e:
+                if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    logger.warning(f"⚠️ 无法监听 {directory}: {e}")
+                missing.append(directory)
+                continue
+            self.watches[wd] = (directory, entries)
+        return missing
+
+    def wait(self, timeout, wakeup_fd=None):
+        """
+        等待变化
+
+        Args:
+            timeout: 最长等待秒数
+            wakeup_fd: 可读时立即返回（如信号唤醒管道）
+
+        Returns:
+            set: 发生变化的键（超时或被唤醒时为空）
+        """
+        fds = [wakeup_fd] if wakeup_fd is not None else []
+        if self.inotify is None:
+            select.select(fds, [], [], max(0.0, min(timeout, POLL_INTERVAL)))
+            return self._poll()
+
+        readable, _, _ = select.select([self.inotify.fd] + fds, [], [], max(0.0, timeout))
+        if self.inotify.fd not in readable:
+            return set()
+        return self._dispatch(self.inotify.read_events())
+
+    def _dispatch(self, events):
+        changed = set()
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # 事件队列溢出：无法知道丢了什么，全部视为变化
+                changed.update(self.targets)
+                continue
+            watch = self.watches.get(wd)
+            if watch is None:
+                continue
+            directory, entries = watch
+            if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                # 目录本身被删除 / 移走：下一次 ensure_watches() 重新添加
+                self.watches.pop(wd, None)
+                changed.update(key for _, key in entries)
+                continue
+            for filename, key in entries:
+                if filename is None or filename == name:
+                    changed.add(key)
+        return changed
+
+    # ------------------------------------------------------------------
+    # stat 轮询
+    # ------------------------------------------------------------------
+    def _snapshot(self):
+        signatures = {}
+        for key, path in self.targets.items():
+            try:
+                st = os.stat(path)
+                signatures[key] = (st.st_ino, st.st_size, st.st_mtime_ns)
+            except OSError:
+                signatures[key] = None
+        return signatures
+
+    def _poll(self):
+        current = self._snapshot()
+        changed = {key for key, signature in current.items() if self._signatures.get(key) != signature}
+        self._signatures = current
+        return changed
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
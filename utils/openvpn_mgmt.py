@@ -0,0 +1,151 @@
+"""
+🆕 OpenVPN management 接口与 CCD 禁用文件
+
+从 routes/api/clients.py 移出，供接口与后台任务（流量配额）共用:
+- openvpn_client_kill(): 按 status 2 中的 Client ID 精确踢下线（找不到时退回 kill <cn>）
+- kill_client(): 使用 OPENVPN_MGMT_HOST / OPENVPN_MGMT_PORT / OPENVPN_MGMT_PASSWORD 环境变量
+- write_ccd_disable() / remove_ccd_disable(): 创建 / 删除 CCD 禁用文件
+"""
+import os
+import socket
+import subprocess
+import time
+
+from utils.openvpn_utils import log_message
+
+CCD_DIR = '/etc/openvpn/ccd'
+
+RECV_CHUNK = 4096
+
+def recv_all_until_end(sock, timeout=3.0):
+    sock.settimeout(timeout)
+    data = b''
+    while True:
+        try:
+            chunk = sock.recv(RECV_CHUNK)
+            if not chunk:
+                break
+            data += chunk
+            if b'\nEND' in data or data.endswith(b'END') or b'\r\nEND' in data:
+                break
+        except socket.timeout:
+            break
+    return data.decode('utf-8', errors='ignore')
+
+def parse_status_for_cids(status_text, common_name):
+    lines = status_text.splitlines()
+    header_cols = None
+    client_lines = []
+    for ln in lines:
+        if ln.startswith('HEADER,CLIENT_LIST'):
+            parts = ln.split(',')
+            header_cols = parts[2:]
+            continue
+        if ln.startswith('CLIENT_LIST,'):
+            client_lines.append(ln)
+
+    if header_cols:
+        low_headers = [h.strip().lower() for h in header_cols]
+        try:
+            idx_cn = low_headers.index('common name')
+        except ValueError:
+            idx_cn = 0
+        cid_idx = low_headers.index('client id') if 'client id' in low_headers else None
+        cids = []
+        for cl in client_lines:
+            parts = cl.split(',')[1:]
+            name = parts[idx_cn] if idx_cn < len(parts) else ''
+            cid = parts[cid_idx] if cid_idx is not None and cid_idx < len(parts) else None
+            if name == common_name:
+                if cid:
+                    cids.append(cid)
+                else:
+                    return []
+        return cids if cids else None
+    return None
+
+def send_and_recv(sock, cmd, wait=0.05, recv_timeout=2.0):
+    sock.sendall((cmd + "\n").encode('utf-8'))
+    time.sleep(wait)
+    return recv_all_until_end(sock, timeout=recv_timeout)
+
+def openvpn_client_kill(host, port, client_name, mgmt_password=None):
+    try:
+        with socket.create_connection((host, port), timeout=5) as s:
+            banner = s.recv(RECV_CHUNK).decode('utf-8', errors='ignore')
+            if mgmt_password:
+                s.sendall(f"password {mgmt_password}\n".encode())
+                time.sleep(0.05)
+                _ = recv_all_until_end(s, timeout=1.0)
+
+            raw_status = send_and_recv(s, "status 2", wait=0.05, recv_timeout=2.0)
+            parse_res = parse_status_for_cids(raw_status, client_name)
+
+            if parse_res is None:
+                resp = send_and_recv(s, f"kill {client_name}", wait=0.05, recv_timeout=2.0)
+                return True, f"未在状态中找到客户端 '{client_name}'。尝试使用 kill {client_name}。响应: {resp.strip()}"
+            elif isinstance(parse_res, list) and len(parse_res) == 0:
+                resp = send_and_recv(s, f"kill {client_name}", wait=0.05, recv_timeout=2.0)
+                return True, f"找到了 '{client_name}' 但未找到客户端 ID。尝试使用 kill {client_name}。响应: {resp.strip()}"
+            else:
+                cids = parse_res
+                results = []
+                for cid in cids:
+                    resp = send_and_recv(s, f"client-kill {cid}", wait=0.05, recv_timeout=2.0)
+                    results.append(f"client-kill {cid} 响应: {resp.strip()}")
+                return True, "成功踢出客户端。\n" + "\n".join(results)
+    except socket.error as e:
+        return False, f"无法连接到 OpenVPN 管理接口: {e}"
+    except Exception as e:
+        return False, f"踢出客户端时发生错误: {e}"
+
+
+def kill_client(client_name):
+    """按环境变量中的管理接口配置踢下线客户端；返回 (是否成功, 说明)"""
+    host = os.environ.get('OPENVPN_MGMT_HOST', '127.0.0.1')
+    port = int(os.environ.get('OPENVPN_MGMT_PORT', 7505))
+    password = os.environ.get('OPENVPN_MGMT_PASSWORD')
+    return openvpn_client_kill(host, port, client_name, mgmt_password=password)
+
+
+def write_ccd_disable(client_name):
+    """
+    创建 CCD 禁用文件（OpenVPN 拒绝该客户端后续连接）
+
+    Raises:
+        subprocess.CalledProcessError: sudo 写入失败
+    """
+    disable_file_path = os.path.join(CCD_DIR, client_name)
+    os.makedirs(CCD_DIR, exist_ok=True)
+
+    cmd = ['sudo', 'sh', '-c', f'echo "disable" > {disable_file_path}']
+    log_message(f"执行命令以禁用客户端:{' '.join(cmd)}")
+    subprocess.run(cmd, capture_output=True, text=True, check=True)
+
+    os.system(f"sudo chown root:root {disable_file_path}")
+    os.system(f"sudo chmod 644 {disable_file_path}")
+    log_message(f"禁用文件创建成功:{disable_file_path}")
+    return disable_file_path
+
+
+def remove_ccd_disable(client_name):
+    """
+    删除 CCD 禁用文件（不存在时忽略）
+
+    Raises:
+        Exception: sudo 删除失败
+    """
+    disable_file_path = os.path.join(CCD_DIR, client_name)
+    if not os.path.exists(disable_file_path):
+        return False
+    try:
+        subprocess.run(
+            ['sudo', 'rm', '-f', disable_file_path],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"删除禁用文件失败: {e.stderr}")
+    log_message(f"已删除客户端 {client_name} 的禁用文件")
+    return True
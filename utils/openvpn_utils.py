@@ -2,13 +2,15 @@ import os
 import subprocess
 import re
 import sys
-from models import db, Client
+from models import db, Client, human_duration
 from sqlalchemy.exc import SQLAlchemyError
 from typing import List, Dict
 import time
 from datetime import datetime, timezone
 from typing import Dict, NamedTuple, Optional
-from sqlalchemy import text
+from sqlalchemy import bindparam, select, update
+from utils.data_version import bump_data_version
+from utils.db_writer import get_db_writer
 import logging
 def log_message(message):
     print(f"[SERVER] {message}", flush=True)
@@ -23,6 +25,7 @@ class OnlineClient(NamedTuple):
     duration_str: str          # 人类可读
     duration_sec: int          # 秒数,方便排序
     connected_since: str       # 原始字符串
+    connected_at: datetime     # 🆕 连接时间(带时区的 UTC)
 
 
 # 缓存 10 s,避免并发刷爆 IO
@@ -130,7 +133,8 @@ def check_openvpn_status():
         return 'not_installed'  # 出错时假设未安装
 
 
-def _parse_connected_since(text: str) -> Optional[datetime]:
+def parse_connected_since(text: str) -> Optional[datetime]:
+    """status.log 的 Connected Since → 带时区的 UTC 时间；无法解析时返回 None"""
     # 1. 你的 status-version 1/2 新格式 → 先当本地时间解析
     try:
         naive = datetime.strptime(text, "%Y-%m-%d %H:%M:%S")
@@ -150,19 +154,6 @@ def _parse_connected_since(text: str) -> Optional[datetime]:
     except (ValueError, OSError):
         return None
 
-def _human_duration(seconds: int) -> str:
-    """>=1 h 输出 1h23m;<1 h 输出 5m12s;<1 min 输出 45s"""
-    if seconds < 0:
-        return "00:00"
-    h, rem = divmod(seconds, 3600)
-    m, s = divmod(rem, 60)
-    if h:
-        return f"{h}h{m:02d}m"
-    if m:
-        return f"{m}m{s:02d}s"
-    return f"{s}s"
-
-
 def get_online_clients(status_file: str = None, cache_ttl: int = 10) -> Dict[str, OnlineClient]:
     global _last_check, _cache
     now = time.time()
@@ -207,7 +198,7 @@ def get_online_clients(status_file: str = None, cache_ttl: int = 10) -> Dict[str
 
         # log_message(f"DEBUG  cn={cn}  conn_since={conn_since}")
 
-        conn_dt = _parse_connected_since(conn_since)
+        conn_dt = parse_connected_since(conn_since)
 
         if conn_dt is None:
             log_message(f"DEBUG  → conn_dt is None, skip")
@@ -220,9 +211,10 @@ def get_online_clients(status_file: str = None, cache_ttl: int = 10) -> Dict[str
         clients[cn] = OnlineClient(
             vpn_ip="",                         # 稍后二次扫描补全
             real_ip=real_ip,
-            duration_str=_human_duration(duration_sec),
+            duration_str=human_duration(duration_sec),
             duration_sec=duration_sec,
-            connected_since=conn_since
+            connected_since=conn_since,
+            connected_at=conn_dt
         )
 
     # 二次扫描:补 vpn_ip(ROUTING TABLE 段)
@@ -393,37 +385,57 @@ def sync_openvpn_clients_to_db():
         log_message(f"sync_openvpn_clients_to_db() 错误: {e}")
 
 def sync_online_state_to_db():
+    """
+    将 status.log 中的在线状态写入数据库
+
+    🆕 先读出当前状态逐行对比，只更新真正变化的行；
+    有变化时递增数据版本号（Core 语句不经过 ORM 事件）。
+    🆕 只存连接时间 connected_since，在线时长读取时计算：
+    没有客户端上线 / 下线 / 重连时不产生任何写入。
+    """
     try:
         online = get_online_clients()  # {cn: OnlineClient}
 
-        # STEP1: 全部先标记为离线
-        db.session.execute(text("""
-            UPDATE clients 
-            SET 
-                online = 0, 
-                vpn_ip = NULL, 
-                real_ip = NULL,
-                duration = NULL
-        """))
-
-        # STEP2: 将在线用户写入数据库
-        for name, info in online.items():
-            db.session.execute(text("""
-                UPDATE clients
-                SET 
-                    online = 1,
-                    vpn_ip = :vpn_ip,
-                    real_ip = :real_ip,
-                    duration = :duration
-                WHERE name = :name
-            """), {
-                "name": name,
-                "vpn_ip": info.vpn_ip,
-                "real_ip": info.real_ip,
-                "duration": info.duration_str  # 你已有字段 duration
-            })
-
+        table = Client.__table__
+        rows = db.session.execute(
+            select(table.c.name, table.c.online, table.c.vpn_ip,
+                   table.c.real_ip, table.c.connected_since)
+        ).all()
+
+        updates = []
+        for name, is_online, vpn_ip, real_ip, connected_since in rows:
+            info = online.get(name)
+            if info:
+                since = info.connected_at.astimezone(timezone.utc).replace(tzinfo=None)
+                desired = (True, info.vpn_ip, info.real_ip, since)
+            else:
+                desired = (False, None, None, None)
+            if (bool(is_online), vpn_ip, real_ip, connected_since) != desired:
+                updates.append({
+                    "b_name": name,
+                    "online": desired[0],
+                    "vpn_ip": desired[1],
+                    "real_ip": desired[2],
+                    "connected_since": desired[3]
+                })
+
+        if not updates:
+            return
+
+        # 经过列类型处理，DateTime 与 ORM 写入的格式一致
+        # 🆕 交给单写入者线程执行，与后台入库 / sync_clients.py 排队写入；
+        # 先结束本会话的事务，避免写入线程等待本线程持有的锁
         db.session.commit()
+        get_db_writer().execute(
+            update(table)
+            .where(table.c.name == bindparam("b_name"))
+            .values(online=bindparam("online"), vpn_ip=bindparam("vpn_ip"),
+                    real_ip=bindparam("real_ip"), connected_since=bindparam("connected_since")),
+            updates
+        )
+        # 本会话中已加载的 Client 对象需要重新读取
+        db.session.expire_all()
+        bump_data_version()
 
     except SQLAlchemyError as e:
         db.session.rollback()
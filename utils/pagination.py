@@ -0,0 +1,145 @@
+# utils/pagination.py
+"""
+键集分页（Keyset / Cursor Pagination）
+- 以排序键（唯一列）作为游标，WHERE key > :cursor ORDER BY key LIMIT n
+  任意深度的页面代价都与第一页相同，不再使用 OFFSET
+- 总数按 (范围, 搜索词, 数据版本号) 缓存，数据未变化时不重复 COUNT
+"""
+import base64
+import json
+import threading
+from collections import OrderedDict
+
+from utils.data_version import current_data_version
+
+DEFAULT_PER_PAGE = 10
+MAX_PER_PAGE = 100
+
+
+class CursorError(ValueError):
+    """游标格式无效"""
+
+
+def encode_cursor(value):
+    """把排序键编码为 URL 安全的游标字符串"""
+    raw = json.dumps({'k': value}, separators=(',', ':'), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    解析游标
+
+    Raises:
+        CursorError: 游标格式无效
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))['k']
+    except (ValueError, KeyError, TypeError) as e:
+        raise CursorError(f'无效的分页游标: {cursor}') from e
+
+
+def parse_per_page(value, default=DEFAULT_PER_PAGE):
+    """解析每页数量，限制在 1 ~ MAX_PER_PAGE"""
+    try:
+        per_page = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(per_page, MAX_PER_PAGE))
+
+
+def keyset_paginate(query, column, *, descending=False, after=None, before=None,
+                    last=False, per_page=DEFAULT_PER_PAGE, total=None, key=None):
+    """
+    对 query 做键集分页
+
+    Args:
+        query: 已加好过滤条件、尚未排序的查询
+        column: 排序列（必须唯一，如 Client.id / Client.name）
+        descending: 是否按该列降序
+        after: 游标，返回排在它之后的一页（下一页）
+        before: 游标，返回排在它之前的一页（上一页）
+        last: 返回最后一页（需提供 total，使最后一页与页码对齐）
+        per_page: 每页数量
+        total: 结果总数，仅 last=True 时需要
+        key: 从结果行取排序键的函数，默认取 column 同名属性
+
+    Returns:
+        dict: {'items', 'next_cursor', 'prev_cursor'}
+    """
+    if key is None:
+        key = lambda row: getattr(row, column.key)
+
+    forward_order = column.desc() if descending else column.asc()
+    backward_order = column.asc() if descending else column.desc()
+
+    if last:
+        # 最后一页：倒序取余数条，保证与 OFFSET 分页的页码一致
+        size = per_page
+        if total:
+            size = total - ((total - 1) // per_page) * per_page
+        rows = query.order_by(backward_order).limit(size).all()
+        rows.reverse()
+        has_before = total is None or total > len(rows)
+        has_after = False
+    elif before is not None:
+        value = decode_cursor(before)
+        cond = column > value if descending else column < value
+        rows = query.filter(cond).order_by(backward_order).limit(per_page + 1).all()
+        has_before = len(rows) > per_page
+        rows = rows[:per_page]
+        rows.reverse()
+        has_after = True
+    else:
+        if after is not None:
+            value = decode_cursor(after)
+            query = query.filter(column < value if descending else column > value)
+        rows = query.order_by(forward_order).limit(per_page + 1).all()
+        has_after = len(rows) > per_page
+        rows = rows[:per_page]
+        has_before = after is not None
+
+    return {
+        'items': rows,
+        'next_cursor': encode_cursor(key(rows[-1])) if rows and has_after else None,
+        'prev_cursor': encode_cursor(key(rows[0])) if rows and has_before else None,
+    }
+
+
+class CountCache:
+    """按 (范围, 搜索词, 数据版本号) 缓存 COUNT 结果"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_count(self, scope, q, query):
+        """
+        返回 query 的总数；同一数据版本内相同搜索条件只执行一次 COUNT
+
+        Args:
+            scope: 区分不同接口 / 过滤条件的名称
+            q: 搜索词
+            query: 用于计数的查询（未排序）
+        """
+        version = current_data_version()
+        cache_key = (scope, q, version)
+        with self._lock:
+            if cache_key in self._entries:
+                self._entries.move_to_end(cache_key)
+                return self._entries[cache_key]
+
+        total = query.order_by(None).count()
+
+        with self._lock:
+            self._entries[cache_key] = total
+            # 旧版本的条目不会再命中，按 LRU 淘汰
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return total
+
+
+# 进程级总数缓存
+count_cache = CountCache()
@@ -0,0 +1,211 @@
+# utils/push_hub.py
+"""
+服务端推送中心
+- 多路复用: 一个连接承载多个主题（clients / service / metrics）
+- 发布方只计算一次，所有订阅者共享同一份消息
+- 内容未变化的消息不会重复发布
+"""
+import json
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """单个订阅者（对应一个 SSE 连接）"""
+
+    def __init__(self, hub, max_pending=100):
+        self.hub = hub
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.closed = False
+
+    def deliver(self, message):
+        """
+        投递消息，队列满说明客户端消费过慢：直接断开，由浏览器自动重连
+
+        Returns:
+            bool: 是否投递成功
+        """
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except queue.Full:
+            self.closed = True
+            return False
+
+    def get(self, timeout):
+        """等待下一条消息，超时返回 None"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.closed = True
+        self.hub.unsubscribe(self)
+
+
+class PushHub:
+    """主题发布 / 订阅中心"""
+
+    def __init__(self, max_subscribers=None):
+        self.lock = threading.Lock()
+        # 🆕 同时在线的订阅者上限（每个 SSE 连接长期占用一个请求线程）
+        self.max_subscribers = max_subscribers
+        self.rejected = 0
+        self.subscribers = set()
+        self.sequence = 0
+        self.last_payloads = {}     # topic -> 最近一次发布的 payload（JSON 字符串）
+        self.published = 0          # 已发布消息数（统计用）
+
+    def subscribe(self, max_pending=100):
+        """
+        新建订阅
+
+        Returns:
+            Subscription: 订阅者；已达到 max_subscribers 时返回 None
+        """
+        sub = Subscription(self, max_pending=max_pending)
+        with self.lock:
+            if self.max_subscribers is not None and len(self.subscribers) >= self.max_subscribers:
+                self.rejected += 1
+                return None
+            self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            self.subscribers.discard(sub)
+
+    def subscriber_count(self):
+        with self.lock:
+            return len(self.subscribers)
+
+    def publish(self, topic, payload, only_if_changed=True):
+        """
+        发布消息
+
+        Args:
+            topic: 主题名
+            payload: 可 JSON 序列化的数据
+            only_if_changed: 与该主题上一次内容相同时不发布
+
+        Returns:
+            bool: 是否实际发布
+        """
+        data = json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str)
+
+        with self.lock:
+            if only_if_changed and self.last_payloads.get(topic) == data:
+                return False
+            self.last_payloads[topic] = data
+            self.sequence += 1
+            message = (self.sequence, topic, data)
+            subscribers = list(self.subscribers)
+            self.published += 1
+
+        dropped = [sub for sub in subscribers if not sub.deliver(message)]
+        if dropped:
+            with self.lock:
+                self.subscribers.difference_update(dropped)
+            logger.warning(f"⚠️ {len(dropped)} 个推送订阅者消费过慢，已断开")
+        return True
+
+    def last_messages(self, topics=None):
+        """获取各主题最近一次的内容，用于新订阅者的初始状态"""
+        with self.lock:
+            return [
+                (self.sequence, topic, data)
+                for topic, data in self.last_payloads.items()
+                if topics is None or topic in topics
+            ]
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'subscribers': len(self.subscribers),
+                'max_subscribers': self.max_subscribers,
+                'rejected': self.rejected,
+                'sequence': self.sequence,
+                'published': self.published,
+                'topics': sorted(self.last_payloads)
+            }
+
+
+def format_sse(message):
+    """把 (sequence, topic, data) 编码为 SSE 帧"""
+    sequence, topic, data = message
+    return f"id: {sequence}\nevent: {topic}\ndata: {data}\n\n"
+
+
+class PushPublisher:
+    """
+    后台发布线程
+
+    按各自周期运行注册的数据源；没有订阅者时不做任何计算，
+    因此服务器负载与打开页面的管理员数量无关。
+    """
+
+    def __init__(self, hub, app=None, tick=0.5):
+        self.hub = hub
+        self.app = app
+        self.tick = tick
+        self.sources = []           # [name, interval, callable, reset, next_run]
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_source(self, name, interval, func, reset=None):
+        """
+        注册数据源
+
+        Args:
+            name: 数据源名称（日志用）
+            interval: 运行周期（秒）
+            func: 无参函数，内部自行调用 hub.publish
+            reset: 订阅者全部断开时调用，用于清理增量基线
+        """
+        self.sources.append([name, interval, func, reset, 0.0])
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='push-publisher', daemon=True)
+        self._thread.start()
+        logger.info(f"✅ 推送发布线程已启动 ({len(self.sources)} 个数据源)")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.tick * 4)
+
+    def _run(self):
+        idle = True
+        while not self._stop.wait(self.tick):
+            if self.hub.subscriber_count() == 0:
+                if not idle:
+                    for source in self.sources:
+                        if source[3]:
+                            source[3]()
+                        source[4] = 0.0
+                    idle = True
+                continue
+            idle = False
+
+            now = time.monotonic()
+            for source in self.sources:
+                name, interval, func, _, next_run = source
+                if now < next_run:
+                    continue
+                source[4] = now + interval
+                try:
+                    if self.app is not None:
+                        with self.app.app_context():
+                            func()
+                    else:
+                        func()
+                except Exception as e:
+                    logger.error(f"❌ 推送数据源 {name} 执行失败: {e}")
@@ -0,0 +1,363 @@
+"""
+🆕 用户组分时段限速调度器
+
+用户组可以挂多个时段（GroupRateSchedule），例如工作时间 10Mbit、夜间与周末 50Mbit。
+
+- 时段使用服务器本地时间；同一用户组有多个时段同时生效时，开始时间最晚的优先
+  （例如 "午休 12:00-13:00" 覆盖 "工作时间 09:00-18:00"），相同时按 id 取后建的
+- 不在任何时段内时使用用户组本身的 upload_rate / download_rate
+- 导出器渲染速率表时通过 effective_rates() 取当前生效的速率，
+  数据库中的用户组基础速率不会被改写
+- 后台线程睡眠到下一个时段边界，边界处只计算一次生效时段；
+  所有速率变化的用户组合并为一次 apply_tc_changes()：
+  一次写速率表 + 一条批量控制请求 → 引擎一次调和、一次 tc -batch，与在线人数无关
+"""
+import logging
+import threading
+import time as _time
+from datetime import datetime, time, timedelta
+
+logger = logging.getLogger(__name__)
+
+# 即使没有边界也定期重新检查（应对系统时间调整）
+RECHECK_INTERVAL = 60
+
+# 应用失败后的重试间隔（秒）
+RETRY_INTERVAL = 10
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_days(value):
+    """
+    解析星期集合
+
+    Args:
+        value: [1, 2, 3] 或 "1-5,7"（ISO 星期，1 = 周一 … 7 = 周日）
+
+    Returns:
+        tuple: 去重排序后的星期
+
+    Raises:
+        ValueError: 格式无效或为空
+    """
+    try:
+        if isinstance(value, str):
+            days = set()
+            for part in value.split(','):
+                part = part.strip()
+                if not part:
+                    continue
+                first, sep, last = part.partition('-')
+                if sep:
+                    days.update(range(int(first), int(last) + 1))
+                else:
+                    days.add(int(part))
+        elif isinstance(value, (list, tuple)):
+            days = {int(day) for day in value}
+        else:
+            raise TypeError(value)
+    except (TypeError, ValueError):
+        raise ValueError('days 必须是星期列表或 "1-5,7" 格式的字符串')
+    if not days or not all(1 <= day <= 7 for day in days):
+        raise ValueError('days 必须是 1 ~ 7 的星期（1 = 周一）')
+    return tuple(sorted(days))
+
+
+def parse_clock(value):
+    """
+    "HH:MM" → 当天的分钟数
+
+    Raises:
+        ValueError: 格式无效
+    """
+    hours, sep, minutes = (value or '').strip().partition(':')
+    if not sep or not hours.isdigit() or not minutes.isdigit() or len(minutes) != 2:
+        raise ValueError(f'无效的时间: {value!r}，应为 HH:MM')
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours <= 23 and 0 <= minutes <= 59):
+        raise ValueError(f'无效的时间: {value!r}，应为 HH:MM')
+    return hours * 60 + minutes
+
+
+class ScheduleWindow:
+    """一个已启用的时段（从数据库加载后的只读副本）"""
+
+    __slots__ = ('id', 'group_id', 'group_name', 'name', 'days', 'start', 'length',
+                 'upload_rate', 'download_rate')
+
+    def __init__(self, id, group_id, group_name, name, days, start_time, end_time,
+                 upload_rate, download_rate):
+        self.id = id
+        self.group_id = group_id
+        self.group_name = group_name
+        self.name = name
+        self.days = frozenset(parse_days(days))
+        self.start = parse_clock(start_time)
+        # 结束早于开始表示跨零点；两者相等表示全天
+        self.length = (parse_clock(end_time) - self.start) % MINUTES_PER_DAY or MINUTES_PER_DAY
+        self.upload_rate = upload_rate.strip()
+        self.download_rate = download_rate.strip()
+
+    def _occurrence(self, day):
+        start = datetime.combine(day, time()) + timedelta(minutes=self.start)
+        return start, start + timedelta(minutes=self.length)
+
+    def active_since(self, now):
+        """当前所处这次时段的开始时间；不在时段内返回 None"""
+        for offset in (0, 1):   # 今天开始的，或昨天开始、跨零点的
+            day = now.date() - timedelta(days=offset)
+            if day.isoweekday() not in self.days:
+                continue
+            start, end = self._occurrence(day)
+            if start <= now < end:
+                return start
+        return None
+
+    def next_boundary(self, now):
+        """now 之后最近的开始或结束时间"""
+        for offset in range(-1, 8):
+            day = now.date() + timedelta(days=offset)
+            if day.isoweekday() not in self.days:
+                continue
+            for moment in self._occurrence(day):
+                if moment > now:
+                    return moment
+        return None
+
+
+def resolve_active(windows, now):
+    """
+    计算每个用户组当前生效的时段
+
+    Returns:
+        dict: {group_id: ScheduleWindow}
+    """
+    best = {}
+    for window in windows:
+        since = window.active_since(now)
+        if since is None:
+            continue
+        key = (since, window.id)
+        current = best.get(window.group_id)
+        if current is None or key > current[0]:
+            best[window.group_id] = (key, window)
+    return {group_id: window for group_id, (_, window) in best.items()}
+
+
+class RateScheduler:
+    """分时段限速调度器（进程级单例，见 get_rate_scheduler()）"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self.lock = threading.Lock()
+        self._apply_lock = threading.Lock()     # 串行化 tick()（后台线程与接口请求）
+        self.windows = []
+        self.loaded = False
+        # group_id -> (schedule_id, upload_rate, download_rate)：导出器据此渲染
+        self.active = {}
+
+        self._wake = threading.Event()
+        self._thread = None
+        self._stop = False
+        self._retry = False
+
+        # 统计
+        self.transitions = 0
+        self.last_transition = None
+
+    # ------------------------------------------------------------------
+    # 时段模型
+    # ------------------------------------------------------------------
+    def reload(self, bind=None):
+        """
+        从数据库重新加载已启用的时段（按列查询，不加载 ORM 对象）
+
+        Args:
+            bind: 任意 SQLAlchemy Session / Connection，默认 db.session
+        """
+        from sqlalchemy import select
+        from models import db, ClientGroup, GroupRateSchedule
+
+        bind = bind if bind is not None else db.session
+        rows = bind.execute(
+            select(
+                GroupRateSchedule.id, GroupRateSchedule.group_id, ClientGroup.name.label('group_name'),
+                GroupRateSchedule.name, GroupRateSchedule.days,
+                GroupRateSchedule.start_time, GroupRateSchedule.end_time,
+                GroupRateSchedule.upload_rate, GroupRateSchedule.download_rate,
+            )
+            .join(ClientGroup, ClientGroup.id == GroupRateSchedule.group_id)
+            .where(GroupRateSchedule.enabled.is_(True))
+        ).all()
+
+        windows = []
+        for row in rows:
+            try:
+                windows.append(ScheduleWindow(*row))
+            except ValueError as e:
+                logger.warning(f"⚠️ 跳过无效的限速时段 {row.id}: {e}")
+        with self.lock:
+            self.windows = windows
+            self.loaded = True
+        self._wake.set()
+
+    def effective_rates(self, group_id, upload_rate, download_rate):
+        """用户组当前生效的 (上行, 下行) 速率；没有生效时段时返回基础速率"""
+        with self.lock:
+            active = self.active.get(group_id)
+        if active is None:
+            return upload_rate, download_rate
+        return active[1], active[2]
+
+    def active_schedule_ids(self):
+        """{group_id: 当前生效的 schedule_id}"""
+        with self.lock:
+            return {group_id: value[0] for group_id, value in self.active.items()}
+
+    def next_transition(self, now=None):
+        now = now or datetime.now()
+        with self.lock:
+            windows = list(self.windows)
+        boundaries = [b for b in (w.next_boundary(now) for w in windows) if b is not None]
+        return min(boundaries) if boundaries else None
+
+    # ------------------------------------------------------------------
+    # 切换
+    # ------------------------------------------------------------------
+    def tick(self, now=None, timeout=None):
+        """
+        重新计算生效时段；有用户组的速率变化时批量应用
+
+        Returns:
+            dict | None: 应用结果（见 apply_tc_changes()，附带 groups），没有变化时为 None
+        """
+        from utils.tc_config_exporter import apply_tc_changes, get_exporter
+
+        with self._apply_lock:
+            now = now or datetime.now()
+            with self.lock:
+                windows = list(self.windows)
+                previous = self.active
+            active = {
+                group_id: (window.id, window.upload_rate, window.download_rate)
+                for group_id, window in resolve_active(windows, now).items()
+            }
+            changed = sorted(
+                group_id for group_id in set(previous) | set(active)
+                if previous.get(group_id) != active.get(group_id)
+            )
+            if not changed and not self._retry:
+                return None
+
+            with self.lock:
+                self.active = active
+
+            # 组名以导出器模型为准（用户组可能已改名）
+            names = {window.group_id: window.group_name for window in windows}
+            exporter_groups = get_exporter().groups
+            roles = []
+            for group_id in changed:
+                name = exporter_groups.get(group_id, (names.get(group_id),))[0]
+                if name and name not in roles:
+                    roles.append(name)
+
+            started = _time.monotonic()
+            result = apply_tc_changes(role_updates=roles, timeout=timeout)
+            # 写速率表失败：恢复旧状态，稍后重试
+            self._retry = result['status'] == 'failed'
+            if self._retry:
+                with self.lock:
+                    self.active = previous
+
+            result = dict(result, groups=roles)
+            self.transitions += 1
+            self.last_transition = {
+                'at': now.isoformat(timespec='seconds'),
+                'groups': roles,
+                'status': result['status'],
+                'latency_ms': result.get('latency_ms'),
+                'elapsed_ms': round((_time.monotonic() - started) * 1000, 1),
+            }
+            logger.info(
+                f"🕒 限速时段切换: {', '.join(roles) or '-'} → {result['status']} "
+                f"({self.last_transition['elapsed_ms']} ms)"
+            )
+            return result
+
+    # ------------------------------------------------------------------
+    # 后台线程
+    # ------------------------------------------------------------------
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='rate-scheduler', daemon=True)
+        self._thread.start()
+        logger.info("✅ 分时段限速调度器已启动")
+
+    def stop(self):
+        self._stop = True
+        self._wake.set()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop:
+            try:
+                if self.app is not None:
+                    with self.app.app_context():
+                        self._cycle()
+                else:
+                    self._cycle()
+            except Exception as e:
+                logger.error(f"❌ 分时段限速调度失败: {e}")
+                self._retry = True
+
+            now = datetime.now()
+            delay = RETRY_INTERVAL if self._retry else RECHECK_INTERVAL
+            boundary = self.next_transition(now)
+            if boundary is not None:
+                # 稍晚于边界醒来，保证 tick() 看到的是边界之后的状态
+                delay = min(delay, (boundary - now).total_seconds() + 0.05)
+            self._wake.wait(max(delay, 0.05))
+            self._wake.clear()
+
+    def _cycle(self):
+        if not self.loaded:
+            self.reload()
+        self.tick()
+
+    def get_stats(self):
+        boundary = self.next_transition()
+        with self.lock:
+            return {
+                'running': self._thread is not None and self._thread.is_alive(),
+                'schedules': len(self.windows),
+                'active_groups': len(self.active),
+                'next_transition': boundary.isoformat(timespec='seconds') if boundary else None,
+                'transitions': self.transitions,
+                'last_transition': self.last_transition,
+            }
+
+
+# 进程级单例
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_rate_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RateScheduler()
+        return _scheduler
+
+
+def start_rate_scheduler(app):
+    """记录应用实例（后台线程需要应用上下文查询数据库）并启动调度线程"""
+    scheduler = get_rate_scheduler()
+    scheduler.app = app
+    scheduler.start()
+    return scheduler
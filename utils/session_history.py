@@ -0,0 +1,283 @@
+"""
+🆕 客户端连接会话历史：相邻两次在线快照的差异 → client_sessions
+
+status.log 每次更新时（由 openvpn_monitor.client_rates.StatusLogReader 统一读取后
+推送给 on_status()）与上一份快照比较，客户端以 (名称, 连接时间) 标识一次连接:
+
+- 新出现的连接插入一行（ended_at 为空）
+- 消失的连接、或同一客户端的连接时间变化（重连）时结束旧会话：
+  写入断开时间（最后一次在快照中看到的时间）、时长与本次连接的累计字节
+- 同一份快照产生的全部开始 / 结束在一个事务中批量写入；没有人上下线时不写数据库
+- Web 进程重启后从 ended_at 为空的行恢复在线会话，已不在线的在第一份快照时结束
+- 开始于 SESSION_RETENTION_DAYS 天之前且已结束的会话分批删除（走 started_at 索引）
+
+时间统一按 UTC 存储（不带时区）。
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from openvpn_monitor.config import Config
+from utils.db_writer import get_db_writer
+
+logger = logging.getLogger(__name__)
+
+# 保留期清理每批删除的行数
+DELETE_BATCH = 5000
+
+
+def utc_naive(value):
+    """带时区的时间 / Unix 秒 → 不带时区的 UTC 时间（与数据库中的存储一致）"""
+    if isinstance(value, (int, float)):
+        value = datetime.fromtimestamp(value, tz=timezone.utc)
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _write_sessions(conn, opens, closes):
+    """写入任务（单写入者线程中执行）：本次快照的开始 / 结束"""
+    from sqlalchemy import bindparam, insert, update
+    from models import ClientSession
+
+    table = ClientSession.__table__
+    if opens:
+        conn.execute(insert(table), opens)
+    if closes:
+        conn.execute(
+            update(table)
+            .where(table.c.client_name == bindparam('b_name'),
+                   table.c.started_at == bindparam('b_started'),
+                   table.c.ended_at.is_(None))
+            .values(ended_at=bindparam('ended_at'), duration_sec=bindparam('duration_sec'),
+                    bytes_recv=bindparam('bytes_recv'), bytes_sent=bindparam('bytes_sent')),
+            closes
+        )
+
+
+class SessionRecorder:
+    """会话记录器（进程级单例，见 get_session_recorder()）"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self.lock = threading.Lock()
+
+        # name -> {'started_at', 'real_ip', 'vpn_ip', 'bytes_recv', 'bytes_sent', 'last_seen'}
+        self.open = {}
+        self.loaded = False
+        # 写入失败时保留，下一次一起写
+        self._pending_opens = []
+        self._pending_closes = []
+
+        self._last_compact = 0.0
+
+        # 统计
+        self.opened = 0
+        self.closed = 0
+        self.last_write = None
+        self.last_compact = None
+
+    # ------------------------------------------------------------------
+    # 快照差异
+    # ------------------------------------------------------------------
+    def _load(self):
+        """从数据库恢复仍在线的会话"""
+        from sqlalchemy import select
+        from models import db, ClientSession
+
+        rows = db.session.execute(
+            select(ClientSession.client_name, ClientSession.started_at,
+                   ClientSession.real_ip, ClientSession.vpn_ip)
+            .where(ClientSession.ended_at.is_(None))
+        ).all()
+        with self.lock:
+            for row in rows:
+                self.open.setdefault(row.client_name, {
+                    'started_at': row.started_at,
+                    'real_ip': row.real_ip,
+                    'vpn_ip': row.vpn_ip,
+                    'bytes_recv': None,
+                    'bytes_sent': None,
+                    'last_seen': None,
+                })
+            self.loaded = True
+
+    def ingest(self, snapshot, ts=None):
+        """
+        处理一份在线快照（status.log 或 management 接口）
+
+        Args:
+            snapshot: {name: {'since', 'real_ip', 'vpn_ip', 'bytes_recv', 'bytes_sent'}}
+            ts: 快照时间（Unix 秒），默认当前时间
+
+        Returns:
+            tuple: (开始的会话数, 结束的会话数)
+        """
+        from utils.openvpn_utils import parse_connected_since
+
+        now = utc_naive(time.time() if ts is None else ts)
+        opens, closes = [], []
+        with self.lock:
+            for name, client in snapshot.items():
+                started = parse_connected_since(client['since'])
+                if started is None:
+                    continue
+                started = utc_naive(started)
+                current = self.open.get(name)
+                if current is not None and current['started_at'] != started:
+                    # 重连：旧会话在新会话开始前结束
+                    closes.append(self._close(name, current, min(current['last_seen'] or started, started)))
+                    current = None
+                if current is None:
+                    current = {'started_at': started}
+                    self.open[name] = current
+                    opens.append({
+                        'client_name': name,
+                        'real_ip': client.get('real_ip'),
+                        'vpn_ip': client.get('vpn_ip'),
+                        'started_at': started,
+                    })
+                current.update(
+                    real_ip=client.get('real_ip'),
+                    vpn_ip=client.get('vpn_ip'),
+                    bytes_recv=client.get('bytes_recv'),
+                    bytes_sent=client.get('bytes_sent'),
+                    last_seen=now,
+                )
+            for name in [name for name in self.open if name not in snapshot]:
+                current = self.open[name]
+                closes.append(self._close(name, current, current['last_seen'] or now))
+
+            opens, self._pending_opens = self._pending_opens + opens, []
+            closes, self._pending_closes = self._pending_closes + closes, []
+
+        if opens or closes:
+            self._write(opens, closes)
+        return len(opens), len(closes)
+
+    def _close(self, name, session, ended):
+        del self.open[name]
+        return {
+            'b_name': name,
+            'b_started': session['started_at'],
+            'ended_at': ended,
+            'duration_sec': max(int((ended - session['started_at']).total_seconds()), 0),
+            'bytes_recv': session['bytes_recv'],
+            'bytes_sent': session['bytes_sent'],
+        }
+
+    def _write(self, opens, closes):
+        """一个事务批量写入本次快照的开始 / 结束"""
+        started = time.monotonic()
+        try:
+            get_db_writer().run(_write_sessions, opens, closes)
+        except Exception:
+            with self.lock:
+                self._pending_opens = opens + self._pending_opens
+                self._pending_closes = closes + self._pending_closes
+            raise
+
+        self.opened += len(opens)
+        self.closed += len(closes)
+        self.last_write = {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'opened': len(opens),
+            'closed': len(closes),
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 1),
+        }
+
+    def on_status(self, snapshot, ts):
+        """status.log 快照回调（StatusLogReader 订阅者）"""
+        if self.app is not None:
+            with self.app.app_context():
+                self._on_status(snapshot, ts)
+        else:
+            self._on_status(snapshot, ts)
+
+    def _on_status(self, snapshot, ts):
+        if not self.loaded:
+            self._load()
+        self.ingest(snapshot, ts)
+
+    def record_sample(self, sample=None):
+        """采样器回调：到期时清理保留期外的会话"""
+        try:
+            if self.app is not None:
+                with self.app.app_context():
+                    self._cycle()
+            else:
+                self._cycle()
+        except Exception as e:
+            logger.error(f"❌ 记录连接会话失败: {e}")
+
+    def _cycle(self):
+        now = time.monotonic()
+        if now - self._last_compact >= Config.SESSION_RETENTION_INTERVAL:
+            self._last_compact = now
+            self.compact()
+
+    # ------------------------------------------------------------------
+    # 保留期
+    # ------------------------------------------------------------------
+    def compact(self, now=None):
+        """分批删除开始时间早于保留期、且已结束的会话；返回删除的行数"""
+        from sqlalchemy import delete, select
+        from models import ClientSession
+
+        now = now or datetime.now(timezone.utc)
+        cutoff = utc_naive(now) - timedelta(days=Config.SESSION_RETENTION_DAYS)
+        started = time.monotonic()
+        removed = 0
+        while True:
+            batch = select(ClientSession.id).where(
+                ClientSession.started_at < cutoff, ClientSession.ended_at.isnot(None)
+            ).limit(DELETE_BATCH).scalar_subquery()
+            count = get_db_writer().execute(delete(ClientSession).where(ClientSession.id.in_(batch)))
+            removed += count
+            if count < DELETE_BATCH:
+                break
+
+        self.last_compact = {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'removed': removed,
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 1),
+        }
+        if removed:
+            logger.info(f"🧹 连接会话保留期清理: {removed} 条 ({self.last_compact['elapsed_ms']} ms)")
+        return removed
+
+    def get_stats(self):
+        with self.lock:
+            online = len(self.open)
+            pending = len(self._pending_opens) + len(self._pending_closes)
+        return {
+            'online_sessions': online,
+            'pending_writes': pending,
+            'opened': self.opened,
+            'closed': self.closed,
+            'last_write': self.last_write,
+            'last_compact': self.last_compact,
+            'retention_days': Config.SESSION_RETENTION_DAYS,
+        }
+
+
+# 进程级单例
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_session_recorder():
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = SessionRecorder()
+        return _recorder
+
+
+def init_session_history(app):
+    """记录应用实例（采样器线程需要应用上下文访问数据库）并订阅 status.log 快照"""
+    from openvpn_monitor.client_rates import get_status_reader
+
+    recorder = get_session_recorder()
+    recorder.app = app
+    get_status_reader().subscribe(recorder.on_status)
+    return recorder
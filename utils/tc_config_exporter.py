@@ -1,9 +1,24 @@
 """
 TC 配置文件导出工具
 负责将数据库中的用户组和客户端数据导出为守护进程可读的配置文件
+
+🆕 增量 / 原子 / 去抖动导出:
+- 内存中维护两份文件对应的模型（用户组速率、客户端→用户组），
+  ORM 提交后按变更增量更新，批量 UPDATE 时标记失效并按列查询全量重建
+- 渲染结果计算内容哈希，与上次写入相同时跳过写盘
+- 先写临时文件再 rename，守护进程不会读到写了一半的文件
+- request_tc_export() 把短时间内的多次变更合并为一次写入，
+  排队的热更新信号在文件写入之后再发送
+- 🆕 额外导出预先计算好的速率表 tc-rates.tbl（客户端 → 上下行速率），
+  首行为内容版本号，守护进程只在版本变化时重新加载，查速率不再 grep
+- 🆕 apply_tc_changes() 同步写入并通过控制通道等待引擎确认生效
+- 🆕 处于限速时段内的用户组按时段速率导出（utils.rate_scheduler）
 """
+import hashlib
 import logging
 import os
+import tempfile
+import threading
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
@@ -11,11 +26,446 @@ logger = logging.getLogger(__name__)
 # 配置文件路径
 USER_RATE_CONF = "/etc/openvpn/tc-users.conf"
 USER_ROLE_MAP = "/etc/openvpn/tc-roles.map"
+RATE_TABLE = "/etc/openvpn/tc-rates.tbl"
+
+# 速率表首行: "#version=<内容哈希前 16 位>"
+RATE_TABLE_VERSION_PREFIX = "#version="
+
+# 去抖动延迟（秒）：窗口内的多次变更合并为一次写入
+EXPORT_DEBOUNCE = 0.5
+
+# Session.info 中暂存的待应用变更
+_CHANGES_KEY = 'tc_export_changes'
+_INVALIDATE_KEY = 'tc_export_invalidate'
+
+
+def _atomic_write(path, content):
+    """写临时文件 → fsync → rename，保证读者看到的要么是旧文件要么是新文件"""
+    directory = os.path.dirname(path)
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _content_hash(content):
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def _group_aggregate(upload_rate, upload_ceil, download_rate, download_ceil, priority):
+    """🆕 用户组聚合限速 → (rate_up, ceil_up, rate_down, ceil_down, prio)；未配置时为 None"""
+    if not upload_rate or not download_rate:
+        return None
+    return (
+        upload_rate.strip(), (upload_ceil or upload_rate).strip(),
+        download_rate.strip(), (download_ceil or download_rate).strip(),
+        priority if priority is not None else 0,
+    )
+
+
+def _group_queue(leaf_qdisc, burst_ms):
+    """🆕 成员 class 的队列参数 → (leaf, burst_ms)；都未配置（使用全局默认）时为 None"""
+    if not leaf_qdisc and not burst_ms:
+        return None
+    return (leaf_qdisc or None, burst_ms or None)
+
+
+def _group_line(name, aggregate, queue):
+    """🆕 速率表中的 @group 行；聚合限速与队列参数都未配置时为 None"""
+    values = []
+    if aggregate is not None:
+        values.append(
+            f"rate_up={aggregate[0]} ceil_up={aggregate[1]} "
+            f"rate_down={aggregate[2]} ceil_down={aggregate[3]} prio={aggregate[4]}"
+        )
+    if queue is not None:
+        leaf, burst_ms = queue
+        if leaf:
+            values.append(f"leaf={leaf}")
+        if burst_ms:
+            values.append(f"burst_ms={burst_ms}")
+    if not values:
+        return None
+    return f"@group\t{name}\t{' '.join(values)}"
+
+
+class TcConfigExporter:
+    """TC 配置导出器（进程级单例，见 get_exporter()）"""
+
+    def __init__(self, debounce=EXPORT_DEBOUNCE):
+        self.debounce = debounce
+        self.lock = threading.RLock()
+        self.app = None
+
+        # 内存模型
+        self.groups = {}        # group_id -> (name, upload_rate, download_rate, aggregate, queue)
+        self.members = {}       # client_id -> (client_name, group_id)
+        self.loaded = False
+
+        # path -> 最近一次写入（或磁盘上已有）内容的哈希
+        self.written_hashes = {}
+
+        # 去抖动状态
+        self._timer = None
+        self._pending_users = {}    # name -> vpn_ip
+        self._pending_roles = []
+
+        # 统计
+        self.writes = 0
+        self.skipped = 0
+
+    def init_app(self, app):
+        """记录应用实例，后台去抖动线程需要应用上下文来重建模型"""
+        self.app = app
+
+    # ------------------------------------------------------------------
+    # 内存模型
+    # ------------------------------------------------------------------
+    def rebuild(self, bind=None):
+        """
+        按列查询全量重建模型（不加载 ORM 对象）
+
+        Args:
+            bind: 任意 SQLAlchemy Session / Connection，默认 db.session
+        """
+        from sqlalchemy import select
+        from models import db, ClientGroup, Client
+
+        bind = bind if bind is not None else db.session
+        group_rows = bind.execute(select(
+            ClientGroup.id, ClientGroup.name, ClientGroup.upload_rate, ClientGroup.download_rate,
+            ClientGroup.aggregate_upload_rate, ClientGroup.aggregate_upload_ceil,
+            ClientGroup.aggregate_download_rate, ClientGroup.aggregate_download_ceil,
+            ClientGroup.priority, ClientGroup.leaf_qdisc, ClientGroup.burst_ms,
+        )).all()
+        member_rows = bind.execute(
+            select(Client.id, Client.name, Client.group_id).where(Client.group_id.isnot(None))
+        ).all()
+
+        with self.lock:
+            self.groups = {
+                row.id: (
+                    row.name, row.upload_rate.strip(), row.download_rate.strip(),
+                    _group_aggregate(
+                        row.aggregate_upload_rate, row.aggregate_upload_ceil,
+                        row.aggregate_download_rate, row.aggregate_download_ceil, row.priority
+                    ),
+                    _group_queue(row.leaf_qdisc, row.burst_ms),
+                )
+                for row in group_rows
+            }
+            self.members = {row.id: (row.name, row.group_id) for row in member_rows}
+            self.loaded = True
+
+    def invalidate(self):
+        """模型失效，下次导出前全量重建"""
+        with self.lock:
+            self.loaded = False
+
+    def apply_changes(self, changes):
+        """
+        增量应用 ORM 变更（模型未加载时忽略，重建时会读到最新数据）
+
+        Args:
+            changes: [('group', id, name, up, down, aggregate, queue) | ('group_deleted', id) |
+                      ('member', client_id, client_name, group_id)]
+        """
+        with self.lock:
+            if not self.loaded:
+                return
+            for change in changes:
+                kind = change[0]
+                if kind == 'group':
+                    _, group_id, name, upload, download, aggregate, queue = change
+                    self.groups[group_id] = (
+                        name, (upload or '').strip(), (download or '').strip(), aggregate, queue
+                    )
+                elif kind == 'group_deleted':
+                    group_id = change[1]
+                    self.groups.pop(group_id, None)
+                    # 外键 ON DELETE SET NULL
+                    for client_id in [cid for cid, (_, gid) in self.members.items() if gid == group_id]:
+                        del self.members[client_id]
+                elif kind == 'member':
+                    _, client_id, client_name, group_id = change
+                    if group_id is None:
+                        self.members.pop(client_id, None)
+                    else:
+                        self.members[client_id] = (client_name, group_id)
+
+    def render(self):
+        """
+        由内存模型生成各文件内容
+
+        🆕 用户组处于限速时段内时，使用时段速率（见 utils.rate_scheduler）
+        🆕 超出流量配额被降速的客户端使用降速速率（见 utils.traffic_quota）
+
+        Returns:
+            dict: {path: content}
+        """
+        from utils.rate_scheduler import get_rate_scheduler
+        from utils.traffic_quota import get_quota_enforcer
+
+        scheduler = get_rate_scheduler()
+        throttled = get_quota_enforcer().throttled_rates()
+        with self.lock:
+            groups = {
+                group_id: (name, *scheduler.effective_rates(group_id, upload, download), agg, queue)
+                for group_id, (name, upload, download, agg, queue) in self.groups.items()
+            }
+            lines_conf = [
+                f"{name}={upload} {download}"
+                for _, (name, upload, download, _, _) in sorted(groups.items())
+            ]
+            # 🆕 用户组聚合限速 / 队列参数: @group<TAB>组名<TAB>key=value ...（旧守护脚本忽略这些行）
+            lines_groups = [
+                line for line in (
+                    _group_line(name, agg, queue)
+                    for _, (name, _, _, agg, queue) in sorted(groups.items())
+                )
+                if line is not None
+            ]
+            members = [
+                (client_id, client_name, group_id, groups[group_id])
+                for client_id, (client_name, group_id) in sorted(self.members.items())
+                if group_id in groups
+            ]
+
+        lines_map = [f"{client_name}={group[0]}" for _, client_name, _, group in members]
+        # 速率表：组名放在最后一列，守护进程 `read client up down group` 可读入含空格的组名
+        lines_table = []
+        for client_id, client_name, group_id, (name, up, down, _, _) in members:
+            # 🆕 超出流量配额且处理方式为降速：仍在原用户组下，上下行使用降速速率
+            limited = throttled.get(client_id)
+            if limited is not None and limited[0] == group_id:
+                up = down = limited[1]
+            lines_table.append(f"{client_name} {up} {down} {name}")
+        body = '# client upload download group\n' + ''.join(line + '\n' for line in lines_groups + lines_table)
+
+        return {
+            # 格式: group_name=upload download
+            USER_RATE_CONF: '\n'.join(lines_conf) + '\n',
+            # 格式: client_name=group_name；没有任何客户端分组时为空文件
+            USER_ROLE_MAP: '\n'.join(lines_map) + '\n' if lines_map else '',
+            # 格式: 首行版本号，其后每行 client upload download group
+            RATE_TABLE: f"{RATE_TABLE_VERSION_PREFIX}{_content_hash(body)[:16]}\n" + body,
+        }
+
+    # ------------------------------------------------------------------
+    # 写盘
+    # ------------------------------------------------------------------
+    def _current_hash(self, path):
+        """上次写入的哈希；首次调用时读取磁盘上的已有文件"""
+        if path not in self.written_hashes:
+            try:
+                with open(path, 'r') as f:
+                    self.written_hashes[path] = _content_hash(f.read())
+            except OSError:
+                self.written_hashes[path] = None
+        return self.written_hashes[path]
+
+    def export(self, bind=None):
+        """
+        同步导出：必要时重建模型，只写内容有变化的文件
+
+        Returns:
+            bool: 是否导出成功
+        """
+        with self.lock:
+            if not self.loaded:
+                self.rebuild(bind)
+            contents = self.render()
+
+            for path, content in contents.items():
+                digest = _content_hash(content)
+                if digest == self._current_hash(path):
+                    self.skipped += 1
+                    continue
+                _atomic_write(path, content)
+                self.written_hashes[path] = digest
+                self.writes += 1
+        return True
+
+    # ------------------------------------------------------------------
+    # 去抖动
+    # ------------------------------------------------------------------
+    def request_export(self, user_updates=(), role_updates=()):
+        """
+        请求一次导出（去抖动），并在写入完成后发送热更新信号
+
+        Args:
+            user_updates: [(client_name, vpn_ip), ...] 需要热更新的在线客户端
+            role_updates: [group_name, ...] 速率变化的用户组
+        """
+        with self.lock:
+            for name, ip in user_updates:
+                if name and ip:
+                    self._pending_users[name] = ip
+            for role in role_updates:
+                if role and role not in self._pending_roles:
+                    self._pending_roles.append(role)
+
+            if self._timer is None:
+                self._timer = threading.Timer(self.debounce, self._flush_in_context)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_in_context(self):
+        if self.app is not None:
+            with self.app.app_context():
+                self.flush()
+        else:
+            self.flush()
+
+    def _take_and_export(self, user_updates=(), role_updates=()):
+        """取出排队的热更新并立即导出；返回 (是否成功, users, roles)"""
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            for name, ip in user_updates:
+                if name and ip:
+                    self._pending_users[name] = ip
+            for role in role_updates:
+                if role and role not in self._pending_roles:
+                    self._pending_roles.append(role)
+            users = list(self._pending_users.items())
+            roles = list(self._pending_roles)
+            self._pending_users.clear()
+            self._pending_roles.clear()
+
+            try:
+                self.export()
+            except Exception as e:
+                logger.error(f"❌ 导出 TC 配置失败: {e}")
+                # 文件未更新：模型可能与数据库不一致，下次重建
+                self.loaded = False
+                return False, users, roles
+        return True, users, roles
+
+    def flush(self):
+        """立即执行排队的导出，然后发送排队的热更新信号"""
+        from openvpn_monitor.tc_hotreload import notify_users_update, notify_role_update
+
+        ok, users, roles = self._take_and_export()
+        if not ok:
+            return False
+        if users:
+            notify_users_update(users)
+        for role in roles:
+            notify_role_update(role)
+        return True
+
+    def apply_now(self, user_updates=(), role_updates=(), timeout=None):
+        """
+        🆕 立即导出（连同排队的变更），并同步等待守护进程应用
+
+        Returns:
+            dict: 见 tc_hotreload.apply_rate_changes()
+        """
+        from openvpn_monitor.tc_hotreload import apply_rate_changes
+
+        ok, users, roles = self._take_and_export(user_updates, role_updates)
+        if not ok:
+            return {'status': 'failed', 'error': '导出 TC 配置失败', 'latency_ms': None}
+        return apply_rate_changes(users=users, roles=roles, timeout=timeout)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'loaded': self.loaded,
+                'groups': len(self.groups),
+                'members': len(self.members),
+                'writes': self.writes,
+                'skipped': self.skipped,
+                'pending': self._timer is not None,
+            }
+
+
+# 进程级单例
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = TcConfigExporter()
+        return _exporter
+
+
+def track_tc_changes(session_target):
+    """
+    监听会话事件，把 ClientGroup / Client.group_id 的变更增量应用到导出器模型
+
+    - after_flush: 收集新增 / 删除 / 字段变化
+    - do_orm_execute: 批量 UPDATE / DELETE 无法逐行跟踪，提交后整体失效
+    - after_commit: 应用变更；回滚时丢弃
+    """
+    from sqlalchemy import event, inspect
+    from models import ClientGroup, Client
+
+    def _after_flush(session, flush_context):
+        changes = session.info.setdefault(_CHANGES_KEY, [])
+        for obj in session.deleted:
+            if isinstance(obj, ClientGroup):
+                changes.append(('group_deleted', obj.id))
+            elif isinstance(obj, Client):
+                changes.append(('member', obj.id, obj.name, None))
+        for obj in list(session.new) + list(session.dirty):
+            if isinstance(obj, ClientGroup):
+                changes.append(('group', obj.id, obj.name, obj.upload_rate, obj.download_rate, _group_aggregate(
+                    obj.aggregate_upload_rate, obj.aggregate_upload_ceil,
+                    obj.aggregate_download_rate, obj.aggregate_download_ceil, obj.priority
+                ), _group_queue(obj.leaf_qdisc, obj.burst_ms)))
+            elif isinstance(obj, Client):
+                state = inspect(obj)
+                if obj in session.new or any(
+                    state.attrs[key].history.has_changes() for key in ('name', 'group_id')
+                ):
+                    changes.append(('member', obj.id, obj.name, obj.group_id))
+
+    def _do_orm_execute(state):
+        if not (state.is_update or state.is_delete):
+            return
+        mapper = state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, (ClientGroup, Client)):
+            state.session.info[_INVALIDATE_KEY] = True
+
+    def _after_commit(session):
+        changes = session.info.pop(_CHANGES_KEY, None)
+        invalidate = session.info.pop(_INVALIDATE_KEY, False)
+        exporter = get_exporter()
+        if invalidate:
+            exporter.invalidate()
+        elif changes:
+            exporter.apply_changes(changes)
+
+    def _after_rollback(session):
+        session.info.pop(_CHANGES_KEY, None)
+        session.info.pop(_INVALIDATE_KEY, None)
+
+    event.listen(session_target, 'after_flush', _after_flush)
+    event.listen(session_target, 'do_orm_execute', _do_orm_execute)
+    event.listen(session_target, 'after_commit', _after_commit)
+    event.listen(session_target, 'after_rollback', _after_rollback)
 
 
 def export_tc_config():
     """
-    导出 TC 配置文件
+    导出 TC 配置文件（同步）
     
     生成两个文件:
     1. /etc/openvpn/tc-users.conf - 用户组速率配置
@@ -26,72 +476,69 @@ def export_tc_config():
        格式: client_name=group_name
        例如: alice=vip_users
     
+    3. /etc/openvpn/tc-rates.tbl - 🆕 客户端速率表（守护进程按版本号加载）
+       格式: 首行 #version=<哈希>，其后 client_name upload download group_name
+       例如: alice 10Mbit 50Mbit vip_users
+       配置了聚合限速的用户组另有一行（TAB 分隔）:
+       @group	vip_users	rate_up=50Mbit ceil_up=80Mbit rate_down=100Mbit ceil_down=200Mbit prio=4
+       覆盖了叶子队列 / burst 的用户组在同一行追加 leaf=cake burst_ms=20（可单独出现）
+    
+    内容未变化的文件不会重写；需要合并多次变更时使用 request_tc_export()。
+
     Returns:
         bool: 是否导出成功
     """
     try:
-        # 延迟导入，避免循环依赖
-        from models import db, ClientGroup, Client
-        
-        # ========== 生成 tc-users.conf ==========
-        groups = ClientGroup.query.all()
-        
-        lines_conf = []
-        for group in groups:
-            # 提取速率值（去掉可能的单位，统一格式）
-            upload = group.upload_rate.strip()
-            download = group.download_rate.strip()
-            
-            # 格式: group_name=upload download
-            lines_conf.append(f"{group.name}={upload} {download}")
-        
-        # 确保目录存在
-        conf_path = Path(USER_RATE_CONF)
-        conf_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        # 写入文件
-        with open(USER_RATE_CONF, 'w') as f:
-            f.write('\n'.join(lines_conf) + '\n')
-        
-        # logger.info(f"✅ 已导出 {len(groups)} 个用户组到 {USER_RATE_CONF}")
-        
-        # ========== 生成 tc-roles.map ==========
-        # 只导出有分组的客户端
-        clients = Client.query.filter(Client.group_id.isnot(None)).all()
-        
-        lines_map = []
-        for client in clients:
-            if client.group:  # 确保有关联的用户组
-                lines_map.append(f"{client.name}={client.group.name}")
-        
-        # 确保目录存在
-        map_path = Path(USER_ROLE_MAP)
-        map_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        # 写入文件
-        with open(USER_ROLE_MAP, 'w') as f:
-            if lines_map:
-                f.write('\n'.join(lines_map) + '\n')
-            else:
-                # 如果没有任何客户端分组，写入空文件
-                f.write('')
-        
-        # logger.info(f"✅ 已导出 {len(clients)} 个客户端映射到 {USER_ROLE_MAP}")
-        
-        return True
+        return get_exporter().export()
         
     except PermissionError as e:
         logger.error(f"❌ 权限不足，无法写入配置文件: {e}")
-        logger.error(f"   请确保 Flask 应用有权限写入 {USER_RATE_CONF} 和 {USER_ROLE_MAP}")
+        logger.error(f"   请确保 Flask 应用有权限写入 {USER_RATE_CONF}、{USER_ROLE_MAP} 和 {RATE_TABLE}")
         return False
         
     except Exception as e:
         logger.error(f"❌ 导出 TC 配置失败: {e}")
         import traceback
         traceback.print_exc()
+        get_exporter().invalidate()
         return False
 
 
+def request_tc_export(user_updates=(), role_updates=()):
+    """
+    🆕 请求导出 TC 配置（去抖动，合并短时间内的多次变更）
+
+    热更新信号会在配置文件写入之后发送，守护进程读取到的一定是新配置。
+
+    Args:
+        user_updates: [(client_name, vpn_ip), ...] 需要热更新的在线客户端
+        role_updates: [group_name, ...] 速率变化的用户组
+    """
+    get_exporter().request_export(user_updates=user_updates, role_updates=role_updates)
+
+
+def flush_tc_export():
+    """立即执行排队的导出（测试 / 关闭前调用）"""
+    return get_exporter().flush()
+
+
+def apply_tc_changes(user_updates=(), role_updates=(), timeout=None):
+    """
+    🆕 同步导出并等待守护进程应用（用于需要返回真实结果的接口）
+
+    排队中的变更会一并写入、一并确认。
+
+    Args:
+        user_updates: [(client_name, vpn_ip), ...]
+        role_updates: [group_name, ...]
+        timeout: 等待上限（秒），默认 Config.TC_APPLY_TIMEOUT
+
+    Returns:
+        dict: {'status': applied / failed / timeout / signaled, 'latency_ms', ...}
+    """
+    return get_exporter().apply_now(user_updates, role_updates, timeout)
+
+
 def ensure_config_files_writable():
     """
     检查配置文件是否可写（用于启动时健康检查）
@@ -100,7 +547,7 @@ def ensure_config_files_writable():
         bool: 是否可写
     """
     try:
-        for path in [USER_RATE_CONF, USER_ROLE_MAP]:
+        for path in [USER_RATE_CONF, USER_ROLE_MAP, RATE_TABLE]:
             # 确保目录存在
             Path(path).parent.mkdir(parents=True, exist_ok=True)
             
@@ -0,0 +1,488 @@
+"""
+🆕 客户端流量统计：累计计数器 → 增量 → 批量入库 → 小时 / 日 / 月汇总
+
+数据来源是 OpenVPN status.log 的 CLIENT LIST（Bytes Received / Bytes Sent，
+本次连接的累计字节），由 openvpn_monitor.client_rates.StatusLogReader 统一读取后
+推送给 on_status()；后台采样器每秒回调 record_sample() 处理到期的入库与清理。
+
+- 增量：与上一次的计数器相减；connected_since 变化（重连）或计数器回退
+  （服务端重启）时视为计数器归零，本次连接的全部字节都是新增量
+- 批量：增量先在内存中按 (整点, 客户端) 累加，每 TRAFFIC_FLUSH_INTERVAL 秒一个事务
+  （经单写入者线程，见 utils.db_writer）写入：
+  原始增量 + 三级汇总（INSERT ... ON CONFLICT DO UPDATE 累加）+ 计数器基线
+- 基线（traffic_counters）与增量在同一事务中写入：Web 进程重启后从基线继续，
+  未入库的增量不会丢失，也不会重复计入
+- 保留期：原始增量已计入汇总，超过 TRAFFIC_RAW_RETENTION_HOURS 后直接分批删除；
+  小时 / 日汇总按各自保留期清理，月汇总永久保留
+- 查询：按客户端查询一段时间走汇总表主键 (client_id, bucket) 的范围扫描，
+  一个月的日明细最多 31 行，与原始增量的数量无关
+
+bucket 编码：小时 = 整点 Unix 秒，日 = 本地日期 YYYYMMDD，月 = 本地月份 YYYYMM
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+from openvpn_monitor.config import Config
+from utils.db_writer import get_db_writer
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ('hour', 'day', 'month')
+
+# 保留期清理每批删除的行数（避免长时间持有 SQLite 写锁）
+DELETE_BATCH = 5000
+
+
+# ==================== bucket 编码 ====================
+def hour_bucket(ts):
+    return int(ts) // 3600 * 3600
+
+
+def day_bucket(ts):
+    return int(time.strftime('%Y%m%d', time.localtime(ts)))
+
+
+def month_bucket(ts):
+    return int(time.strftime('%Y%m', time.localtime(ts)))
+
+
+def parse_bucket(granularity, value):
+    """
+    查询参数 → bucket
+
+    Args:
+        granularity: hour / day / month
+        value: hour = "YYYY-MM-DDTHH[:MM]"，day = "YYYY-MM-DD"，month = "YYYY-MM"
+
+    Raises:
+        ValueError: 格式无效
+    """
+    try:
+        if granularity == 'hour':
+            return hour_bucket(datetime.fromisoformat(value).timestamp())
+        if granularity == 'day':
+            return int(datetime.strptime(value, '%Y-%m-%d').strftime('%Y%m%d'))
+        return int(datetime.strptime(value, '%Y-%m').strftime('%Y%m'))
+    except (TypeError, ValueError):
+        formats = {'hour': 'YYYY-MM-DDTHH:MM', 'day': 'YYYY-MM-DD', 'month': 'YYYY-MM'}
+        raise ValueError(f'无效的时间: {value!r}，应为 {formats[granularity]}')
+
+
+def format_bucket(granularity, bucket):
+    """bucket → 可读字符串"""
+    if granularity == 'hour':
+        return datetime.fromtimestamp(bucket).isoformat(timespec='minutes')
+    if granularity == 'day':
+        return f'{bucket // 10000:04d}-{bucket // 100 % 100:02d}-{bucket % 100:02d}'
+    return f'{bucket // 100:04d}-{bucket % 100:02d}'
+
+
+def current_bucket(granularity, ts=None):
+    ts = time.time() if ts is None else ts
+    return {'hour': hour_bucket, 'day': day_bucket, 'month': month_bucket}[granularity](ts)
+
+
+def _rollup_model(granularity):
+    from models import TrafficHourly, TrafficDaily, TrafficMonthly
+    return {'hour': TrafficHourly, 'day': TrafficDaily, 'month': TrafficMonthly}[granularity]
+
+
+# ==================== 查询 ====================
+def client_usage(client_id, granularity, start, end):
+    """
+    单个客户端在 [start, end] 内每个周期的流量（来自汇总表）
+
+    Returns:
+        list: [{'period', 'bytes_recv', 'bytes_sent', 'total'}]，只包含有流量的周期
+    """
+    from sqlalchemy import select
+    from models import db
+
+    model = _rollup_model(granularity)
+    rows = db.session.execute(
+        select(model.bucket, model.bytes_recv, model.bytes_sent)
+        .where(model.client_id == client_id, model.bucket >= start, model.bucket <= end)
+        .order_by(model.bucket)
+    ).all()
+    return [
+        {
+            'period': format_bucket(granularity, row.bucket),
+            'bytes_recv': row.bytes_recv,
+            'bytes_sent': row.bytes_sent,
+            'total': row.bytes_recv + row.bytes_sent,
+        }
+        for row in rows
+    ]
+
+
+def top_usage(granularity, bucket, n):
+    """
+    某个周期流量最多的 N 个客户端
+
+    Returns:
+        list: [{'client_id', 'name', 'bytes_recv', 'bytes_sent', 'total'}]
+    """
+    from sqlalchemy import select
+    from models import db, Client
+
+    model = _rollup_model(granularity)
+    total = (model.bytes_recv + model.bytes_sent).label('total')
+    rows = db.session.execute(
+        select(model.client_id, Client.name, model.bytes_recv, model.bytes_sent, total)
+        .outerjoin(Client, Client.id == model.client_id)
+        .where(model.bucket == bucket)
+        .order_by(total.desc())
+        .limit(n)
+    ).all()
+    return [dict(row._mapping) for row in rows]
+
+
+# ==================== 采集与入库 ====================
+def _write_flush(conn, samples, rollups, counters):
+    """写入任务（单写入者线程中执行）：原始增量、三级汇总累加、计数器基线"""
+    from sqlalchemy import insert
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+    from models import TrafficSample, TrafficCounter
+
+    if samples:
+        conn.execute(insert(TrafficSample), samples)
+    for model, totals in rollups.items():
+        if not totals:
+            continue
+        stmt = sqlite_insert(model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[model.client_id, model.bucket],
+            set_={
+                'bytes_recv': model.bytes_recv + stmt.excluded.bytes_recv,
+                'bytes_sent': model.bytes_sent + stmt.excluded.bytes_sent,
+            },
+        )
+        conn.execute(stmt, [
+            {'client_id': client_id, 'bucket': bucket, 'bytes_recv': recv, 'bytes_sent': sent}
+            for (client_id, bucket), (recv, sent) in totals.items()
+        ])
+    if counters:
+        stmt = sqlite_insert(TrafficCounter)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[TrafficCounter.client_id],
+            set_={column: stmt.excluded[column]
+                  for column in ('connected_since', 'bytes_recv', 'bytes_sent', 'ts')},
+        )
+        conn.execute(stmt, counters)
+
+
+class TrafficAccountant:
+    """流量统计（进程级单例，见 get_traffic_accountant()）"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self.lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        # name -> (connected_since, bytes_recv, bytes_sent)：最近一次采集到的计数器
+        self.baseline = {}
+        self.loaded = False
+        # hour_bucket -> {'ts': 最近采样时间, 'clients': {name: [bytes_recv, bytes_sent]}}
+        self.pending = {}
+        # 基线有变化、需要写回 traffic_counters 的客户端
+        self.dirty = set()
+        # name（小写，与 clients.name 的 NOCASE 一致）-> client_id
+        self.client_ids = {}
+        # 🆕 入库后的增量回调（如流量配额），参数为本次写入的原始增量行
+        self.listeners = []
+
+        self._last_flush = time.monotonic()
+        self._last_compact = 0.0
+
+        # 统计
+        self.resets = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.unknown_clients = 0
+        self.last_flush = None
+        self.last_compact = None
+
+    # ------------------------------------------------------------------
+    # 基线
+    # ------------------------------------------------------------------
+    def _load(self):
+        """从 traffic_counters 恢复计数器基线（Web 进程重启后继续计算增量）"""
+        from sqlalchemy import select
+        from models import db, Client, TrafficCounter
+
+        rows = db.session.execute(
+            select(Client.name, TrafficCounter.connected_since,
+                   TrafficCounter.bytes_recv, TrafficCounter.bytes_sent)
+            .join(Client, Client.id == TrafficCounter.client_id)
+        ).all()
+        with self.lock:
+            for row in rows:
+                self.baseline.setdefault(row.name, (row.connected_since, row.bytes_recv, row.bytes_sent))
+            self.loaded = True
+        logger.info(f"✅ 流量统计已恢复 {len(rows)} 个客户端的计数器基线")
+
+    def _resolve_ids(self, names):
+        """客户端名 → id；遇到未知的名字时重新加载一次映射"""
+        from sqlalchemy import select
+        from models import db, Client
+
+        if any(name.lower() not in self.client_ids for name in names):
+            self.client_ids = {
+                name.lower(): client_id
+                for client_id, name in db.session.execute(select(Client.id, Client.name))
+            }
+        return {name: self.client_ids.get(name.lower()) for name in names}
+
+    # ------------------------------------------------------------------
+    # 采集
+    # ------------------------------------------------------------------
+    def ingest(self, counters, ts=None):
+        """
+        处理一份累计计数器快照（status.log 或 management 接口的 status 输出）
+
+        Args:
+            counters: {name: {'since', 'bytes_recv', 'bytes_sent', ...}}
+            ts: 快照时间（Unix 秒），默认当前时间
+
+        Returns:
+            int: 本次产生增量的客户端数
+        """
+        ts = time.time() if ts is None else ts
+        changed = 0
+        hour = hour_bucket(ts)
+        with self.lock:
+            for name, c in counters.items():
+                recv, sent, since = c['bytes_recv'], c['bytes_sent'], c['since']
+                previous = self.baseline.get(name)
+                if previous == (since, recv, sent):
+                    continue
+                if previous is None or previous[0] != since or recv < previous[1] or sent < previous[2]:
+                    # 新连接或计数器归零：本次连接的累计值全部是新增量
+                    if previous is not None:
+                        self.resets += 1
+                    delta_recv, delta_sent = recv, sent
+                else:
+                    delta_recv, delta_sent = recv - previous[1], sent - previous[2]
+                self.baseline[name] = (since, recv, sent)
+                self.dirty.add(name)
+                if delta_recv or delta_sent:
+                    slot = self.pending.setdefault(hour, {'ts': ts, 'clients': {}})
+                    slot['ts'] = max(slot['ts'], ts)
+                    totals = slot['clients'].setdefault(name, [0, 0])
+                    totals[0] += delta_recv
+                    totals[1] += delta_sent
+                    changed += 1
+        return changed
+
+    def on_status(self, counters, ts):
+        """status.log 快照回调（StatusLogReader 订阅者）：计算增量"""
+        if self.app is not None:
+            with self.app.app_context():
+                self._on_status(counters, ts)
+        else:
+            self._on_status(counters, ts)
+
+    def _on_status(self, counters, ts):
+        if not self.loaded:
+            self._load()
+        self.ingest(counters, ts)
+
+    def record_sample(self, sample=None):
+        """采样器回调：到期时批量入库与清理"""
+        try:
+            if self.app is not None:
+                with self.app.app_context():
+                    self._cycle()
+            else:
+                self._cycle()
+        except Exception as e:
+            logger.error(f"❌ 流量统计失败: {e}")
+
+    def _cycle(self):
+        now = time.monotonic()
+        if now - self._last_flush >= Config.TRAFFIC_FLUSH_INTERVAL:
+            self._last_flush = now
+            self.flush()
+        if now - self._last_compact >= Config.TRAFFIC_RETENTION_INTERVAL:
+            self._last_compact = now
+            self.compact()
+
+    # ------------------------------------------------------------------
+    # 入库
+    # ------------------------------------------------------------------
+    def flush(self):
+        """
+        一个事务写入全部待入库的增量、三级汇总与计数器基线
+
+        Returns:
+            int: 写入的原始增量行数
+        """
+        from models import TrafficHourly, TrafficDaily, TrafficMonthly
+
+        with self._flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                dirty, self.dirty = self.dirty, set()
+                baseline = {name: self.baseline[name] for name in dirty}
+            if not pending and not dirty:
+                return 0
+
+            started = time.monotonic()
+            names = set(dirty)
+            for slot in pending.values():
+                names.update(slot['clients'])
+            ids = self._resolve_ids(names)
+
+            samples = []
+            rollups = {TrafficHourly: {}, TrafficDaily: {}, TrafficMonthly: {}}
+            for hour, slot in sorted(pending.items()):
+                buckets = ((TrafficHourly, hour), (TrafficDaily, day_bucket(hour)),
+                           (TrafficMonthly, month_bucket(hour)))
+                for name, (recv, sent) in slot['clients'].items():
+                    client_id = ids.get(name)
+                    if client_id is None:
+                        self.unknown_clients += 1
+                        continue
+                    samples.append({'client_id': client_id, 'ts': int(slot['ts']),
+                                    'bytes_recv': recv, 'bytes_sent': sent})
+                    for model, bucket in buckets:
+                        totals = rollups[model].setdefault((client_id, bucket), [0, 0])
+                        totals[0] += recv
+                        totals[1] += sent
+
+            now = int(time.time())
+            counters = [
+                {'client_id': ids[name], 'connected_since': since,
+                 'bytes_recv': recv, 'bytes_sent': sent, 'ts': now}
+                for name, (since, recv, sent) in baseline.items() if ids.get(name) is not None
+            ]
+
+            try:
+                get_db_writer().run(_write_flush, samples, rollups, counters)
+            except Exception:
+                # 放回内存，下一次一起入库
+                self._restore(pending, dirty)
+                raise
+
+            self.flushes += 1
+            self.rows_written += len(samples)
+            self.last_flush = {
+                'at': datetime.fromtimestamp(now).isoformat(timespec='seconds'),
+                'samples': len(samples),
+                'counters': len(counters),
+                'elapsed_ms': round((time.monotonic() - started) * 1000, 1),
+            }
+            logger.debug(f"流量统计入库: {len(samples)} 条增量 ({self.last_flush['elapsed_ms']} ms)")
+
+        for listener in list(self.listeners):
+            try:
+                listener(samples)
+            except Exception as e:
+                logger.error(f"❌ 流量增量回调失败: {e}")
+        return len(samples)
+
+    def add_listener(self, callback):
+        """注册入库后的回调 callback(samples)，samples 为 [{'client_id', 'ts', 'bytes_recv', 'bytes_sent'}]"""
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+
+    def _restore(self, pending, dirty):
+        with self.lock:
+            for hour, slot in pending.items():
+                current = self.pending.setdefault(hour, {'ts': slot['ts'], 'clients': {}})
+                current['ts'] = max(current['ts'], slot['ts'])
+                for name, (recv, sent) in slot['clients'].items():
+                    totals = current['clients'].setdefault(name, [0, 0])
+                    totals[0] += recv
+                    totals[1] += sent
+            self.dirty |= dirty
+
+    # ------------------------------------------------------------------
+    # 保留期
+    # ------------------------------------------------------------------
+    def compact(self, now=None):
+        """
+        删除超过保留期的原始增量与小时 / 日汇总（已计入上一级汇总）
+
+        Returns:
+            dict: 每张表删除的行数
+        """
+        from sqlalchemy import delete, select
+        from models import TrafficSample, TrafficHourly, TrafficDaily
+
+        now = time.time() if now is None else now
+        cutoffs = (
+            (TrafficSample, TrafficSample.ts, int(now - Config.TRAFFIC_RAW_RETENTION_HOURS * 3600)),
+            (TrafficHourly, TrafficHourly.bucket,
+             hour_bucket(now - Config.TRAFFIC_HOURLY_RETENTION_DAYS * 86400)),
+            (TrafficDaily, TrafficDaily.bucket,
+             day_bucket(now - Config.TRAFFIC_DAILY_RETENTION_DAYS * 86400)),
+        )
+        started = time.monotonic()
+        removed = {}
+        for model, column, cutoff in cutoffs:
+            key = model.__table__.c.id if model is TrafficSample else column
+            total = 0
+            while True:
+                # 分批删除，每批一个短事务
+                batch = select(key).where(column < cutoff).limit(DELETE_BATCH).scalar_subquery()
+                count = get_db_writer().execute(delete(model).where(key.in_(batch)))
+                total += count
+                if count < DELETE_BATCH:
+                    break
+            removed[model.__tablename__] = total
+
+        self.last_compact = {
+            'at': datetime.fromtimestamp(now).isoformat(timespec='seconds'),
+            'removed': removed,
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 1),
+        }
+        if any(removed.values()):
+            logger.info(f"🧹 流量统计保留期清理: {removed} ({self.last_compact['elapsed_ms']} ms)")
+        return removed
+
+    def get_stats(self):
+        with self.lock:
+            pending = sum(len(slot['clients']) for slot in self.pending.values())
+            tracked = len(self.baseline)
+        return {
+            'tracked_clients': tracked,
+            'pending_deltas': pending,
+            'flush_interval': Config.TRAFFIC_FLUSH_INTERVAL,
+            'counter_resets': self.resets,
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'unknown_clients': self.unknown_clients,
+            'last_flush': self.last_flush,
+            'last_compact': self.last_compact,
+            'retention': {
+                'raw_hours': Config.TRAFFIC_RAW_RETENTION_HOURS,
+                'hourly_days': Config.TRAFFIC_HOURLY_RETENTION_DAYS,
+                'daily_days': Config.TRAFFIC_DAILY_RETENTION_DAYS,
+            },
+        }
+
+
+# 进程级单例
+_accountant = None
+_accountant_lock = threading.Lock()
+
+
+def get_traffic_accountant():
+    global _accountant
+    with _accountant_lock:
+        if _accountant is None:
+            _accountant = TrafficAccountant()
+        return _accountant
+
+
+def init_traffic_accounting(app):
+    """记录应用实例（采样器线程需要应用上下文访问数据库）并订阅 status.log 快照"""
+    from openvpn_monitor.client_rates import get_status_reader
+
+    accountant = get_traffic_accountant()
+    accountant.app = app
+    get_status_reader().subscribe(accountant.on_status)
+    return accountant
@@ -0,0 +1,538 @@
+"""
+🆕 用户组流量配额：按日 / 按月限制每个成员的流量，超额后降速或禁用
+
+- 配额配置在用户组上（quota_bytes / quota_period / quota_action / quota_throttle_rate），
+  每个成员单独计量，上下行合计
+- 增量执行：流量统计每次入库后回调 on_deltas()，只处理本次有增量的客户端——
+  累加内存中的本周期用量并与所在用户组的配额比较，不重新汇总，
+  每次检查的开销与在线总人数无关（O(有流量的客户端)）
+- 本周期用量只在启动时从日 / 月汇总表读取一次，之后完全由增量维护
+- 超额处理:
+  - throttle: 导出器渲染速率表时把该客户端的速率替换为降速速率，
+    经 TC 引擎生效（客户端仍在原用户组的 class 下）
+  - disable: 写 CCD 禁用文件 + 管理接口踢下线 + clients.disabled = True
+  - 超额状态写入 traffic_quota_states，Web 进程重启后继续生效
+  （与其他写入一样经单写入者线程执行，见 utils.db_writer）
+- 周期切换（本地零点 / 每月 1 日零点）时解除上一周期的全部超额状态；
+  被禁用的客户端只有仍处于禁用状态、且未逻辑到期时才会重新启用
+- 管理员在周期内手动启用超额客户端视为本周期放行，不会再次禁用
+- 踢线、写 CCD 等耗时操作由常驻工作线程执行，不阻塞采样线程；
+  失败的操作按退避间隔重试，多次失败后撤销该超额状态，下一次流量增量时重新检查
+"""
+import heapq
+import itertools
+import logging
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+
+from openvpn_monitor.config import Config
+from utils.db_writer import get_db_writer
+from utils.traffic_accounting import day_bucket, month_bucket
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ('day', 'month')
+ACTIONS = ('throttle', 'disable')
+
+_BUCKET_FUNCS = {'day': day_bucket, 'month': month_bucket}
+
+# 超额处理失败时的重试：最多执行次数与首次重试间隔（秒，之后每次翻倍）
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 10
+
+# 配额单位（1024 进制）
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+_SIZE_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([KMGT]?B)?$', re.IGNORECASE)
+
+
+def parse_quota(value):
+    """
+    配额 → 字节数
+
+    Args:
+        value: 整数字节数，或 "500MB" / "50GB" / "1.5TB"（1024 进制）
+
+    Raises:
+        ValueError: 格式无效或不大于 0
+    """
+    if isinstance(value, bool):
+        raise ValueError('配额格式无效，应为字节数或 "50GB" 格式')
+    if isinstance(value, (int, float)):
+        amount = int(value)
+    else:
+        match = _SIZE_RE.match(str(value or '').strip())
+        if not match:
+            raise ValueError('配额格式无效，应为字节数或 "50GB" 格式')
+        amount = int(float(match.group(1)) * SIZE_UNITS[(match.group(2) or 'B').upper()])
+    if amount <= 0:
+        raise ValueError('配额必须大于 0')
+    return amount
+
+
+def format_bytes(value):
+    """字节数 → "12.3GB" """
+    for unit in ('TB', 'GB', 'MB', 'KB'):
+        if value >= SIZE_UNITS[unit]:
+            return f'{value / SIZE_UNITS[unit]:.1f}{unit}'
+    return f'{value}B'
+
+
+def _save_state(conn, client_id, state):
+    """写入任务（单写入者线程中执行）：记录超额状态，已存在时覆盖"""
+    from datetime import timezone
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+    from models import TrafficQuotaState
+
+    values = dict(state, client_id=client_id, exceeded_at=datetime.now(timezone.utc))
+    stmt = sqlite_insert(TrafficQuotaState).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[TrafficQuotaState.client_id],
+        set_={column: stmt.excluded[column] for column in values if column != 'client_id'},
+    )
+    conn.execute(stmt)
+
+
+class QuotaPolicy:
+    """用户组的配额配置（从数据库加载后的只读副本）"""
+
+    __slots__ = ('group_id', 'limit', 'period', 'action', 'throttle_rate')
+
+    def __init__(self, group_id, limit, period, action, throttle_rate):
+        self.group_id = group_id
+        self.limit = limit
+        self.period = period if period in PERIODS else 'month'
+        self.action = action if action in ACTIONS else 'throttle'
+        self.throttle_rate = (throttle_rate or '').strip() or Config.TRAFFIC_QUOTA_THROTTLE_RATE
+
+
+class QuotaEnforcer:
+    """流量配额引擎（进程级单例，见 get_quota_enforcer()）"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self.lock = threading.RLock()
+        self.loaded = False
+        # group_id -> QuotaPolicy（只含配置了配额的用户组）
+        self.policies = {}
+        # period -> [当前 bucket, {client_id: 本周期已用字节}]
+        self.usage = {period: [None, {}] for period in PERIODS}
+        # client_id -> {'group_id', 'period', 'bucket', 'action', 'used_bytes', 'quota_bytes'}
+        self.exceeded = {}
+
+        self._jobs = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        # 等待重试的任务 [(到期时间, 序号, job)]，只由工作线程访问
+        self._retries = []
+        self._retry_seq = itertools.count()
+
+        # 统计
+        self.checks = 0
+        self.enforced = 0
+        self.lifted = 0
+        self.failed_jobs = 0
+        self.last_reset = None
+
+    # ------------------------------------------------------------------
+    # 加载
+    # ------------------------------------------------------------------
+    def _load_policies(self):
+        from sqlalchemy import select
+        from models import db, ClientGroup
+
+        rows = db.session.execute(
+            select(ClientGroup.id, ClientGroup.quota_bytes, ClientGroup.quota_period,
+                   ClientGroup.quota_action, ClientGroup.quota_throttle_rate)
+            .where(ClientGroup.quota_bytes.isnot(None))
+        ).all()
+        return {row.id: QuotaPolicy(*row) for row in rows if row.quota_bytes > 0}
+
+    def _load_state(self, now):
+        """启动时：本周期用量（汇总表）+ 已超额的客户端"""
+        from sqlalchemy import select
+        from models import db, TrafficDaily, TrafficMonthly, TrafficQuotaState
+
+        usage = {}
+        for period, model in (('day', TrafficDaily), ('month', TrafficMonthly)):
+            bucket = _BUCKET_FUNCS[period](now)
+            rows = db.session.execute(
+                select(model.client_id, model.bytes_recv + model.bytes_sent).where(model.bucket == bucket)
+            ).all()
+            usage[period] = [bucket, {client_id: used for client_id, used in rows}]
+        exceeded = {
+            state.client_id: {
+                'group_id': state.group_id,
+                'period': state.period,
+                'bucket': state.bucket,
+                'action': state.action,
+                'used_bytes': state.used_bytes,
+                'quota_bytes': state.quota_bytes,
+            }
+            for state in TrafficQuotaState.query.all()
+        }
+        return usage, exceeded
+
+    def reload(self, now=None):
+        """
+        重新加载配额配置并重新评估全部成员（用户组配额变更后调用）
+
+        首次调用时还会加载本周期用量与超额状态
+        """
+        from utils.tc_config_exporter import get_exporter
+
+        now = now or datetime.now().timestamp()
+        policies = self._load_policies()
+        # 在持有 self.lock 之前取导出器模型（导出器渲染时会反过来调用 throttled_rates()）
+        members = self._members(get_exporter())
+        with self.lock:
+            if not self.loaded:
+                self.usage, self.exceeded = self._load_state(now)
+                self.loaded = True
+            self.policies = policies
+            self._rollover(now)
+            self._evaluate_all(members)
+
+    # ------------------------------------------------------------------
+    # 增量检查
+    # ------------------------------------------------------------------
+    def on_deltas(self, samples):
+        """
+        流量统计入库后的回调：只处理本次有增量的客户端
+
+        Args:
+            samples: [{'client_id', 'ts', 'bytes_recv', 'bytes_sent'}]
+        """
+        if not self.loaded:
+            # 首次加载从汇总表读取用量，已包含本次增量
+            self.reload()
+            return
+        from utils.tc_config_exporter import get_exporter
+
+        members = self._members(get_exporter())
+        # 同一批增量只有少数几个采样时间（每个整点一个）
+        buckets = {}
+        with self.lock:
+            for sample in samples:
+                ts = sample['ts']
+                if ts not in buckets:
+                    self._rollover(ts)
+                    buckets[ts] = {period: _BUCKET_FUNCS[period](ts) for period in PERIODS}
+                client_id = sample['client_id']
+                used = sample['bytes_recv'] + sample['bytes_sent']
+                for period in PERIODS:
+                    bucket, totals = self.usage[period]
+                    # 跨零点入库的上一周期增量不再计入
+                    if buckets[ts][period] == bucket:
+                        totals[client_id] = totals.get(client_id, 0) + used
+                self.checks += 1
+                member = members.get(client_id)
+                if member is not None:
+                    self._check(client_id, member[0], member[1])
+
+    def record_sample(self, sample=None):
+        """采样器回调：检查周期切换（只比较 bucket，切换时才访问数据库）"""
+        if not self.loaded:
+            return
+        now = datetime.now().timestamp()
+        if all(self.usage[period][0] == _BUCKET_FUNCS[period](now) for period in PERIODS):
+            return
+        try:
+            if self.app is not None:
+                with self.app.app_context(), self.lock:
+                    self._rollover(now)
+            else:
+                with self.lock:
+                    self._rollover(now)
+        except Exception as e:
+            logger.error(f"❌ 流量配额周期切换失败: {e}")
+
+    def _members(self, exporter):
+        """client_id -> (client_name, group_id)；复用导出器的内存模型（随 ORM 变更增量更新）"""
+        if not exporter.loaded:
+            exporter.rebuild()
+        return exporter.members
+
+    def _check(self, client_id, client_name, group_id):
+        policy = self.policies.get(group_id)
+        state = self.exceeded.get(client_id)
+        if state is not None:
+            if policy is None or state['group_id'] != group_id or state['period'] != policy.period \
+                    or state['action'] != policy.action:
+                # 配额被取消 / 客户端换组 / 配额配置变化
+                self._lift(client_id, client_name)
+            else:
+                return
+        if policy is None:
+            return
+        used = self.usage[policy.period][1].get(client_id, 0)
+        if used >= policy.limit:
+            self._enforce(client_id, client_name, policy, used)
+
+    def _evaluate_all(self, members):
+        """重新评估所有已超额客户端与配额用户组的全部成员（只在配置变更 / 启动时）"""
+        for client_id in list(self.exceeded):
+            name, group_id = members.get(client_id, (None, None))
+            if name is None:
+                self._lift(client_id, self._client_name(client_id))
+                continue
+            policy = self.policies.get(group_id)
+            if policy is None or self.usage[policy.period][1].get(client_id, 0) < policy.limit:
+                self._lift(client_id, name)
+        for client_id, (name, group_id) in list(members.items()):
+            if group_id in self.policies:
+                self._check(client_id, name, group_id)
+
+    # ------------------------------------------------------------------
+    # 超额 / 解除
+    # ------------------------------------------------------------------
+    def _enforce(self, client_id, client_name, policy, used):
+        state = {
+            'group_id': policy.group_id,
+            'period': policy.period,
+            'bucket': self.usage[policy.period][0],
+            'action': policy.action,
+            'used_bytes': used,
+            'quota_bytes': policy.limit,
+        }
+        get_db_writer().run(_save_state, client_id, state)
+        self.exceeded[client_id] = state
+        self.enforced += 1
+        logger.warning(
+            f"⚠️ 客户端 {client_name} 超出{'日' if policy.period == 'day' else '月'}流量配额: "
+            f"{format_bytes(used)} / {format_bytes(policy.limit)} → "
+            f"{'降速 ' + policy.throttle_rate if policy.action == 'throttle' else '禁用'}"
+        )
+        self._submit(policy.action, 'enforce', client_id, client_name)
+
+    def _lift(self, client_id, client_name):
+        from sqlalchemy import delete
+        from models import TrafficQuotaState
+
+        state = self.exceeded.pop(client_id, None)
+        if state is None:
+            return
+        get_db_writer().execute(delete(TrafficQuotaState).where(TrafficQuotaState.client_id == client_id))
+        self.lifted += 1
+        logger.info(f"✅ 解除客户端 {client_name} 的流量配额限制（{state['action']}）")
+        if client_name:
+            self._submit(state['action'], 'lift', client_id, client_name)
+
+    def _rollover(self, now):
+        """进入新周期：清零用量，一次删除并解除上一周期的全部超额状态"""
+        from sqlalchemy import delete
+        from models import db, Client, TrafficQuotaState
+
+        for period in PERIODS:
+            bucket = _BUCKET_FUNCS[period](now)
+            current = self.usage[period]
+            if current[0] is not None and bucket <= current[0]:
+                continue
+            self.usage[period] = [bucket, {}]
+            expired = {
+                client_id: state for client_id, state in self.exceeded.items()
+                if state['period'] == period and state['bucket'] < bucket
+            }
+            if expired:
+                get_db_writer().execute(delete(TrafficQuotaState).where(
+                    TrafficQuotaState.period == period, TrafficQuotaState.bucket < bucket
+                ))
+                names = dict(
+                    db.session.query(Client.id, Client.name).filter(Client.id.in_(list(expired))).all()
+                )
+                for client_id, state in expired.items():
+                    del self.exceeded[client_id]
+                    if names.get(client_id):
+                        self._submit(state['action'], 'lift', client_id, names[client_id])
+                self.lifted += len(expired)
+            if current[0] is not None:
+                self.last_reset = {
+                    'period': period,
+                    'bucket': bucket,
+                    'at': datetime.fromtimestamp(now).isoformat(timespec='seconds'),
+                    'lifted': len(expired),
+                }
+                logger.info(f"🔄 流量配额进入新{'日' if period == 'day' else '月'}周期 {bucket}，解除 {len(expired)} 个客户端")
+
+    def _client_name(self, client_id):
+        from models import db, Client
+        client = db.session.get(Client, client_id)
+        return client.name if client else None
+
+    def throttled_rates(self):
+        """
+        导出器渲染速率表时调用
+
+        Returns:
+            dict: {client_id: (group_id, 降速速率)}，只含超额处理为 throttle 的客户端
+        """
+        with self.lock:
+            return {
+                client_id: (state['group_id'], self.policies[state['group_id']].throttle_rate)
+                for client_id, state in self.exceeded.items()
+                if state['action'] == 'throttle' and state['group_id'] in self.policies
+            }
+
+    # ------------------------------------------------------------------
+    # 执行动作（工作线程）
+    # ------------------------------------------------------------------
+    def _submit(self, action, op, client_id, client_name):
+        self._jobs.put((action, op, client_id, client_name, 0))
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run_jobs, name='traffic-quota', daemon=True)
+                self._worker.start()
+
+    def _run_jobs(self):
+        """常驻工作线程（不因空闲退出，避免退出瞬间提交的任务无人处理）"""
+        while True:
+            if self._retries and self._retries[0][0] <= time.monotonic():
+                job = heapq.heappop(self._retries)[2]
+            else:
+                timeout = max(0.0, self._retries[0][0] - time.monotonic()) if self._retries else None
+                try:
+                    job = self._jobs.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+            try:
+                if self.app is not None:
+                    with self.app.app_context():
+                        self._run_job(job)
+                else:
+                    self._run_job(job)
+            except Exception as e:
+                logger.error(f"❌ 流量配额处理异常 {job}: {e}")
+
+    def _run_job(self, job):
+        action, op, client_id, client_name, attempt = job
+        if attempt and not self._job_current(action, op, client_id):
+            # 等待重试期间状态已变化（已解除 / 再次超额），不再执行
+            return
+        try:
+            self._execute(action, op, client_name)
+            return
+        except Exception as e:
+            error = e
+        attempt += 1
+        if attempt < JOB_MAX_ATTEMPTS:
+            delay = JOB_RETRY_DELAY * 2 ** (attempt - 1)
+            logger.warning(
+                f"⚠️ 流量配额处理失败 {action}/{op} {client_name}（第 {attempt} 次），{delay} 秒后重试: {error}"
+            )
+            heapq.heappush(self._retries, (
+                time.monotonic() + delay, next(self._retry_seq),
+                (action, op, client_id, client_name, attempt),
+            ))
+            return
+        self.failed_jobs += 1
+        logger.error(f"❌ 流量配额处理失败 {action}/{op} {client_name}，已尝试 {attempt} 次: {error}")
+        if op == 'enforce':
+            self._abandon(client_id, action)
+
+    def _job_current(self, action, op, client_id):
+        """待重试的任务是否仍与当前超额状态一致"""
+        with self.lock:
+            state = self.exceeded.get(client_id)
+            if op == 'enforce':
+                return state is not None and state['action'] == action
+            return state is None or state['action'] != action
+
+    def _abandon(self, client_id, action):
+        """超额处理最终失败：撤销该超额状态，下一次流量增量时重新检查并再次处理"""
+        from sqlalchemy import delete
+        from models import TrafficQuotaState
+
+        with self.lock:
+            state = self.exceeded.get(client_id)
+            if state is None or state['action'] != action:
+                return
+            del self.exceeded[client_id]
+            get_db_writer().execute(delete(TrafficQuotaState).where(TrafficQuotaState.client_id == client_id))
+
+    def _execute(self, action, op, client_name):
+        from models import Client
+        from utils.openvpn_mgmt import kill_client, remove_ccd_disable, write_ccd_disable
+        from utils.tc_config_exporter import request_tc_export
+
+        client = Client.query.filter_by(name=client_name).first()
+        if action == 'throttle':
+            # 速率表由导出器按 throttled_rates() 渲染；在线时同时热更新
+            vpn_ip = client.vpn_ip if client and client.online else None
+            request_tc_export(user_updates=[(client_name, vpn_ip)] if vpn_ip else ())
+            return
+
+        if op == 'enforce':
+            write_ccd_disable(client_name)
+            ok, message = kill_client(client_name)
+            if not ok:
+                logger.warning(f"⚠️ 超额客户端 {client_name} 踢下线失败: {message}")
+            if client and not client.disabled:
+                self._set_disabled(client.id, True)
+            return
+
+        # 解除禁用：管理员已手动启用或客户端已逻辑到期时不处理
+        if client is None or not client.disabled:
+            return
+        if client.logical_expiry and datetime.now() > client.logical_expiry:
+            logger.info(f"客户端 {client_name} 已逻辑到期，周期切换后保持禁用")
+            return
+        remove_ccd_disable(client_name)
+        self._set_disabled(client.id, False)
+
+    @staticmethod
+    def _set_disabled(client_id, disabled):
+        """经单写入者更新 clients.disabled（不经过会话，需自行递增数据版本号）"""
+        from sqlalchemy import update
+        from models import db, Client
+        from utils.data_version import bump_data_version
+
+        # 先结束本会话的读事务，随后重新读取
+        db.session.commit()
+        get_db_writer().execute(update(Client).where(Client.id == client_id).values(disabled=disabled))
+        db.session.expire_all()
+        bump_data_version()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'loaded': self.loaded,
+                'groups': len(self.policies),
+                'periods': {period: self.usage[period][0] for period in PERIODS},
+                'tracked_clients': {period: len(self.usage[period][1]) for period in PERIODS},
+                'exceeded': len(self.exceeded),
+                'checks': self.checks,
+                'enforced': self.enforced,
+                'lifted': self.lifted,
+                'last_reset': self.last_reset,
+                'pending_jobs': self._jobs.qsize(),
+                'retrying_jobs': len(self._retries),
+                'failed_jobs': self.failed_jobs,
+            }
+
+    def usage_of(self, client_id, period):
+        """客户端本周期已用字节（内存中的增量累计）"""
+        with self.lock:
+            return self.usage[period][1].get(client_id, 0)
+
+
+# 进程级单例
+_enforcer = None
+_enforcer_lock = threading.Lock()
+
+
+def get_quota_enforcer():
+    global _enforcer
+    with _enforcer_lock:
+        if _enforcer is None:
+            _enforcer = QuotaEnforcer()
+        return _enforcer
+
+
+def init_traffic_quota(app, accountant):
+    """记录应用实例并挂到流量统计的入库回调上"""
+    enforcer = get_quota_enforcer()
+    enforcer.app = app
+    accountant.add_listener(enforcer.on_deltas)
+    return enforcer
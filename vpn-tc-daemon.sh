@@ -1,4 +1,6 @@
 #!/usr/bin/env bash
+# 旧版 TC 守护脚本（保留用于回退）
+# 默认服务已改用 Python 调和引擎: python -m openvpn_monitor.tc_engine
 set -euo pipefail
 
 #####################################
@@ -18,6 +20,8 @@ DEFAULT_DOWN="2Mbit"
 
 USER_RATE_CONF="/etc/openvpn/tc-users.conf"
 USER_ROLE_MAP="/etc/openvpn/tc-roles.map"
+# 🆕 预先计算的客户端速率表（由 Web 端导出，首行 #version=...）
+RATE_TABLE="/etc/openvpn/tc-rates.tbl"
 
 INTERVAL=3
 
@@ -29,6 +33,9 @@ RELOAD_SIGNAL="$RELOAD_DIR/reload.signal"
 declare -g -A IP_CLASS_MAP=()    # ip -> "user:classid"
 declare -g -A CLASSID_USED=()    # classid -> 1
 declare -g -A LAST_SEEN=()    # ip -> user
+declare -g -A USER_RATE=()    # 🆕 user -> "up down"（来自速率表）
+declare -g -A USER_GROUP=()   # 🆕 user -> group（来自速率表）
+RATE_TABLE_VERSION=""         # 🆕 已加载的速率表版本，空表示未加载（退回 grep）
 REPAIR_TICK=0
 REPAIR_INTERVAL=5            # 每 5 轮才允许一次 repair
 
@@ -43,6 +50,55 @@ cmd_exists() {
     command -v "$1" >/dev/null 2>&1
 }
 
+# 🆕 加载速率表：只读首行比较版本号，变化时才整表读入关联数组（全部为 bash 内建，不 fork）
+load_rate_table() {
+    [[ -f "$RATE_TABLE" ]] || return 0
+
+    local header version
+    { IFS= read -r header; } < "$RATE_TABLE" || return 0
+    [[ "$header" == "#version="* ]] || return 0
+    version="${header#\#version=}"
+    [[ "$version" == "$RATE_TABLE_VERSION" ]] && return 0
+
+    local client up down group
+    USER_RATE=()
+    USER_GROUP=()
+    while read -r client up down group; do
+        # @group 行是 TC 引擎的用户组聚合限速，本脚本只做单层限速，忽略
+        [[ -z "$client" || "$client" == \#* || "$client" == @* ]] && continue
+        USER_RATE["$client"]="$up $down"
+        USER_GROUP["$client"]="$group"
+    done < "$RATE_TABLE"
+
+    RATE_TABLE_VERSION="$version"
+    log "📋 速率表已加载: 版本 $version, ${#USER_RATE[@]} 个客户端"
+}
+
+# 🆕 查询用户速率，结果写入全局 RATE_UP / RATE_DOWN（避免命令替换的子 shell）
+lookup_user_rate() {
+    local user="$1"
+    local rate
+
+    if [[ -n "$RATE_TABLE_VERSION" ]]; then
+        rate="${USER_RATE[$user]:-${DEFAULT_UP} ${DEFAULT_DOWN}}"
+    else
+        rate="$(get_user_rate "$user")"
+    fi
+    read -r RATE_UP RATE_DOWN <<< "$rate"
+}
+
+# 🆕 查询用户所属用户组
+get_user_group() {
+    local user="$1"
+
+    if [[ -n "$RATE_TABLE_VERSION" ]]; then
+        echo "${USER_GROUP[$user]:-}"
+    elif [[ -f "$USER_ROLE_MAP" ]]; then
+        grep "^${user}=" "$USER_ROLE_MAP" 2>/dev/null | head -n1 | cut -d= -f2
+    fi
+}
+
+# 旧格式查询（速率表不存在时使用）
 get_user_rate() {
     local user="$1"
 
@@ -252,7 +308,7 @@ add_client() {
     fi
     local cid="$ALLOCATED_CLASSID"
 
-    read RATE_UP RATE_DOWN <<< "$(get_user_rate "$user")"
+    lookup_user_rate "$user"
 
     if ! class_exists "$VPN_DEV" "1:" "$cid"; then
         tc class add dev "$VPN_DEV" parent 1:1 classid 1:$cid htb rate "$RATE_UP" ceil "$RATE_UP" 2>/dev/null || true
@@ -396,7 +452,7 @@ repair_client() {
     local entry="${IP_CLASS_MAP[$ip]}"
     local classid="${entry##*:}"
 
-    read RATE_UP RATE_DOWN <<< "$(get_user_rate "$user")"
+    lookup_user_rate "$user"
 
     local repaired=0
 
@@ -469,7 +525,7 @@ update_client_rate() {
     fi
     
     local classid="${entry##*:}"
-    read RATE_UP RATE_DOWN <<< "$(get_user_rate "$user")"
+    lookup_user_rate "$user"
     
     log "🔄 开始热更新: $user ($ip) class=$classid → ↑$RATE_UP ↓$RATE_DOWN"
     
@@ -508,6 +564,9 @@ update_client_rate() {
 #####################################
 process_reload_signals() {
     [[ ! -f "$RELOAD_SIGNAL" ]] && return 0
+
+    # 🆕 信号在配置写入后才发出：先确保速率表是最新版本
+    load_rate_table
     
     local processed=0
     local line_count=0
@@ -535,6 +594,26 @@ process_reload_signals() {
                 fi
                 ;;
                 
+            UPDATE_USERS)
+                # 🆕 批量更新，value 格式: user1|ip1,user2|ip2,...
+                local batch_count=0
+                local pair
+                IFS=',' read -r -a pairs <<< "$value"
+                log "📢 收到批量用户更新信号: ${#pairs[@]} 个用户"
+
+                for pair in "${pairs[@]}"; do
+                    local user="${pair%%|*}"
+                    local ip="${pair##*|}"
+                    [[ -z "$user" || -z "$ip" || "$user" == "$pair" ]] && continue
+                    update_client_rate "$user" "$ip" && {
+                        batch_count=$((batch_count + 1))
+                        processed=1
+                    }
+                done
+
+                log "✅ 批量更新完成: $batch_count 个在线用户"
+                ;;
+
             UPDATE_ROLE)
                 # value 格式: rolename
                 local role="$value"
@@ -546,18 +625,20 @@ process_reload_signals() {
                 for ip in "${!IP_CLASS_MAP[@]}"; do
                     local entry="${IP_CLASS_MAP[$ip]}"
                     local user="${entry%%:*}"
-                    
-                    # 检查用户是否属于该角色
-                    if [[ -f "$USER_ROLE_MAP" ]]; then
-                        local user_role
-                        user_role=$(grep "^${user}=" "$USER_ROLE_MAP" 2>/dev/null | head -n1 | cut -d= -f2)
-                        
-                        if [[ "$user_role" == "$role" ]]; then
-                            update_client_rate "$user" "$ip" && {
-                                ((updated_count++))
-                                processed=1
-                            }
-                        fi
+                    local user_role
+
+                    # 检查用户是否属于该角色（速率表已加载时直接查数组）
+                    if [[ -n "$RATE_TABLE_VERSION" ]]; then
+                        user_role="${USER_GROUP[$user]:-}"
+                    else
+                        user_role=$(get_user_group "$user")
+                    fi
+
+                    if [[ "$user_role" == "$role" ]]; then
+                        update_client_rate "$user" "$ip" && {
+                            updated_count=$((updated_count + 1))
+                            processed=1
+                        }
                     fi
                 done
                 
@@ -605,6 +686,9 @@ log "✅ 服务启动完成，开始监控客户端连接"
 
 
 while true; do
+    # 🆕 速率表版本变化时重新加载（未变化只读一行）
+    load_rate_table || true
+
     mapfile -t CURRENT < <(parse_clients)
 
     declare -A CURRENT_MAP=()